@@ -10,7 +10,6 @@
 
 from typing import Callable, Iterable, Optional, Dict, Any
 from datetime import datetime, timedelta
-import json
 import os
 import logging
 import time
@@ -21,10 +20,12 @@ from telegram.ext import Application, ContextTypes
 
 from fb_report.constants import ALMATY_TZ, DATA_DIR, kzt_round_up_1000
 
-from fb_report.storage import load_accounts
+from fb_report.storage import load_accounts_view
 from fb_report.client_groups import is_client_group
 
-from services.facebook_api import allow_fb_api_calls
+from services.account_meta import remember_accounts_meta
+from services.facebook_api import allow_fb_api_calls, fb_call, fetch_accounts_info, run_fb_io
+from services.sqlite_store import get_row, load_doc, save_doc, upsert_row
 
 
 _last_status: Dict[str, Any] = {}
@@ -37,25 +38,11 @@ _BILLING_CACHE_FILE = os.path.join(DATA_DIR, "billing_cache.json")
 BILLING_BALANCE_EPSILON_USD = 0.01
 
 
-def _load_billing_cache() -> dict:
-    try:
-        with open(_BILLING_CACHE_FILE, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return obj if isinstance(obj, dict) else {}
-    except Exception:
-        return {}
-
-
-def _save_billing_cache(obj: dict) -> None:
+def _billing_cache_get_usd(aid: str) -> float | None:
     try:
-        _atomic_write_json(_BILLING_CACHE_FILE, obj if isinstance(obj, dict) else {})
+        item = get_row("billing_cache", _BILLING_CACHE_FILE, str(aid))
     except Exception:
-        pass
-
-
-def _billing_cache_get_usd(aid: str) -> float | None:
-    st = _load_billing_cache() or {}
-    item = st.get(str(aid))
+        item = None
     if not isinstance(item, dict):
         return None
     try:
@@ -65,37 +52,31 @@ def _billing_cache_get_usd(aid: str) -> float | None:
 
 
 def _billing_cache_write(aid: str, usd: float) -> None:
-    st = _load_billing_cache() or {}
-    st[str(aid)] = {"last_usd": float(usd), "last_ts": int(time.time())}
-    _save_billing_cache(st)
+    try:
+        upsert_row(
+            "billing_cache",
+            _BILLING_CACHE_FILE,
+            str(aid),
+            {"last_usd": float(usd), "last_ts": int(time.time())},
+        )
+    except Exception:
+        return
     try:
         logging.getLogger(__name__).info("billing_cache_write aid=%s usd=%.2f", str(aid), float(usd))
     except Exception:
         pass
 
 
-def _atomic_write_json(path: str, obj: dict) -> None:
-    tmp = f"{path}.tmp"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-        f.flush()
-        os.fsync(f.fileno())
-    os.replace(tmp, path)
-
-
 def _load_state() -> dict:
     try:
-        with open(_FOLLOWUPS_FILE, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return obj if isinstance(obj, dict) else {}
+        return load_doc("billing_followups", _FOLLOWUPS_FILE)
     except Exception:
         return {}
 
 
 def _save_state(state: dict) -> None:
     try:
-        _atomic_write_json(_FOLLOWUPS_FILE, state if isinstance(state, dict) else {})
+        save_doc("billing_followups", _FOLLOWUPS_FILE, state if isinstance(state, dict) else {})
     except Exception:
         pass
 
@@ -162,7 +143,7 @@ async def _billing_followup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     try:
-        store = load_accounts() or {}
+        store = load_accounts_view() or {}
     except Exception:
         store = {}
     if store and not (store.get(str(aid), {}) or {}).get("enabled", True):
@@ -206,7 +187,12 @@ async def _billing_followup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
     status = None
     try:
         with allow_fb_api_calls(reason="billing_followup"):
-            info = AdAccount(str(aid)).api_get(fields=["name", "account_status", "balance"])
+            info = await fb_call(
+                AdAccount(str(aid)).api_get,
+                fields=["name", "account_status", "balance"],
+                _caller="billing_followup",
+                _aid=str(aid),
+            )
             if hasattr(info, "export_all_data"):
                 info = info.export_all_data()
         if isinstance(info, dict):
@@ -356,7 +342,7 @@ async def _billing_watch_job(
         rate = 0.0
 
     try:
-        store = load_accounts() or {}
+        store = load_accounts_view() or {}
     except Exception:
         store = {}
 
@@ -373,39 +359,32 @@ async def _billing_watch_job(
     else:
         enabled_count = int(len(all_ids))
 
+    poll_ids = [
+        str(aid)
+        for aid in all_ids
+        if not (store and not (store.get(str(aid), {}) or {}).get("enabled", True))
+    ]
+    with allow_fb_api_calls(reason="billing_watch_poll"):
+        infos = await run_fb_io(fetch_accounts_info, poll_ids, caller="billing_watch_poll")
+    remember_accounts_meta({a: i for a, (i, _e) in infos.items()}, full=False)
+
     for aid in all_ids:
         if store and not (store.get(str(aid), {}) or {}).get("enabled", True):
             continue
         processed += 1
-        try:
-            with allow_fb_api_calls(reason="billing_watch_poll"):
-                info = AdAccount(str(aid)).api_get(fields=["name", "account_status", "balance"])
-                if hasattr(info, "export_all_data"):
-                    info = info.export_all_data()
-        except FacebookRequestError as e:
+        info, err = infos.get(str(aid), (None, None))
+        if err:
             http_status = None
             fb_code = None
             try:
-                http_status = int(
-                    getattr(e, "http_status", None)()
-                    if callable(getattr(e, "http_status", None))
-                    else getattr(e, "http_status", None)
-                )
+                http_status = int(err.get("http_status"))
             except Exception:
                 http_status = None
             try:
-                fb_code = int(e.api_error_code())
+                fb_code = int(err.get("code"))
             except Exception:
                 fb_code = None
-            msg = None
-            try:
-                msg = str(e)
-            except Exception:
-                msg = None
-            _log_api_error("billing_watch_poll", str(aid), http_status, fb_code, msg)
-            continue
-        except Exception as e:
-            _log_api_error("billing_watch_poll", str(aid), None, None, str(e))
+            _log_api_error("billing_watch_poll", str(aid), http_status, fb_code, err.get("message"))
             continue
 
         if not isinstance(info, dict):
@@ -537,7 +516,7 @@ def init_billing_watch(
     try:
         now = datetime.now(ALMATY_TZ)
         try:
-            store = load_accounts() or {}
+            store = load_accounts_view() or {}
         except Exception:
             store = {}
         state = _load_state() or {}
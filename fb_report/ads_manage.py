@@ -25,8 +25,17 @@ from fb_report.budget_plan import (
     upsert_budget_plan,
 )
 from fb_report.budget_plan_engine import apply_budget_plan_preview, build_budget_plan_preview
+from fb_report.callback_router import CallbackRouter
 from services.analytics import parse_insight
-from services.facebook_api import allow_fb_api_calls, fetch_adsets, fetch_ads, fetch_campaigns, fetch_insights_bulk, safe_api_call
+from services.facebook_api import (
+    allow_fb_api_calls,
+    fb_call,
+    fetch_adsets,
+    fetch_ads,
+    fetch_campaigns,
+    fetch_insights_bulk,
+    run_fb_io,
+)
 from services.reports import fmt_int
 
 _LOG = logging.getLogger(__name__)
@@ -312,7 +321,7 @@ async def _bp_render_pick_campaigns(q, context: ContextTypes.DEFAULT_TYPE, *, ki
         return
 
     with allow_fb_api_calls(reason="ads_manage:bp_pick_campaigns"):
-        items = fetch_campaigns(aid, force=True)
+        items = await run_fb_io(fetch_campaigns, aid)
 
     kind_u = str(kind or "").upper().strip()
     if kind_u == "BUNDLE":
@@ -348,7 +357,7 @@ async def _bp_render_pick_adsets(q, context: ContextTypes.DEFAULT_TYPE, *, kind:
         return
 
     with allow_fb_api_calls(reason="ads_manage:bp_pick_adsets"):
-        items = fetch_adsets(aid, force=True)
+        items = await run_fb_io(fetch_adsets, aid)
 
     bp["pick_items"] = list(items or [])
 
@@ -558,7 +567,29 @@ def _bulk_metrics(*, aid: str, level: str, ids: List[str], filter_field: str, id
     return out
 
 
-def _render_lines(*, title: str, items: List[Dict[str, Any]], metrics: Dict[str, Dict[str, Any]], aid: str, selected_id: str) -> str:
+def _freshness_line(fetched_at: float, refreshing: bool) -> str:
+    """Возраст данных из кэша FB (пусто, если данные свежее 5 минут)."""
+    try:
+        age_s = time.time() - float(fetched_at or 0.0)
+    except Exception:
+        return ""
+    if not fetched_at or age_s < 300:
+        return ""
+    mins = int(age_s // 60)
+    age = f"{mins} мин" if mins < 60 else f"{mins // 60} ч {mins % 60} мин"
+    return f"🕒 Данные {age} назад" + (" · обновляются" if refreshing else "")
+
+
+def _render_lines(
+    *,
+    title: str,
+    items: List[Dict[str, Any]],
+    metrics: Dict[str, Dict[str, Any]],
+    aid: str,
+    selected_id: str,
+    fetched_at: float = 0.0,
+    refreshing: bool = False,
+) -> str:
     lines: List[str] = [f"<b>{html.escape(title)}</b>"]
 
     if not items:
@@ -591,6 +622,10 @@ def _render_lines(*, title: str, items: List[Dict[str, Any]], metrics: Dict[str,
             f"{prefix}{emo} {nm} — {fmt_int(leads)} / {_fmt_cpa(spend, leads)} — {fmt_int(reach) if reach is not None else '—'} — {_fmt_money(spend)}"
         )
 
+    fresh = _freshness_line(fetched_at, refreshing)
+    if fresh:
+        lines.extend(["", fresh])
+
     return "\n".join(lines)
 
 
@@ -745,7 +780,7 @@ async def _render_accounts(q, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
-async def _render_campaigns(q, context: ContextTypes.DEFAULT_TYPE, *, force: bool) -> None:
+async def _render_campaigns(q, context: ContextTypes.DEFAULT_TYPE, *, force: bool, live: bool = False) -> None:
     st = _state(context)
     aid = str(st.get("aid") or "")
     if not aid:
@@ -754,22 +789,32 @@ async def _render_campaigns(q, context: ContextTypes.DEFAULT_TYPE, *, force: boo
 
     if force or not isinstance(st.get("items"), list) or st.get("level") != "campaigns":
         with allow_fb_api_calls(reason="ads_manage:list_campaigns"):
-            items = fetch_campaigns(aid, force=bool(force))
+            items = await run_fb_io(fetch_campaigns, aid, force=bool(live))
         ids = [str(x.get("id") or "") for x in (items or []) if str(x.get("id") or "").strip()]
-        metrics = _bulk_metrics(aid=aid, level="campaign", ids=ids, filter_field="campaign.id", id_key="campaign_id")
+        metrics = await run_fb_io(_bulk_metrics, aid=aid, level="campaign", ids=ids, filter_field="campaign.id", id_key="campaign_id")
         st["items"] = items
         st["metrics"] = metrics
         st["level"] = "campaigns"
+        st["fetched_at"] = float(getattr(items, "fetched_at", 0.0) or 0.0)
+        st["refreshing"] = bool(getattr(items, "refreshing", False))
 
     items = list(st.get("items") or [])
     metrics = dict(st.get("metrics") or {})
     selected_id = str(st.get("selected_id") or "")
 
-    text = _render_lines(title=f"Кампании — {get_account_name(aid)}", items=items, metrics=metrics, aid=aid, selected_id=selected_id)
+    text = _render_lines(
+        title=f"Кампании — {get_account_name(aid)}",
+        items=items,
+        metrics=metrics,
+        aid=aid,
+        selected_id=selected_id,
+        fetched_at=float(st.get("fetched_at") or 0.0),
+        refreshing=bool(st.get("refreshing")),
+    )
     await _safe_edit_message_text(q, text, reply_markup=_list_kb(level="campaigns", items=items, selected_id=selected_id), parse_mode=ParseMode.HTML)
 
 
-async def _render_adsets(q, context: ContextTypes.DEFAULT_TYPE, *, force: bool) -> None:
+async def _render_adsets(q, context: ContextTypes.DEFAULT_TYPE, *, force: bool, live: bool = False) -> None:
     st = _state(context)
     aid = str(st.get("aid") or "")
     campaign_id = str(st.get("campaign_id") or "")
@@ -779,23 +824,33 @@ async def _render_adsets(q, context: ContextTypes.DEFAULT_TYPE, *, force: bool)
 
     if force or not isinstance(st.get("items"), list) or st.get("level") != "adsets":
         with allow_fb_api_calls(reason="ads_manage:list_adsets"):
-            all_items = fetch_adsets(aid, force=bool(force))
+            all_items = await run_fb_io(fetch_adsets, aid, force=bool(live))
         items = [x for x in (all_items or []) if str((x or {}).get("campaign_id") or "") == str(campaign_id)]
         ids = [str(x.get("id") or "") for x in (items or []) if str(x.get("id") or "").strip()]
-        metrics = _bulk_metrics(aid=aid, level="adset", ids=ids, filter_field="adset.id", id_key="adset_id")
+        metrics = await run_fb_io(_bulk_metrics, aid=aid, level="adset", ids=ids, filter_field="adset.id", id_key="adset_id")
         st["items"] = items
         st["metrics"] = metrics
         st["level"] = "adsets"
+        st["fetched_at"] = float(getattr(all_items, "fetched_at", 0.0) or 0.0)
+        st["refreshing"] = bool(getattr(all_items, "refreshing", False))
 
     items = list(st.get("items") or [])
     metrics = dict(st.get("metrics") or {})
     selected_id = str(st.get("selected_id") or "")
 
-    text = _render_lines(title=f"Адсеты — {get_account_name(aid)}", items=items, metrics=metrics, aid=aid, selected_id=selected_id)
+    text = _render_lines(
+        title=f"Адсеты — {get_account_name(aid)}",
+        items=items,
+        metrics=metrics,
+        aid=aid,
+        selected_id=selected_id,
+        fetched_at=float(st.get("fetched_at") or 0.0),
+        refreshing=bool(st.get("refreshing")),
+    )
     await _safe_edit_message_text(q, text, reply_markup=_list_kb(level="adsets", items=items, selected_id=selected_id), parse_mode=ParseMode.HTML)
 
 
-async def _render_ads(q, context: ContextTypes.DEFAULT_TYPE, *, force: bool) -> None:
+async def _render_ads(q, context: ContextTypes.DEFAULT_TYPE, *, force: bool, live: bool = False) -> None:
     st = _state(context)
     aid = str(st.get("aid") or "")
     adset_id = str(st.get("adset_id") or "")
@@ -805,19 +860,29 @@ async def _render_ads(q, context: ContextTypes.DEFAULT_TYPE, *, force: bool) ->
 
     if force or not isinstance(st.get("items"), list) or st.get("level") != "ads":
         with allow_fb_api_calls(reason="ads_manage:list_ads"):
-            all_items = fetch_ads(aid, force=bool(force))
+            all_items = await run_fb_io(fetch_ads, aid, force=bool(live))
         items = [x for x in (all_items or []) if str((x or {}).get("adset_id") or "") == str(adset_id)]
         ids = [str(x.get("id") or "") for x in (items or []) if str(x.get("id") or "").strip()]
-        metrics = _bulk_metrics(aid=aid, level="ad", ids=ids, filter_field="ad.id", id_key="ad_id")
+        metrics = await run_fb_io(_bulk_metrics, aid=aid, level="ad", ids=ids, filter_field="ad.id", id_key="ad_id")
         st["items"] = items
         st["metrics"] = metrics
         st["level"] = "ads"
+        st["fetched_at"] = float(getattr(all_items, "fetched_at", 0.0) or 0.0)
+        st["refreshing"] = bool(getattr(all_items, "refreshing", False))
 
     items = list(st.get("items") or [])
     metrics = dict(st.get("metrics") or {})
     selected_id = str(st.get("selected_id") or "")
 
-    text = _render_lines(title=f"Объявления — {get_account_name(aid)}", items=items, metrics=metrics, aid=aid, selected_id=selected_id)
+    text = _render_lines(
+        title=f"Объявления — {get_account_name(aid)}",
+        items=items,
+        metrics=metrics,
+        aid=aid,
+        selected_id=selected_id,
+        fetched_at=float(st.get("fetched_at") or 0.0),
+        refreshing=bool(st.get("refreshing")),
+    )
     await _safe_edit_message_text(q, text, reply_markup=_list_kb(level="ads", items=items, selected_id=selected_id), parse_mode=ParseMode.HTML)
 
 
@@ -909,7 +974,7 @@ async def _apply_confirm(q, context: ContextTypes.DEFAULT_TYPE) -> None:
                     obj = AdSet(oid)
                 else:
                     obj = Ad(oid)
-                res, info = safe_api_call(obj.api_update, params={"status": new_status}, _caller="ads_manage", _aid=aid, _return_error_info=True)
+                res, info = await fb_call(obj.api_update, params={"status": new_status}, _caller="ads_manage", _aid=aid, _return_error_info=True)
         except Exception as e:
             info = {"kind": "exception", "message": str(e)}
 
@@ -931,11 +996,11 @@ async def _apply_confirm(q, context: ContextTypes.DEFAULT_TYPE) -> None:
             await q.message.reply_text("✅ Статус изменён")
             cur = str(st.get("level") or "")
             if cur == "campaigns":
-                await _render_campaigns(q, context, force=True)
+                await _render_campaigns(q, context, force=True, live=True)
             elif cur == "adsets":
-                await _render_adsets(q, context, force=True)
+                await _render_adsets(q, context, force=True, live=True)
             else:
-                await _render_ads(q, context, force=True)
+                await _render_ads(q, context, force=True, live=True)
             return
 
         await _safe_edit_message_text(q, f"⚠️ Ошибка: {err_msg}", reply_markup=_confirm_kb(), parse_mode=ParseMode.HTML)
@@ -953,7 +1018,7 @@ async def _apply_confirm(q, context: ContextTypes.DEFAULT_TYPE) -> None:
             cents = int(float(new_budget) * 100)
             with allow_fb_api_calls(reason="ads_manage:budget"):
                 obj = AdSet(adset_id)
-                res, info = safe_api_call(obj.api_update, params={"daily_budget": cents}, _caller="ads_manage", _aid=aid, _return_error_info=True)
+                res, info = await fb_call(obj.api_update, params={"daily_budget": cents}, _caller="ads_manage", _aid=aid, _return_error_info=True)
         except Exception as e:
             info = {"kind": "exception", "message": str(e)}
 
@@ -973,7 +1038,7 @@ async def _apply_confirm(q, context: ContextTypes.DEFAULT_TYPE) -> None:
         st.pop("pending", None)
         if ok:
             await q.message.reply_text("✅ Бюджет изменён")
-            await _render_adsets(q, context, force=True)
+            await _render_adsets(q, context, force=True, live=True)
             return
 
         await _safe_edit_message_text(q, f"⚠️ Ошибка: {err_msg}", reply_markup=_confirm_kb(), parse_mode=ParseMode.HTML)
@@ -982,6 +1047,14 @@ async def _apply_confirm(q, context: ContextTypes.DEFAULT_TYPE) -> None:
     await q.answer("Нет действия", show_alert=False)
 
 
+_BP_ENTRY_ROUTER = CallbackRouter("ads_manage_bp_entry")
+_ROUTER = CallbackRouter("ads_manage")
+
+
+def callback_routers() -> List[CallbackRouter]:
+    return [_BP_ENTRY_ROUTER, _ROUTER]
+
+
 async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     if not _can_access(update):
         return False
@@ -998,441 +1071,494 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> boo
 
     st = _state(context)
 
-    if data == "am_bp_accounts":
-        await _bp_render_accounts(q, context)
+    if await _BP_ENTRY_ROUTER.dispatch(data, update, context, q, data, st):
         return True
 
-    if data.startswith("am_bp_acc|"):
-        aid = str(data.split("|", 1)[1] or "").strip()
-        bp = _bp_state(context)
-        bp.clear()
-        bp["aid"] = aid
-        await _bp_render_plans(q, context)
-        return True
+    bp = _bp_state(context)
+    plan = bp.get("edit_plan")
+    if data in {"am_bp_name", "am_bp_total"} or data.startswith("am_bp_lock_") or data.startswith("am_bp_pick_") or data.startswith("am_bp_"):
+        if not isinstance(plan, dict) and data not in {"am_bp_accounts", "am_bp_exit", "am_bp_menu"}:
+            await _bp_render_plans(q, context)
+            return True
 
-    if data == "am_bp_exit":
-        await _render_accounts(q, context)
-        return True
+    await _ROUTER.dispatch(data, update, context, q, data, st, bp, plan)
+    return True
 
-    if data == "am_bp_menu":
-        bp = _bp_state(context)
-        if not str(bp.get("aid") or "").strip():
-            bp["aid"] = str(st.get("aid") or "").strip()
-        await _bp_render_plans(q, context)
-        return True
 
-    if data.startswith("am_bp_open|"):
-        pid = str(data.split("|", 1)[1] or "").strip()
-        plan = get_budget_plan(pid)
-        if not isinstance(plan, dict):
-            await q.answer("План не найден", show_alert=True)
-            await _bp_render_plans(q, context)
-            return True
-        bp = _bp_state(context)
-        bp["aid"] = str(plan.get("account_id") or bp.get("aid") or "").strip()
-        bp["edit_plan"] = dict(plan)
-        bp.pop("preview", None)
-        await _bp_render_edit(update, context)
-        return True
+# ========= CALLBACK-МАРШРУТЫ =========
+# Вход в бюджетные планы: до проверки наличия редактируемого плана.
 
-    if data.startswith("am_bp_new|"):
-        scope = str(data.split("|", 1)[1] or "ACCOUNT").upper().strip()
-        bp = _bp_state(context)
-        aid = str(bp.get("aid") or st.get("aid") or "").strip()
-        if not aid:
-            await _bp_render_accounts(q, context)
-            return True
 
-        plan = {
-            "plan_id": "",
-            "scope_type": "BUNDLE" if scope == "BUNDLE" else "ACCOUNT",
-            "account_id": aid,
-            "name": "",
-            "period_type": "MONTH",
-            "budget_total_usd": None,
-            "is_enabled": True,
-            "excluded_campaign_ids": [],
-            "excluded_adset_ids": [],
-            "bundle_campaign_ids": [],
-            "locked_adset_limits": {},
-        }
-        bp["edit_plan"] = plan
-        bp.pop("preview", None)
-        await _bp_render_edit(update, context)
-        return True
+@_BP_ENTRY_ROUTER.exact("am_bp_accounts")
+async def _cb_am_bp_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any]):
+    await _bp_render_accounts(q, context)
 
+
+@_BP_ENTRY_ROUTER.prefix("am_bp_acc|")
+async def _cb_am_bp_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any]):
+    aid = str(data.split("|", 1)[1] or "").strip()
     bp = _bp_state(context)
-    plan = bp.get("edit_plan")
-    if data in {"am_bp_name", "am_bp_total"} or data.startswith("am_bp_lock_") or data.startswith("am_bp_pick_") or data.startswith("am_bp_"):
-        if not isinstance(plan, dict) and data not in {"am_bp_accounts", "am_bp_exit", "am_bp_menu"}:
-            await _bp_render_plans(q, context)
-            return True
+    bp.clear()
+    bp["aid"] = aid
+    await _bp_render_plans(q, context)
 
-    if data == "am_bp_edit":
-        await _bp_render_edit(update, context)
-        return True
 
-    if data == "am_bp_name":
-        context.user_data["ads_manage_bp_await"] = {"kind": "name"}
-        await q.message.reply_text("Введи название плана")
-        return True
+@_BP_ENTRY_ROUTER.exact("am_bp_exit")
+async def _cb_am_bp_exit(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any]):
+    await _render_accounts(q, context)
 
-    if data == "am_bp_period":
-        cur = str(plan.get("period_type") or "MONTH").upper().strip()
-        order = ["MONTH", "WEEK", "DAY"]
-        try:
-            idx = order.index(cur)
-        except Exception:
-            idx = 0
-        plan["period_type"] = order[(idx + 1) % len(order)]
-        bp["edit_plan"] = plan
-        await _bp_render_edit(update, context)
-        return True
 
-    if data == "am_bp_scope":
-        cur = str(plan.get("scope_type") or "ACCOUNT").upper().strip()
-        plan["scope_type"] = "BUNDLE" if cur != "BUNDLE" else "ACCOUNT"
-        if str(plan.get("scope_type") or "") != "BUNDLE":
-            plan["bundle_campaign_ids"] = []
-        bp["edit_plan"] = plan
-        await _bp_render_edit(update, context)
-        return True
+@_BP_ENTRY_ROUTER.exact("am_bp_menu")
+async def _cb_am_bp_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any]):
+    bp = _bp_state(context)
+    if not str(bp.get("aid") or "").strip():
+        bp["aid"] = str(st.get("aid") or "").strip()
+    await _bp_render_plans(q, context)
 
-    if data == "am_bp_total":
-        context.user_data["ads_manage_bp_await"] = {"kind": "total"}
-        await q.message.reply_text("Введи Budget total (USD)")
-        return True
 
-    if data == "am_bp_bundle_campaigns":
-        await _bp_render_pick_campaigns(q, context, kind="BUNDLE")
+@_BP_ENTRY_ROUTER.prefix("am_bp_open|")
+async def _cb_am_bp_open(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any]):
+    pid = str(data.split("|", 1)[1] or "").strip()
+    plan = get_budget_plan(pid)
+    if not isinstance(plan, dict):
+        await q.answer("План не найден", show_alert=True)
+        await _bp_render_plans(q, context)
         return True
+    bp = _bp_state(context)
+    bp["aid"] = str(plan.get("account_id") or bp.get("aid") or "").strip()
+    bp["edit_plan"] = dict(plan)
+    bp.pop("preview", None)
+    await _bp_render_edit(update, context)
 
-    if data == "am_bp_excl_campaigns":
-        await _bp_render_pick_campaigns(q, context, kind="EXCL")
-        return True
 
-    if data == "am_bp_excl_adsets":
-        await _bp_render_pick_adsets(q, context, kind="EXCL")
+@_BP_ENTRY_ROUTER.prefix("am_bp_new|")
+async def _cb_am_bp_new(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any]):
+    scope = str(data.split("|", 1)[1] or "ACCOUNT").upper().strip()
+    bp = _bp_state(context)
+    aid = str(bp.get("aid") or st.get("aid") or "").strip()
+    if not aid:
+        await _bp_render_accounts(q, context)
         return True
 
-    if data == "am_bp_locks":
+    plan = {
+        "plan_id": "",
+        "scope_type": "BUNDLE" if scope == "BUNDLE" else "ACCOUNT",
+        "account_id": aid,
+        "name": "",
+        "period_type": "MONTH",
+        "budget_total_usd": None,
+        "is_enabled": True,
+        "excluded_campaign_ids": [],
+        "excluded_adset_ids": [],
+        "bundle_campaign_ids": [],
+        "locked_adset_limits": {},
+    }
+    bp["edit_plan"] = plan
+    bp.pop("preview", None)
+    await _bp_render_edit(update, context)
+
+
+# Остальные кнопки (am_bp_* — только при открытом плане, см. on_callback).
+
+
+@_ROUTER.exact("am_bp_edit")
+async def _cb_am_bp_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.exact("am_bp_name")
+async def _cb_am_bp_name(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    context.user_data["ads_manage_bp_await"] = {"kind": "name"}
+    await q.message.reply_text("Введи название плана")
+
+
+@_ROUTER.exact("am_bp_period")
+async def _cb_am_bp_period(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    cur = str(plan.get("period_type") or "MONTH").upper().strip()
+    order = ["MONTH", "WEEK", "DAY"]
+    try:
+        idx = order.index(cur)
+    except Exception:
+        idx = 0
+    plan["period_type"] = order[(idx + 1) % len(order)]
+    bp["edit_plan"] = plan
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.exact("am_bp_scope")
+async def _cb_am_bp_scope(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    cur = str(plan.get("scope_type") or "ACCOUNT").upper().strip()
+    plan["scope_type"] = "BUNDLE" if cur != "BUNDLE" else "ACCOUNT"
+    if str(plan.get("scope_type") or "") != "BUNDLE":
+        plan["bundle_campaign_ids"] = []
+    bp["edit_plan"] = plan
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.exact("am_bp_total")
+async def _cb_am_bp_total(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    context.user_data["ads_manage_bp_await"] = {"kind": "total"}
+    await q.message.reply_text("Введи Budget total (USD)")
+
+
+@_ROUTER.exact("am_bp_bundle_campaigns")
+async def _cb_am_bp_bundle_campaigns(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_pick_campaigns(q, context, kind="BUNDLE")
+
+
+@_ROUTER.exact("am_bp_excl_campaigns")
+async def _cb_am_bp_excl_campaigns(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_pick_campaigns(q, context, kind="EXCL")
+
+
+@_ROUTER.exact("am_bp_excl_adsets")
+async def _cb_am_bp_excl_adsets(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_pick_adsets(q, context, kind="EXCL")
+
+
+@_ROUTER.exact("am_bp_locks")
+async def _cb_am_bp_locks(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_pick_adsets(q, context, kind="LOCKS")
+
+
+@_ROUTER.exact("am_bp_toggle")
+async def _cb_am_bp_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    plan["is_enabled"] = not bool(plan.get("is_enabled", True))
+    bp["edit_plan"] = plan
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.exact("am_bp_save")
+async def _cb_am_bp_save(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    saved = upsert_budget_plan(plan)
+    bp["edit_plan"] = dict(saved)
+    await q.message.reply_text("✅ План сохранён")
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.prefix("am_bp_delete|")
+async def _cb_am_bp_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    pid = str(data.split("|", 1)[1] or "").strip()
+    if pid:
+        delete_budget_plan(pid)
+    bp.pop("edit_plan", None)
+    bp.pop("preview", None)
+    await q.message.reply_text("✅ Удалено")
+    await _bp_render_plans(q, context)
+
+
+@_ROUTER.prefix("am_bp_pick_bundle|")
+async def _cb_am_bp_pick_bundle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    cid = str(data.split("|", 1)[1] or "").strip()
+    cur = set([str(x) for x in (plan.get("bundle_campaign_ids") or []) if str(x).strip()])
+    if cid in cur:
+        cur.remove(cid)
+    else:
+        cur.add(cid)
+    plan["bundle_campaign_ids"] = list(cur)
+    bp["edit_plan"] = plan
+    items = bp.get("pick_items")
+    await _safe_edit_message_reply_markup(
+        q,
+        reply_markup=_bp_pick_list_kb(items=list(items or []), selected=cur, prefix="am_bp_pick_bundle", done_cb="am_bp_pick_bundle_done", back_cb="am_bp_edit"),
+    )
+
+
+@_ROUTER.exact("am_bp_pick_bundle_done")
+async def _cb_am_bp_pick_bundle_done(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.prefix("am_bp_pick_excl_c|")
+async def _cb_am_bp_pick_excl_c(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    cid = str(data.split("|", 1)[1] or "").strip()
+    cur = set([str(x) for x in (plan.get("excluded_campaign_ids") or []) if str(x).strip()])
+    if cid in cur:
+        cur.remove(cid)
+    else:
+        cur.add(cid)
+    plan["excluded_campaign_ids"] = list(cur)
+    bp["edit_plan"] = plan
+    items = bp.get("pick_items")
+    await _safe_edit_message_reply_markup(
+        q,
+        reply_markup=_bp_pick_list_kb(items=list(items or []), selected=cur, prefix="am_bp_pick_excl_c", done_cb="am_bp_pick_excl_c_done", back_cb="am_bp_edit"),
+    )
+
+
+@_ROUTER.exact("am_bp_pick_excl_c_done")
+async def _cb_am_bp_pick_excl_c_done(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.prefix("am_bp_pick_excl_a|")
+async def _cb_am_bp_pick_excl_a(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    aid2 = str(data.split("|", 1)[1] or "").strip()
+    cur = set([str(x) for x in (plan.get("excluded_adset_ids") or []) if str(x).strip()])
+    if aid2 in cur:
+        cur.remove(aid2)
+    else:
+        cur.add(aid2)
+    plan["excluded_adset_ids"] = list(cur)
+    bp["edit_plan"] = plan
+    items = bp.get("pick_items")
+    await _safe_edit_message_reply_markup(
+        q,
+        reply_markup=_bp_pick_list_kb(items=list(items or []), selected=cur, prefix="am_bp_pick_excl_a", done_cb="am_bp_pick_excl_a_done", back_cb="am_bp_edit"),
+    )
+
+
+@_ROUTER.exact("am_bp_pick_excl_a_done")
+async def _cb_am_bp_pick_excl_a_done(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.prefix("am_bp_lock_toggle|")
+async def _cb_am_bp_lock_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    adset_id = str(data.split("|", 1)[1] or "").strip()
+    lock = plan.get("locked_adset_limits")
+    if not isinstance(lock, dict):
+        lock = {}
+        plan["locked_adset_limits"] = lock
+    if adset_id in lock:
+        lock.pop(adset_id, None)
+    else:
+        lock[adset_id] = {"locked": True, "min_usd_day": None, "max_usd_day": None}
+    bp["edit_plan"] = plan
+    await _bp_render_pick_adsets(q, context, kind="LOCKS")
+
+
+@_ROUTER.prefix("am_bp_lock_item|")
+async def _cb_am_bp_lock_item(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    adset_id = str(data.split("|", 1)[1] or "").strip()
+    lock = plan.get("locked_adset_limits")
+    item = lock.get(adset_id) if isinstance(lock, dict) else None
+    if not isinstance(item, dict):
         await _bp_render_pick_adsets(q, context, kind="LOCKS")
         return True
 
-    if data == "am_bp_toggle":
-        plan["is_enabled"] = not bool(plan.get("is_enabled", True))
-        bp["edit_plan"] = plan
-        await _bp_render_edit(update, context)
-        return True
+    nm = ""
+    try:
+        for it in list(bp.get("pick_items") or []):
+            if str((it or {}).get("id") or "") == adset_id:
+                nm = str((it or {}).get("name") or "")
+                break
+    except Exception:
+        nm = ""
+    title = f"🔒 <b>Locked adset</b>\n\n{str(nm or adset_id)}"
+    await _safe_edit_message_text(q, title, reply_markup=_bp_lock_item_kb(adset_id, item), parse_mode=ParseMode.HTML)
 
-    if data == "am_bp_save":
-        saved = upsert_budget_plan(plan)
-        bp["edit_plan"] = dict(saved)
-        await q.message.reply_text("✅ План сохранён")
-        await _bp_render_edit(update, context)
-        return True
 
-    if data.startswith("am_bp_delete|"):
-        pid = str(data.split("|", 1)[1] or "").strip()
-        if pid:
-            delete_budget_plan(pid)
-        bp.pop("edit_plan", None)
-        bp.pop("preview", None)
-        await q.message.reply_text("✅ Удалено")
-        await _bp_render_plans(q, context)
-        return True
+@_ROUTER.prefix("am_bp_lock_min|")
+async def _cb_am_bp_lock_min(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    adset_id = str(data.split("|", 1)[1] or "").strip()
+    context.user_data["ads_manage_bp_await"] = {"kind": "min", "adset_id": adset_id}
+    await q.message.reply_text("Введи min_usd_day (USD)")
 
-    if data.startswith("am_bp_pick_bundle|"):
-        cid = str(data.split("|", 1)[1] or "").strip()
-        cur = set([str(x) for x in (plan.get("bundle_campaign_ids") or []) if str(x).strip()])
-        if cid in cur:
-            cur.remove(cid)
-        else:
-            cur.add(cid)
-        plan["bundle_campaign_ids"] = list(cur)
-        bp["edit_plan"] = plan
-        items = bp.get("pick_items")
-        await _safe_edit_message_reply_markup(
-            q,
-            reply_markup=_bp_pick_list_kb(items=list(items or []), selected=cur, prefix="am_bp_pick_bundle", done_cb="am_bp_pick_bundle_done", back_cb="am_bp_edit"),
-        )
-        return True
 
-    if data == "am_bp_pick_bundle_done":
+@_ROUTER.prefix("am_bp_lock_max|")
+async def _cb_am_bp_lock_max(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    adset_id = str(data.split("|", 1)[1] or "").strip()
+    context.user_data["ads_manage_bp_await"] = {"kind": "max", "adset_id": adset_id}
+    await q.message.reply_text("Введи max_usd_day (USD)")
+
+
+@_ROUTER.exact("am_bp_locks_done")
+async def _cb_am_bp_locks_done(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _bp_render_edit(update, context)
+
+
+@_ROUTER.exact("am_bp_preview")
+async def _cb_am_bp_preview(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    with allow_fb_api_calls(reason="ads_manage:bp_preview"):
+        pv = await run_fb_io(build_budget_plan_preview, plan, force=True)
+    if not isinstance(pv, dict):
+        await q.message.reply_text("⚠️ Не удалось построить preview")
         await _bp_render_edit(update, context)
         return True
-
-    if data.startswith("am_bp_pick_excl_c|"):
-        cid = str(data.split("|", 1)[1] or "").strip()
-        cur = set([str(x) for x in (plan.get("excluded_campaign_ids") or []) if str(x).strip()])
-        if cid in cur:
-            cur.remove(cid)
-        else:
-            cur.add(cid)
-        plan["excluded_campaign_ids"] = list(cur)
-        bp["edit_plan"] = plan
-        items = bp.get("pick_items")
-        await _safe_edit_message_reply_markup(
-            q,
-            reply_markup=_bp_pick_list_kb(items=list(items or []), selected=cur, prefix="am_bp_pick_excl_c", done_cb="am_bp_pick_excl_c_done", back_cb="am_bp_edit"),
-        )
+    if not pv.get("ok"):
+        err = str(pv.get("error") or "unknown_error")
+        await q.message.reply_text(f"⚠️ Preview error: {err}")
+        await _bp_render_edit(update, context)
         return True
+    bp["preview"] = pv
+    await _safe_edit_message_text(q, _bp_preview_text(pv), reply_markup=_bp_preview_kb(), parse_mode=ParseMode.HTML)
+
 
-    if data == "am_bp_pick_excl_c_done":
+@_ROUTER.exact("am_bp_apply")
+async def _cb_am_bp_apply(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    pv = bp.get("preview")
+    if not isinstance(pv, dict) or not pv.get("ok"):
+        await q.answer("Сначала сделай preview", show_alert=True)
         await _bp_render_edit(update, context)
         return True
-
-    if data.startswith("am_bp_pick_excl_a|"):
-        aid2 = str(data.split("|", 1)[1] or "").strip()
-        cur = set([str(x) for x in (plan.get("excluded_adset_ids") or []) if str(x).strip()])
-        if aid2 in cur:
-            cur.remove(aid2)
-        else:
-            cur.add(aid2)
-        plan["excluded_adset_ids"] = list(cur)
-        bp["edit_plan"] = plan
-        items = bp.get("pick_items")
-        await _safe_edit_message_reply_markup(
-            q,
-            reply_markup=_bp_pick_list_kb(items=list(items or []), selected=cur, prefix="am_bp_pick_excl_a", done_cb="am_bp_pick_excl_a_done", back_cb="am_bp_edit"),
-        )
+    res = apply_budget_plan_preview(pv)
+    if not isinstance(res, dict):
+        await q.message.reply_text("⚠️ Не удалось применить")
+        bp.pop("preview", None)
+        await _bp_render_edit(update, context)
         return True
 
-    if data == "am_bp_pick_excl_a_done":
+    if not res.get("ok") and res.get("error"):
+        await q.message.reply_text(f"⚠️ Apply error: {str(res.get('error'))}")
+        bp.pop("preview", None)
         await _bp_render_edit(update, context)
         return True
 
-    if data.startswith("am_bp_lock_toggle|"):
-        adset_id = str(data.split("|", 1)[1] or "").strip()
-        lock = plan.get("locked_adset_limits")
-        if not isinstance(lock, dict):
-            lock = {}
-            plan["locked_adset_limits"] = lock
-        if adset_id in lock:
-            lock.pop(adset_id, None)
-        else:
-            lock[adset_id] = {"locked": True, "min_usd_day": None, "max_usd_day": None}
-        bp["edit_plan"] = plan
-        await _bp_render_pick_adsets(q, context, kind="LOCKS")
-        return True
+    updated = int(res.get("updated") or 0)
+    skipped = int(res.get("skipped") or 0)
+    failed = int(res.get("failed") or 0)
 
-    if data.startswith("am_bp_lock_item|"):
-        adset_id = str(data.split("|", 1)[1] or "").strip()
-        lock = plan.get("locked_adset_limits")
-        item = lock.get(adset_id) if isinstance(lock, dict) else None
-        if not isinstance(item, dict):
-            await _bp_render_pick_adsets(q, context, kind="LOCKS")
-            return True
+    lines: List[str] = [f"Apply: updated={updated} skipped={skipped} failed={failed}"]
 
-        nm = ""
-        try:
-            for it in list(bp.get("pick_items") or []):
-                if str((it or {}).get("id") or "") == adset_id:
-                    nm = str((it or {}).get("name") or "")
-                    break
-        except Exception:
-            nm = ""
-        title = f"🔒 <b>Locked adset</b>\n\n{str(nm or adset_id)}"
-        await _safe_edit_message_text(q, title, reply_markup=_bp_lock_item_kb(adset_id, item), parse_mode=ParseMode.HTML)
-        return True
+    name_map: Dict[str, str] = {}
+    try:
+        for ch in list((pv or {}).get("changes") or []):
+            if isinstance(ch, dict):
+                aid2 = str(ch.get("adset_id") or "").strip()
+                nm2 = str(ch.get("name") or "").strip()
+                if aid2:
+                    name_map[aid2] = nm2
+    except Exception:
+        name_map = {}
 
-    if data.startswith("am_bp_lock_min|"):
-        adset_id = str(data.split("|", 1)[1] or "").strip()
-        context.user_data["ads_manage_bp_await"] = {"kind": "min", "adset_id": adset_id}
-        await q.message.reply_text("Введи min_usd_day (USD)")
-        return True
+    failed_items: List[Dict[str, Any]] = []
+    try:
+        for r in list(res.get("results") or []):
+            if isinstance(r, dict) and str(r.get("status") or "") == "error":
+                failed_items.append(r)
+    except Exception:
+        failed_items = []
 
-    if data.startswith("am_bp_lock_max|"):
-        adset_id = str(data.split("|", 1)[1] or "").strip()
-        context.user_data["ads_manage_bp_await"] = {"kind": "max", "adset_id": adset_id}
-        await q.message.reply_text("Введи max_usd_day (USD)")
-        return True
+    if failed_items:
+        lines.append("Ошибки (первые):")
+        for r in failed_items[:3]:
+            adset_id = str(r.get("adset_id") or "").strip()
+            nm = str(name_map.get(adset_id) or "")
+            if len(nm) > 28:
+                nm = nm[:25] + "…"
+            err_txt = _human_fb_error(r.get("error") if isinstance(r.get("error"), dict) else None)
+            label = nm or adset_id
+            lines.append(f"- {label}: {err_txt}")
 
-    if data == "am_bp_locks_done":
-        await _bp_render_edit(update, context)
-        return True
-
-    if data == "am_bp_preview":
-        with allow_fb_api_calls(reason="ads_manage:bp_preview"):
-            pv = build_budget_plan_preview(plan, force=True)
-        if not isinstance(pv, dict):
-            await q.message.reply_text("⚠️ Не удалось построить preview")
-            await _bp_render_edit(update, context)
-            return True
-        if not pv.get("ok"):
-            err = str(pv.get("error") or "unknown_error")
-            await q.message.reply_text(f"⚠️ Preview error: {err}")
-            await _bp_render_edit(update, context)
-            return True
-        bp["preview"] = pv
-        await _safe_edit_message_text(q, _bp_preview_text(pv), reply_markup=_bp_preview_kb(), parse_mode=ParseMode.HTML)
-        return True
+    await q.message.reply_text("\n".join(lines))
+    bp.pop("preview", None)
+    await _bp_render_edit(update, context)
 
-    if data == "am_bp_apply":
-        pv = bp.get("preview")
-        if not isinstance(pv, dict) or not pv.get("ok"):
-            await q.answer("Сначала сделай preview", show_alert=True)
-            await _bp_render_edit(update, context)
-            return True
-        res = apply_budget_plan_preview(pv)
-        if not isinstance(res, dict):
-            await q.message.reply_text("⚠️ Не удалось применить")
-            bp.pop("preview", None)
-            await _bp_render_edit(update, context)
-            return True
 
-        if not res.get("ok") and res.get("error"):
-            await q.message.reply_text(f"⚠️ Apply error: {str(res.get('error'))}")
-            bp.pop("preview", None)
-            await _bp_render_edit(update, context)
-            return True
+@_ROUTER.exact("am_menu")
+async def _cb_am_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _render_accounts(q, context)
 
-        updated = int(res.get("updated") or 0)
-        skipped = int(res.get("skipped") or 0)
-        failed = int(res.get("failed") or 0)
 
-        lines: List[str] = [f"Apply: updated={updated} skipped={skipped} failed={failed}"]
+@_ROUTER.prefix("am_acc|")
+async def _cb_am_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    aid = data.split("|", 1)[1]
+    st.clear()
+    st.update({"level": "campaigns", "aid": str(aid), "selected_id": ""})
+    await _render_campaigns(q, context, force=True)
 
-        name_map: Dict[str, str] = {}
-        try:
-            for ch in list((pv or {}).get("changes") or []):
-                if isinstance(ch, dict):
-                    aid2 = str(ch.get("adset_id") or "").strip()
-                    nm2 = str(ch.get("name") or "").strip()
-                    if aid2:
-                        name_map[aid2] = nm2
-        except Exception:
-            name_map = {}
 
-        failed_items: List[Dict[str, Any]] = []
-        try:
-            for r in list(res.get("results") or []):
-                if isinstance(r, dict) and str(r.get("status") or "") == "error":
-                    failed_items.append(r)
-        except Exception:
-            failed_items = []
-
-        if failed_items:
-            lines.append("Ошибки (первые):")
-            for r in failed_items[:3]:
-                adset_id = str(r.get("adset_id") or "").strip()
-                nm = str(name_map.get(adset_id) or "")
-                if len(nm) > 28:
-                    nm = nm[:25] + "…"
-                err_txt = _human_fb_error(r.get("error") if isinstance(r.get("error"), dict) else None)
-                label = nm or adset_id
-                lines.append(f"- {label}: {err_txt}")
-
-        await q.message.reply_text("\n".join(lines))
-        bp.pop("preview", None)
-        await _bp_render_edit(update, context)
-        return True
+@_ROUTER.prefix("am_sel|")
+async def _cb_am_sel(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    oid = data.split("|", 1)[1]
+    st["selected_id"] = str(oid)
+    cur = str(st.get("level") or "")
+    if cur == "campaigns":
+        await _render_campaigns(q, context, force=False)
+    elif cur == "adsets":
+        await _render_adsets(q, context, force=False)
+    else:
+        await _render_ads(q, context, force=False)
 
-    if data == "am_menu":
-        await _render_accounts(q, context)
-        return True
 
-    if data.startswith("am_acc|"):
-        aid = data.split("|", 1)[1]
-        st.clear()
-        st.update({"level": "campaigns", "aid": str(aid), "selected_id": ""})
+@_ROUTER.exact("am_back")
+async def _cb_am_back(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    cur = str(st.get("level") or "")
+    if cur == "adsets":
+        st["level"] = "campaigns"
+        st.pop("campaign_id", None)
+        st.pop("adset_id", None)
+        st["selected_id"] = ""
         await _render_campaigns(q, context, force=True)
         return True
-
-    if data.startswith("am_sel|"):
-        oid = data.split("|", 1)[1]
-        st["selected_id"] = str(oid)
-        cur = str(st.get("level") or "")
-        if cur == "campaigns":
-            await _render_campaigns(q, context, force=False)
-        elif cur == "adsets":
-            await _render_adsets(q, context, force=False)
-        else:
-            await _render_ads(q, context, force=False)
+    if cur == "ads":
+        st["level"] = "adsets"
+        st.pop("adset_id", None)
+        st["selected_id"] = ""
+        await _render_adsets(q, context, force=True)
         return True
+    await _render_accounts(q, context)
 
-    if data == "am_back":
-        cur = str(st.get("level") or "")
-        if cur == "adsets":
-            st["level"] = "campaigns"
-            st.pop("campaign_id", None)
-            st.pop("adset_id", None)
-            st["selected_id"] = ""
-            await _render_campaigns(q, context, force=True)
-            return True
-        if cur == "ads":
-            st["level"] = "adsets"
-            st.pop("adset_id", None)
-            st["selected_id"] = ""
-            await _render_adsets(q, context, force=True)
-            return True
-        await _render_accounts(q, context)
-        return True
 
-    if data == "am_open":
-        cur = str(st.get("level") or "")
-        sel = str(st.get("selected_id") or "").strip()
-        if not sel:
-            await q.answer("Выбери объект", show_alert=False)
-            return True
-        if cur == "campaigns":
-            st["level"] = "adsets"
-            st["campaign_id"] = sel
-            st["selected_id"] = ""
-            await _render_adsets(q, context, force=True)
-            return True
-        if cur == "adsets":
-            st["level"] = "ads"
-            st["adset_id"] = sel
-            st["selected_id"] = ""
-            await _render_ads(q, context, force=True)
-            return True
-        await q.answer("Нижний уровень", show_alert=False)
+@_ROUTER.exact("am_open")
+async def _cb_am_open(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    cur = str(st.get("level") or "")
+    sel = str(st.get("selected_id") or "").strip()
+    if not sel:
+        await q.answer("Выбери объект", show_alert=False)
         return True
-
-    if data == "am_refresh":
-        ok, wait_s = _refresh_allowed(context)
-        if not ok:
-            await q.answer(f"Подожди {wait_s}с", show_alert=False)
-            return True
-        cur = str(st.get("level") or "")
-        if cur == "campaigns":
-            await _render_campaigns(q, context, force=True)
-        elif cur == "adsets":
-            await _render_adsets(q, context, force=True)
-        elif cur == "ads":
-            await _render_ads(q, context, force=True)
-        else:
-            await _render_accounts(q, context)
+    if cur == "campaigns":
+        st["level"] = "adsets"
+        st["campaign_id"] = sel
+        st["selected_id"] = ""
+        await _render_adsets(q, context, force=True)
         return True
-
-    if data == "am_edit":
-        await q.answer("⏳ В разработке", show_alert=True)
+    if cur == "adsets":
+        st["level"] = "ads"
+        st["adset_id"] = sel
+        st["selected_id"] = ""
+        await _render_ads(q, context, force=True)
         return True
+    await q.answer("Нижний уровень", show_alert=False)
 
-    if data == "am_toggle":
-        await _start_toggle(q, context)
-        return True
 
-    if data == "am_budget":
-        await _start_budget(q, context)
+@_ROUTER.exact("am_refresh")
+async def _cb_am_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    ok, wait_s = _refresh_allowed(context)
+    if not ok:
+        await q.answer(f"Подожди {wait_s}с", show_alert=False)
         return True
+    cur = str(st.get("level") or "")
+    if cur == "campaigns":
+        await _render_campaigns(q, context, force=True, live=True)
+    elif cur == "adsets":
+        await _render_adsets(q, context, force=True, live=True)
+    elif cur == "ads":
+        await _render_ads(q, context, force=True, live=True)
+    else:
+        await _render_accounts(q, context)
 
-    if data == "am_confirm":
-        await _apply_confirm(q, context)
-        return True
 
-    if data == "am_cancel":
-        st.pop("pending", None)
-        cur = str(st.get("level") or "")
-        if cur == "campaigns":
-            await _render_campaigns(q, context, force=False)
-        elif cur == "adsets":
-            await _render_adsets(q, context, force=False)
-        elif cur == "ads":
-            await _render_ads(q, context, force=False)
-        else:
-            await _render_accounts(q, context)
-        return True
+@_ROUTER.exact("am_edit")
+async def _cb_am_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await q.answer("⏳ В разработке", show_alert=True)
 
-    return True
+
+@_ROUTER.exact("am_toggle")
+async def _cb_am_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _start_toggle(q, context)
+
+
+@_ROUTER.exact("am_budget")
+async def _cb_am_budget(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _start_budget(q, context)
+
+
+@_ROUTER.exact("am_confirm")
+async def _cb_am_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    await _apply_confirm(q, context)
+
+
+@_ROUTER.exact("am_cancel")
+async def _cb_am_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, q, data: str, st: Dict[str, Any], bp: Dict[str, Any], plan: Any):
+    st.pop("pending", None)
+    cur = str(st.get("level") or "")
+    if cur == "campaigns":
+        await _render_campaigns(q, context, force=False)
+    elif cur == "adsets":
+        await _render_adsets(q, context, force=False)
+    elif cur == "ads":
+        await _render_ads(q, context, force=False)
+    else:
+        await _render_accounts(q, context)
@@ -41,6 +41,7 @@ from .constants import (
 )
 from .storage import (
     load_accounts,
+    load_accounts_view,
     save_accounts,
     get_account_name,
     get_enabled_accounts_in_order,
@@ -81,6 +82,7 @@ from .jobs import (
     schedule_morning_report,
     send_morning_report_to_chat,
     schedule_client_groups_morning_report,
+    schedule_account_meta_refresh,
     build_heatmap_status_text,
     run_heatmap_snapshot_collector_once,
     schedule_heatmap_snapshot_collector,
@@ -101,6 +103,9 @@ from .cpa_alerts import (
 from .cpa_alerts import run_cpa_alerts_for_mode as _run_cpa_alerts_for_mode
 from .autopilot_format import ap_action_text
 from . import ads_manage
+from .callback_router import CallbackRouter, format_route_stats
+from .update_processor import PerChatUpdateProcessor, TG_CONCURRENT_UPDATES
+from .loop_watchdog import format_loop_stats, start_loop_watchdog, stop_loop_watchdog
 
 from services.facebook_api import (
     pause_ad,
@@ -111,6 +116,9 @@ from services.facebook_api import (
     classify_api_error,
     allow_fb_api_calls,
     deny_fb_api_calls,
+    warm_catalog_cache,
+    single_flight_stats,
+    run_fb_io,
 )
 from services.ai_focus import get_focus_comment, ask_deepseek, sanitize_ai_text
 from fb_report.cpa_monitoring import build_anomaly_messages_for_account
@@ -120,7 +128,9 @@ from services.heatmap_store import (
     sum_ready_spend_for_date,
     load_snapshot,
     list_snapshot_hours,
+    load_day_rollups,
 )
+from services.entity_index import entity_name, list_entities
 import json
 import asyncio
 import time as pytime
@@ -200,7 +210,7 @@ def client_main_menu() -> InlineKeyboardMarkup:
 
 
 def morning_report_level_kb(aid: str) -> InlineKeyboardMarkup:
-    st = load_accounts().get(str(aid), {})
+    st = load_accounts_view().get(str(aid), {})
     mr = (st or {}).get("morning_report") or {}
     if not isinstance(mr, dict):
         mr = {}
@@ -391,7 +401,7 @@ def cpa_alerts_rule_text(rule_id: str) -> str:
 
 
 def client_group_accounts_kb(chat_id: str) -> InlineKeyboardMarkup:
-    store = load_accounts() or {}
+    store = load_accounts_view() or {}
     ids = [aid for aid in (store or {}).keys()]
     ids.sort(key=lambda x: str(get_account_name(str(x)) or ""))
 
@@ -409,7 +419,7 @@ def client_group_accounts_kb(chat_id: str) -> InlineKeyboardMarkup:
 
 
 def client_accounts_kb(prefix: str, chat_id: str) -> InlineKeyboardMarkup:
-    store = load_accounts() or {}
+    store = load_accounts_view() or {}
     allowed = enabled_accounts_for_group(str(chat_id)) or []
     allowed_set = set(str(x) for x in allowed)
 
@@ -534,7 +544,7 @@ def _autopilot_analysis_kb(aid: str) -> InlineKeyboardMarkup:
 
 
 def monitoring_compare_accounts_kb(prefix: str) -> InlineKeyboardMarkup:
-    store = load_accounts()
+    store = load_accounts_view()
     if store:
         enabled_ids = [aid for aid, row in store.items() if row.get("enabled", True)]
         disabled_ids = [aid for aid, row in store.items() if not row.get("enabled", True)]
@@ -559,7 +569,7 @@ def monitoring_compare_accounts_kb(prefix: str) -> InlineKeyboardMarkup:
 
 
 def monitoring_accounts_kb() -> InlineKeyboardMarkup:
-    store = load_accounts()
+    store = load_accounts_view()
     if store:
         enabled_ids = [aid for aid, row in store.items() if row.get("enabled", True)]
         disabled_ids = [aid for aid, row in store.items() if not row.get("enabled", True)]
@@ -589,7 +599,7 @@ def monitoring_accounts_kb() -> InlineKeyboardMarkup:
 
 
 def _autopilot_hm_kb(aid: str) -> InlineKeyboardMarkup:
-    store = load_accounts() or {}
+    store = load_accounts_view() or {}
     row = store.get(str(aid)) or {}
     hm = (row or {}).get("heatmap") or {}
     if not isinstance(hm, dict):
@@ -1001,7 +1011,7 @@ async def _autopilot_hourly_job(context: ContextTypes.DEFAULT_TYPE):
     window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
 
     log = logging.getLogger(__name__)
-    store = load_accounts() or {}
+    store = load_accounts_view() or {}
     for aid, row in store.items():
         if not (row or {}).get("enabled", True):
             continue
@@ -1081,7 +1091,7 @@ async def _autopilot_hourly_job(context: ContextTypes.DEFAULT_TYPE):
                     except Exception:
                         pct_f = 0.0
                     with allow_fb_api_calls(reason="autopilot_apply"):
-                        res = apply_budget_change(str(act.get("adset_id") or ""), pct_f)
+                        res = await run_fb_io(apply_budget_change, str(act.get("adset_id") or ""), pct_f)
                     if str(res.get("status") or "").lower() in {"ok", "success"}:
                         applied_msgs.append(str(res.get("message") or "") + "\n\n" + _ap_action_text(act))
                         applied_total += 1
@@ -1103,7 +1113,7 @@ async def _autopilot_hourly_job(context: ContextTypes.DEFAULT_TYPE):
                 if kind == "pause_ad":
                     ad_id = str(act.get("ad_id") or "")
                     with allow_fb_api_calls(reason="autopilot_apply"):
-                        res = pause_ad(ad_id)
+                        res = await run_fb_io(pause_ad, ad_id)
                     if str(res.get("status") or "").lower() in {"ok", "success"}:
                         applied_msgs.append(str(res.get("message") or res.get("exception") or "") + "\n\n" + _ap_action_text(act))
                         applied_total += 1
@@ -1124,7 +1134,7 @@ async def _autopilot_hourly_job(context: ContextTypes.DEFAULT_TYPE):
 
                 if kind == "pause_adset":
                     with allow_fb_api_calls(reason="autopilot_apply"):
-                        res = disable_entity(str(act.get("adset_id") or ""))
+                        res = await run_fb_io(disable_entity, str(act.get("adset_id") or ""))
                     if str(res.get("status") or "").lower() in {"ok", "success"}:
                         applied_msgs.append(str(res.get("message") or "") + "\n\n" + _ap_action_text(act))
                         append_autopilot_event(
@@ -1205,7 +1215,7 @@ async def _autopilot_warmup_job(context: ContextTypes.DEFAULT_TYPE):
     win = prev_full_hour_window(now=now)
     window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
 
-    store = load_accounts() or {}
+    store = load_accounts_view() or {}
     any_lines = []
     diag_lines = []
     total_groups = 0
@@ -2384,63 +2394,29 @@ def _discover_lead_metrics_for_account(aid: str) -> list[dict]:
     return out
 
 
-def _snapshot_rows_last_7d(aid: str) -> list[dict]:
+def _last_7d_dates() -> list[str]:
     now = datetime.now(ALMATY_TZ)
     end = (now - timedelta(days=1)).date()
-    start = end - timedelta(days=6)
-    all_rows: list[dict] = []
-    with deny_fb_api_calls(reason="snapshot_rows_last_7d"):
-        cur = start
-        while cur <= end:
-            d = cur.strftime("%Y-%m-%d")
-            for h in list_snapshot_hours(str(aid), date_str=str(d)):
-                snap = load_snapshot(str(aid), date_str=str(d), hour=int(h)) or {}
-                if str(snap.get("status") or "") not in {"ready", "ready_low_confidence"}:
-                    continue
-                for r in (snap.get("rows") or []):
-                    if isinstance(r, dict):
-                        all_rows.append(r)
-            cur = cur + timedelta(days=1)
-    return all_rows
+    return [(end - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(6, -1, -1)]
 
 
 def _campaign_options_from_snapshots(aid: str) -> list[dict]:
-    all_rows = _snapshot_rows_last_7d(aid)
-    seen: dict[str, str] = {}
-    for r in all_rows:
-        cid = str((r or {}).get("campaign_id") or "")
-        if not cid:
-            continue
-        nm = str((r or {}).get("campaign_name") or cid)
-        if cid not in seen:
-            seen[cid] = nm
-    out = [{"id": cid, "name": nm} for cid, nm in seen.items()]
-    out.sort(key=lambda x: str((x or {}).get("name") or ""))
-    return out
+    return [
+        {"id": str(c.get("id") or ""), "name": str(c.get("name") or "")}
+        for c in list_entities(str(aid), "campaign", since=_last_7d_dates()[0])
+    ]
 
 
 def _campaign_name_from_snapshots(aid: str, campaign_id: str) -> str:
-    cid = str(campaign_id or "")
-    if not cid:
-        return ""
-    for r in _snapshot_rows_last_7d(aid):
-        if str((r or {}).get("campaign_id") or "") == cid:
-            return str((r or {}).get("campaign_name") or cid)
-    return cid
+    return entity_name(str(aid), "campaign", str(campaign_id or ""))
 
 
 def _adset_name_from_snapshots(aid: str, adset_id: str) -> str:
-    sid = str(adset_id or "")
-    if not sid:
-        return ""
-    for r in _snapshot_rows_last_7d(aid):
-        if str((r or {}).get("adset_id") or "") == sid:
-            return str((r or {}).get("name") or sid)
-    return sid
+    return entity_name(str(aid), "adset", str(adset_id or ""))
 
 
 def heatmap_monitoring_accounts_kb() -> InlineKeyboardMarkup:
-    store = load_accounts()
+    store = load_accounts_view()
     if store:
         enabled_ids = [aid for aid, row in store.items() if row.get("enabled", True)]
         disabled_ids = [aid for aid, row in store.items() if not row.get("enabled", True)]
@@ -2516,7 +2492,7 @@ async def _send_comparison_for_all(
     period_new,
     label_new: str,
 ) -> None:
-    store = load_accounts()
+    store = load_accounts_view()
     any_sent = False
     selected = []
     for aid in get_enabled_accounts_in_order():
@@ -2549,7 +2525,7 @@ async def _send_comparison_for_all(
         return
 
     for aid in selected:
-        txt = build_comparison_report(aid, period_old, label_old, period_new, label_new)
+        txt = await run_fb_io(build_comparison_report, aid, period_old, label_old, period_new, label_new)
         if not txt:
             continue
         any_sent = True
@@ -2784,7 +2760,7 @@ def monitoring_menu_kb(*, is_sa: bool = False) -> InlineKeyboardMarkup:
 def heatmap_hourly_accounts_kb() -> InlineKeyboardMarkup:
     """Выбор аккаунта для почасовой тепловой карты (из меню мониторинга)."""
 
-    store = load_accounts()
+    store = load_accounts_view()
     if store:
         enabled_ids = [aid for aid, row in store.items() if row.get("enabled", True)]
         disabled_ids = [
@@ -2992,7 +2968,7 @@ def reports_accounts_kb(prefix: str) -> InlineKeyboardMarkup:
     Отличается от общей accounts_kb только кнопкой "Назад", которая
     возвращает в подменю отчётов, а не сразу в главное меню.
     """
-    store = load_accounts()
+    store = load_accounts_view()
     if store:
         enabled_ids = [aid for aid, row in store.items() if row.get("enabled", True)]
         disabled_ids = [
@@ -3037,7 +3013,7 @@ def _weekday_label(key: str) -> str:
 
 
 def cpa_settings_kb(aid: str):
-    st = load_accounts().get(aid, {"alerts": {}})
+    st = load_accounts_view().get(aid, {"alerts": {}})
     alerts = st.get("alerts", {}) or {}
 
     account_cpa = float(alerts.get("account_cpa", alerts.get("target_cpl", 0.0)) or 0.0)
@@ -3128,42 +3104,34 @@ def cpa_settings_kb(aid: str):
 def cpa_campaigns_kb(aid: str) -> InlineKeyboardMarkup:
     """Список кампаний для настроек CPA-алёртов."""
 
-    st = load_accounts()
+    st = load_accounts_view()
     row = st.get(aid, {"alerts": {}})
     alerts = row.get("alerts", {}) or {}
     campaign_alerts = alerts.get("campaign_alerts", {}) or {}
 
     def _campaign_rows_from_snapshots() -> list[dict]:
-        all_rows = _snapshot_rows_last_7d(aid)
+        with deny_fb_api_calls(reason="cpa_campaigns_kb_rollups"):
+            rollups = load_day_rollups(str(aid), dates=_last_7d_dates())
 
         agg: dict[str, dict] = {}
-        for r in all_rows:
-            cid = str((r or {}).get("campaign_id") or "")
-            if not cid:
-                continue
-            it = agg.setdefault(
-                cid,
-                {"campaign_id": cid, "name": (r or {}).get("campaign_name") or cid, "spend": 0.0, "msgs": 0, "leads": 0, "total": 0},
-            )
-            try:
-                it["spend"] = float(it.get("spend") or 0.0) + float((r or {}).get("spend") or 0.0)
-            except Exception:
-                pass
-            try:
-                it["msgs"] = int(it.get("msgs") or 0) + int((r or {}).get("msgs") or 0)
-            except Exception:
-                pass
-            try:
-                it["leads"] = int(it.get("leads") or 0) + int((r or {}).get("leads") or 0)
-            except Exception:
-                pass
-            try:
-                t = (r or {}).get("total")
-                if t is None:
-                    t = int((r or {}).get("msgs") or 0) + int((r or {}).get("leads") or 0)
-                it["total"] = int(it.get("total") or 0) + int(t or 0)
-            except Exception:
-                pass
+        for rollup in rollups.values():
+            for cid, t in ((rollup or {}).get("campaigns") or {}).items():
+                cid = str(cid or "")
+                if not cid or not isinstance(t, dict):
+                    continue
+                it = agg.setdefault(
+                    cid,
+                    {"campaign_id": cid, "name": _campaign_name_from_snapshots(aid, cid), "spend": 0.0, "msgs": 0, "leads": 0, "total": 0},
+                )
+                try:
+                    it["spend"] = float(it.get("spend") or 0.0) + float(t.get("spend") or 0.0)
+                except Exception:
+                    pass
+                for k in ("msgs", "leads", "total"):
+                    try:
+                        it[k] = int(it.get(k) or 0) + int(t.get(k) or 0)
+                    except Exception:
+                        pass
 
         out = list(agg.values())
         out.sort(key=lambda x: float((x or {}).get("spend") or 0.0), reverse=True)
@@ -3212,21 +3180,16 @@ def cpa_campaigns_kb(aid: str) -> InlineKeyboardMarkup:
 def cpa_adsets_kb(aid: str) -> InlineKeyboardMarkup:
     """Список адсетов для настроек CPA-алёртов."""
 
-    st = load_accounts()
+    st = load_accounts_view()
     row = st.get(aid, {"alerts": {}})
     alerts = row.get("alerts", {}) or {}
     adset_alerts = alerts.get("adset_alerts", {}) or {}
 
     def _adsets_from_snapshots() -> list[dict]:
-        seen: dict[str, str] = {}
-        for r in _snapshot_rows_last_7d(aid):
-            adset_id = str((r or {}).get("adset_id") or "")
-            if not adset_id:
-                continue
-            nm = (r or {}).get("name") or adset_id
-            if adset_id not in seen:
-                seen[adset_id] = str(nm)
-        return [{"id": i, "name": n} for i, n in seen.items()]
+        return [
+            {"id": str(it.get("id") or ""), "name": str(it.get("name") or "")}
+            for it in list_entities(str(aid), "adset", since=_last_7d_dates()[0])
+        ]
 
     adsets = _adsets_from_snapshots()
     active_adset_ids = {str((r or {}).get("id") or "") for r in adsets if (r or {}).get("id")}
@@ -3269,7 +3232,7 @@ def cpa_adsets_kb(aid: str) -> InlineKeyboardMarkup:
 def cpa_ads_kb(aid: str) -> InlineKeyboardMarkup:
     """Список объявлений для настроек CPA-алёртов."""
 
-    st = load_accounts()
+    st = load_accounts_view()
     row = st.get(aid, {"alerts": {}})
     alerts = row.get("alerts", {}) or {}
     ad_alerts = alerts.get("ad_alerts", {}) or {}
@@ -3388,7 +3351,7 @@ def heatmap_menu(aid: str) -> InlineKeyboardMarkup:
 
 
 def _flag_line(aid: str) -> str:
-    st = load_accounts().get(aid, {})
+    st = load_accounts_view().get(aid, {})
     enabled = st.get("enabled", True)
     m = st.get("metrics", {}) or {}
     on = "🟢" if enabled else "🔴"
@@ -3398,7 +3361,7 @@ def _flag_line(aid: str) -> str:
 
 
 def accounts_kb(prefix: str) -> InlineKeyboardMarkup:
-    store = load_accounts()
+    store = load_accounts_view()
     if store:
         enabled_ids = [aid for aid, row in store.items() if row.get("enabled", True)]
         disabled_ids = [
@@ -3425,7 +3388,7 @@ def accounts_kb(prefix: str) -> InlineKeyboardMarkup:
 
 
 def settings_kb(aid: str) -> InlineKeyboardMarkup:
-    st = load_accounts().get(aid, {"enabled": True, "metrics": {}, "alerts": {}})
+    st = load_accounts_view().get(aid, {"enabled": True, "metrics": {}, "alerts": {}})
     en_text = "Выключить кабинет" if st.get("enabled", True) else "Включить кабинет"
     m_on = st.get("metrics", {}).get("messaging", True)
     l_on = st.get("metrics", {}).get("leads", False)
@@ -3491,7 +3454,7 @@ def cpa_test_rules_kb() -> InlineKeyboardMarkup:
 
 def _user_has_focus_settings(user_id: str) -> bool:
     """Проверка, есть ли у пользователя какие-либо сохранённые настройки Фокус-ИИ."""
-    st = load_accounts()
+    st = load_accounts_view()
     for row in st.values():
         focus = row.get("focus") or {}
         if user_id in focus:
@@ -3654,6 +3617,9 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/heatmap_debug_last <act_id> — отладка: последний слепок + суммы + coverage(today/yday)\n"
         "/report_debug <act_id> yday general — отладка отчёта (params/time_range/tz/attribution/sums)\n"
         "/version — показать текущую версию бота и краткое описание\n"
+        "/cb_stats — латентность кнопок по маршрутам (суперадмин)\n"
+        "/fb_dedupe — дедупликация одинаковых запросов к FB (суперадмин)\n"
+        "/loop_stats — зависания event loop и лаг по перцентилям (суперадмин)\n"
         "\n"
         "🚀 Функции автопилота:\n"
         "• Автоматические рекомендации по аккаунту\n"
@@ -3677,7 +3643,7 @@ async def cmd_report_debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kind = str(parts[2] if len(parts) >= 3 else "yday")
     mode = str(parts[3] if len(parts) >= 4 else "general")
     try:
-        txt = build_report_debug(str(aid), str(kind), str(mode))
+        txt = await run_fb_io(build_report_debug, str(aid), str(kind), str(mode))
     except Exception as e:
         txt = f"report_debug_error: {type(e).__name__}: {e}"
     await update.message.reply_text(txt)
@@ -3762,6 +3728,43 @@ async def cmd_version(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, reply_markup=main_menu(uid=uid, chat_id=chat_id, chat_type=str(chat.type) if chat else None))
 
 
+async def cmd_cb_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Суперадмин: латентность callback-маршрутов (самые дорогие кнопки сверху)."""
+    uid = update.effective_user.id if update.effective_user else None
+    if not is_superadmin(uid):
+        return
+    text = format_route_stats([_CB_ROUTER] + ads_manage.callback_routers())
+    await update.message.reply_text(text, parse_mode="HTML")
+
+
+async def cmd_fb_dedupe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Суперадмин: дедупликация одинаковых запросов к FB (single-flight) по ключам."""
+    uid = update.effective_user.id if update.effective_user else None
+    if not is_superadmin(uid):
+        return
+    rows = single_flight_stats(limit=20)
+    if not rows:
+        await update.message.reply_text("Нет данных")
+        return
+    lines = ["FB single-flight (calls — запросы, joined — ожидали чужой запрос, unshared — результат лидера не раздан, timeouts — не дождались лидера)"]
+    for r in rows:
+        lines.append(
+            f"• {str(r.get('key') or '')[:120]} "
+            f"calls={int(r.get('calls') or 0)} joined={int(r.get('joined') or 0)} "
+            f"err={int(r.get('errors') or 0)} unshared={int(r.get('unshared') or 0)} "
+            f"timeouts={int(r.get('timeouts') or 0)}"
+        )
+    await update.message.reply_text("\n".join(lines))
+
+
+async def cmd_loop_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Суперадмин: лаг event loop (перцентили) и зависания по обработчикам."""
+    uid = update.effective_user.id if update.effective_user else None
+    if not is_superadmin(uid):
+        return
+    await update.message.reply_text(format_loop_stats())
+
+
 async def cmd_heatmap(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not _allowed(update):
         return
@@ -3807,7 +3810,7 @@ async def cmd_heatmap_status(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 def _build_heatmap_debug_last_text(*, aid: str) -> str:
-    st = load_accounts() or {}
+    st = load_accounts_view() or {}
     row = st.get(str(aid)) or {}
     hm = (row or {}).get("heatmap") or {}
     if not isinstance(hm, dict):
@@ -4155,7 +4158,7 @@ async def cmd_sync(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not _allowed(update):
         return
     try:
-        res = upsert_from_bm()
+        res = await run_fb_io(upsert_from_bm)
         last_sync_h = human_last_sync()
         await update.message.reply_text(
             f"✅ Синк завершён. Добавлено: {res['added']}, "
@@ -4198,6 +4201,9 @@ async def on_cb_autopilot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return
 
 
+_CB_ROUTER = CallbackRouter("main")
+
+
 async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -4241,6 +4247,7 @@ async def _on_cb_internal(
     chat_id: str,
     data: str,
 ):
+    uid = None
     try:
         uid = update.effective_user.id if update.effective_user else None
         is_sa = bool(is_superadmin(uid))
@@ -4384,10 +4391,10 @@ async def _on_cb_internal(
                     if lvl == "OFF":
                         continue
                     if lvl == "ACCOUNT":
-                        txt = get_cached_report(str(aid), "yesterday", label)
+                        txt = await run_fb_io(get_cached_report, str(aid), "yesterday", label)
                     else:
                         lvl_map = {"CAMPAIGN": "CAMPAIGN", "ADSET": "ADSET", "AD": "AD"}
-                        txt = build_account_report(str(aid), "yesterday", lvl_map.get(lvl, "ACCOUNT"), label=label)
+                        txt = await run_fb_io(build_account_report, str(aid), "yesterday", lvl_map.get(lvl, "ACCOUNT"), label=label)
                     if txt:
                         sent_any = True
                         await context.bot.send_message(chat_id=str(chat_id), text=str(txt), parse_mode="HTML")
@@ -4428,13 +4435,13 @@ async def _on_cb_internal(
                 if lvl == "OFF":
                     return
                 if lvl == "ACCOUNT":
-                    txt = build_report_with_caller(str(aid), "today", label, caller="client_group_report")
+                    txt = await run_fb_io(build_report_with_caller, str(aid), "today", label, caller="client_group_report")
                 elif lvl == "CAMPAIGN":
-                    txt = build_account_report(str(aid), "today", "CAMPAIGN", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), "today", "CAMPAIGN", label=label)
                 elif lvl == "ADSET":
-                    txt = build_account_report(str(aid), "today", "ADSET", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), "today", "ADSET", label=label)
                 else:
-                    txt = build_account_report(str(aid), "today", "AD", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), "today", "AD", label=label)
                 if txt:
                     await context.bot.send_message(chat_id=str(chat_id), text=str(txt), parse_mode="HTML")
                 return
@@ -4448,13 +4455,13 @@ async def _on_cb_internal(
                 if lvl == "OFF":
                     return
                 if lvl == "ACCOUNT":
-                    txt = get_cached_report(str(aid), "yesterday", label)
+                    txt = await run_fb_io(get_cached_report, str(aid), "yesterday", label)
                 elif lvl == "CAMPAIGN":
-                    txt = build_account_report(str(aid), "yesterday", "CAMPAIGN", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), "yesterday", "CAMPAIGN", label=label)
                 elif lvl == "ADSET":
-                    txt = build_account_report(str(aid), "yesterday", "ADSET", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), "yesterday", "ADSET", label=label)
                 else:
-                    txt = build_account_report(str(aid), "yesterday", "AD", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), "yesterday", "AD", label=label)
                 if txt:
                     await context.bot.send_message(chat_id=str(chat_id), text=str(txt), parse_mode="HTML")
                 else:
@@ -4483,13 +4490,13 @@ async def _on_cb_internal(
                 if lvl == "OFF":
                     return
                 if lvl == "ACCOUNT":
-                    txt = get_cached_report(str(aid), period, label)
+                    txt = await run_fb_io(get_cached_report, str(aid), period, label)
                 elif lvl == "CAMPAIGN":
-                    txt = build_account_report(str(aid), period, "CAMPAIGN", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), period, "CAMPAIGN", label=label)
                 elif lvl == "ADSET":
-                    txt = build_account_report(str(aid), period, "ADSET", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), period, "ADSET", label=label)
                 else:
-                    txt = build_account_report(str(aid), period, "AD", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), period, "AD", label=label)
                 if txt:
                     await context.bot.send_message(chat_id=str(chat_id), text=str(txt), parse_mode="HTML")
                 return
@@ -4563,3794 +4570,3962 @@ async def _on_cb_internal(
     if str(update.effective_chat.type) == "private" and not is_sa:
         return
 
-    if data == "noop":
-        await q.answer("Ок", show_alert=False)
-        return
+    await _CB_ROUTER.dispatch(data, update, context, q, chat_id, data, uid=uid, is_sa=is_sa)
 
-    if data == "version":
-        text = _build_version_text()
-        await context.bot.send_message(chat_id, text)
-        return
 
-    if data == "menu":
-        await safe_edit_message(
-            q,
-            "🤖 Выберите действие:",
-            reply_markup=main_menu(
-                uid=uid,
-                chat_id=str(chat_id),
-                chat_type=str(update.effective_chat.type) if update.effective_chat else None,
-            ),
-        )
-        return
+# ========= CALLBACK-МАРШРУТЫ (_CB_ROUTER) =========
+# Кнопки после общих проверок _on_cb_internal. Порядок регистрации не важен:
+# точное совпадение -> голова "prefix|" -> самый длинный префикс.
 
-    if data == "ads_manage_menu":
-        if not is_sa:
-            return
-        await ads_manage.open_menu(update, context)
-        return
 
-    if str(data).startswith("am_"):
-        if not is_sa:
-            return
-        handled = await ads_manage.on_callback(update, context)
-        if handled:
-            return
+@_CB_ROUTER.exact("noop")
+async def _cb_noop(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await q.answer("Ок", show_alert=False)
 
-    if data == "autopilot_menu":
-        await safe_edit_message(
-            q,
-            "Выберите кабинет для Автопилота:",
-            reply_markup=_autopilot_menu_kb(),
-        )
-        return
 
-    if data == "ap_set_chat":
-        try:
-            set_autopilot_chat_id(chat_id)
-        except Exception:
-            pass
-        await q.answer("Чат Автопилота обновлён")
-        await safe_edit_message(
-            q,
-            "✅ Этот чат установлен как чат Автопилота\n\nВыберите кабинет для Автопилота:",
-            reply_markup=_autopilot_menu_kb(),
-        )
-        return
+@_CB_ROUTER.exact("version")
+async def _cb_version(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    text = _build_version_text()
+    await context.bot.send_message(chat_id, text)
+
+
+@_CB_ROUTER.exact("menu")
+async def _cb_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "🤖 Выберите действие:",
+        reply_markup=main_menu(
+            uid=uid,
+            chat_id=str(chat_id),
+            chat_type=str(update.effective_chat.type) if update.effective_chat else None,
+        ),
+    )
 
-    if data.startswith("autopilot_acc|"):
-        aid = data.split("|", 1)[1]
-        text = _autopilot_dashboard_text(aid)
-        await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
-        return
 
-    if data.startswith("ap_groups|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            _autopilot_groups_menu_text(aid),
-            reply_markup=_autopilot_groups_kb(aid),
-        )
+@_CB_ROUTER.exact("ads_manage_menu")
+async def _cb_ads_manage_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
         return
+    await ads_manage.open_menu(update, context)
 
-    if data.startswith("ap_group_create|"):
-        aid = data.split("|", 1)[1]
-        gid = uuid.uuid4().hex[:8]
-        grp = {
-            "name": f"Группа {gid}",
-            "campaign_ids": [],
-            "kpi": "total",
-            "lead_metric": None,
-            "goals": {"leads": None, "period": "day", "until": None, "target_cpl": None, "planned_budget": None},
-        }
-        ap = _autopilot_get(aid)
-        groups = ap.get("campaign_groups") or {}
-        if not isinstance(groups, dict):
-            groups = {}
-        groups[gid] = grp
-        ap["campaign_groups"] = groups
-        ap["active_group_id"] = gid
-        _autopilot_set(aid, ap)
-        await q.answer("Группа создана")
-        await safe_edit_message(
-            q,
-            _autopilot_group_menu_text(aid, gid)
-            + "\n\nПодсказка: нажми '📌 Кампании', чтобы добавить рекламные кампании в группу."
-            + "\nЕсли хочешь — напиши название группы в чат.",
-            reply_markup=_autopilot_group_kb(aid, gid),
-        )
-        context.user_data["await_ap_group_rename"] = {"aid": aid, "gid": gid}
-        return
 
-    if data.startswith("ap_group_open|"):
-        _p, aid, gid = data.split("|", 2)
-        await safe_edit_message(
-            q,
-            _autopilot_group_menu_text(aid, gid),
-            reply_markup=_autopilot_group_kb(aid, gid),
-        )
+@_CB_ROUTER.prefix("am_")
+async def _cb_am(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
         return
+    await ads_manage.on_callback(update, context)
 
-    if data.startswith("ap_group_rename|"):
-        _p, aid, gid = data.split("|", 2)
-        grp = _autopilot_group_get(aid, gid)
-        cur_name = grp.get("name") or gid
-        await safe_edit_message(
-            q,
-            f"✏️ Переименовать группу\n\nТекущее название: {cur_name}\n\nНапиши новое название в чат.",
-            reply_markup=_autopilot_group_kb(aid, gid),
-        )
-        context.user_data["await_ap_group_rename"] = {"aid": aid, "gid": gid}
-        return
 
-    if data.startswith("ap_group_select|"):
-        _p, aid, gid = data.split("|", 2)
-        _autopilot_set(aid, {"active_group_id": str(gid)})
-        await q.answer("Активная группа выбрана")
-        await safe_edit_message(
-            q,
-            _autopilot_dashboard_text(aid),
-            reply_markup=_autopilot_kb(aid),
-        )
-        return
+@_CB_ROUTER.exact("autopilot_menu")
+async def _cb_autopilot_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите кабинет для Автопилота:",
+        reply_markup=_autopilot_menu_kb(),
+    )
 
-    if data.startswith("ap_group_toggle|"):
-        _p, aid, gid = data.split("|", 2)
-        cur = set(_autopilot_active_group_ids(aid))
-        if str(gid) in cur:
-            cur.remove(str(gid))
-            await q.answer("Отключил слежение за группой")
-        else:
-            cur.add(str(gid))
-            await q.answer("Включил слежение за группой")
-        _autopilot_set_active_group_ids(aid, sorted(cur))
-        await safe_edit_message(
-            q,
-            _autopilot_group_menu_text(aid, gid),
-            reply_markup=_autopilot_group_kb(aid, gid),
-        )
-        return
 
-    if data.startswith("ap_group_off|"):
-        aid = data.split("|", 1)[1]
-        _autopilot_set(aid, {"active_group_id": None, "active_group_ids": []})
-        await q.answer("Группы отключены")
-        await safe_edit_message(
-            q,
-            _autopilot_dashboard_text(aid),
-            reply_markup=_autopilot_kb(aid),
-        )
-        return
+@_CB_ROUTER.exact("ap_set_chat")
+async def _cb_ap_set_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    try:
+        set_autopilot_chat_id(chat_id)
+    except Exception:
+        pass
+    await q.answer("Чат Автопилота обновлён")
+    await safe_edit_message(
+        q,
+        "✅ Этот чат установлен как чат Автопилота\n\nВыберите кабинет для Автопилота:",
+        reply_markup=_autopilot_menu_kb(),
+    )
 
-    if data.startswith("ap_group_delete|"):
-        _p, aid, gid = data.split("|", 2)
-        _autopilot_group_delete(aid, gid)
-        await q.answer("Группа удалена")
-        await safe_edit_message(
-            q,
-            _autopilot_groups_menu_text(aid),
-            reply_markup=_autopilot_groups_kb(aid),
-        )
-        return
 
-    if data.startswith("ap_group_kpi|"):
-        _p, aid, gid = data.split("|", 2)
-        await safe_edit_message(
-            q,
-            f"📊 KPI группы — {get_account_name(aid)}\n\nВыберите, что считать KPI:",
-            reply_markup=_autopilot_group_kpi_kb(aid, gid),
-        )
-        return
+@_CB_ROUTER.prefix("autopilot_acc|")
+async def _cb_autopilot_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    text = _autopilot_dashboard_text(aid)
+    await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
 
-    if data.startswith("ap_group_kpi_set|"):
-        _p, aid, gid, code = data.split("|", 3)
-        grp = _autopilot_group_get(aid, gid)
-        grp["kpi"] = str(code)
-        _autopilot_group_set(aid, gid, grp)
-        await q.answer("KPI обновлён")
-        await safe_edit_message(
-            q,
-            f"📊 KPI группы — {get_account_name(aid)}\n\nВыберите, что считать KPI:",
-            reply_markup=_autopilot_group_kpi_kb(aid, gid),
-        )
-        return
 
-    if data.startswith("ap_group_campaigns|"):
-        _p, aid, gid = data.split("|", 2)
-        kb, active_ids = _autopilot_group_campaigns_kb_active_only(aid, gid)
-        grp = _autopilot_group_get(aid, gid)
-        cur = set(str(x) for x in (grp.get("campaign_ids") or []) if x)
-        cleaned = set(x for x in cur if x in active_ids)
-        if cleaned != cur:
-            grp["campaign_ids"] = sorted(cleaned)
-            _autopilot_group_set(aid, gid, grp)
-            kb, _active_ids = _autopilot_group_campaigns_kb_active_only(aid, gid)
-        await safe_edit_message(
-            q,
-            f"📌 Кампании группы — {get_account_name(aid)}\n\nОтметьте 2–10 кампаний:",
-            reply_markup=kb,
-        )
-        return
+@_CB_ROUTER.prefix("ap_groups|")
+async def _cb_ap_groups(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        _autopilot_groups_menu_text(aid),
+        reply_markup=_autopilot_groups_kb(aid),
+    )
 
-    if data.startswith("ap_group_camp_toggle|"):
-        _p, aid, gid, tok = data.split("|", 3)
-        try:
-            cid = _campaign_token_to_id(tok)
-        except Exception:
-            await q.answer("Кампания не найдена. Открой 'Кампании' ещё раз.", show_alert=True)
-            return
 
-        grp = _autopilot_group_get(aid, gid)
-        cur = set(str(x) for x in (grp.get("campaign_ids") or []) if x)
-        if str(cid) in cur:
-            cur.remove(str(cid))
-        else:
-            _kb_tmp, active_ids = _autopilot_group_campaigns_kb_active_only(aid, gid)
-            if str(cid) not in set(str(x) for x in (active_ids or set()) if x):
-                await q.answer(
-                    "Кампания недоступна в слепках за 7 дней. "
-                    "Собери слепок и открой список ещё раз.",
-                    show_alert=True,
-                )
-                return
-            cur.add(str(cid))
-        grp["campaign_ids"] = sorted(cur)
-        _autopilot_group_set(aid, gid, grp)
-        kb, _active_ids = _autopilot_group_campaigns_kb_active_only(aid, gid)
-        await safe_edit_message(
-            q,
-            f"📌 Кампании группы — {get_account_name(aid)}\n\nОтметьте 2–10 кампаний:",
-            reply_markup=kb,
-        )
-        return
+@_CB_ROUTER.prefix("ap_group_create|")
+async def _cb_ap_group_create(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    gid = uuid.uuid4().hex[:8]
+    grp = {
+        "name": f"Группа {gid}",
+        "campaign_ids": [],
+        "kpi": "total",
+        "lead_metric": None,
+        "goals": {"leads": None, "period": "day", "until": None, "target_cpl": None, "planned_budget": None},
+    }
+    ap = _autopilot_get(aid)
+    groups = ap.get("campaign_groups") or {}
+    if not isinstance(groups, dict):
+        groups = {}
+    groups[gid] = grp
+    ap["campaign_groups"] = groups
+    ap["active_group_id"] = gid
+    _autopilot_set(aid, ap)
+    await q.answer("Группа создана")
+    await safe_edit_message(
+        q,
+        _autopilot_group_menu_text(aid, gid)
+        + "\n\nПодсказка: нажми '📌 Кампании', чтобы добавить рекламные кампании в группу."
+        + "\nЕсли хочешь — напиши название группы в чат.",
+        reply_markup=_autopilot_group_kb(aid, gid),
+    )
+    context.user_data["await_ap_group_rename"] = {"aid": aid, "gid": gid}
 
-    if data.startswith("ap_group_leadmetric|"):
-        _p, aid, gid = data.split("|", 2)
-        grp = _autopilot_group_get(aid, gid)
-        options = _discover_lead_metrics_for_account(aid)
 
-        current = grp.get("lead_metric")
-        current_at = (current or {}).get("action_type") if isinstance(current, dict) else None
+@_CB_ROUTER.prefix("ap_group_open|")
+async def _cb_ap_group_open(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    await safe_edit_message(
+        q,
+        _autopilot_group_menu_text(aid, gid),
+        reply_markup=_autopilot_group_kb(aid, gid),
+    )
 
-        if not options:
-            kb = InlineKeyboardMarkup(
-                [[InlineKeyboardButton("⬅️ Назад", callback_data=f"ap_group_open|{aid}|{gid}")]]
-            )
-            await safe_edit_message(
-                q,
-                "❗️Не найдено метрик заявок с сайта (за вчера).\n"
-                "Проверь события в Ads Manager.",
-                reply_markup=kb,
-            )
-            return
 
-        mapping = {str(i): it for i, it in enumerate(options)}
-        context.user_data["ap_group_lead_metric_options"] = {
-            "aid": aid,
-            "gid": gid,
-            "items": mapping,
-        }
+@_CB_ROUTER.prefix("ap_group_rename|")
+async def _cb_ap_group_rename(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    grp = _autopilot_group_get(aid, gid)
+    cur_name = grp.get("name") or gid
+    await safe_edit_message(
+        q,
+        f"✏️ Переименовать группу\n\nТекущее название: {cur_name}\n\nНапиши новое название в чат.",
+        reply_markup=_autopilot_group_kb(aid, gid),
+    )
+    context.user_data["await_ap_group_rename"] = {"aid": aid, "gid": gid}
+
+
+@_CB_ROUTER.prefix("ap_group_select|")
+async def _cb_ap_group_select(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    _autopilot_set(aid, {"active_group_id": str(gid)})
+    await q.answer("Активная группа выбрана")
+    await safe_edit_message(
+        q,
+        _autopilot_dashboard_text(aid),
+        reply_markup=_autopilot_kb(aid),
+    )
 
-        rows = []
-        for i, it in mapping.items():
-            label = it.get("label") or it.get("action_type")
-            if current_at and it.get("action_type") == current_at:
-                label = f"✅ {label}"
-            rows.append(
-                [
-                    InlineKeyboardButton(
-                        str(label),
-                        callback_data=f"ap_group_leadmetric_set|{aid}|{gid}|{i}",
-                    )
-                ]
-            )
-        rows.append(
-            [
-                InlineKeyboardButton(
-                    "Сбросить (по аккаунту)",
-                    callback_data=f"ap_group_leadmetric_clear|{aid}|{gid}",
-                )
-            ]
-        )
-        rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"ap_group_open|{aid}|{gid}")])
-        await safe_edit_message(q, "📊 Метрика заявок группы (за вчера):", reply_markup=InlineKeyboardMarkup(rows))
-        return
 
-    if data.startswith("ap_group_leadmetric_clear|"):
-        _p, aid, gid = data.split("|", 2)
-        grp = _autopilot_group_get(aid, gid)
-        grp["lead_metric"] = None
-        _autopilot_group_set(aid, gid, grp)
-        await q.answer("Метрика сброшена")
-        await safe_edit_message(
-            q,
-            _autopilot_group_menu_text(aid, gid),
-            reply_markup=_autopilot_group_kb(aid, gid),
-        )
-        return
+@_CB_ROUTER.prefix("ap_group_toggle|")
+async def _cb_ap_group_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    cur = set(_autopilot_active_group_ids(aid))
+    if str(gid) in cur:
+        cur.remove(str(gid))
+        await q.answer("Отключил слежение за группой")
+    else:
+        cur.add(str(gid))
+        await q.answer("Включил слежение за группой")
+    _autopilot_set_active_group_ids(aid, sorted(cur))
+    await safe_edit_message(
+        q,
+        _autopilot_group_menu_text(aid, gid),
+        reply_markup=_autopilot_group_kb(aid, gid),
+    )
 
-    if data.startswith("ap_group_leadmetric_set|"):
-        _p, aid, gid, idx = data.split("|", 3)
 
-        stash = context.user_data.get("ap_group_lead_metric_options") or {}
-        if stash.get("aid") != aid or stash.get("gid") != gid:
-            await q.answer("Список метрик устарел. Открой заново.", show_alert=True)
-            return
+@_CB_ROUTER.prefix("ap_group_off|")
+async def _cb_ap_group_off(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    _autopilot_set(aid, {"active_group_id": None, "active_group_ids": []})
+    await q.answer("Группы отключены")
+    await safe_edit_message(
+        q,
+        _autopilot_dashboard_text(aid),
+        reply_markup=_autopilot_kb(aid),
+    )
 
-        items = stash.get("items") or {}
-        it = items.get(str(idx))
-        if not it:
-            await q.answer("Метрика не найдена. Открой заново.", show_alert=True)
-            return
 
-        action_type = it.get("action_type")
-        label = it.get("label")
-        if not action_type:
-            await q.answer("Пустой action_type.", show_alert=True)
-            return
+@_CB_ROUTER.prefix("ap_group_delete|")
+async def _cb_ap_group_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    _autopilot_group_delete(aid, gid)
+    await q.answer("Группа удалена")
+    await safe_edit_message(
+        q,
+        _autopilot_groups_menu_text(aid),
+        reply_markup=_autopilot_groups_kb(aid),
+    )
 
-        grp = _autopilot_group_get(aid, gid)
-        grp["lead_metric"] = {
-            "action_type": str(action_type),
-            "label": str(label or action_type),
-        }
+
+@_CB_ROUTER.prefix("ap_group_kpi|")
+async def _cb_ap_group_kpi(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    await safe_edit_message(
+        q,
+        f"📊 KPI группы — {get_account_name(aid)}\n\nВыберите, что считать KPI:",
+        reply_markup=_autopilot_group_kpi_kb(aid, gid),
+    )
+
+
+@_CB_ROUTER.prefix("ap_group_kpi_set|")
+async def _cb_ap_group_kpi_set(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid, code = data.split("|", 3)
+    grp = _autopilot_group_get(aid, gid)
+    grp["kpi"] = str(code)
+    _autopilot_group_set(aid, gid, grp)
+    await q.answer("KPI обновлён")
+    await safe_edit_message(
+        q,
+        f"📊 KPI группы — {get_account_name(aid)}\n\nВыберите, что считать KPI:",
+        reply_markup=_autopilot_group_kpi_kb(aid, gid),
+    )
+
+
+@_CB_ROUTER.prefix("ap_group_campaigns|")
+async def _cb_ap_group_campaigns(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    kb, active_ids = _autopilot_group_campaigns_kb_active_only(aid, gid)
+    grp = _autopilot_group_get(aid, gid)
+    cur = set(str(x) for x in (grp.get("campaign_ids") or []) if x)
+    cleaned = set(x for x in cur if x in active_ids)
+    if cleaned != cur:
+        grp["campaign_ids"] = sorted(cleaned)
         _autopilot_group_set(aid, gid, grp)
-        await q.answer("Метрика обновлена")
-        await safe_edit_message(
-            q,
-            _autopilot_group_menu_text(aid, gid),
-            reply_markup=_autopilot_group_kb(aid, gid),
-        )
+        kb, _active_ids = _autopilot_group_campaigns_kb_active_only(aid, gid)
+    await safe_edit_message(
+        q,
+        f"📌 Кампании группы — {get_account_name(aid)}\n\nОтметьте 2–10 кампаний:",
+        reply_markup=kb,
+    )
+
+
+@_CB_ROUTER.prefix("ap_group_camp_toggle|")
+async def _cb_ap_group_camp_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid, tok = data.split("|", 3)
+    try:
+        cid = _campaign_token_to_id(tok)
+    except Exception:
+        await q.answer("Кампания не найдена. Открой 'Кампании' ещё раз.", show_alert=True)
         return
 
-    if data.startswith("ap_mode|"):
-        try:
-            _p, aid, mode = data.split("|", 2)
-        except ValueError:
-            await q.answer("Некорректные данные режима.", show_alert=True)
+    grp = _autopilot_group_get(aid, gid)
+    cur = set(str(x) for x in (grp.get("campaign_ids") or []) if x)
+    if str(cid) in cur:
+        cur.remove(str(cid))
+    else:
+        _kb_tmp, active_ids = _autopilot_group_campaigns_kb_active_only(aid, gid)
+        if str(cid) not in set(str(x) for x in (active_ids or set()) if x):
+            await q.answer(
+                "Кампания недоступна в слепках за 7 дней. "
+                "Собери слепок и открой список ещё раз.",
+                show_alert=True,
+            )
             return
+        cur.add(str(cid))
+    grp["campaign_ids"] = sorted(cur)
+    _autopilot_group_set(aid, gid, grp)
+    kb, _active_ids = _autopilot_group_campaigns_kb_active_only(aid, gid)
+    await safe_edit_message(
+        q,
+        f"📌 Кампании группы — {get_account_name(aid)}\n\nОтметьте 2–10 кампаний:",
+        reply_markup=kb,
+    )
 
-        ap = _autopilot_get(aid)
-        old = str(ap.get("mode") or "OFF").upper()
-        new = str(mode or "OFF").upper()
 
-        _autopilot_set(aid, {"mode": new})
-        append_autopilot_event(
-            aid,
-            {
-                "type": "mode_change",
-                "from": old,
-                "to": new,
-                "chat_id": str(chat_id),
-            },
-        )
+@_CB_ROUTER.prefix("ap_group_leadmetric|")
+async def _cb_ap_group_leadmetric(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    grp = _autopilot_group_get(aid, gid)
+    options = _discover_lead_metrics_for_account(aid)
 
-        await q.answer(f"Режим: {_autopilot_human_mode(new)}")
-        text = _autopilot_dashboard_text(aid)
-        await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
-        return
+    current = grp.get("lead_metric")
+    current_at = (current or {}).get("action_type") if isinstance(current, dict) else None
 
-    if data.startswith("ap_set_leads|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            "🎯 Цель по лидам\n\n"
-            "Напиши в чат число лидов (например 20).\n"
-            "0 — сбросить цель.",
-            reply_markup=_autopilot_kb(aid),
+    if not options:
+        kb = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("⬅️ Назад", callback_data=f"ap_group_open|{aid}|{gid}")]]
         )
-        gid = str(_autopilot_get(aid).get("active_group_id") or "").strip() or None
-        context.user_data["await_ap_leads_for"] = {"aid": aid, "gid": gid}
-        return
-
-    if data.startswith("ap_set_cpl|"):
-        aid = data.split("|", 1)[1]
         await safe_edit_message(
             q,
-            "💰 Целевой CPL\n\n"
-            "Напиши в чат число в $ (например 1.2).\n"
-            "0 — сбросить цель.",
-            reply_markup=_autopilot_kb(aid),
+            "❗️Не найдено метрик заявок с сайта (за вчера).\n"
+            "Проверь события в Ads Manager.",
+            reply_markup=kb,
         )
-        gid = str(_autopilot_get(aid).get("active_group_id") or "").strip() or None
-        context.user_data["await_ap_cpl_for"] = {"aid": aid, "gid": gid}
         return
 
-    if data.startswith("ap_set_budget|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            "💵 Плановый бюджет\n\n"
-            "Напиши в чат число в $ (например 30).\n"
-            "0 — сбросить план.",
-            reply_markup=_autopilot_kb(aid),
+    mapping = {str(i): it for i, it in enumerate(options)}
+    context.user_data["ap_group_lead_metric_options"] = {
+        "aid": aid,
+        "gid": gid,
+        "items": mapping,
+    }
+
+    rows = []
+    for i, it in mapping.items():
+        label = it.get("label") or it.get("action_type")
+        if current_at and it.get("action_type") == current_at:
+            label = f"✅ {label}"
+        rows.append(
+            [
+                InlineKeyboardButton(
+                    str(label),
+                    callback_data=f"ap_group_leadmetric_set|{aid}|{gid}|{i}",
+                )
+            ]
         )
-        gid = str(_autopilot_get(aid).get("active_group_id") or "").strip() or None
-        context.user_data["await_ap_budget_for"] = {"aid": aid, "gid": gid}
+    rows.append(
+        [
+            InlineKeyboardButton(
+                "Сбросить (по аккаунту)",
+                callback_data=f"ap_group_leadmetric_clear|{aid}|{gid}",
+            )
+        ]
+    )
+    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"ap_group_open|{aid}|{gid}")])
+    await safe_edit_message(q, "📊 Метрика заявок группы (за вчера):", reply_markup=InlineKeyboardMarkup(rows))
+
+
+@_CB_ROUTER.prefix("ap_group_leadmetric_clear|")
+async def _cb_ap_group_leadmetric_clear(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid = data.split("|", 2)
+    grp = _autopilot_group_get(aid, gid)
+    grp["lead_metric"] = None
+    _autopilot_group_set(aid, gid, grp)
+    await q.answer("Метрика сброшена")
+    await safe_edit_message(
+        q,
+        _autopilot_group_menu_text(aid, gid),
+        reply_markup=_autopilot_group_kb(aid, gid),
+    )
+
+
+@_CB_ROUTER.prefix("ap_group_leadmetric_set|")
+async def _cb_ap_group_leadmetric_set(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, gid, idx = data.split("|", 3)
+
+    stash = context.user_data.get("ap_group_lead_metric_options") or {}
+    if stash.get("aid") != aid or stash.get("gid") != gid:
+        await q.answer("Список метрик устарел. Открой заново.", show_alert=True)
         return
 
-    if data.startswith("ap_period|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(q, "Выберите период цели:", reply_markup=_autopilot_period_kb(aid))
+    items = stash.get("items") or {}
+    it = items.get(str(idx))
+    if not it:
+        await q.answer("Метрика не найдена. Открой заново.", show_alert=True)
         return
 
-    if data.startswith("ap_period_set|"):
-        try:
-            _p, aid, code = data.split("|", 2)
-        except ValueError:
-            await q.answer("Некорректные данные периода.", show_alert=True)
-            return
+    action_type = it.get("action_type")
+    label = it.get("label")
+    if not action_type:
+        await q.answer("Пустой action_type.", show_alert=True)
+        return
 
-        ap = _autopilot_get(aid)
-        active_gid = str(ap.get("active_group_id") or "").strip() or None
-        if active_gid:
-            grp = _autopilot_group_get(aid, active_gid)
-            goals = grp.get("goals") or {}
-            if not isinstance(goals, dict):
-                goals = {}
-        else:
-            goals = ap.get("goals") or {}
-            if not isinstance(goals, dict):
-                goals = {}
+    grp = _autopilot_group_get(aid, gid)
+    grp["lead_metric"] = {
+        "action_type": str(action_type),
+        "label": str(label or action_type),
+    }
+    _autopilot_group_set(aid, gid, grp)
+    await q.answer("Метрика обновлена")
+    await safe_edit_message(
+        q,
+        _autopilot_group_menu_text(aid, gid),
+        reply_markup=_autopilot_group_kb(aid, gid),
+    )
 
-        code = str(code or "day")
-        goals["period"] = code
-        if code != "until":
-            goals["until"] = None
 
-        if active_gid:
-            grp["goals"] = goals
-            _autopilot_group_set(aid, active_gid, grp)
-        else:
-            _autopilot_set(aid, {"goals": goals})
-        append_autopilot_event(
-            aid,
-            {
-                "type": "period_set",
-                "period": code,
-                "chat_id": str(chat_id),
-            },
-        )
+@_CB_ROUTER.prefix("ap_mode|")
+async def _cb_ap_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    try:
+        _p, aid, mode = data.split("|", 2)
+    except ValueError:
+        await q.answer("Некорректные данные режима.", show_alert=True)
+        return
 
-        if code == "until":
-            await q.answer("Период: до даты")
-            await context.bot.send_message(
-                chat_id,
-                "Введите дату в формате ДД.ММ.ГГГГ (например 25.01.2026)",
-            )
-            context.user_data["await_ap_until_for"] = {"aid": aid, "gid": active_gid}
-            return
+    ap = _autopilot_get(aid)
+    old = str(ap.get("mode") or "OFF").upper()
+    new = str(mode or "OFF").upper()
+
+    _autopilot_set(aid, {"mode": new})
+    append_autopilot_event(
+        aid,
+        {
+            "type": "mode_change",
+            "from": old,
+            "to": new,
+            "chat_id": str(chat_id),
+        },
+    )
 
-        await q.answer("Период обновлён")
-        text = _autopilot_dashboard_text(aid)
-        await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
-        return
+    await q.answer(f"Режим: {_autopilot_human_mode(new)}")
+    text = _autopilot_dashboard_text(aid)
+    await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
 
-    if data.startswith("ap_toggle_reenable|"):
-        aid = data.split("|", 1)[1]
-        ap = _autopilot_get(aid)
-        limits = ap.get("limits") or {}
-        if not isinstance(limits, dict):
-            limits = {}
-        cur = bool(limits.get("allow_reenable_ads", False))
-        limits["allow_reenable_ads"] = not cur
-        _autopilot_set(aid, {"limits": limits})
-        append_autopilot_event(
-            aid,
-            {
-                "type": "toggle",
-                "key": "allow_reenable_ads",
-                "value": bool(limits.get("allow_reenable_ads")),
-                "chat_id": str(chat_id),
-            },
-        )
-        text = _autopilot_dashboard_text(aid)
-        await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
+
+@_CB_ROUTER.prefix("ap_set_leads|")
+async def _cb_ap_set_leads(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        "🎯 Цель по лидам\n\n"
+        "Напиши в чат число лидов (например 20).\n"
+        "0 — сбросить цель.",
+        reply_markup=_autopilot_kb(aid),
+    )
+    gid = str(_autopilot_get(aid).get("active_group_id") or "").strip() or None
+    context.user_data["await_ap_leads_for"] = {"aid": aid, "gid": gid}
+
+
+@_CB_ROUTER.prefix("ap_set_cpl|")
+async def _cb_ap_set_cpl(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        "💰 Целевой CPL\n\n"
+        "Напиши в чат число в $ (например 1.2).\n"
+        "0 — сбросить цель.",
+        reply_markup=_autopilot_kb(aid),
+    )
+    gid = str(_autopilot_get(aid).get("active_group_id") or "").strip() or None
+    context.user_data["await_ap_cpl_for"] = {"aid": aid, "gid": gid}
+
+
+@_CB_ROUTER.prefix("ap_set_budget|")
+async def _cb_ap_set_budget(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        "💵 Плановый бюджет\n\n"
+        "Напиши в чат число в $ (например 30).\n"
+        "0 — сбросить план.",
+        reply_markup=_autopilot_kb(aid),
+    )
+    gid = str(_autopilot_get(aid).get("active_group_id") or "").strip() or None
+    context.user_data["await_ap_budget_for"] = {"aid": aid, "gid": gid}
+
+
+@_CB_ROUTER.prefix("ap_period|")
+async def _cb_ap_period(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(q, "Выберите период цели:", reply_markup=_autopilot_period_kb(aid))
+
+
+@_CB_ROUTER.prefix("ap_period_set|")
+async def _cb_ap_period_set(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    try:
+        _p, aid, code = data.split("|", 2)
+    except ValueError:
+        await q.answer("Некорректные данные периода.", show_alert=True)
         return
 
-    if data.startswith("ap_toggle_pause_adsets|"):
-        aid = data.split("|", 1)[1]
-        ap = _autopilot_get(aid)
-        limits = ap.get("limits") or {}
-        if not isinstance(limits, dict):
-            limits = {}
-        cur = bool(limits.get("allow_pause_adsets", False))
-        limits["allow_pause_adsets"] = not cur
-        _autopilot_set(aid, {"limits": limits})
-        append_autopilot_event(
-            aid,
-            {
-                "type": "toggle",
-                "key": "allow_pause_adsets",
-                "value": bool(limits.get("allow_pause_adsets")),
-                "chat_id": str(chat_id),
-            },
+    ap = _autopilot_get(aid)
+    active_gid = str(ap.get("active_group_id") or "").strip() or None
+    if active_gid:
+        grp = _autopilot_group_get(aid, active_gid)
+        goals = grp.get("goals") or {}
+        if not isinstance(goals, dict):
+            goals = {}
+    else:
+        goals = ap.get("goals") or {}
+        if not isinstance(goals, dict):
+            goals = {}
+
+    code = str(code or "day")
+    goals["period"] = code
+    if code != "until":
+        goals["until"] = None
+
+    if active_gid:
+        grp["goals"] = goals
+        _autopilot_group_set(aid, active_gid, grp)
+    else:
+        _autopilot_set(aid, {"goals": goals})
+    append_autopilot_event(
+        aid,
+        {
+            "type": "period_set",
+            "period": code,
+            "chat_id": str(chat_id),
+        },
+    )
+
+    if code == "until":
+        await q.answer("Период: до даты")
+        await context.bot.send_message(
+            chat_id,
+            "Введите дату в формате ДД.ММ.ГГГГ (например 25.01.2026)",
         )
-        text = _autopilot_dashboard_text(aid)
-        await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
+        context.user_data["await_ap_until_for"] = {"aid": aid, "gid": active_gid}
         return
 
-    if data.startswith("ap_analyze|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(q, f"Считаю анализ для {get_account_name(aid)}…")
+    await q.answer("Период обновлён")
+    text = _autopilot_dashboard_text(aid)
+    await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
 
-        append_autopilot_event(
-            aid,
-            {
-                "type": "analysis_run",
-                "scope": "adset",
-                "chat_id": str(chat_id),
-            },
-        )
 
-        text = _autopilot_analysis_text(aid)
-        await safe_edit_message(q, text, reply_markup=_autopilot_analysis_kb(aid))
-        return
+@_CB_ROUTER.prefix("ap_toggle_reenable|")
+async def _cb_ap_toggle_reenable(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    ap = _autopilot_get(aid)
+    limits = ap.get("limits") or {}
+    if not isinstance(limits, dict):
+        limits = {}
+    cur = bool(limits.get("allow_reenable_ads", False))
+    limits["allow_reenable_ads"] = not cur
+    _autopilot_set(aid, {"limits": limits})
+    append_autopilot_event(
+        aid,
+        {
+            "type": "toggle",
+            "key": "allow_reenable_ads",
+            "value": bool(limits.get("allow_reenable_ads")),
+            "chat_id": str(chat_id),
+        },
+    )
+    text = _autopilot_dashboard_text(aid)
+    await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
 
-    if data.startswith("ap_hm|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            "Выберите период для рекомендаций по часам:",
-            reply_markup=_autopilot_hm_kb(aid),
-        )
+
+@_CB_ROUTER.prefix("ap_toggle_pause_adsets|")
+async def _cb_ap_toggle_pause_adsets(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    ap = _autopilot_get(aid)
+    limits = ap.get("limits") or {}
+    if not isinstance(limits, dict):
+        limits = {}
+    cur = bool(limits.get("allow_pause_adsets", False))
+    limits["allow_pause_adsets"] = not cur
+    _autopilot_set(aid, {"limits": limits})
+    append_autopilot_event(
+        aid,
+        {
+            "type": "toggle",
+            "key": "allow_pause_adsets",
+            "value": bool(limits.get("allow_pause_adsets")),
+            "chat_id": str(chat_id),
+        },
+    )
+    text = _autopilot_dashboard_text(aid)
+    await safe_edit_message(q, text, reply_markup=_autopilot_kb(aid))
+
+
+@_CB_ROUTER.prefix("ap_analyze|")
+async def _cb_ap_analyze(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(q, f"Считаю анализ для {get_account_name(aid)}…")
+
+    append_autopilot_event(
+        aid,
+        {
+            "type": "analysis_run",
+            "scope": "adset",
+            "chat_id": str(chat_id),
+        },
+    )
+
+    text = _autopilot_analysis_text(aid)
+    await safe_edit_message(q, text, reply_markup=_autopilot_analysis_kb(aid))
+
+
+@_CB_ROUTER.prefix("ap_hm|")
+async def _cb_ap_hm(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        "Выберите период для рекомендаций по часам:",
+        reply_markup=_autopilot_hm_kb(aid),
+    )
+
+
+@_CB_ROUTER.prefix("ap_hm_p|")
+async def _cb_ap_hm_p(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    try:
+        _p, aid, mode = data.split("|", 2)
+    except ValueError:
+        await q.answer("Некорректный период.", show_alert=True)
         return
 
-    if data.startswith("ap_hm_p|"):
-        try:
-            _p, aid, mode = data.split("|", 2)
-        except ValueError:
-            await q.answer("Некорректный период.", show_alert=True)
-            return
+    context.user_data["ap_hm_last"] = {"aid": str(aid), "mode": str(mode)}
 
-        context.user_data["ap_hm_last"] = {"aid": str(aid), "mode": str(mode)}
+    await safe_edit_message(q, f"Строю heatmap для {get_account_name(aid)}…")
 
-        await safe_edit_message(q, f"Строю heatmap для {get_account_name(aid)}…")
+    append_autopilot_event(
+        aid,
+        {
+            "type": "heatmap_view",
+            "mode": str(mode),
+            "chat_id": str(chat_id),
+        },
+    )
 
-        append_autopilot_event(
-            aid,
-            {
-                "type": "heatmap_view",
-                "mode": str(mode),
-                "chat_id": str(chat_id),
-            },
-        )
+    try:
+        heat_txt, summary = build_hourly_heatmap_for_account(aid, get_account_name_fn=get_account_name, mode=str(mode))
+    except Exception:
+        heat_txt, summary = ("Не удалось построить тепловую карту.", {})
+
+    extra = _autopilot_hm_summary(summary or {})
+    text = str(heat_txt or "") + "\n\n" + str(extra or "")
+    await safe_edit_message(q, text, reply_markup=_autopilot_hm_kb(aid))
+
+
+@_CB_ROUTER.prefix("ap_hm_toggle_paused|")
+async def _cb_ap_hm_toggle_paused(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts() or {}
+    row = st.get(str(aid)) or {}
+    hm = (row or {}).get("heatmap") or {}
+    if not isinstance(hm, dict):
+        hm = {}
+    cur = bool(hm.get("include_paused", False))
+    hm["include_paused"] = not cur
+    row["heatmap"] = hm
+    st[str(aid)] = row
+    save_accounts(st)
 
+    await q.answer("Фильтр обновлён")
+
+    last = context.user_data.get("ap_hm_last") or {}
+    last_aid = str((last or {}).get("aid") or "")
+    last_mode = str((last or {}).get("mode") or "")
+    if last_aid == str(aid) and last_mode:
         try:
-            heat_txt, summary = build_hourly_heatmap_for_account(aid, get_account_name_fn=get_account_name, mode=str(mode))
+            heat_txt, summary = build_hourly_heatmap_for_account(
+                aid,
+                get_account_name_fn=get_account_name,
+                mode=str(last_mode),
+            )
         except Exception:
             heat_txt, summary = ("Не удалось построить тепловую карту.", {})
-
         extra = _autopilot_hm_summary(summary or {})
         text = str(heat_txt or "") + "\n\n" + str(extra or "")
         await safe_edit_message(q, text, reply_markup=_autopilot_hm_kb(aid))
         return
 
-    if data.startswith("ap_hm_toggle_paused|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts() or {}
-        row = st.get(str(aid)) or {}
-        hm = (row or {}).get("heatmap") or {}
-        if not isinstance(hm, dict):
-            hm = {}
-        cur = bool(hm.get("include_paused", False))
-        hm["include_paused"] = not cur
-        row["heatmap"] = hm
-        st[str(aid)] = row
-        save_accounts(st)
+    await safe_edit_message(
+        q,
+        "Фильтр обновлён. Выберите период для рекомендаций по часам:",
+        reply_markup=_autopilot_hm_kb(aid),
+    )
 
-        await q.answer("Фильтр обновлён")
 
-        last = context.user_data.get("ap_hm_last") or {}
-        last_aid = str((last or {}).get("aid") or "")
-        last_mode = str((last or {}).get("mode") or "")
-        if last_aid == str(aid) and last_mode:
-            try:
-                heat_txt, summary = build_hourly_heatmap_for_account(
-                    aid,
-                    get_account_name_fn=get_account_name,
-                    mode=str(last_mode),
-                )
-            except Exception:
-                heat_txt, summary = ("Не удалось построить тепловую карту.", {})
-            extra = _autopilot_hm_summary(summary or {})
-            text = str(heat_txt or "") + "\n\n" + str(extra or "")
-            await safe_edit_message(q, text, reply_markup=_autopilot_hm_kb(aid))
-            return
+@_CB_ROUTER.prefix("aphmforce|")
+async def _cb_aphmforce(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(str(aid), {})
+    ap = (row or {}).get("autopilot") or {}
+    if not isinstance(ap, dict):
+        ap = {}
 
-        await safe_edit_message(
-            q,
-            "Фильтр обновлён. Выберите период для рекомендаций по часам:",
-            reply_markup=_autopilot_hm_kb(aid),
-        )
+    mode = str(ap.get("mode") or "OFF").upper()
+    if mode != "AUTO_LIMITS":
+        await q.answer("Force доступен только в режиме 'Авто с лимитами'.", show_alert=True)
         return
 
-    if data.startswith("aphmforce|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(str(aid), {})
-        ap = (row or {}).get("autopilot") or {}
-        if not isinstance(ap, dict):
-            ap = {}
+    hs = ap.get("heatmap_state") or {}
+    if not isinstance(hs, dict):
+        hs = {}
 
-        mode = str(ap.get("mode") or "OFF").upper()
-        if mode != "AUTO_LIMITS":
-            await q.answer("Force доступен только в режиме 'Авто с лимитами'.", show_alert=True)
-            return
+    until = (datetime.now(ALMATY_TZ) + timedelta(hours=1)).isoformat()
+    hs["force_until"] = until
+    ap["heatmap_state"] = hs
+    row["autopilot"] = ap
+    st[str(aid)] = row
+    save_accounts(st)
 
-        hs = ap.get("heatmap_state") or {}
-        if not isinstance(hs, dict):
-            hs = {}
+    append_autopilot_event(
+        aid,
+        {
+            "type": "heatmap_force_granted",
+            "until": until,
+            "chat_id": str(chat_id),
+        },
+    )
 
-        until = (datetime.now(ALMATY_TZ) + timedelta(hours=1)).isoformat()
-        hs["force_until"] = until
-        ap["heatmap_state"] = hs
-        row["autopilot"] = ap
-        st[str(aid)] = row
-        save_accounts(st)
+    await safe_edit_message(
+        q,
+        f"✅ Разрешил heatmap-применения сверх лимитов до {datetime.now(ALMATY_TZ).strftime('%H:%M')}+1ч.",
+        reply_markup=_autopilot_kb(aid),
+    )
 
-        append_autopilot_event(
-            aid,
-            {
-                "type": "heatmap_force_granted",
-                "until": until,
-                "chat_id": str(chat_id),
-            },
-        )
 
-        await safe_edit_message(
-            q,
-            f"✅ Разрешил heatmap-применения сверх лимитов до {datetime.now(ALMATY_TZ).strftime('%H:%M')}+1ч.",
-            reply_markup=_autopilot_kb(aid),
-        )
-        return
+@_CB_ROUTER.prefix("ap_suggest|")
+async def _cb_ap_suggest(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(q, f"Генерирую действия для {get_account_name(aid)}…")
 
-    if data.startswith("ap_suggest|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(q, f"Генерирую действия для {get_account_name(aid)}…")
+    ap_chat_id, _src = _resolve_autopilot_chat_id_logged(reason="ap_suggest")
 
-        ap_chat_id, _src = _resolve_autopilot_chat_id_logged(reason="ap_suggest")
+    win = prev_full_hour_window()
+    window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
+    with deny_fb_api_calls(reason="autopilot_suggest_dataset"):
+        _ds, ds_status, ds_reason, ds_meta = get_heatmap_dataset(
+            str(aid),
+            date_str=str(win.get("date") or ""),
+            hours=[int(win.get("hour") or 0)],
+        )
 
-        win = prev_full_hour_window()
-        window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
-        with deny_fb_api_calls(reason="autopilot_suggest_dataset"):
-            _ds, ds_status, ds_reason, ds_meta = get_heatmap_dataset(
-                str(aid),
-                date_str=str(win.get("date") or ""),
-                hours=[int(win.get("hour") or 0)],
-            )
+    ap = _autopilot_get(aid)
+    mode = str(ap.get("mode") or "OFF").upper()
+    try:
+        with deny_fb_api_calls(reason="autopilot_suggest_generate"):
+            actions, reasons = _ap_generate_actions(aid, debug=True)  # type: ignore[misc]
+    except Exception:
+        actions, reasons = ([], ["api_error"])
+    append_autopilot_event(
+        aid,
+        {
+            "type": "actions_generated",
+            "count": int(len(actions)),
+            "chat_id": str(chat_id),
+        },
+    )
 
-        ap = _autopilot_get(aid)
-        mode = str(ap.get("mode") or "OFF").upper()
-        try:
-            with deny_fb_api_calls(reason="autopilot_suggest_generate"):
-                actions, reasons = _ap_generate_actions(aid, debug=True)  # type: ignore[misc]
-        except Exception:
-            actions, reasons = ([], ["api_error"])
-        append_autopilot_event(
-            aid,
-            {
-                "type": "actions_generated",
-                "count": int(len(actions)),
-                "chat_id": str(chat_id),
-            },
+    if not actions:
+        reason_txt = _ap_top_reasons(reasons or [], n=2)
+        await safe_edit_message(
+            q,
+            "Нет подходящих действий по текущим данным.\n\n"
+            + "Источник данных: heatmap cache\n"
+            + f"Окно: {window_label}\n"
+            + f"Слепок: {ds_status} ({ds_reason})\n\n"
+            + (f"Причина: {reason_txt}\n\n" if reason_txt else "")
+            + "Подсказка: проверь, что есть spend сегодня и что adset ACTIVE/SCHEDULED.",
+            reply_markup=_autopilot_analysis_kb(aid),
         )
+        return
 
-        if not actions:
-            reason_txt = _ap_top_reasons(reasons or [], n=2)
-            await safe_edit_message(
-                q,
-                "Нет подходящих действий по текущим данным.\n\n"
-                + "Источник данных: heatmap cache\n"
-                + f"Окно: {window_label}\n"
-                + f"Слепок: {ds_status} ({ds_reason})\n\n"
-                + (f"Причина: {reason_txt}\n\n" if reason_txt else "")
-                + "Подсказка: проверь, что есть spend сегодня и что adset ACTIVE/SCHEDULED.",
-                reply_markup=_autopilot_analysis_kb(aid),
-            )
-            return
+    pending = context.bot_data.setdefault("ap_pending_actions", {})
+    auto_applied = 0
+    for act in actions:
+        act["aid"] = str(aid)
 
-        pending = context.bot_data.setdefault("ap_pending_actions", {})
-        auto_applied = 0
-        for act in actions:
-            act["aid"] = str(aid)
+        # ADVISOR: только рекомендации/notice.
+        if mode == "ADVISOR":
+            token = uuid.uuid4().hex[:10]
+            act["token"] = token
+            pending[token] = act
+            kb = _ap_action_kb(allow_apply=False, token=token, allow_edit=False)
+            await context.bot.send_message(ap_chat_id, _ap_action_text(act), reply_markup=kb)
+            continue
 
-            # ADVISOR: только рекомендации/notice.
-            if mode == "ADVISOR":
+        # AUTO_LIMITS: автоприменяем только строго в рамках лимитов.
+        if mode == "AUTO_LIMITS":
+            ok, why = _ap_within_limits_for_auto(aid, act)
+            if ok:
+                kind = str(act.get("kind") or "")
                 token = uuid.uuid4().hex[:10]
                 act["token"] = token
-                pending[token] = act
-                kb = _ap_action_kb(allow_apply=False, token=token, allow_edit=False)
-                await context.bot.send_message(ap_chat_id, _ap_action_text(act), reply_markup=kb)
-                continue
 
-            # AUTO_LIMITS: автоприменяем только строго в рамках лимитов.
-            if mode == "AUTO_LIMITS":
-                ok, why = _ap_within_limits_for_auto(aid, act)
-                if ok:
-                    kind = str(act.get("kind") or "")
-                    token = uuid.uuid4().hex[:10]
-                    act["token"] = token
-
-                    if kind == "budget_pct":
-                        try:
-                            pct_f = float(act.get("percent") or 0.0)
-                        except Exception:
-                            pct_f = 0.0
-                        res = apply_budget_change(str(act.get("adset_id") or ""), pct_f)
-                        append_autopilot_event(
-                            aid,
-                            {
-                                "type": "action_auto_apply",
-                                "token": token,
-                                "kind": kind,
-                                "adset_id": str(act.get("adset_id") or ""),
-                                "percent": pct_f,
-                                "status": res.get("status"),
-                                "message": res.get("message"),
-                                "chat_id": str(chat_id),
-                            },
-                        )
-                        await context.bot.send_message(
-                            ap_chat_id,
-                            "🤖 Авто с лимитами: применено автоматически\n\n" + str(res.get("message") or "") + "\n\n" + _ap_action_text(act),
-                        )
-                        auto_applied += 1
-                        continue
+                if kind == "budget_pct":
+                    try:
+                        pct_f = float(act.get("percent") or 0.0)
+                    except Exception:
+                        pct_f = 0.0
+                    res = apply_budget_change(str(act.get("adset_id") or ""), pct_f)
+                    append_autopilot_event(
+                        aid,
+                        {
+                            "type": "action_auto_apply",
+                            "token": token,
+                            "kind": kind,
+                            "adset_id": str(act.get("adset_id") or ""),
+                            "percent": pct_f,
+                            "status": res.get("status"),
+                            "message": res.get("message"),
+                            "chat_id": str(chat_id),
+                        },
+                    )
+                    await context.bot.send_message(
+                        ap_chat_id,
+                        "🤖 Авто с лимитами: применено автоматически\n\n" + str(res.get("message") or "") + "\n\n" + _ap_action_text(act),
+                    )
+                    auto_applied += 1
+                    continue
+
+                if kind == "pause_ad":
+                    ad_id = str(act.get("ad_id") or "")
+                    adset_id = str(act.get("adset_id") or "")
+                    try:
+                        active_cnt = _count_active_ads_in_adset(aid, adset_id)
+                    except Exception:
+                        active_cnt = 0
 
-                    if kind == "pause_ad":
-                        ad_id = str(act.get("ad_id") or "")
-                        adset_id = str(act.get("adset_id") or "")
-                        try:
-                            active_cnt = _count_active_ads_in_adset(aid, adset_id)
-                        except Exception:
-                            active_cnt = 0
-
-                        if active_cnt <= 1:
-                            ok = False
-                            why = "single_active_ad"
-                        else:
-                            with allow_fb_api_calls(reason="ap_suggest_apply"):
-                                res = pause_ad(ad_id)
-                            append_autopilot_event(
-                                aid,
-                                {
-                                    "type": "action_auto_apply",
-                                    "token": token,
-                                    "kind": kind,
-                                    "adset_id": adset_id,
-                                    "ad_id": ad_id,
-                                    "status": res.get("status"),
-                                    "message": res.get("message") or res.get("exception"),
-                                    "chat_id": str(chat_id),
-                                },
-                            )
-                            await context.bot.send_message(
-                                ap_chat_id,
-                                "🤖 Авто с лимитами: применено автоматически\n\n" + str(res.get("message") or res.get("exception") or "") + "\n\n" + _ap_action_text(act),
-                            )
-                            auto_applied += 1
-                            continue
-
-                    if kind == "pause_adset":
-                        # В AUTO_LIMITS всё равно только если явно включено allow_pause_adsets (генератор уже отфильтровал).
+                    if active_cnt <= 1:
+                        ok = False
+                        why = "single_active_ad"
+                    else:
                         with allow_fb_api_calls(reason="ap_suggest_apply"):
-                            res = disable_entity(str(act.get("adset_id") or ""))
+                            res = await run_fb_io(pause_ad, ad_id)
                         append_autopilot_event(
                             aid,
                             {
                                 "type": "action_auto_apply",
                                 "token": token,
                                 "kind": kind,
-                                "adset_id": str(act.get("adset_id") or ""),
+                                "adset_id": adset_id,
+                                "ad_id": ad_id,
                                 "status": res.get("status"),
-                                "message": res.get("message"),
+                                "message": res.get("message") or res.get("exception"),
                                 "chat_id": str(chat_id),
                             },
                         )
                         await context.bot.send_message(
                             ap_chat_id,
-                            "🤖 Авто с лимитами: применено автоматически\n\n" + (res.get("message") or "") + "\n\n" + _ap_action_text(act),
+                            "🤖 Авто с лимитами: применено автоматически\n\n" + str(res.get("message") or res.get("exception") or "") + "\n\n" + _ap_action_text(act),
                         )
                         auto_applied += 1
                         continue
 
-                # не в лимитах -> отправляем как обычную рекомендацию с кнопками
-                token = uuid.uuid4().hex[:10]
-                act["token"] = token
-                pending[token] = act
-                kind = str(act.get("kind") or "")
-                allow_edit = kind == "budget_pct"
-                kb = _ap_action_kb(allow_apply=True, token=token, allow_edit=allow_edit)
-                await context.bot.send_message(
-                    ap_chat_id,
-                    _ap_action_text(act)
-                    + f"\n\n⚠️ Вне лимитов режима 'Авто с лимитами': {why}",
-                    reply_markup=kb,
-                )
-                continue
-
-            # SEMI / OFF: SEMI — подтверждение вручную; OFF — по факту тоже не должен предлагать, но оставим безопасно.
-            token = uuid.uuid4().hex[:10]
-            act["token"] = token
-            pending[token] = act
+                if kind == "pause_adset":
+                    # В AUTO_LIMITS всё равно только если явно включено allow_pause_adsets (генератор уже отфильтровал).
+                    with allow_fb_api_calls(reason="ap_suggest_apply"):
+                        res = await run_fb_io(disable_entity, str(act.get("adset_id") or ""))
+                    append_autopilot_event(
+                        aid,
+                        {
+                            "type": "action_auto_apply",
+                            "token": token,
+                            "kind": kind,
+                            "adset_id": str(act.get("adset_id") or ""),
+                            "status": res.get("status"),
+                            "message": res.get("message"),
+                            "chat_id": str(chat_id),
+                        },
+                    )
+                    await context.bot.send_message(
+                        ap_chat_id,
+                        "🤖 Авто с лимитами: применено автоматически\n\n" + (res.get("message") or "") + "\n\n" + _ap_action_text(act),
+                    )
+                    auto_applied += 1
+                    continue
 
+            # не в лимитах -> отправляем как обычную рекомендацию с кнопками
+            token = uuid.uuid4().hex[:10]
+            act["token"] = token
+            pending[token] = act
             kind = str(act.get("kind") or "")
             allow_edit = kind == "budget_pct"
-            kb = _ap_action_kb(
-                allow_apply=bool(act.get("allow_apply")), token=token, allow_edit=allow_edit
+            kb = _ap_action_kb(allow_apply=True, token=token, allow_edit=allow_edit)
+            await context.bot.send_message(
+                ap_chat_id,
+                _ap_action_text(act)
+                + f"\n\n⚠️ Вне лимитов режима 'Авто с лимитами': {why}",
+                reply_markup=kb,
             )
-            await context.bot.send_message(chat_id, _ap_action_text(act), reply_markup=kb)
-
-        await safe_edit_message(
-            q,
-            f"Отправил действий: {len(actions)}\n"
-            + (f"Автоприменено: {auto_applied}\n" if auto_applied else "")
-            + "Каждое действие отдельным сообщением ниже.",
-            reply_markup=_autopilot_analysis_kb(aid),
-        )
-        return
+            continue
 
-    if data.startswith("ap_dry|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(q, f"🧪 Dry-run: {get_account_name(aid)} — считаю, что бы сделал…")
+        # SEMI / OFF: SEMI — подтверждение вручную; OFF — по факту тоже не должен предлагать, но оставим безопасно.
+        token = uuid.uuid4().hex[:10]
+        act["token"] = token
+        pending[token] = act
 
-        ap_chat_id, _src = _resolve_autopilot_chat_id_logged(reason="ap_dry")
+        kind = str(act.get("kind") or "")
+        allow_edit = kind == "budget_pct"
+        kb = _ap_action_kb(
+            allow_apply=bool(act.get("allow_apply")), token=token, allow_edit=allow_edit
+        )
+        await context.bot.send_message(chat_id, _ap_action_text(act), reply_markup=kb)
 
-        ap = _autopilot_get(aid)
-        mode = str(ap.get("mode") or "OFF").upper()
-        gids = _autopilot_active_group_ids(aid)
+    await safe_edit_message(
+        q,
+        f"Отправил действий: {len(actions)}\n"
+        + (f"Автоприменено: {auto_applied}\n" if auto_applied else "")
+        + "Каждое действие отдельным сообщением ниже.",
+        reply_markup=_autopilot_analysis_kb(aid),
+    )
 
-        win = prev_full_hour_window()
-        window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
 
-        with deny_fb_api_calls(reason="autopilot_dry_dataset"):
-            _ds, ds_status, ds_reason, ds_meta = get_heatmap_dataset(
-                str(aid),
-                date_str=str(win.get("date") or ""),
-                hours=[int(win.get("hour") or 0)],
-            )
+@_CB_ROUTER.prefix("ap_dry|")
+async def _cb_ap_dry(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(q, f"🧪 Dry-run: {get_account_name(aid)} — считаю, что бы сделал…")
 
-        lines = [
-            f"🧪 Dry-run автопилота: {get_account_name(aid)}",
-            f"Режим: {mode}",
-            "Источник данных: heatmap cache",
-            f"Окно: {window_label}",
-            f"Слепок: {ds_status} ({ds_reason})",
-            "",
-        ]
-        if mode not in {"AUTO_LIMITS", "SEMI", "ADVISOR", "OFF"}:
-            lines.append(f"⚠️ Неизвестный режим: {mode}")
-            lines.append("")
+    ap_chat_id, _src = _resolve_autopilot_chat_id_logged(reason="ap_dry")
 
-        if not gids:
-            lines.append("Действий: 0")
-            lines.append(f"Причина: {_ap_reason_human('no_monitored_groups')}")
-            await context.bot.send_message(ap_chat_id, "\n".join(lines), disable_notification=False)
-            await safe_edit_message(q, "🧪 Dry-run завершён.", reply_markup=_autopilot_analysis_kb(aid))
-            return
+    ap = _autopilot_get(aid)
+    mode = str(ap.get("mode") or "OFF").upper()
+    gids = _autopilot_active_group_ids(aid)
 
-        total_actions = 0
-        reason_counts: Counter[str] = Counter()
-        for gid in gids:
-            eff = _autopilot_effective_config_for_group(aid, gid)
-            gname = eff.get("group_name") or str(gid)
-            try:
-                with deny_fb_api_calls(reason="autopilot_dry_generate"):
-                    actions, reasons = _ap_generate_actions(aid, eff=eff, debug=True)  # type: ignore[misc]
-            except Exception:
-                actions, reasons = ([], ["api_error"])
+    win = prev_full_hour_window()
+    window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
 
-            total_actions += int(len(actions or []))
-            if actions:
-                lines.append(f"🤖 Группа: {gname} — идеи: {len(actions)}")
-                for act in (actions or [])[:5]:
-                    lines.append("")
-                    lines.append(_ap_action_text(act))
-            else:
-                reason_counts.update([str(x) for x in (reasons or []) if x])
-                reason_txt = _ap_top_reasons(reasons or [], n=2)
-                lines.append(f"🤖 Группа: {gname} — действий 0")
-                if reason_txt:
-                    lines.append(f"Причина: {reason_txt}")
-            lines.append("")
+    with deny_fb_api_calls(reason="autopilot_dry_dataset"):
+        _ds, ds_status, ds_reason, ds_meta = get_heatmap_dataset(
+            str(aid),
+            date_str=str(win.get("date") or ""),
+            hours=[int(win.get("hour") or 0)],
+        )
 
-        if total_actions <= 0:
-            top = _ap_top_reasons(list(reason_counts.elements()) or [], n=2)
-            if top:
-                lines.append(f"Итого причина: {top}")
+    lines = [
+        f"🧪 Dry-run автопилота: {get_account_name(aid)}",
+        f"Режим: {mode}",
+        "Источник данных: heatmap cache",
+        f"Окно: {window_label}",
+        f"Слепок: {ds_status} ({ds_reason})",
+        "",
+    ]
+    if mode not in {"AUTO_LIMITS", "SEMI", "ADVISOR", "OFF"}:
+        lines.append(f"⚠️ Неизвестный режим: {mode}")
+        lines.append("")
 
+    if not gids:
+        lines.append("Действий: 0")
+        lines.append(f"Причина: {_ap_reason_human('no_monitored_groups')}")
         await context.bot.send_message(ap_chat_id, "\n".join(lines), disable_notification=False)
         await safe_edit_message(q, "🧪 Dry-run завершён.", reply_markup=_autopilot_analysis_kb(aid))
         return
 
-    if data == "insta_links_menu":
-        # Сценарий получения ссылок на активную инста-рекламу.
-        store = load_accounts() or {}
-        enabled_ids = [aid for aid, row in (store or {}).items() if (row or {}).get("enabled", True)]
+    total_actions = 0
+    reason_counts: Counter[str] = Counter()
+    for gid in gids:
+        eff = _autopilot_effective_config_for_group(aid, gid)
+        gname = eff.get("group_name") or str(gid)
         try:
-            logging.getLogger(__name__).info(
-                "caller=ads_links enabled_accounts=%s",
-                int(len(enabled_ids)),
-            )
+            with deny_fb_api_calls(reason="autopilot_dry_generate"):
+                actions, reasons = _ap_generate_actions(aid, eff=eff, debug=True)  # type: ignore[misc]
         except Exception:
-            pass
+            actions, reasons = ([], ["api_error"])
 
-        if not enabled_ids:
-            await safe_edit_message(q, "Нет включённых аккаунтов")
-            return
+        total_actions += int(len(actions or []))
+        if actions:
+            lines.append(f"🤖 Группа: {gname} — идеи: {len(actions)}")
+            for act in (actions or [])[:5]:
+                lines.append("")
+                lines.append(_ap_action_text(act))
+        else:
+            reason_counts.update([str(x) for x in (reasons or []) if x])
+            reason_txt = _ap_top_reasons(reasons or [], n=2)
+            lines.append(f"🤖 Группа: {gname} — действий 0")
+            if reason_txt:
+                lines.append(f"Причина: {reason_txt}")
+        lines.append("")
 
-        await safe_edit_message(
-            q,
-            "Выберите рекламный аккаунт для получения ссылок на активную рекламу в Instagram:",
-            reply_markup=accounts_kb("insta_links_acc"),
-        )
-        return
+    if total_actions <= 0:
+        top = _ap_top_reasons(list(reason_counts.elements()) or [], n=2)
+        if top:
+            lines.append(f"Итого причина: {top}")
 
-    if data == "monitoring_menu":
-        await safe_edit_message(
-            q,
-            "Раздел мониторинга. Выберите пункт:",
-            reply_markup=monitoring_menu_kb(is_sa=bool(is_sa)),
-        )
-        return
+    await context.bot.send_message(ap_chat_id, "\n".join(lines), disable_notification=False)
+    await safe_edit_message(q, "🧪 Dry-run завершён.", reply_markup=_autopilot_analysis_kb(aid))
 
-    if data == "cpa_alerts_settings":
-        if not is_sa:
-            return
-        _cpa_ensure_state()
-        _cpa_ensure_defaults()
-        st = _cpa_load_state() or {}
-        is_enabled = bool(st.get("enabled") is True)
-        await safe_edit_message(
-            q,
-            "⚙️ Настройки CPA-алёртов",
-            reply_markup=cpa_alerts_settings_kb(is_enabled=is_enabled),
-        )
-        return
 
-    if data == "cpa_alerts_global_toggle":
-        if not is_sa:
-            return
-        st = _cpa_load_state() or {}
-        new_val = not bool(st.get("enabled") is True)
-        _cpa_set_global_enabled(bool(new_val))
-        await safe_edit_message(
-            q,
-            "⚙️ Настройки CPA-алёртов",
-            reply_markup=cpa_alerts_settings_kb(is_enabled=bool(new_val)),
+@_CB_ROUTER.exact("insta_links_menu")
+async def _cb_insta_links_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Сценарий получения ссылок на активную инста-рекламу.
+    store = load_accounts_view() or {}
+    enabled_ids = [aid for aid, row in (store or {}).items() if (row or {}).get("enabled", True)]
+    try:
+        logging.getLogger(__name__).info(
+            "caller=ads_links enabled_accounts=%s",
+            int(len(enabled_ids)),
         )
-        return
+    except Exception:
+        pass
 
-    if data == "cpa_alerts_rules":
-        if not is_sa:
-            return
-        _cpa_ensure_state()
-        _cpa_ensure_defaults()
-        await safe_edit_message(
-            q,
-            "📋 CPA-алёрты — правила",
-            reply_markup=cpa_alerts_rules_kb(),
-        )
+    if not enabled_ids:
+        await safe_edit_message(q, "Нет включённых аккаунтов")
         return
 
-    if data == "cpa_alerts_new_rule":
-        if not is_sa:
-            return
-        rr = _cpa_create_default_rule(name="")
-        rr = _cpa_upsert_rule(rr)
-        rid = str(rr.get("id") or "").strip()
-        await safe_edit_message(
-            q,
-            cpa_alerts_rule_text(rid),
-            reply_markup=cpa_alerts_rule_kb(rid),
-        )
-        return
+    await safe_edit_message(
+        q,
+        "Выберите рекламный аккаунт для получения ссылок на активную рекламу в Instagram:",
+        reply_markup=accounts_kb("insta_links_acc"),
+    )
 
-    if data.startswith("cpa_alerts_rule|"):
-        if not is_sa:
-            return
-        rid = str(data.split("|", 1)[1] or "").strip()
-        if not rid:
-            return
-        await safe_edit_message(
-            q,
-            cpa_alerts_rule_text(rid),
-            reply_markup=cpa_alerts_rule_kb(rid),
-        )
-        return
 
-    if data.startswith("cpa_alerts_rule_toggle|"):
-        if not is_sa:
-            return
-        rid = str(data.split("|", 1)[1] or "").strip()
-        if not rid:
-            return
-        _cpa_toggle_rule_enabled(rid)
-        await safe_edit_message(
-            q,
-            cpa_alerts_rule_text(rid),
-            reply_markup=cpa_alerts_rule_kb(rid),
-        )
-        return
+@_CB_ROUTER.exact("monitoring_menu")
+async def _cb_monitoring_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Раздел мониторинга. Выберите пункт:",
+        reply_markup=monitoring_menu_kb(is_sa=bool(is_sa)),
+    )
 
-    if data.startswith("cpa_alerts_delete|"):
-        if not is_sa:
-            return
-        rid = str(data.split("|", 1)[1] or "").strip()
-        if not rid:
-            return
-        _cpa_delete_rule(rid)
-        await safe_edit_message(
-            q,
-            "📋 CPA-алёрты — правила",
-            reply_markup=cpa_alerts_rules_kb(),
-        )
-        return
 
-    if data.startswith("cpa_alerts_set_scope|"):
-        if not is_sa:
-            return
-        _p, rid, val = data.split("|", 2)
-        rr = _cpa_get_rule(str(rid))
-        if not rr:
-            return
-        v = str(val or "ACCOUNT").upper().strip()
-        if v not in {"ACCOUNT", "ENTITY_GROUP", "CAMPAIGN", "ADSET"}:
-            v = "ACCOUNT"
-        rr2 = dict(rr)
-        rr2["scope_type"] = v
-        _cpa_upsert_rule(rr2)
-        await safe_edit_message(
-            q,
-            cpa_alerts_rule_text(rid),
-            reply_markup=cpa_alerts_rule_kb(rid),
-        )
+@_CB_ROUTER.exact("cpa_alerts_settings")
+async def _cb_cpa_alerts_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
         return
+    _cpa_ensure_state()
+    _cpa_ensure_defaults()
+    st = _cpa_load_state() or {}
+    is_enabled = bool(st.get("enabled") is True)
+    await safe_edit_message(
+        q,
+        "⚙️ Настройки CPA-алёртов",
+        reply_markup=cpa_alerts_settings_kb(is_enabled=is_enabled),
+    )
 
-    if data.startswith("cpa_alerts_set_result|"):
-        if not is_sa:
-            return
-        _p, rid, val = data.split("|", 2)
-        rr = _cpa_get_rule(str(rid))
-        if not rr:
-            return
-        v = str(val or "BLENDED").upper().strip()
-        if v not in {"BLENDED", "MESSAGES", "SUBMIT_APPLICATION"}:
-            v = "BLENDED"
-        rr2 = dict(rr)
-        rr2["result_type"] = v
-        _cpa_upsert_rule(rr2)
-        await safe_edit_message(
-            q,
-            cpa_alerts_rule_text(rid),
-            reply_markup=cpa_alerts_rule_kb(rid),
-        )
-        return
 
-    if data.startswith("cpa_alerts_set_schedule|"):
-        if not is_sa:
-            return
-        _p, rid, val = data.split("|", 2)
-        rr = _cpa_get_rule(str(rid))
-        if not rr:
-            return
-        v = str(val or "DAILY").upper().strip()
-        if v not in {"HOURLY", "DAILY", "DAYS_3", "WEEKLY"}:
-            v = "DAILY"
-        rr2 = dict(rr)
-        rr2["schedule"] = v
-        _cpa_upsert_rule(rr2)
-        await safe_edit_message(
-            q,
-            cpa_alerts_rule_text(rid),
-            reply_markup=cpa_alerts_rule_kb(rid),
-        )
+@_CB_ROUTER.exact("cpa_alerts_global_toggle")
+async def _cb_cpa_alerts_global_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
         return
+    st = _cpa_load_state() or {}
+    new_val = not bool(st.get("enabled") is True)
+    _cpa_set_global_enabled(bool(new_val))
+    await safe_edit_message(
+        q,
+        "⚙️ Настройки CPA-алёртов",
+        reply_markup=cpa_alerts_settings_kb(is_enabled=bool(new_val)),
+    )
 
-    if data.startswith("cpa_alerts_edit|"):
-        if not is_sa:
-            return
-        _p, rid, field = data.split("|", 2)
-        rr = _cpa_get_rule(str(rid))
-        if not rr:
-            return
-        fld = str(field or "").strip()
-        if fld not in {
-            "name",
-            "target_cpa_usd",
-            "scope_id",
-            "account_id",
-            "send_time",
-            "active_hours",
-            "min_spend_to_trigger_usd",
-            "top_ads_limit",
-        }:
-            return
-        context.user_data["await_cpa_alerts_edit"] = {"rule_id": str(rid), "field": fld}
-        prompts = {
-            "name": "Введите название правила текстом (до 48 символов)",
-            "target_cpa_usd": "Введите target CPA в долларах (например 2.5)",
-            "scope_id": "Введите scope_id (ACCOUNT: act_... / GROUP: group_id / CAMPAIGN: campaign_id / ADSET: adset_id)",
-            "account_id": "Введите account_id вида act_... (нужно для scope CAMPAIGN/ADSET; можно оставить пустым)",
-            "send_time": "Введите время отправки HH:MM (например 10:45)",
-            "active_hours": "Введите активные часы HH:MM-HH:MM (например 10:30-21:30)",
-            "min_spend_to_trigger_usd": "Введите минимальный spend ($) для триггера (например 20)",
-            "top_ads_limit": "Введите лимит TOP ads (целое число, например 5)",
-        }
-        await safe_edit_message(
-            q,
-            str(prompts.get(fld) or "Введите значение"),
-            reply_markup=cpa_alerts_rule_kb(str(rid)),
-        )
-        return
 
-    if data.startswith("cpa_alerts_test|"):
-        if not is_sa:
-            return
-        rid = str(data.split("|", 1)[1] or "").strip()
-        if not rid:
-            return
-        rr = _cpa_get_rule(rid) or {}
-        schedule = str((rr or {}).get("schedule") or "DAILY").upper().strip()
-        mode = schedule if schedule in {"HOURLY", "DAILY", "DAYS_3", "WEEKLY"} else "DAILY"
-        await safe_edit_message(q, "🧪 Запускаю тест CPA-алерта…")
-        await _run_cpa_alerts_for_mode(context, mode=mode, rule_id=rid, test=True)
-        await safe_edit_message(q, "✅ Тест отправлен в админ-чат", reply_markup=cpa_alerts_rule_kb(rid))
+@_CB_ROUTER.exact("cpa_alerts_rules")
+async def _cb_cpa_alerts_rules(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
         return
+    _cpa_ensure_state()
+    _cpa_ensure_defaults()
+    await safe_edit_message(
+        q,
+        "📋 CPA-алёрты — правила",
+        reply_markup=cpa_alerts_rules_kb(),
+    )
 
-    if data == "cpa_test_menu":
-        if not is_sa:
-            return
-        await safe_edit_message(
-            q,
-            "🧪 Тест CPA-алерта\n\nВыбери правило:",
-            reply_markup=cpa_test_rules_kb(),
-        )
-        return
 
-    if data.startswith("cpa_test_rule|"):
-        if not is_sa:
-            return
-        rid = str(data.split("|", 1)[1] or "").strip()
-        if not rid:
-            return
-        rr = None
-        try:
-            rr = next((x for x in (_cpa_rules_list(enabled_only=True) or []) if str((x or {}).get("id") or "").strip() == rid), None)
-        except Exception:
-            rr = None
-        schedule = str((rr or {}).get("schedule") or "DAILY").upper().strip()
-        mode = schedule if schedule in {"HOURLY", "DAILY", "DAYS_3", "WEEKLY"} else "DAILY"
-        await safe_edit_message(q, "🧪 Запускаю тест CPA-алерта…")
-        await _run_cpa_alerts_for_mode(context, mode=mode, rule_id=rid, test=True)
-        await safe_edit_message(q, "✅ Тест отправлен в админ-чат", reply_markup=monitoring_menu_kb(is_sa=True))
+@_CB_ROUTER.exact("cpa_alerts_new_rule")
+async def _cb_cpa_alerts_new_rule(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
         return
+    rr = _cpa_create_default_rule(name="")
+    rr = _cpa_upsert_rule(rr)
+    rid = str(rr.get("id") or "").strip()
+    await safe_edit_message(
+        q,
+        cpa_alerts_rule_text(rid),
+        reply_markup=cpa_alerts_rule_kb(rid),
+    )
 
-    if data == "heatmap_status_menu":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для статуса теплокарты:",
-            reply_markup=accounts_kb("heatmap_status_acc"),
-        )
-        return
 
-    if data.startswith("heatmap_status_acc|"):
-        aid = data.split("|", 1)[1]
-        text = build_heatmap_status_text(aid=aid)
-        await safe_edit_message(q, text, reply_markup=monitoring_menu_kb())
+@_CB_ROUTER.prefix("cpa_alerts_rule|")
+async def _cb_cpa_alerts_rule(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
         return
-
-    if data.startswith("hm_collect_prev|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"📌 Собираю слепок предыдущего часа для {get_account_name(aid)}…",
-            reply_markup=_autopilot_analysis_kb(aid),
-        )
-        try:
-            await run_heatmap_snapshot_collector_once(context, aid=str(aid))
-        except Exception:
-            pass
-        text = build_heatmap_status_text(aid=aid)
-        await safe_edit_message(q, text, reply_markup=_autopilot_analysis_kb(aid))
+    rid = str(data.split("|", 1)[1] or "").strip()
+    if not rid:
         return
+    await safe_edit_message(
+        q,
+        cpa_alerts_rule_text(rid),
+        reply_markup=cpa_alerts_rule_kb(rid),
+    )
 
-    if data == "focus_ai_menu":
-        await safe_edit_message(
-            q,
-            "🎯 Фокус-ИИ\n\n"
-            "Выберите режим:",
-            reply_markup=focus_ai_main_kb(),
-        )
-        return
 
-    if data == "anomalies_menu":
-        # Выбор аккаунта для проверки аномалий по адсетам.
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для анализа аномалий по адсетам:",
-            reply_markup=accounts_kb("anomalies_acc"),
-        )
+@_CB_ROUTER.prefix("cpa_alerts_rule_toggle|")
+async def _cb_cpa_alerts_rule_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
+        return
+    rid = str(data.split("|", 1)[1] or "").strip()
+    if not rid:
         return
+    _cpa_toggle_rule_enabled(rid)
+    await safe_edit_message(
+        q,
+        cpa_alerts_rule_text(rid),
+        reply_markup=cpa_alerts_rule_kb(rid),
+    )
 
-    if data.startswith("insta_links_acc|"):
-        aid = data.split("|", 1)[1]
-        account_name = get_account_name(aid)
 
-        try:
-            st = load_accounts() or {}
-            row = (st or {}).get(str(aid)) or {}
-            if not bool(row.get("enabled", True)):
-                await safe_edit_message(q, "Этот аккаунт выключен в настройках. Включи его и повтори.")
-                return
-        except Exception:
-            pass
+@_CB_ROUTER.prefix("cpa_alerts_delete|")
+async def _cb_cpa_alerts_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
+        return
+    rid = str(data.split("|", 1)[1] or "").strip()
+    if not rid:
+        return
+    _cpa_delete_rule(rid)
+    await safe_edit_message(
+        q,
+        "📋 CPA-алёрты — правила",
+        reply_markup=cpa_alerts_rules_kb(),
+    )
 
-        await safe_edit_message(
-            q,
-            f"🔗 Ссылки на рекламу — {account_name}\n\n"
-            "Собираю активные инста-объявления...",
-        )
 
-        items = fetch_instagram_active_ads_links(aid)
-        messages = format_instagram_ads_links(items)
+@_CB_ROUTER.prefix("cpa_alerts_set_scope|")
+async def _cb_cpa_alerts_set_scope(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
+        return
+    _p, rid, val = data.split("|", 2)
+    rr = _cpa_get_rule(str(rid))
+    if not rr:
+        return
+    v = str(val or "ACCOUNT").upper().strip()
+    if v not in {"ACCOUNT", "ENTITY_GROUP", "CAMPAIGN", "ADSET"}:
+        v = "ACCOUNT"
+    rr2 = dict(rr)
+    rr2["scope_type"] = v
+    _cpa_upsert_rule(rr2)
+    await safe_edit_message(
+        q,
+        cpa_alerts_rule_text(rid),
+        reply_markup=cpa_alerts_rule_kb(rid),
+    )
 
-        for msg in messages:
-            await context.bot.send_message(chat_id, msg)
-            # Небольшая пауза, чтобы не заддосить Telegram при большом количестве ссылок
-            await asyncio.sleep(0.3)
-        return
 
-    if data.startswith("anomalies_acc|"):
-        aid = data.split("|", 1)[1]
-        account_name = get_account_name(aid)
+@_CB_ROUTER.prefix("cpa_alerts_set_result|")
+async def _cb_cpa_alerts_set_result(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
+        return
+    _p, rid, val = data.split("|", 2)
+    rr = _cpa_get_rule(str(rid))
+    if not rr:
+        return
+    v = str(val or "BLENDED").upper().strip()
+    if v not in {"BLENDED", "MESSAGES", "SUBMIT_APPLICATION"}:
+        v = "BLENDED"
+    rr2 = dict(rr)
+    rr2["result_type"] = v
+    _cpa_upsert_rule(rr2)
+    await safe_edit_message(
+        q,
+        cpa_alerts_rule_text(rid),
+        reply_markup=cpa_alerts_rule_kb(rid),
+    )
 
-        await safe_edit_message(
-            q,
-            f"⚠️ Анализ аномалий по адсетам для {account_name}…",
-        )
 
-        messages = build_anomaly_messages_for_account(aid)
+@_CB_ROUTER.prefix("cpa_alerts_set_schedule|")
+async def _cb_cpa_alerts_set_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
+        return
+    _p, rid, val = data.split("|", 2)
+    rr = _cpa_get_rule(str(rid))
+    if not rr:
+        return
+    v = str(val or "DAILY").upper().strip()
+    if v not in {"HOURLY", "DAILY", "DAYS_3", "WEEKLY"}:
+        v = "DAILY"
+    rr2 = dict(rr)
+    rr2["schedule"] = v
+    _cpa_upsert_rule(rr2)
+    await safe_edit_message(
+        q,
+        cpa_alerts_rule_text(rid),
+        reply_markup=cpa_alerts_rule_kb(rid),
+    )
 
-        if not messages:
-            await context.bot.send_message(
-                chat_id,
-                f"⚠️ Для аккаунта {account_name} аномалий по адсетам не обнаружено.",
-            )
-            return
 
-        for msg in messages:
-            await context.bot.send_message(chat_id, msg)
-            await asyncio.sleep(0.3)
+@_CB_ROUTER.prefix("cpa_alerts_edit|")
+async def _cb_cpa_alerts_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
+        return
+    _p, rid, field = data.split("|", 2)
+    rr = _cpa_get_rule(str(rid))
+    if not rr:
+        return
+    fld = str(field or "").strip()
+    if fld not in {
+        "name",
+        "target_cpa_usd",
+        "scope_id",
+        "account_id",
+        "send_time",
+        "active_hours",
+        "min_spend_to_trigger_usd",
+        "top_ads_limit",
+    }:
         return
+    context.user_data["await_cpa_alerts_edit"] = {"rule_id": str(rid), "field": fld}
+    prompts = {
+        "name": "Введите название правила текстом (до 48 символов)",
+        "target_cpa_usd": "Введите target CPA в долларах (например 2.5)",
+        "scope_id": "Введите scope_id (ACCOUNT: act_... / GROUP: group_id / CAMPAIGN: campaign_id / ADSET: adset_id)",
+        "account_id": "Введите account_id вида act_... (нужно для scope CAMPAIGN/ADSET; можно оставить пустым)",
+        "send_time": "Введите время отправки HH:MM (например 10:45)",
+        "active_hours": "Введите активные часы HH:MM-HH:MM (например 10:30-21:30)",
+        "min_spend_to_trigger_usd": "Введите минимальный spend ($) для триггера (например 20)",
+        "top_ads_limit": "Введите лимит TOP ads (целое число, например 5)",
+    }
+    await safe_edit_message(
+        q,
+        str(prompts.get(fld) or "Введите значение"),
+        reply_markup=cpa_alerts_rule_kb(str(rid)),
+    )
 
-    # ==== Фокус-ИИ: сценарий настроек ====
 
-    if data == "focus_ai_settings":
-        await safe_edit_message(
-            q,
-            "🎯 Фокус-ИИ — настройки\n\n"
-            "Сначала выбери рекламный аккаунт, для которого будем настраивать Фокус-ИИ:",
-            reply_markup=accounts_kb("focus_ai_acc"),
-        )
+@_CB_ROUTER.prefix("cpa_alerts_test|")
+async def _cb_cpa_alerts_test(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
+        return
+    rid = str(data.split("|", 1)[1] or "").strip()
+    if not rid:
         return
+    rr = _cpa_get_rule(rid) or {}
+    schedule = str((rr or {}).get("schedule") or "DAILY").upper().strip()
+    mode = schedule if schedule in {"HOURLY", "DAILY", "DAYS_3", "WEEKLY"} else "DAILY"
+    await safe_edit_message(q, "🧪 Запускаю тест CPA-алерта…")
+    await _run_cpa_alerts_for_mode(context, mode=mode, rule_id=rid, test=True)
+    await safe_edit_message(q, "✅ Тест отправлен в админ-чат", reply_markup=cpa_alerts_rule_kb(rid))
 
-    if data.startswith("focus_ai_acc|"):
-        aid = data.split("|", 1)[1]
-        context.user_data["focus_ai_settings_aid"] = aid
-        await safe_edit_message(
-            q,
-            f"🎯 Фокус-ИИ — настройки для {get_account_name(aid)}\n\n"
-            "Выбери уровень, на котором будет работать Фокус-ИИ:",
-            reply_markup=focus_ai_level_kb_settings(),
-        )
+
+@_CB_ROUTER.exact("cpa_test_menu")
+async def _cb_cpa_test_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
         return
+    await safe_edit_message(
+        q,
+        "🧪 Тест CPA-алерта\n\nВыбери правило:",
+        reply_markup=cpa_test_rules_kb(),
+    )
 
-    if data.startswith("focus_ai_set_level|"):
-        _prefix, level = data.split("|", 1)
-        aid = context.user_data.get("focus_ai_settings_aid")
-        if not aid:
-            await safe_edit_message(
-                q,
-                "Не удалось определить аккаунт для настроек Фокус-ИИ. Вернись назад и выбери аккаунт ещё раз.",
-                reply_markup=accounts_kb("focus_ai_acc"),
-            )
-            return
 
-        if level != "account":
-            level_human = {
-                "campaign": "Кампании",
-                "adset": "Адсеты",
-                "ad": "Объявления",
-            }.get(level, level)
-            await safe_edit_message(
-                q,
-                f"Уровень '{level_human}' пока в разработке.\n\n"
-                "Сейчас можно включить Фокус-ИИ только на уровне всего аккаунта.",
-                reply_markup=focus_ai_level_kb_settings(),
-            )
-            return
+@_CB_ROUTER.prefix("cpa_test_rule|")
+async def _cb_cpa_test_rule(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    if not is_sa:
+        return
+    rid = str(data.split("|", 1)[1] or "").strip()
+    if not rid:
+        return
+    rr = None
+    try:
+        rr = next((x for x in (_cpa_rules_list(enabled_only=True) or []) if str((x or {}).get("id") or "").strip() == rid), None)
+    except Exception:
+        rr = None
+    schedule = str((rr or {}).get("schedule") or "DAILY").upper().strip()
+    mode = schedule if schedule in {"HOURLY", "DAILY", "DAYS_3", "WEEKLY"} else "DAILY"
+    await safe_edit_message(q, "🧪 Запускаю тест CPA-алерта…")
+    await _run_cpa_alerts_for_mode(context, mode=mode, rule_id=rid, test=True)
+    await safe_edit_message(q, "✅ Тест отправлен в админ-чат", reply_markup=monitoring_menu_kb(is_sa=True))
+
+
+@_CB_ROUTER.exact("heatmap_status_menu")
+async def _cb_heatmap_status_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для статуса теплокарты:",
+        reply_markup=accounts_kb("heatmap_status_acc"),
+    )
 
-        # Сохраняем простейшую настройку Фокус-ИИ: пользователь → уровень "account" по aid
-        st = load_accounts()
-        row = st.get(aid, {})
-        focus = row.get("focus") or {}
-        uid = str(update.effective_user.id)
-        focus[uid] = {"level": "account", "enabled": True}
-        row["focus"] = focus
-        st[aid] = row
-        save_accounts(st)
 
-        await safe_edit_message(
-            q,
-            f"🎯 Фокус-ИИ включён для аккаунта {get_account_name(aid)} на уровне всего аккаунта.\n\n"
-            "Дальше Фокус-ИИ будет использоваться при почасовом мониторинге и разовых отчётах.",
-            reply_markup=focus_ai_main_kb(),
-        )
-        return
+@_CB_ROUTER.prefix("heatmap_status_acc|")
+async def _cb_heatmap_status_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    text = build_heatmap_status_text(aid=aid)
+    await safe_edit_message(q, text, reply_markup=monitoring_menu_kb())
 
-    # ==== Фокус-ИИ: разовый отчёт ====
 
-    if data == "focus_ai_now":
-        uid = str(update.effective_user.id)
-        if _user_has_focus_settings(uid):
-            await safe_edit_message(
-                q,
-                "📊 Разовый отчёт Фокус-ИИ по уже настроенным объектам пока в разработке.\n\n"
-                "План: бот возьмёт текущие цели Фокус-ИИ, сравнит несколько периодов и предложит действия.",
-                reply_markup=focus_ai_main_kb(),
-            )
+@_CB_ROUTER.prefix("hm_collect_prev|")
+async def _cb_hm_collect_prev(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"📌 Собираю слепок предыдущего часа для {get_account_name(aid)}…",
+        reply_markup=_autopilot_analysis_kb(aid),
+    )
+    try:
+        await run_heatmap_snapshot_collector_once(context, aid=str(aid))
+    except Exception:
+        pass
+    text = build_heatmap_status_text(aid=aid)
+    await safe_edit_message(q, text, reply_markup=_autopilot_analysis_kb(aid))
+
+
+@_CB_ROUTER.exact("focus_ai_menu")
+async def _cb_focus_ai_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "🎯 Фокус-ИИ\n\n"
+        "Выберите режим:",
+        reply_markup=focus_ai_main_kb(),
+    )
+
+
+@_CB_ROUTER.exact("anomalies_menu")
+async def _cb_anomalies_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Выбор аккаунта для проверки аномалий по адсетам.
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для анализа аномалий по адсетам:",
+        reply_markup=accounts_kb("anomalies_acc"),
+    )
+
+
+@_CB_ROUTER.prefix("insta_links_acc|")
+async def _cb_insta_links_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    account_name = get_account_name(aid)
+
+    try:
+        st = load_accounts_view() or {}
+        row = (st or {}).get(str(aid)) or {}
+        if not bool(row.get("enabled", True)):
+            await safe_edit_message(q, "Этот аккаунт выключен в настройках. Включи его и повтори.")
             return
+    except Exception:
+        pass
 
-        await safe_edit_message(
-            q,
-            "📊 Разовый отчёт Фокус-ИИ\n\n"
-            "Сначала выбери аккаунт, по которому нужен отчёт:",
-            reply_markup=accounts_kb("focus_ai_now_acc"),
+    await safe_edit_message(
+        q,
+        f"🔗 Ссылки на рекламу — {account_name}\n\n"
+        "Собираю активные инста-объявления...",
+    )
+
+    items = await run_fb_io(fetch_instagram_active_ads_links, aid)
+    messages = format_instagram_ads_links(items)
+
+    for msg in messages:
+        await context.bot.send_message(chat_id, msg)
+        # Небольшая пауза, чтобы не заддосить Telegram при большом количестве ссылок
+        await asyncio.sleep(0.3)
+
+
+@_CB_ROUTER.prefix("anomalies_acc|")
+async def _cb_anomalies_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    account_name = get_account_name(aid)
+
+    await safe_edit_message(
+        q,
+        f"⚠️ Анализ аномалий по адсетам для {account_name}…",
+    )
+
+    messages = build_anomaly_messages_for_account(aid)
+
+    if not messages:
+        await context.bot.send_message(
+            chat_id,
+            f"⚠️ Для аккаунта {account_name} аномалий по адсетам не обнаружено.",
         )
         return
 
-    if data.startswith("focus_ai_now_acc|"):
-        aid = data.split("|", 1)[1]
-        context.user_data["focus_ai_now_aid"] = aid
+    for msg in messages:
+        await context.bot.send_message(chat_id, msg)
+        await asyncio.sleep(0.3)
+
+
+# ==== Фокус-ИИ: сценарий настроек ====
+@_CB_ROUTER.exact("focus_ai_settings")
+async def _cb_focus_ai_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "🎯 Фокус-ИИ — настройки\n\n"
+        "Сначала выбери рекламный аккаунт, для которого будем настраивать Фокус-ИИ:",
+        reply_markup=accounts_kb("focus_ai_acc"),
+    )
+
+
+@_CB_ROUTER.prefix("focus_ai_acc|")
+async def _cb_focus_ai_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    context.user_data["focus_ai_settings_aid"] = aid
+    await safe_edit_message(
+        q,
+        f"🎯 Фокус-ИИ — настройки для {get_account_name(aid)}\n\n"
+        "Выбери уровень, на котором будет работать Фокус-ИИ:",
+        reply_markup=focus_ai_level_kb_settings(),
+    )
+
+
+@_CB_ROUTER.prefix("focus_ai_set_level|")
+async def _cb_focus_ai_set_level(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _prefix, level = data.split("|", 1)
+    aid = context.user_data.get("focus_ai_settings_aid")
+    if not aid:
         await safe_edit_message(
             q,
-            f"📊 Разовый отчёт Фокус-ИИ для {get_account_name(aid)}\n\n"
-            "Выбери уровень, по которому хотешь посмотреть отчёт:",
-            reply_markup=focus_ai_level_kb_now(),
+            "Не удалось определить аккаунт для настроек Фокус-ИИ. Вернись назад и выбери аккаунт ещё раз.",
+            reply_markup=accounts_kb("focus_ai_acc"),
         )
         return
 
-    if data.startswith("focus_ai_now_level|"):
-        _prefix, level = data.split("|", 1)
-        aid = context.user_data.get("focus_ai_now_aid")
-        if not aid:
-            await safe_edit_message(
-                q,
-                "Не удалось определить аккаунт для отчёта Фокус-ИИ. Вернись назад и выбери аккаунт ещё раз.",
-                reply_markup=accounts_kb("focus_ai_now_acc"),
-            )
-            return
-
-        # Сохраняем уровень и предлагаем выбрать период.
-        context.user_data["focus_ai_now_level"] = level
+    if level != "account":
         level_human = {
-            "account": "Аккаунт",
             "campaign": "Кампании",
             "adset": "Адсеты",
             "ad": "Объявления",
         }.get(level, level)
+        await safe_edit_message(
+            q,
+            f"Уровень '{level_human}' пока в разработке.\n\n"
+            "Сейчас можно включить Фокус-ИИ только на уровне всего аккаунта.",
+            reply_markup=focus_ai_level_kb_settings(),
+        )
+        return
+
+    # Сохраняем простейшую настройку Фокус-ИИ: пользователь → уровень "account" по aid
+    st = load_accounts()
+    row = st.get(aid, {})
+    focus = row.get("focus") or {}
+    uid = str(update.effective_user.id)
+    focus[uid] = {"level": "account", "enabled": True}
+    row["focus"] = focus
+    st[aid] = row
+    save_accounts(st)
+
+    await safe_edit_message(
+        q,
+        f"🎯 Фокус-ИИ включён для аккаунта {get_account_name(aid)} на уровне всего аккаунта.\n\n"
+        "Дальше Фокус-ИИ будет использоваться при почасовом мониторинге и разовых отчётах.",
+        reply_markup=focus_ai_main_kb(),
+    )
+
 
+# ==== Фокус-ИИ: разовый отчёт ====
+@_CB_ROUTER.exact("focus_ai_now")
+async def _cb_focus_ai_now(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    uid = str(update.effective_user.id)
+    if _user_has_focus_settings(uid):
         await safe_edit_message(
             q,
-            "📊 Разовый отчёт Фокус-ИИ\n\n"
-            f"Объект: {get_account_name(aid)} — уровень: {level_human}.\n\n"
-            "Выбери период для анализа:",
-            reply_markup=focus_ai_period_kb(level),
+            "📊 Разовый отчёт Фокус-ИИ по уже настроенным объектам пока в разработке.\n\n"
+            "План: бот возьмёт текущие цели Фокус-ИИ, сравнит несколько периодов и предложит действия.",
+            reply_markup=focus_ai_main_kb(),
         )
         return
 
-    if data.startswith("focus_ai_now_period|"):
-        # Формат: focus_ai_now_period|{level}|{mode}
-        _, level, mode = data.split("|", 2)
-        aid = context.user_data.get("focus_ai_now_aid")
-        if not aid:
-            await safe_edit_message(
-                q,
-                "Не удалось определить аккаунт для отчёта Фокус-ИИ. Вернись назад и выбери аккаунт ещё раз.",
-                reply_markup=accounts_kb("focus_ai_now_acc"),
-            )
-            return
+    await safe_edit_message(
+        q,
+        "📊 Разовый отчёт Фокус-ИИ\n\n"
+        "Сначала выбери аккаунт, по которому нужен отчёт:",
+        reply_markup=accounts_kb("focus_ai_now_acc"),
+    )
 
-        level_human = {
-            "account": "Аккаунт",
-            "campaign": "Кампании",
-            "adset": "Адсеты",
-            "ad": "Объявления",
-        }.get(level, level)
 
-        period_human = {
-            "today": "Сегодня",
-            "yday": "Вчера",
-            "7d": "Последние 7 дней",
-            "30d": "Последние 30 дней",
-            "custom": "Свой период",
-        }.get(mode, "Последние 7 дней")
-
-        # Для custom сначала просим ввести диапазон дат в свободном вводе.
-        if mode == "custom":
-            context.user_data["focus_ai_now_custom_ctx"] = {
-                "aid": aid,
-                "level": level,
-            }
-            await safe_edit_message(
-                q,
-                "🗓 Фокус-ИИ — свой период\n\n"
-                f"Объект: {get_account_name(aid)} — уровень: {level_human}.\n\n"
-                "Введи даты форматом: 01.06.2025-07.06.2025",
-                reply_markup=focus_ai_period_kb(level),
-            )
-            return
+@_CB_ROUTER.prefix("focus_ai_now_acc|")
+async def _cb_focus_ai_now_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    context.user_data["focus_ai_now_aid"] = aid
+    await safe_edit_message(
+        q,
+        f"📊 Разовый отчёт Фокус-ИИ для {get_account_name(aid)}\n\n"
+        "Выбери уровень, по которому хотешь посмотреть отчёт:",
+        reply_markup=focus_ai_level_kb_now(),
+    )
 
-        # Показываем пользователю понятный индикатор, что Фокус-ИИ работает.
+
+@_CB_ROUTER.prefix("focus_ai_now_level|")
+async def _cb_focus_ai_now_level(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _prefix, level = data.split("|", 1)
+    aid = context.user_data.get("focus_ai_now_aid")
+    if not aid:
         await safe_edit_message(
             q,
-            "🧠 Фокус-ИИ думает...\n"
-            f"Анализирую данные по аккаунту и уровню '{level_human}' за период: {period_human}...",
+            "Не удалось определить аккаунт для отчёта Фокус-ИИ. Вернись назад и выбери аккаунт ещё раз.",
+            reply_markup=accounts_kb("focus_ai_now_acc"),
         )
+        return
 
-        log = logging.getLogger(__name__)
-        t_all = pytime.monotonic()
-        log.info(
-            "[focus_ai_now] start aid=%s level=%s mode=%s",
-            aid,
-            level,
-            mode,
+    # Сохраняем уровень и предлагаем выбрать период.
+    context.user_data["focus_ai_now_level"] = level
+    level_human = {
+        "account": "Аккаунт",
+        "campaign": "Кампании",
+        "adset": "Адсеты",
+        "ad": "Объявления",
+    }.get(level, level)
+
+    await safe_edit_message(
+        q,
+        "📊 Разовый отчёт Фокус-ИИ\n\n"
+        f"Объект: {get_account_name(aid)} — уровень: {level_human}.\n\n"
+        "Выбери период для анализа:",
+        reply_markup=focus_ai_period_kb(level),
+    )
+
+
+@_CB_ROUTER.prefix("focus_ai_now_period|")
+async def _cb_focus_ai_now_period(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Формат: focus_ai_now_period|{level}|{mode}
+    _, level, mode = data.split("|", 2)
+    aid = context.user_data.get("focus_ai_now_aid")
+    if not aid:
+        await safe_edit_message(
+            q,
+            "Не удалось определить аккаунт для отчёта Фокус-ИИ. Вернись назад и выбери аккаунт ещё раз.",
+            reply_markup=accounts_kb("focus_ai_now_acc"),
+        )
+        return
+
+    level_human = {
+        "account": "Аккаунт",
+        "campaign": "Кампании",
+        "adset": "Адсеты",
+        "ad": "Объявления",
+    }.get(level, level)
+
+    period_human = {
+        "today": "Сегодня",
+        "yday": "Вчера",
+        "7d": "Последние 7 дней",
+        "30d": "Последние 30 дней",
+        "custom": "Свой период",
+    }.get(mode, "Последние 7 дней")
+
+    # Для custom сначала просим ввести диапазон дат в свободном вводе.
+    if mode == "custom":
+        context.user_data["focus_ai_now_custom_ctx"] = {
+            "aid": aid,
+            "level": level,
+        }
+        await safe_edit_message(
+            q,
+            "🗓 Фокус-ИИ — свой период\n\n"
+            f"Объект: {get_account_name(aid)} — уровень: {level_human}.\n\n"
+            "Введи даты форматом: 01.06.2025-07.06.2025",
+            reply_markup=focus_ai_period_kb(level),
         )
+        return
 
-        win = prev_full_hour_window(now=datetime.now(ALMATY_TZ))
-        date_str = str(win.get("date") or "")
-        hour_int = int(win.get("hour") or 0)
-        window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
+    # Показываем пользователю понятный индикатор, что Фокус-ИИ работает.
+    await safe_edit_message(
+        q,
+        "🧠 Фокус-ИИ думает...\n"
+        f"Анализирую данные по аккаунту и уровню '{level_human}' за период: {period_human}...",
+    )
 
-        with deny_fb_api_calls(reason="ai_focus_now_dataset"):
-            ds, ds_status, ds_reason, ds_meta = get_heatmap_dataset(
-                str(aid),
-                date_str=date_str,
-                hours=[hour_int],
-            )
+    log = logging.getLogger(__name__)
+    t_all = pytime.monotonic()
+    log.info(
+        "[focus_ai_now] start aid=%s level=%s mode=%s",
+        aid,
+        level,
+        mode,
+    )
 
-        if ds_status != "ready" or not ds or not (ds.get("rows") or []):
-            attempts = (ds_meta or {}).get("attempts")
-            last_try_at = (ds_meta or {}).get("last_try_at")
-            next_try_at = (ds_meta or {}).get("next_try_at")
-            txt = (
-                "📊 Разовый отчёт Фокус-ИИ\n"
-                f"Объект: {get_account_name(aid)}\n"
-                f"Уровень: {level_human}\n"
-                f"Источник данных: heatmap cache\n"
-                f"Окно: {date_str} {window_label}\n"
-                f"Слепок: {ds_status} ({ds_reason})\n"
-            )
-            if attempts is not None:
-                txt += f"Попытки: {attempts}\n"
-            if last_try_at:
-                txt += f"Последняя попытка: {last_try_at}\n"
-            if next_try_at:
-                txt += f"Следующая попытка: {next_try_at}\n"
-            txt += "\nЕсли слепка нет или он собирается — нажми '📌 Собрать слепок предыдущего часа' и повтори."
-
-            await safe_edit_message(q, txt, reply_markup=focus_ai_main_kb())
-            return
+    win = prev_full_hour_window(now=datetime.now(ALMATY_TZ))
+    date_str = str(win.get("date") or "")
+    hour_int = int(win.get("hour") or 0)
+    window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
 
-        with deny_fb_api_calls(reason="ai_focus_now_dataset"):
-            rows = list(ds.get("rows") or [])
-            rows.sort(key=lambda x: float((x or {}).get("spend") or 0.0), reverse=True)
-            rows = rows[:FOCUS_AI_MAX_OBJECTS]
-
-            spend_sum = 0.0
-            msgs_sum = 0
-            leads_sum = 0
-            total_sum = 0
-            spend_for_msgs_sum = 0.0
-            spend_for_leads_sum = 0.0
-            spend_for_total_sum = 0.0
-            for r in rows:
-                try:
-                    spend_sum += float((r or {}).get("spend") or 0.0)
-                except Exception:
-                    pass
-                try:
-                    msgs_sum += int((r or {}).get("msgs") or 0)
-                except Exception:
-                    pass
-                try:
-                    leads_sum += int((r or {}).get("leads") or 0)
-                except Exception:
-                    pass
-                try:
-                    total_sum += int((r or {}).get("total") or 0)
-                except Exception:
-                    pass
+    with deny_fb_api_calls(reason="ai_focus_now_dataset"):
+        ds, ds_status, ds_reason, ds_meta = get_heatmap_dataset(
+            str(aid),
+            date_str=date_str,
+            hours=[hour_int],
+        )
 
-                try:
-                    spend_for_msgs_sum += float((r or {}).get("spend_for_msgs") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("msgs") or 0) > 0 else 0.0))
-                except Exception:
-                    pass
-                try:
-                    spend_for_leads_sum += float((r or {}).get("spend_for_leads") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("leads") or 0) > 0 else 0.0))
-                except Exception:
-                    pass
-                try:
-                    spend_for_total_sum += float((r or {}).get("spend_for_total") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("total") or 0) > 0 else 0.0))
-                except Exception:
-                    pass
+    if ds_status != "ready" or not ds or not (ds.get("rows") or []):
+        attempts = (ds_meta or {}).get("attempts")
+        last_try_at = (ds_meta or {}).get("last_try_at")
+        next_try_at = (ds_meta or {}).get("next_try_at")
+        txt = (
+            "📊 Разовый отчёт Фокус-ИИ\n"
+            f"Объект: {get_account_name(aid)}\n"
+            f"Уровень: {level_human}\n"
+            f"Источник данных: heatmap cache\n"
+            f"Окно: {date_str} {window_label}\n"
+            f"Слепок: {ds_status} ({ds_reason})\n"
+        )
+        if attempts is not None:
+            txt += f"Попытки: {attempts}\n"
+        if last_try_at:
+            txt += f"Последняя попытка: {last_try_at}\n"
+        if next_try_at:
+            txt += f"Следующая попытка: {next_try_at}\n"
+        txt += "\nЕсли слепка нет или он собирается — нажми '📌 Собрать слепок предыдущего часа' и повтори."
+
+        await safe_edit_message(q, txt, reply_markup=focus_ai_main_kb())
+        return
+
+    with deny_fb_api_calls(reason="ai_focus_now_dataset"):
+        rows = list(ds.get("rows") or [])
+        rows.sort(key=lambda x: float((x or {}).get("spend") or 0.0), reverse=True)
+        rows = rows[:FOCUS_AI_MAX_OBJECTS]
+
+        spend_sum = 0.0
+        msgs_sum = 0
+        leads_sum = 0
+        total_sum = 0
+        spend_for_msgs_sum = 0.0
+        spend_for_leads_sum = 0.0
+        spend_for_total_sum = 0.0
+        for r in rows:
+            try:
+                spend_sum += float((r or {}).get("spend") or 0.0)
+            except Exception:
+                pass
+            try:
+                msgs_sum += int((r or {}).get("msgs") or 0)
+            except Exception:
+                pass
+            try:
+                leads_sum += int((r or {}).get("leads") or 0)
+            except Exception:
+                pass
+            try:
+                total_sum += int((r or {}).get("total") or 0)
+            except Exception:
+                pass
 
-            cpl_total = (spend_for_total_sum / float(total_sum)) if (total_sum > 0 and spend_for_total_sum > 0) else None
-
-            if level == "account":
-                data_for_analysis = {
-                    "scope": "account",
-                    "account_id": aid,
-                    "account_name": get_account_name(aid),
-                    "requested_period_mode": mode,
-                    "requested_period_label": period_human,
-                    "source": "heatmap_cache",
-                    "snapshot": {
-                        "date": date_str,
-                        "hour": int(hour_int),
-                        "window": window_label,
-                        "status": ds_status,
-                        "reason": ds_reason,
-                        "meta": ds_meta,
-                    },
-                    "totals": {
-                        "spend": spend_sum,
-                        "spend_for_msgs": spend_for_msgs_sum,
-                        "spend_for_leads": spend_for_leads_sum,
-                        "spend_for_total": spend_for_total_sum,
-                        "msgs": msgs_sum,
-                        "leads": leads_sum,
-                        "total": total_sum,
-                        "cpl": cpl_total,
-                    },
-                    "adsets": rows,
-                }
-            elif level == "adset":
-                data_for_analysis = {
-                    "scope": "adset",
-                    "account_id": aid,
-                    "account_name": get_account_name(aid),
-                    "requested_period_mode": mode,
-                    "requested_period_label": period_human,
-                    "source": "heatmap_cache",
-                    "snapshot": {
-                        "date": date_str,
-                        "hour": int(hour_int),
-                        "window": window_label,
-                        "status": ds_status,
-                        "reason": ds_reason,
-                        "meta": ds_meta,
-                    },
-                    "adsets": rows,
-                }
-            elif level == "campaign":
-                by_camp = {}
-                for r in rows:
-                    cid = str((r or {}).get("campaign_id") or "")
-                    if not cid:
-                        continue
-                    it = by_camp.setdefault(
-                        cid,
-                        {
-                            "campaign_id": cid,
-                            "name": (r or {}).get("campaign_name") or cid,
-                            "spend": 0.0,
-                            "spend_for_msgs": 0.0,
-                            "spend_for_leads": 0.0,
-                            "spend_for_total": 0.0,
-                            "msgs": 0,
-                            "leads": 0,
-                            "total": 0,
-                        },
-                    )
-                    it["spend"] = float(it.get("spend") or 0.0) + float((r or {}).get("spend") or 0.0)
-                    it["spend_for_msgs"] = float(it.get("spend_for_msgs") or 0.0) + float((r or {}).get("spend_for_msgs") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("msgs") or 0) > 0 else 0.0))
-                    it["spend_for_leads"] = float(it.get("spend_for_leads") or 0.0) + float((r or {}).get("spend_for_leads") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("leads") or 0) > 0 else 0.0))
-                    it["spend_for_total"] = float(it.get("spend_for_total") or 0.0) + float((r or {}).get("spend_for_total") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("total") or 0) > 0 else 0.0))
-                    it["msgs"] = int(it.get("msgs") or 0) + int((r or {}).get("msgs") or 0)
-                    it["leads"] = int(it.get("leads") or 0) + int((r or {}).get("leads") or 0)
-                    it["total"] = int(it.get("total") or 0) + int((r or {}).get("total") or 0)
-
-                camps = list(by_camp.values())
-                for c in camps:
-                    sp = float(c.get("spend_for_total") or 0.0)
-                    tot = int(c.get("total") or 0)
-                    c["cpl"] = (sp / float(tot)) if (tot > 0 and sp > 0) else None
-                camps.sort(key=lambda x: float((x or {}).get("spend") or 0.0), reverse=True)
-                camps = camps[:FOCUS_AI_MAX_OBJECTS]
-                data_for_analysis = {
-                    "scope": "campaign",
-                    "account_id": aid,
-                    "account_name": get_account_name(aid),
-                    "requested_period_mode": mode,
-                    "requested_period_label": period_human,
-                    "source": "heatmap_cache",
-                    "snapshot": {
-                        "date": date_str,
-                        "hour": int(hour_int),
-                        "window": window_label,
-                        "status": ds_status,
-                        "reason": ds_reason,
-                        "meta": ds_meta,
+            try:
+                spend_for_msgs_sum += float((r or {}).get("spend_for_msgs") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("msgs") or 0) > 0 else 0.0))
+            except Exception:
+                pass
+            try:
+                spend_for_leads_sum += float((r or {}).get("spend_for_leads") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("leads") or 0) > 0 else 0.0))
+            except Exception:
+                pass
+            try:
+                spend_for_total_sum += float((r or {}).get("spend_for_total") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("total") or 0) > 0 else 0.0))
+            except Exception:
+                pass
+
+        cpl_total = (spend_for_total_sum / float(total_sum)) if (total_sum > 0 and spend_for_total_sum > 0) else None
+
+        if level == "account":
+            data_for_analysis = {
+                "scope": "account",
+                "account_id": aid,
+                "account_name": get_account_name(aid),
+                "requested_period_mode": mode,
+                "requested_period_label": period_human,
+                "source": "heatmap_cache",
+                "snapshot": {
+                    "date": date_str,
+                    "hour": int(hour_int),
+                    "window": window_label,
+                    "status": ds_status,
+                    "reason": ds_reason,
+                    "meta": ds_meta,
+                },
+                "totals": {
+                    "spend": spend_sum,
+                    "spend_for_msgs": spend_for_msgs_sum,
+                    "spend_for_leads": spend_for_leads_sum,
+                    "spend_for_total": spend_for_total_sum,
+                    "msgs": msgs_sum,
+                    "leads": leads_sum,
+                    "total": total_sum,
+                    "cpl": cpl_total,
+                },
+                "adsets": rows,
+            }
+        elif level == "adset":
+            data_for_analysis = {
+                "scope": "adset",
+                "account_id": aid,
+                "account_name": get_account_name(aid),
+                "requested_period_mode": mode,
+                "requested_period_label": period_human,
+                "source": "heatmap_cache",
+                "snapshot": {
+                    "date": date_str,
+                    "hour": int(hour_int),
+                    "window": window_label,
+                    "status": ds_status,
+                    "reason": ds_reason,
+                    "meta": ds_meta,
+                },
+                "adsets": rows,
+            }
+        elif level == "campaign":
+            by_camp = {}
+            for r in rows:
+                cid = str((r or {}).get("campaign_id") or "")
+                if not cid:
+                    continue
+                it = by_camp.setdefault(
+                    cid,
+                    {
+                        "campaign_id": cid,
+                        "name": (r or {}).get("campaign_name") or cid,
+                        "spend": 0.0,
+                        "spend_for_msgs": 0.0,
+                        "spend_for_leads": 0.0,
+                        "spend_for_total": 0.0,
+                        "msgs": 0,
+                        "leads": 0,
+                        "total": 0,
                     },
-                    "campaigns": camps,
-                }
-            elif level == "ad":
-                data_for_analysis = None
-            else:
-                data_for_analysis = None
+                )
+                it["spend"] = float(it.get("spend") or 0.0) + float((r or {}).get("spend") or 0.0)
+                it["spend_for_msgs"] = float(it.get("spend_for_msgs") or 0.0) + float((r or {}).get("spend_for_msgs") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("msgs") or 0) > 0 else 0.0))
+                it["spend_for_leads"] = float(it.get("spend_for_leads") or 0.0) + float((r or {}).get("spend_for_leads") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("leads") or 0) > 0 else 0.0))
+                it["spend_for_total"] = float(it.get("spend_for_total") or 0.0) + float((r or {}).get("spend_for_total") or (float((r or {}).get("spend") or 0.0) if int((r or {}).get("total") or 0) > 0 else 0.0))
+                it["msgs"] = int(it.get("msgs") or 0) + int((r or {}).get("msgs") or 0)
+                it["leads"] = int(it.get("leads") or 0) + int((r or {}).get("leads") or 0)
+                it["total"] = int(it.get("total") or 0) + int((r or {}).get("total") or 0)
+
+            camps = list(by_camp.values())
+            for c in camps:
+                sp = float(c.get("spend_for_total") or 0.0)
+                tot = int(c.get("total") or 0)
+                c["cpl"] = (sp / float(tot)) if (tot > 0 and sp > 0) else None
+            camps.sort(key=lambda x: float((x or {}).get("spend") or 0.0), reverse=True)
+            camps = camps[:FOCUS_AI_MAX_OBJECTS]
+            data_for_analysis = {
+                "scope": "campaign",
+                "account_id": aid,
+                "account_name": get_account_name(aid),
+                "requested_period_mode": mode,
+                "requested_period_label": period_human,
+                "source": "heatmap_cache",
+                "snapshot": {
+                    "date": date_str,
+                    "hour": int(hour_int),
+                    "window": window_label,
+                    "status": ds_status,
+                    "reason": ds_reason,
+                    "meta": ds_meta,
+                },
+                "campaigns": camps,
+            }
+        elif level == "ad":
+            data_for_analysis = None
+        else:
+            data_for_analysis = None
 
-            user_msg = json.dumps(data_for_analysis, ensure_ascii=False) if data_for_analysis else ""
+        user_msg = json.dumps(data_for_analysis, ensure_ascii=False) if data_for_analysis else ""
 
-        if level == "ad":
-            await safe_edit_message(
-                q,
-                "📊 Разовый отчёт Фокус-ИИ\n"
-                f"Объект: {get_account_name(aid)}\n"
-                "Уровень: Объявления\n\n"
-                "Для уровня 'Объявления' сейчас нет данных в слепках (нет ad_id в heatmap cache).",
-                reply_markup=focus_ai_main_kb(),
-            )
-            return
+    if level == "ad":
+        await safe_edit_message(
+            q,
+            "📊 Разовый отчёт Фокус-ИИ\n"
+            f"Объект: {get_account_name(aid)}\n"
+            "Уровень: Объявления\n\n"
+            "Для уровня 'Объявления' сейчас нет данных в слепках (нет ad_id в heatmap cache).",
+            reply_markup=focus_ai_main_kb(),
+        )
+        return
 
-        if not user_msg:
-            await safe_edit_message(
-                q,
-                "Неизвестный уровень для Фокус-ИИ.",
-                reply_markup=focus_ai_main_kb(),
-            )
-            return
+    if not user_msg:
+        await safe_edit_message(
+            q,
+            "Неизвестный уровень для Фокус-ИИ.",
+            reply_markup=focus_ai_main_kb(),
+        )
+        return
 
-        system_msg = (
-            "Ты — продвинутый аналитик по Facebook Ads (Фокус-ИИ). "
-            "Отвечай ТОЛЬКО на русском языке. "
-            "Сделай отчёт, который читается сканированием, без простыней. "
-            "Каждый объект (кампания/адсет/объявление) — отдельным блоком. "
-            "В конце — короткое итоговое резюме + конкретные рекомендации (действия), без абстракций. "
-            "\n\n"
-            "ЛЕГЕНДА ЭМОДЗИ (ФИКСИРОВАННАЯ, ДРУГИЕ НЕ ИСПОЛЬЗОВАТЬ):\n"
-            "🟢 — хорошо / эффективно\n"
-            "🟡 — нормально, но есть нюансы\n"
-            "🟠 — риск / требует внимания\n"
-            "🔴 — плохо / аномалия\n"
-            "\n"
-            "ЗАПРЕЩЕНЫ СЛОВА (не используй ни в каком виде): check_creatives, optimize, consider.\n"
-            "\n"
-            "ФОРМАТ report_text:\n"
-            "- После разделителя '────────────────────' дай блоки по объектам.\n"
-            "- Каждый блок начинается с эмодзи из легенды + название объекта.\n"
-            "- Затем 1 строка метрик: Сообщения | Лиды | Всего (msgs+leads) | Расход $ | CPL.\n"
-            "- Далее 2–3 коротких подпункта: 'Сильная сторона', 'Зона внимания' или 'Проблема/Риск' (по ситуации).\n"
-            "- Затем строка: '👉 Что сделать' и 1 конкретное действие (например: оставить, увеличить бюджет на 20%, снизить бюджет на 20%, остановить).\n"
-            "- Между объектами ставь '────────────────────'.\n"
-            "- В конце: '📌 Итоговое резюме' (3–5 строк) + '📈 Рекомендация' (1–2 строки) + '🔍 Уверенность анализа: N%'.\n"
-            "\n"
-            "JSON-ОТВЕТ (СТРОГО один объект, без текста вокруг):\n"
-            "{"
-            "\"status\":\"ok\"|\"error\"," 
-            "\"report_text\":\"...\"," 
-            "\"recommendation\":\"increase_budget\"|\"decrease_budget\"|\"keep\"," 
-            "\"suggested_change_percent\":число," 
-            "\"confidence\":0-100," 
-            "\"objects\":[{\"id\":\"...\",\"name\":\"...\",\"level\":\"campaign\"|\"adset\"|\"ad\",\"recommendation\":\"increase_budget\"|\"decrease_budget\"|\"keep\",\"suggested_change_percent\":число,\"confidence\":0-100}],"
-            "\"budget_actions\":[{\"level\":\"adset\",\"campaign_id\":\"...\",\"adset_id\":\"...\",\"old_budget\":5.0,\"new_budget\":5.5,\"reason\":\"...\"}],"
-            "\"ads_actions\":[{\"type\":\"pause_ad\"|\"notify_only\",\"campaign_id\":\"...\",\"adset_id\":\"...\",\"ad_id\":\"...\",\"reason\":\"...\",\"confidence\":0.0}]"
-            "}"
+    system_msg = (
+        "Ты — продвинутый аналитик по Facebook Ads (Фокус-ИИ). "
+        "Отвечай ТОЛЬКО на русском языке. "
+        "Сделай отчёт, который читается сканированием, без простыней. "
+        "Каждый объект (кампания/адсет/объявление) — отдельным блоком. "
+        "В конце — короткое итоговое резюме + конкретные рекомендации (действия), без абстракций. "
+        "\n\n"
+        "ЛЕГЕНДА ЭМОДЗИ (ФИКСИРОВАННАЯ, ДРУГИЕ НЕ ИСПОЛЬЗОВАТЬ):\n"
+        "🟢 — хорошо / эффективно\n"
+        "🟡 — нормально, но есть нюансы\n"
+        "🟠 — риск / требует внимания\n"
+        "🔴 — плохо / аномалия\n"
+        "\n"
+        "ЗАПРЕЩЕНЫ СЛОВА (не используй ни в каком виде): check_creatives, optimize, consider.\n"
+        "\n"
+        "ФОРМАТ report_text:\n"
+        "- После разделителя '────────────────────' дай блоки по объектам.\n"
+        "- Каждый блок начинается с эмодзи из легенды + название объекта.\n"
+        "- Затем 1 строка метрик: Сообщения | Лиды | Всего (msgs+leads) | Расход $ | CPL.\n"
+        "- Далее 2–3 коротких подпункта: 'Сильная сторона', 'Зона внимания' или 'Проблема/Риск' (по ситуации).\n"
+        "- Затем строка: '👉 Что сделать' и 1 конкретное действие (например: оставить, увеличить бюджет на 20%, снизить бюджет на 20%, остановить).\n"
+        "- Между объектами ставь '────────────────────'.\n"
+        "- В конце: '📌 Итоговое резюме' (3–5 строк) + '📈 Рекомендация' (1–2 строки) + '🔍 Уверенность анализа: N%'.\n"
+        "\n"
+        "JSON-ОТВЕТ (СТРОГО один объект, без текста вокруг):\n"
+        "{"
+        "\"status\":\"ok\"|\"error\"," 
+        "\"report_text\":\"...\"," 
+        "\"recommendation\":\"increase_budget\"|\"decrease_budget\"|\"keep\"," 
+        "\"suggested_change_percent\":число," 
+        "\"confidence\":0-100," 
+        "\"objects\":[{\"id\":\"...\",\"name\":\"...\",\"level\":\"campaign\"|\"adset\"|\"ad\",\"recommendation\":\"increase_budget\"|\"decrease_budget\"|\"keep\",\"suggested_change_percent\":число,\"confidence\":0-100}],"
+        "\"budget_actions\":[{\"level\":\"adset\",\"campaign_id\":\"...\",\"adset_id\":\"...\",\"old_budget\":5.0,\"new_budget\":5.5,\"reason\":\"...\"}],"
+        "\"ads_actions\":[{\"type\":\"pause_ad\"|\"notify_only\",\"campaign_id\":\"...\",\"adset_id\":\"...\",\"ad_id\":\"...\",\"reason\":\"...\",\"confidence\":0.0}]"
+        "}"
+    )
+
+
+    content = ""
+    json_ok = False
+    try:
+        t0 = pytime.monotonic()
+
+        ds_resp = await asyncio.wait_for(
+            ask_deepseek(
+                [
+                    {"role": "system", "content": system_msg},
+                    {"role": "user", "content": user_msg},
+                ],
+                json_mode=True,
+                andrey_tone=True,
+            ),
+            timeout=FOCUS_AI_DEEPSEEK_TIMEOUT_S,
         )
 
+        choice = (ds_resp.get("choices") or [{}])[0]
+        content = (choice.get("message") or {}).get("content") or ""
+        if not content.strip():
+            raise ValueError("empty_deepseek_content")
 
-        content = ""
-        json_ok = False
         try:
-            t0 = pytime.monotonic()
-
-            ds_resp = await asyncio.wait_for(
-                ask_deepseek(
-                    [
-                        {"role": "system", "content": system_msg},
-                        {"role": "user", "content": user_msg},
-                    ],
-                    json_mode=True,
-                    andrey_tone=True,
-                ),
-                timeout=FOCUS_AI_DEEPSEEK_TIMEOUT_S,
-            )
-
-            choice = (ds_resp.get("choices") or [{}])[0]
-            content = (choice.get("message") or {}).get("content") or ""
-            if not content.strip():
-                raise ValueError("empty_deepseek_content")
+            parsed = json.loads(content)
+        except Exception:
+            cleaned = content.strip()
+            if cleaned.startswith("```"):
+                cleaned = re.sub(r"^```(?:json)?\s*", "", cleaned, flags=re.IGNORECASE)
+                cleaned = re.sub(r"\s*```$", "", cleaned)
 
             try:
-                parsed = json.loads(content)
+                parsed = json.loads(cleaned)
             except Exception:
-                cleaned = content.strip()
-                if cleaned.startswith("```"):
-                    cleaned = re.sub(r"^```(?:json)?\s*", "", cleaned, flags=re.IGNORECASE)
-                    cleaned = re.sub(r"\s*```$", "", cleaned)
+                lb = cleaned.find("{")
+                rb = cleaned.rfind("}")
+                if lb >= 0 and rb > lb:
+                    parsed = json.loads(cleaned[lb : rb + 1])
+                else:
+                    raise
 
+        json_ok = True
+
+        log.info(
+            "[focus_ai_now] deepseek ok elapsed=%.2fs total=%.2fs",
+            pytime.monotonic() - t0,
+            pytime.monotonic() - t_all,
+        )
+    except asyncio.TimeoutError:
+        log.warning("[focus_ai_now] deepseek timeout total=%.2fs", pytime.monotonic() - t_all)
+        parsed = {
+            "status": "error",
+            "analysis": "Фокус-ИИ не ответил вовремя. Попробуй повторить запрос позже или выбери период 7/30 дней.",
+            "recommendation": "keep",
+            "confidence": 0,
+            "suggested_change_percent": 0,
+        }
+    except Exception as e:
+        extracted_report_text = ""
+        if content.strip():
+            cleaned = content.strip()
+            if cleaned.startswith("```"):
+                cleaned = re.sub(r"^```(?:json)?\s*", "", cleaned, flags=re.IGNORECASE)
+                cleaned = re.sub(r"\s*```$", "", cleaned)
+
+            m = re.search(
+                r"\"report_text\"\s*:\s*\"((?:\\.|[^\"\\])*)\"",
+                cleaned,
+                flags=re.DOTALL,
+            )
+            if m:
+                raw_val = m.group(1)
                 try:
-                    parsed = json.loads(cleaned)
+                    extracted_report_text = json.loads('"' + raw_val + '"')
                 except Exception:
-                    lb = cleaned.find("{")
-                    rb = cleaned.rfind("}")
-                    if lb >= 0 and rb > lb:
-                        parsed = json.loads(cleaned[lb : rb + 1])
-                    else:
-                        raise
-
-            json_ok = True
+                    try:
+                        extracted_report_text = bytes(raw_val, "utf-8").decode("unicode_escape")
+                    except Exception:
+                        extracted_report_text = (
+                            raw_val.replace(r"\\n", "\n")
+                            .replace(r"\\t", "\t")
+                            .replace(r"\\\"", '"')
+                            .replace(r"\\\\", "\\")
+                        )
 
-            log.info(
-                "[focus_ai_now] deepseek ok elapsed=%.2fs total=%.2fs",
-                pytime.monotonic() - t0,
-                pytime.monotonic() - t_all,
+        # Если JSON-режим не дал ничего (часто при сетевом обрыве), пробуем короткий текстовый режим.
+        if not extracted_report_text.strip() and not content.strip():
+            system_msg_text = (
+                "Ты — продвинутый аналитик по Facebook Ads (Фокус-ИИ). "
+                "Отвечай ТОЛЬКО на русском языке. "
+                "Сделай отчёт, который читается сканированием, без простыней. "
+                "Каждый объект (кампания/адсет/объявление) — отдельным блоком. "
+                "Между объектами ставь разделитель '────────────────────'. "
+                "В каждом блоке: эмодзи статуса (🟢/🟡/🟠/🔴) + название, затем 1 строка метрик: Показы | Клики | Сообщения/Лиды | Расход | CPA. "
+                "Все денежные суммы указывай строго в долларах США и используй символ '$' (никаких €, EUR, рублей и т.п.). "
+                "Далее 2–3 коротких строки по делу и строка '👉 Что сделать' с 1 конкретным действием. "
+                "В конце: '📌 Итоговое резюме' (3–5 строк) + '📈 Рекомендация' (1–2 строки). "
+                "Запрещено: JSON, фигурные скобки, код, Markdown (**/__/#/`), ссылки и форматирование."
             )
-        except asyncio.TimeoutError:
-            log.warning("[focus_ai_now] deepseek timeout total=%.2fs", pytime.monotonic() - t_all)
+            try:
+                ds_txt = await asyncio.wait_for(
+                    ask_deepseek(
+                        [
+                            {"role": "system", "content": system_msg_text},
+                            {"role": "user", "content": user_msg},
+                        ],
+                        json_mode=False,
+                        andrey_tone=True,
+                        temperature=0.4,
+                        max_tokens=500,
+                    ),
+                    timeout=FOCUS_AI_DEEPSEEK_TIMEOUT_S,
+                )
+                ch = (ds_txt.get("choices") or [{}])[0]
+                txt = (ch.get("message") or {}).get("content") or ""
+                cleaned_txt = sanitize_ai_text(txt)
+                cleaned_txt = cleaned_txt.replace("**", "").replace("__", "")
+                cleaned_txt = (
+                    cleaned_txt.replace("€", "$")
+                    .replace("EUR", "$")
+                    .replace("eur", "$")
+                    .replace("евро", "$")
+                    .replace("Евро", "$")
+                )
+                extracted_report_text = cleaned_txt
+            except Exception:
+                extracted_report_text = ""
+
+        if extracted_report_text.strip():
             parsed = {
-                "status": "error",
-                "analysis": "Фокус-ИИ не ответил вовремя. Попробуй повторить запрос позже или выбери период 7/30 дней.",
+                "status": "ok",
+                "report_text": extracted_report_text,
                 "recommendation": "keep",
                 "confidence": 0,
                 "suggested_change_percent": 0,
+                "objects": [],
+                "budget_actions": [],
+                "ads_actions": [],
             }
-        except Exception as e:
-            extracted_report_text = ""
-            if content.strip():
-                cleaned = content.strip()
-                if cleaned.startswith("```"):
-                    cleaned = re.sub(r"^```(?:json)?\s*", "", cleaned, flags=re.IGNORECASE)
-                    cleaned = re.sub(r"\s*```$", "", cleaned)
-
-                m = re.search(
-                    r"\"report_text\"\s*:\s*\"((?:\\.|[^\"\\])*)\"",
-                    cleaned,
-                    flags=re.DOTALL,
-                )
-                if m:
-                    raw_val = m.group(1)
-                    try:
-                        extracted_report_text = json.loads('"' + raw_val + '"')
-                    except Exception:
-                        try:
-                            extracted_report_text = bytes(raw_val, "utf-8").decode("unicode_escape")
-                        except Exception:
-                            extracted_report_text = (
-                                raw_val.replace(r"\\n", "\n")
-                                .replace(r"\\t", "\t")
-                                .replace(r"\\\"", '"')
-                                .replace(r"\\\\", "\\")
-                            )
-
-            # Если JSON-режим не дал ничего (часто при сетевом обрыве), пробуем короткий текстовый режим.
-            if not extracted_report_text.strip() and not content.strip():
-                system_msg_text = (
-                    "Ты — продвинутый аналитик по Facebook Ads (Фокус-ИИ). "
-                    "Отвечай ТОЛЬКО на русском языке. "
-                    "Сделай отчёт, который читается сканированием, без простыней. "
-                    "Каждый объект (кампания/адсет/объявление) — отдельным блоком. "
-                    "Между объектами ставь разделитель '────────────────────'. "
-                    "В каждом блоке: эмодзи статуса (🟢/🟡/🟠/🔴) + название, затем 1 строка метрик: Показы | Клики | Сообщения/Лиды | Расход | CPA. "
-                    "Все денежные суммы указывай строго в долларах США и используй символ '$' (никаких €, EUR, рублей и т.п.). "
-                    "Далее 2–3 коротких строки по делу и строка '👉 Что сделать' с 1 конкретным действием. "
-                    "В конце: '📌 Итоговое резюме' (3–5 строк) + '📈 Рекомендация' (1–2 строки). "
-                    "Запрещено: JSON, фигурные скобки, код, Markdown (**/__/#/`), ссылки и форматирование."
-                )
-                try:
-                    ds_txt = await asyncio.wait_for(
-                        ask_deepseek(
-                            [
-                                {"role": "system", "content": system_msg_text},
-                                {"role": "user", "content": user_msg},
-                            ],
-                            json_mode=False,
-                            andrey_tone=True,
-                            temperature=0.4,
-                            max_tokens=500,
-                        ),
-                        timeout=FOCUS_AI_DEEPSEEK_TIMEOUT_S,
-                    )
-                    ch = (ds_txt.get("choices") or [{}])[0]
-                    txt = (ch.get("message") or {}).get("content") or ""
-                    cleaned_txt = sanitize_ai_text(txt)
-                    cleaned_txt = cleaned_txt.replace("**", "").replace("__", "")
-                    cleaned_txt = (
-                        cleaned_txt.replace("€", "$")
-                        .replace("EUR", "$")
-                        .replace("eur", "$")
-                        .replace("евро", "$")
-                        .replace("Евро", "$")
-                    )
-                    extracted_report_text = cleaned_txt
-                except Exception:
-                    extracted_report_text = ""
-
-            if extracted_report_text.strip():
-                parsed = {
-                    "status": "ok",
-                    "report_text": extracted_report_text,
-                    "recommendation": "keep",
-                    "confidence": 0,
-                    "suggested_change_percent": 0,
-                    "objects": [],
-                    "budget_actions": [],
-                    "ads_actions": [],
-                }
+            log.warning(
+                "[focus_ai_now] deepseek returned broken JSON; extracted report_text fallback (%s)",
+                type(e).__name__,
+            )
+        else:
+            if isinstance(e, ValueError) and str(e) == "empty_deepseek_content":
+                log.warning("[focus_ai_now] deepseek empty content")
+            else:
                 log.warning(
-                    "[focus_ai_now] deepseek returned broken JSON; extracted report_text fallback (%s)",
-                    type(e).__name__,
+                    "[focus_ai_now] deepseek error: %s", type(e).__name__, exc_info=e
                 )
-            else:
-                if isinstance(e, ValueError) and str(e) == "empty_deepseek_content":
-                    log.warning("[focus_ai_now] deepseek empty content")
-                else:
-                    log.warning(
-                        "[focus_ai_now] deepseek error: %s", type(e).__name__, exc_info=e
-                    )
-                parsed = {
-                    "status": "error",
-                    "analysis": "Фокус-ИИ временно недоступен. Попробуй ещё раз чуть позже.",
-                    "reason": f"DeepSeek error: {e}",
-                    "recommendation": "keep",
-                    "confidence": 0,
-                    "suggested_change_percent": 0,
-                }
-
-        status = parsed.get("status", "ok")
-        report_text = parsed.get("report_text") or ""
-        rec = parsed.get("recommendation") or "keep"
-        conf = parsed.get("confidence") or 0
-        delta = parsed.get("suggested_change_percent") or 0
-        objects = parsed.get("objects") or []
-        budget_actions = parsed.get("budget_actions") or []
-        ads_actions = parsed.get("ads_actions") or []
-
-        allowed_recs = {"increase_budget", "decrease_budget", "keep"}
-        if rec not in allowed_recs:
-            rec = "keep"
-        try:
-            delta = int(delta)
-        except Exception:
-            delta = 0
-        try:
-            conf = int(conf)
-        except Exception:
-            conf = 0
+            parsed = {
+                "status": "error",
+                "analysis": "Фокус-ИИ временно недоступен. Попробуй ещё раз чуть позже.",
+                "reason": f"DeepSeek error: {e}",
+                "recommendation": "keep",
+                "confidence": 0,
+                "suggested_change_percent": 0,
+            }
 
-        period_label = data_for_analysis.get("requested_period_label") or period_human
+    status = parsed.get("status", "ok")
+    report_text = parsed.get("report_text") or ""
+    rec = parsed.get("recommendation") or "keep"
+    conf = parsed.get("confidence") or 0
+    delta = parsed.get("suggested_change_percent") or 0
+    objects = parsed.get("objects") or []
+    budget_actions = parsed.get("budget_actions") or []
+    ads_actions = parsed.get("ads_actions") or []
+
+    allowed_recs = {"increase_budget", "decrease_budget", "keep"}
+    if rec not in allowed_recs:
+        rec = "keep"
+    try:
+        delta = int(delta)
+    except Exception:
+        delta = 0
+    try:
+        conf = int(conf)
+    except Exception:
+        conf = 0
 
-        header_lines = [
-            "📊 Разовый отчёт Фокус-ИИ",
-            f"Объект: {get_account_name(aid)}",
-            f"Уровень: {level_human}",
-            f"Период: {period_label}",
-            "Источник данных: heatmap cache",
-            f"Окно: {date_str} {window_label}",
-            "",
-        ]
+    period_label = data_for_analysis.get("requested_period_label") or period_human
 
-        if status != "ok":
-            text_out = (
-                "\n".join(header_lines)
-                + "⚠️ Фокус-ИИ временно недоступен. Используй стандартные отчёты по аккаунту.\n"
-            )
-        else:
-            if not report_text:
-                report_text = "Фокус-ИИ вернул пустой отчёт. Попробуй повторить запрос позже."
-            cleaned = sanitize_ai_text(report_text)
-            if cleaned.lstrip().startswith("{"):
-                cleaned = "Фокус-ИИ вернул некорректный формат ответа. Попробуй повторить запрос позже."
-            if not cleaned:
-                cleaned = "Фокус-ИИ вернул пустой отчёт. Попробуй повторить запрос позже."
-            text_out = "\n".join(header_lines) + cleaned.strip()
-
-        # Мы находимся внутри callback-хэндлера, поэтому update.message == None.
-        # Отправляем ответ через bot.send_message в текущий чат.
-        reply_markup = None
-        if json_ok:
-            reply_markup = focus_ai_recommendation_kb(level, rec, float(delta), objects)
+    header_lines = [
+        "📊 Разовый отчёт Фокус-ИИ",
+        f"Объект: {get_account_name(aid)}",
+        f"Уровень: {level_human}",
+        f"Период: {period_label}",
+        "Источник данных: heatmap cache",
+        f"Окно: {date_str} {window_label}",
+        "",
+    ]
 
-        await context.bot.send_message(
-            chat_id,
-            text_out,
-            reply_markup=reply_markup,
+    if status != "ok":
+        text_out = (
+            "\n".join(header_lines)
+            + "⚠️ Фокус-ИИ временно недоступен. Используй стандартные отчёты по аккаунту.\n"
         )
-        return
+    else:
+        if not report_text:
+            report_text = "Фокус-ИИ вернул пустой отчёт. Попробуй повторить запрос позже."
+        cleaned = sanitize_ai_text(report_text)
+        if cleaned.lstrip().startswith("{"):
+            cleaned = "Фокус-ИИ вернул некорректный формат ответа. Попробуй повторить запрос позже."
+        if not cleaned:
+            cleaned = "Фокус-ИИ вернул пустой отчёт. Попробуй повторить запрос позже."
+        text_out = "\n".join(header_lines) + cleaned.strip()
+
+    # Мы находимся внутри callback-хэндлера, поэтому update.message == None.
+    # Отправляем ответ через bot.send_message в текущий чат.
+    reply_markup = None
+    if json_ok:
+        reply_markup = focus_ai_recommendation_kb(level, rec, float(delta), objects)
 
-    if data.startswith("ai_bud_apply|"):
-        # Формат: ai_bud_apply|{aid}|{adset_id}|{cents}
-        try:
-            _p, aid, adset_id, cents_s = data.split("|", 3)
-            cents = int(cents_s)
-        except Exception:
-            await q.answer("Некорректные данные действия.", show_alert=True)
-            return
+    await context.bot.send_message(
+        chat_id,
+        text_out,
+        reply_markup=reply_markup,
+    )
 
-        new_budget = float(cents) / 100.0
-        reasons = context.user_data.get("ai_action_reasons") or {}
-        reason = reasons.get(f"bud:{aid}:{adset_id}:{cents}") or ""
 
-        with allow_fb_api_calls(reason="ai_focus_apply_budget"):
-            res = set_adset_budget(adset_id, new_budget)
-        if res.get("status") != "ok":
-            msg = res.get("message") or ""
-            await context.bot.send_message(chat_id, f"❌ Не удалось применить действие: {msg}")
-            return
+@_CB_ROUTER.prefix("ai_bud_apply|")
+async def _cb_ai_bud_apply(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Формат: ai_bud_apply|{aid}|{adset_id}|{cents}
+    try:
+        _p, aid, adset_id, cents_s = data.split("|", 3)
+        cents = int(cents_s)
+    except Exception:
+        await q.answer("Некорректные данные действия.", show_alert=True)
+        return
 
-        old_b = res.get("old_budget")
-        new_b = res.get("new_budget")
-        lines = [
-            "✅ Бюджет обновлён",
-            "",
-            f"Adset: {adset_id}",
-        ]
-        try:
-            if old_b is not None and new_b is not None:
-                lines.append(f"Было: ${float(old_b):.2f}")
-                lines.append(f"Стало: ${float(new_b):.2f}")
-        except Exception:
-            pass
-        if reason:
-            lines.append(f"Причина: {reason}")
+    new_budget = float(cents) / 100.0
+    reasons = context.user_data.get("ai_action_reasons") or {}
+    reason = reasons.get(f"bud:{aid}:{adset_id}:{cents}") or ""
 
-        await context.bot.send_message(chat_id, "\n".join(lines))
+    with allow_fb_api_calls(reason="ai_focus_apply_budget"):
+        res = await run_fb_io(set_adset_budget, adset_id, new_budget)
+    if res.get("status") != "ok":
+        msg = res.get("message") or ""
+        await context.bot.send_message(chat_id, f"❌ Не удалось применить действие: {msg}")
         return
 
-    if data.startswith("ai_bud_manual|"):
-        # Формат: ai_bud_manual|{aid}|{adset_id}
-        try:
-            _p, aid, adset_id = data.split("|", 2)
-        except Exception:
-            await q.answer("Некорректные данные.", show_alert=True)
-            return
+    old_b = res.get("old_budget")
+    new_b = res.get("new_budget")
+    lines = [
+        "✅ Бюджет обновлён",
+        "",
+        f"Adset: {adset_id}",
+    ]
+    try:
+        if old_b is not None and new_b is not None:
+            lines.append(f"Было: ${float(old_b):.2f}")
+            lines.append(f"Стало: ${float(new_b):.2f}")
+    except Exception:
+        pass
+    if reason:
+        lines.append(f"Причина: {reason}")
 
-        cur = None
+    await context.bot.send_message(chat_id, "\n".join(lines))
 
-        context.user_data["await_ai_budget_for"] = {"aid": aid, "adset_id": adset_id}
-        suffix = f" Текущий: ${cur:.2f}." if cur is not None else ""
-        await context.bot.send_message(
-            chat_id,
-            f"Введи новый дневной бюджет для adset {adset_id} в $ (например 5.5).{suffix}",
-        )
+
+@_CB_ROUTER.prefix("ai_bud_manual|")
+async def _cb_ai_bud_manual(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Формат: ai_bud_manual|{aid}|{adset_id}
+    try:
+        _p, aid, adset_id = data.split("|", 2)
+    except Exception:
+        await q.answer("Некорректные данные.", show_alert=True)
         return
 
-    if data.startswith("ai_ad_pause|"):
-        # Формат: ai_ad_pause|{aid}|{ad_id}|{adset_id}
-        try:
-            _p, aid, ad_id, adset_id = data.split("|", 3)
-        except Exception:
-            await q.answer("Некорректные данные.", show_alert=True)
-            return
+    cur = None
 
-        reasons = context.user_data.get("ai_action_reasons") or {}
-        reason = reasons.get(f"adpause:{aid}:{ad_id}:{adset_id}") or ""
+    context.user_data["await_ai_budget_for"] = {"aid": aid, "adset_id": adset_id}
+    suffix = f" Текущий: ${cur:.2f}." if cur is not None else ""
+    await context.bot.send_message(
+        chat_id,
+        f"Введи новый дневной бюджет для adset {adset_id} в $ (например 5.5).{suffix}",
+    )
 
-        with allow_fb_api_calls(reason="ai_focus_pause_ad"):
-            res = pause_ad(ad_id)
-        if res.get("status") != "ok":
-            msg = res.get("message") or res.get("exception") or ""
-            await context.bot.send_message(chat_id, f"❌ Не удалось применить действие: {msg}")
-            return
 
-        lines = [
-            "✅ Объявление отключено",
-            f"Ad: {ad_id}",
-            "Статус: ACTIVE → PAUSED",
-        ]
-        if reason:
-            lines.append(f"Причина: {reason}")
-        await context.bot.send_message(chat_id, "\n".join(lines))
+@_CB_ROUTER.prefix("ai_ad_pause|")
+async def _cb_ai_ad_pause(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Формат: ai_ad_pause|{aid}|{ad_id}|{adset_id}
+    try:
+        _p, aid, ad_id, adset_id = data.split("|", 3)
+    except Exception:
+        await q.answer("Некорректные данные.", show_alert=True)
         return
 
-    if data.startswith("focus_ai_action|"):
-        # Пока только подтверждаем получение действия от пользователя.
-        # В следующих итерациях сюда будет добавлена реальная логика изменения бюджетов.
-        _prefix, lvl, action, delta_str = data.split("|", 3)
+    reasons = context.user_data.get("ai_action_reasons") or {}
+    reason = reasons.get(f"adpause:{aid}:{ad_id}:{adset_id}") or ""
+
+    with allow_fb_api_calls(reason="ai_focus_pause_ad"):
+        res = await run_fb_io(pause_ad, ad_id)
+    if res.get("status") != "ok":
+        msg = res.get("message") or res.get("exception") or ""
+        await context.bot.send_message(chat_id, f"❌ Не удалось применить действие: {msg}")
+        return
+
+    lines = [
+        "✅ Объявление отключено",
+        f"Ad: {ad_id}",
+        "Статус: ACTIVE → PAUSED",
+    ]
+    if reason:
+        lines.append(f"Причина: {reason}")
+    await context.bot.send_message(chat_id, "\n".join(lines))
+
+
+@_CB_ROUTER.prefix("focus_ai_action|")
+async def _cb_focus_ai_action(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Пока только подтверждаем получение действия от пользователя.
+    # В следующих итерациях сюда будет добавлена реальная логика изменения бюджетов.
+    _prefix, lvl, action, delta_str = data.split("|", 3)
+    delta_val = 0
+    try:
+        delta_val = int(delta_str)
+    except Exception:
+        delta_val = 0
+
+    human_action = {
+        "inc": "увеличение бюджета",
+        "dec": "снижение бюджета",
+        "keep": "оставить как есть",
+        "manual": "ручной ввод",
+    }.get(action, action)
+
+    await safe_edit_message(
+        q,
+        f"Фокус-ИИ: получено действие '{human_action}' для уровня '{lvl}' (Δ={delta_val}%).\n"
+        "Реальные изменения бюджета будут добавлены на следующем этапе.",
+        reply_markup=focus_ai_main_kb(),
+    )
+
+
+@_CB_ROUTER.prefix("focus_ai_obj|")
+async def _cb_focus_ai_obj(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Формат: focus_ai_obj|adset|{adset_id}|inc|20
+    _prefix, obj_level, obj_id, action, delta_str = data.split("|", 4)
+    try:
+        delta_val = int(delta_str)
+    except Exception:
         delta_val = 0
-        try:
-            delta_val = int(delta_str)
-        except Exception:
-            delta_val = 0
 
-        human_action = {
-            "inc": "увеличение бюджета",
-            "dec": "снижение бюджета",
-            "keep": "оставить как есть",
-            "manual": "ручной ввод",
-        }.get(action, action)
+    if obj_level != "adset":
+        await q.answer("Пока можно применять бюджеты только на уровне адсета.", show_alert=True)
+        return
+
+    # Подтверждение перед реальным изменением бюджета.
+    text = (
+        "Подтверждение действия Фокус-ИИ:\n\n"
+        f"Объект: adset {obj_id}\n"
+        f"Действие: {'увеличить' if action == 'inc' else 'уменьшить'} бюджет на {delta_val:+d}%\n\n"
+        "Применить изменение бюджета?"
+    )
+    kb = InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    "✅ Да",
+                    callback_data=f"focus_ai_obj_confirm|adset|{obj_id}|{action}|{delta_val}",
+                ),
+                InlineKeyboardButton(
+                    "❌ Отмена",
+                    callback_data="focus_ai_obj_cancel",
+                ),
+            ]
+        ]
+    )
+
+    await safe_edit_message(q, text, reply_markup=kb)
+
+
+@_CB_ROUTER.prefix("cpa_ai_ads|")
+async def _cb_cpa_ai_ads(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    alerts["ai_cpa_ads_enabled"] = not bool(alerts.get("ai_cpa_ads_enabled", False))
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+    text, kb = cpa_settings_kb(aid)
+    await safe_edit_message(q, text, reply_markup=kb)
+
 
+@_CB_ROUTER.prefix("focus_ai_obj_confirm|")
+async def _cb_focus_ai_obj_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Формат: focus_ai_obj_confirm|adset|{adset_id}|inc|20
+    _p, obj_level, obj_id, action, delta_str = data.split("|", 4)
+    try:
+        delta_val = float(delta_str)
+    except Exception:
+        delta_val = 0.0
+
+    if obj_level != "adset":
         await safe_edit_message(
             q,
-            f"Фокус-ИИ: получено действие '{human_action}' для уровня '{lvl}' (Δ={delta_val}%).\n"
-            "Реальные изменения бюджета будут добавлены на следующем этапе.",
-            reply_markup=focus_ai_main_kb(),
+            "Можно подтверждать только изменения бюджета на уровне адсета.",
         )
         return
 
-    if data.startswith("focus_ai_obj|"):
-        # Формат: focus_ai_obj|adset|{adset_id}|inc|20
-        _prefix, obj_level, obj_id, action, delta_str = data.split("|", 4)
-        try:
-            delta_val = int(delta_str)
-        except Exception:
-            delta_val = 0
+    # Если рекомендация была на снижение (dec), передаём отрицательный процент.
+    if action == "dec" and delta_val > 0:
+        delta_val = -delta_val
 
-        if obj_level != "adset":
-            await q.answer("Пока можно применять бюджеты только на уровне адсета.", show_alert=True)
-            return
+    with allow_fb_api_calls(reason="ai_focus_apply_budget"):
+        res = await run_fb_io(apply_budget_change, obj_id, delta_val)
+    status = res.get("status")
+    msg = res.get("message") or "Бюджет обновлён."
 
-        # Подтверждение перед реальным изменением бюджета.
+    if status != "ok":
+        text = f"⚠️ Не удалось применить изменение бюджета: {msg}"
+    else:
+        old_b = res.get("old_budget")
+        new_b = res.get("new_budget")
         text = (
-            "Подтверждение действия Фокус-ИИ:\n\n"
-            f"Объект: adset {obj_id}\n"
-            f"Действие: {'увеличить' if action == 'inc' else 'уменьшить'} бюджет на {delta_val:+d}%\n\n"
-            "Применить изменение бюджета?"
-        )
-        kb = InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        "✅ Да",
-                        callback_data=f"focus_ai_obj_confirm|adset|{obj_id}|{action}|{delta_val}",
-                    ),
-                    InlineKeyboardButton(
-                        "❌ Отмена",
-                        callback_data="focus_ai_obj_cancel",
-                    ),
-                ]
-            ]
+            "✅ Изменение бюджета применено.\n\n"
+            f"Adset: {obj_id}\n"
+            f"Старый бюджет: {old_b:.2f} $\n"
+            f"Новый бюджет: {new_b:.2f} $\n"
+            f"Δ: {delta_val:+.0f}%"
         )
 
-        await safe_edit_message(q, text, reply_markup=kb)
-        return
+    await safe_edit_message(q, text)
 
-    if data.startswith("cpa_ai_ads|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        alerts["ai_cpa_ads_enabled"] = not bool(alerts.get("ai_cpa_ads_enabled", False))
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
-        text, kb = cpa_settings_kb(aid)
-        await safe_edit_message(q, text, reply_markup=kb)
-        return
 
-    if data.startswith("focus_ai_obj_confirm|"):
-        # Формат: focus_ai_obj_confirm|adset|{adset_id}|inc|20
-        _p, obj_level, obj_id, action, delta_str = data.split("|", 4)
-        try:
-            delta_val = float(delta_str)
-        except Exception:
-            delta_val = 0.0
+@_CB_ROUTER.exact("focus_ai_obj_cancel")
+async def _cb_focus_ai_obj_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(q, "Действие Фокус-ИИ отменено.")
 
-        if obj_level != "adset":
-            await safe_edit_message(
-                q,
-                "Можно подтверждать только изменения бюджета на уровне адсета.",
-            )
-            return
 
-        # Если рекомендация была на снижение (dec), передаём отрицательный процент.
-        if action == "dec" and delta_val > 0:
-            delta_val = -delta_val
+@_CB_ROUTER.exact("reports_menu")
+async def _cb_reports_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите тип отчёта:",
+        reply_markup=reports_menu_kb(),
+    )
 
-        with allow_fb_api_calls(reason="ai_focus_apply_budget"):
-            res = apply_budget_change(obj_id, delta_val)
-        status = res.get("status")
-        msg = res.get("message") or "Бюджет обновлён."
 
-        if status != "ok":
-            text = f"⚠️ Не удалось применить изменение бюджета: {msg}"
-        else:
-            old_b = res.get("old_budget")
-            new_b = res.get("new_budget")
-            text = (
-                "✅ Изменение бюджета применено.\n\n"
-                f"Adset: {obj_id}\n"
-                f"Старый бюджет: {old_b:.2f} $\n"
-                f"Новый бюджет: {new_b:.2f} $\n"
-                f"Δ: {delta_val:+.0f}%"
-            )
+# ======= НОВЫЙ РАЗДЕЛ "ОТЧЁТЫ" =======
+# Совместимость: старый callback rep_all_menu ведём в новый report_all.
+@_CB_ROUTER.exact("report_all", "rep_all_menu")
+async def _cb_report_all(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите период:",
+        reply_markup=reports_periods_kb("rep_all"),
+    )
 
-        await safe_edit_message(q, text)
-        return
 
-    if data == "focus_ai_obj_cancel":
-        await safe_edit_message(q, "Действие Фокус-ИИ отменено.")
-        return
+@_CB_ROUTER.exact("report_one")
+async def _cb_report_one(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для отчёта по аккаунту:",
+        reply_markup=reports_accounts_kb("rep_one_acc"),
+    )
 
-    if data == "reports_menu":
-        await safe_edit_message(
-            q,
-            "Выберите тип отчёта:",
-            reply_markup=reports_menu_kb(),
-        )
-        return
 
-    # ======= НОВЫЙ РАЗДЕЛ "ОТЧЁТЫ" =======
-    # Совместимость: старый callback rep_all_menu ведём в новый report_all.
-    if data in {"report_all", "rep_all_menu"}:
-        await safe_edit_message(
-            q,
-            "Выберите период:",
-            reply_markup=reports_periods_kb("rep_all"),
-        )
-        return
+@_CB_ROUTER.exact("adsets_menu")
+async def _cb_adsets_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для отчёта по адсетам:",
+        reply_markup=accounts_kb("adrep"),
+    )
 
-    if data == "report_one":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для отчёта по аккаунту:",
-            reply_markup=reports_accounts_kb("rep_one_acc"),
-        )
-        return
 
-    if data == "adsets_menu":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для отчёта по адсетам:",
-            reply_markup=accounts_kb("adrep"),
-        )
-        return
+@_CB_ROUTER.prefix("rep_one_acc|")
+async def _cb_rep_one_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Отчёт по: {get_account_name(aid)}\nВыберите уровень отчёта:",
+        reply_markup=account_reports_level_kb(aid),
+    )
 
-    if data.startswith("rep_one_acc|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"Отчёт по: {get_account_name(aid)}\nВыберите уровень отчёта:",
-            reply_markup=account_reports_level_kb(aid),
-        )
-        return
-    
-    if data.startswith("rep_acc_mode|"):
-        _, aid, mode = data.split("|", 2)
+
+@_CB_ROUTER.prefix("rep_acc_mode|")
+async def _cb_rep_acc_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, mode = data.split("|", 2)
+    await safe_edit_message(
+        q,
+        f"Отчёт по: {get_account_name(aid)}\nВыберите период:",
+        reply_markup=account_reports_periods_kb(aid, mode),
+    )
+
+
+@_CB_ROUTER.prefix("rep_acc_back|")
+async def _cb_rep_acc_back(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, _mode = data.split("|", 2)
+    await safe_edit_message(
+        q,
+        f"Отчёт по: {get_account_name(aid)}\nВыберите уровень отчёта:",
+        reply_markup=account_reports_level_kb(aid),
+    )
+
+
+@_CB_ROUTER.prefix("rep_acc_p|")
+async def _cb_rep_acc_p(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    # Формат: rep_acc_p|{aid}|{mode}|{kind}
+    _, aid, mode, kind = data.split("|", 3)
+
+    if kind == "custom":
+        context.user_data["await_rep_acc_range_for"] = {"aid": aid, "mode": mode}
+        mode_human = {
+            "general": "общий отчёт",
+            "campaigns": "по кампаниям",
+            "adsets": "по адсетам",
+            "ads": "по объявлениям",
+        }.get(str(mode), str(mode))
         await safe_edit_message(
             q,
-            f"Отчёт по: {get_account_name(aid)}\nВыберите период:",
+            (
+                f"🗓 Отчёт по: {get_account_name(aid)}\n"
+                f"Уровень: {mode_human}\n\n"
+                "Введи даты форматом: 01.06.2025-07.06.2025"
+            ),
             reply_markup=account_reports_periods_kb(aid, mode),
         )
         return
 
-    if data.startswith("rep_acc_back|"):
-        _, aid, _mode = data.split("|", 2)
-        await safe_edit_message(
-            q,
-            f"Отчёт по: {get_account_name(aid)}\nВыберите уровень отчёта:",
-            reply_markup=account_reports_level_kb(aid),
-        )
-        return
+    # Общий отчёт по аккаунту — используем существующую логику one_*.
+    if mode == "general":
+        if kind == "today":
+            label = datetime.now(ALMATY_TZ).strftime("%d.%m.%Y")
+            await safe_edit_message(
+                q,
+                f"Отчёт по {get_account_name(aid)} за {label}:",
+            )
+            txt = await run_fb_io(get_cached_report, aid, "today", label)
+            await context.bot.send_message(
+                chat_id,
+                txt or "Нет данных/нет доступа.",
+                parse_mode="HTML",
+            )
+            return
 
-    if data.startswith("rep_acc_p|"):
-        # Формат: rep_acc_p|{aid}|{mode}|{kind}
-        _, aid, mode, kind = data.split("|", 3)
+        if kind == "yday":
+            label = (datetime.now(ALMATY_TZ) - timedelta(days=1)).strftime(
+                "%d.%m.%Y"
+            )
+            await safe_edit_message(
+                q,
+                f"Отчёт по {get_account_name(aid)} за {label}:",
+            )
+            txt = await run_fb_io(get_cached_report, aid, "yesterday", label)
+            await context.bot.send_message(
+                chat_id,
+                txt or "Нет данных/нет доступа.",
+                parse_mode="HTML",
+            )
+            return
 
-        if kind == "custom":
-            context.user_data["await_rep_acc_range_for"] = {"aid": aid, "mode": mode}
-            mode_human = {
-                "general": "общий отчёт",
-                "campaigns": "по кампаниям",
-                "adsets": "по адсетам",
-                "ads": "по объявлениям",
-            }.get(str(mode), str(mode))
+        if kind == "week":
+            until = datetime.now(ALMATY_TZ) - timedelta(days=1)
+            since = until - timedelta(days=6)
+            period = {
+                "since": since.strftime("%Y-%m-%d"),
+                "until": until.strftime("%Y-%m-%d"),
+            }
+            label = f"{since.strftime('%d.%m')}-{until.strftime('%d.%m')}"
             await safe_edit_message(
                 q,
-                (
-                    f"🗓 Отчёт по: {get_account_name(aid)}\n"
-                    f"Уровень: {mode_human}\n\n"
-                    "Введи даты форматом: 01.06.2025-07.06.2025"
-                ),
-                reply_markup=account_reports_periods_kb(aid, mode),
+                f"Отчёт по {get_account_name(aid)} за {label}:",
+            )
+            txt = await run_fb_io(get_cached_report, aid, period, label)
+            await context.bot.send_message(
+                chat_id,
+                txt or "Нет данных/нет доступа.",
+                parse_mode="HTML",
             )
             return
 
-        # Общий отчёт по аккаунту — используем существующую логику one_*.
-        if mode == "general":
-            if kind == "today":
-                label = datetime.now(ALMATY_TZ).strftime("%d.%m.%Y")
-                await safe_edit_message(
-                    q,
-                    f"Отчёт по {get_account_name(aid)} за {label}:",
-                )
-                txt = get_cached_report(aid, "today", label)
-                await context.bot.send_message(
-                    chat_id,
-                    txt or "Нет данных/нет доступа.",
-                    parse_mode="HTML",
-                )
-                return
-
-            if kind == "yday":
-                label = (datetime.now(ALMATY_TZ) - timedelta(days=1)).strftime(
-                    "%d.%m.%Y"
-                )
-                await safe_edit_message(
-                    q,
-                    f"Отчёт по {get_account_name(aid)} за {label}:",
-                )
-                txt = get_cached_report(aid, "yesterday", label)
-                await context.bot.send_message(
-                    chat_id,
-                    txt or "Нет данных/нет доступа.",
-                    parse_mode="HTML",
-                )
-                return
-
-            if kind == "week":
-                until = datetime.now(ALMATY_TZ) - timedelta(days=1)
-                since = until - timedelta(days=6)
-                period = {
-                    "since": since.strftime("%Y-%m-%d"),
-                    "until": until.strftime("%Y-%m-%d"),
-                }
-                label = f"{since.strftime('%d.%m')}-{until.strftime('%d.%m')}"
-                await safe_edit_message(
-                    q,
-                    f"Отчёт по {get_account_name(aid)} за {label}:",
-                )
-                txt = get_cached_report(aid, period, label)
-                await context.bot.send_message(
-                    chat_id,
-                    txt or "Нет данных/нет доступа.",
-                    parse_mode="HTML",
-                )
-                return
-
-            if kind == "compare":
-                await safe_edit_message(
-                    q,
-                    f"Сравнение периодов для {get_account_name(aid)}:",
-                    reply_markup=compare_kb_for(aid),
-                )
-                return
-
-        if kind == "today":
-            period = "today"
-            label = "сегодня"
-        elif kind == "yday":
-            period = "yesterday"
-            label = "вчера"
-        elif kind == "week":
-            until = datetime.now(ALMATY_TZ) - timedelta(days=1)
-            since = until - timedelta(days=6)
-            period = {
-                "since": since.strftime("%Y-%m-%d"),
-                "until": until.strftime("%Y-%m-%d"),
-            }
-            label = "последние 7 дней"
-        else:
-            await safe_edit_message(
-                q,
-                "Сравнение периодов пока доступно только для общего отчёта по аккаунту.",
-            )
-            return
-
-        name = get_account_name(aid)
-
-        if mode == "campaigns":
-            await safe_edit_message(
-                q,
-                f"Готовлю отчёт по кампаниям для {name} ({label})…",
-            )
-            txt = build_account_report(aid, period, "CAMPAIGN", label=label)
-            await context.bot.send_message(
-                chat_id,
-                txt or "Нет данных/нет доступа.",
-                parse_mode="HTML",
-            )
-            return
-
-        if mode == "adsets":
-            await safe_edit_message(
-                q,
-                f"Готовлю отчёт по адсетам для {name} ({label})…",
-            )
-            txt = build_account_report(aid, period, "ADSET", label=label)
-            await context.bot.send_message(
-                chat_id,
-                txt or "Нет данных/нет доступа.",
-                parse_mode="HTML",
-            )
-            return
-
-        if mode == "ads":
+        if kind == "compare":
             await safe_edit_message(
                 q,
-                f"Готовлю отчёт по объявлениям для {name} ({label})…",
-            )
-            txt = build_account_report(aid, period, "AD", label=label)
-            await context.bot.send_message(
-                chat_id,
-                txt or "Нет данных/нет доступа.",
-                parse_mode="HTML",
+                f"Сравнение периодов для {get_account_name(aid)}:",
+                reply_markup=compare_kb_for(aid),
             )
             return
 
-    if data.startswith("adrep|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"Готовлю отчёт по адсетам для {get_account_name(aid)} "
-            f"за последние 7 дней…",
-        )
-        await send_adset_report(context, chat_id, aid)
-        return
-
-    # Старые callback'и rep_today/rep_yday/rep_week считаем синонимами
-    # новых rep_all_today/rep_all_yday/rep_all_week.
-    if data in {"rep_all_today", "rep_today"}:
-        label = datetime.now(ALMATY_TZ).strftime("%d.%m.%Y")
-        await safe_edit_message(q, f"Готовлю отчёт за {label}…")
-        await send_period_report(context, chat_id, "today", label)
-        return
-
-    if data in {"rep_all_yday", "rep_yday"}:
-        label = (datetime.now(ALMATY_TZ) - timedelta(days=1)).strftime("%d.%m.%Y")
-        await q.edit_message_text(f"Готовлю отчёт за {label}…")
-        await send_period_report(context, chat_id, "yesterday", label)
-        return
-
-    if data in {"rep_all_week", "rep_week"}:
+    if kind == "today":
+        period = "today"
+        label = "сегодня"
+    elif kind == "yday":
+        period = "yesterday"
+        label = "вчера"
+    elif kind == "week":
         until = datetime.now(ALMATY_TZ) - timedelta(days=1)
         since = until - timedelta(days=6)
         period = {
             "since": since.strftime("%Y-%m-%d"),
             "until": until.strftime("%Y-%m-%d"),
         }
-        label = f"{since.strftime('%d.%m')}-{until.strftime('%d.%m')}"
-        await q.edit_message_text(f"Готовлю отчёт за {label}…")
-        await send_period_report(context, chat_id, period, label)
-        return
-
-    if data == "rep_all_custom":
-        context.user_data["await_all_range_for"] = True
+        label = "последние 7 дней"
+    else:
         await safe_edit_message(
             q,
-            "Введи даты форматом: 01.06.2025-07.06.2025",
-            reply_markup=reports_periods_kb("rep_all"),
+            "Сравнение периодов пока доступно только для общего отчёта по аккаунту.",
         )
         return
 
-    if data == "rep_all_compare":
-        context.user_data["await_all_cmp_for"] = True
-        await safe_edit_message(
-            q,
-            "Отправь два диапазона дат через ';' или с новой строки.\n"
-            "Пример: 01.06.2025-07.06.2025;08.06.2025-14.06.2025",
-            reply_markup=reports_periods_kb("rep_all"),
-        )
-        return
+    name = get_account_name(aid)
 
-    if data == "hm_menu":
+    if mode == "campaigns":
         await safe_edit_message(
             q,
-            "Выберите аккаунт для тепловой карты:",
-            reply_markup=accounts_kb("hmacc"),
+            f"Готовлю отчёт по кампаниям для {name} ({label})…",
+        )
+        txt = await run_fb_io(build_account_report, aid, period, "CAMPAIGN", label=label)
+        await context.bot.send_message(
+            chat_id,
+            txt or "Нет данных/нет доступа.",
+            parse_mode="HTML",
         )
         return
 
-    if data.startswith("hmacc|"):
-        aid = data.split("|", 1)[1]
-        context.user_data["heatmap_aid"] = aid
+    if mode == "adsets":
         await safe_edit_message(
             q,
-            f"Выберите период тепловой карты для {get_account_name(aid)}:",
-            reply_markup=heatmap_menu(aid),
+            f"Готовлю отчёт по адсетам для {name} ({label})…",
+        )
+        txt = await run_fb_io(build_account_report, aid, period, "ADSET", label=label)
+        await context.bot.send_message(
+            chat_id,
+            txt or "Нет данных/нет доступа.",
+            parse_mode="HTML",
         )
         return
 
-    if data.startswith("hmdebug|"):
-        aid = data.split("|", 1)[1]
-        if not aid.startswith("act_"):
-            aid = "act_" + aid
-        txt = _build_heatmap_debug_last_text(aid=str(aid))
+    if mode == "ads":
         await safe_edit_message(
             q,
-            txt,
-            reply_markup=main_menu(
-                uid=uid,
-                chat_id=str(chat_id),
-                chat_type=str(update.effective_chat.type) if update.effective_chat else None,
-            ),
+            f"Готовлю отчёт по объявлениям для {name} ({label})…",
+        )
+        txt = await run_fb_io(build_account_report, aid, period, "AD", label=label)
+        await context.bot.send_message(
+            chat_id,
+            txt or "Нет данных/нет доступа.",
+            parse_mode="HTML",
         )
         return
 
-    if data.startswith("hm7|"):
-        aid = data.split("|")[1]
-        heat = build_heatmap_for_account(aid, get_account_name, mode="7")
-        await safe_edit_message(q, heat, parse_mode="HTML")
-        return
 
-    if data.startswith("hm14|"):
-        aid = data.split("|")[1]
-        heat = build_heatmap_for_account(aid, get_account_name, mode="14")
-        await q.edit_message_text(heat, parse_mode="HTML")
-        return
+@_CB_ROUTER.prefix("adrep|")
+async def _cb_adrep(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Готовлю отчёт по адсетам для {get_account_name(aid)} "
+        f"за последние 7 дней…",
+    )
+    await send_adset_report(context, chat_id, aid)
 
-    if data.startswith("hmmonth|"):
-        aid = data.split("|")[1]
-        heat = build_heatmap_for_account(aid, get_account_name, mode="month")
-        await q.edit_message_text(heat, parse_mode="HTML")
-        return
 
-    if data == "billing":
-        await safe_edit_message(
-            q,
-            "Что показать по биллингу?",
-            reply_markup=billing_menu(),
-        )
-        return
-    if data == "billing_current":
-        await safe_edit_message(q, "📋 Биллинги (текущие):")
-        await send_billing(context, chat_id, only_inactive=False)
-        return
-    if data == "billing_forecast":
-        await safe_edit_message(q, "🔮 Считаю прогноз списаний…")
-        await send_billing_forecast(context, chat_id)
-        return
+# Старые callback'и rep_today/rep_yday/rep_week считаем синонимами
+# новых rep_all_today/rep_all_yday/rep_all_week.
+@_CB_ROUTER.exact("rep_all_today", "rep_today")
+async def _cb_rep_all_today(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    label = datetime.now(ALMATY_TZ).strftime("%d.%m.%Y")
+    await safe_edit_message(q, f"Готовлю отчёт за {label}…")
+    await send_period_report(context, chat_id, "today", label)
 
-    if data == "leads_plan_soon":
-        text = (
-            "📈 План заявок\n\n"
-            "В этом разделе позже будет аналитика: план заявок на месяц/неделю и "
-            "сравнение с фактом — на сколько отстаём или перевыполняем план.\n\n"
-            "Пока это информационная кнопка, функционал в разработке."
-        )
-        await safe_edit_message(q, text, reply_markup=monitoring_menu_kb())
-        return
 
-    # ====== Мониторинг: заглушки режимов сравнения и настроек ======
+@_CB_ROUTER.exact("rep_all_yday", "rep_yday")
+async def _cb_rep_all_yday(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    label = (datetime.now(ALMATY_TZ) - timedelta(days=1)).strftime("%d.%m.%Y")
+    await q.edit_message_text(f"Готовлю отчёт за {label}…")
+    await send_period_report(context, chat_id, "yesterday", label)
 
-    if data == "mon_yday_vs_byday":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для сравнения: вчера vs позавчера",
-            reply_markup=monitoring_compare_accounts_kb("moncmp_yday"),
-        )
-        return
 
-    if data == "mon_lastweek_vs_prevweek":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для сравнения: прошлая неделя vs позапрошлая",
-            reply_markup=monitoring_compare_accounts_kb("moncmp_lastweek"),
-        )
-        return
+@_CB_ROUTER.exact("rep_all_week", "rep_week")
+async def _cb_rep_all_week(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    until = datetime.now(ALMATY_TZ) - timedelta(days=1)
+    since = until - timedelta(days=6)
+    period = {
+        "since": since.strftime("%Y-%m-%d"),
+        "until": until.strftime("%Y-%m-%d"),
+    }
+    label = f"{since.strftime('%d.%m')}-{until.strftime('%d.%m')}"
+    await q.edit_message_text(f"Готовлю отчёт за {label}…")
+    await send_period_report(context, chat_id, period, label)
+
+
+@_CB_ROUTER.exact("rep_all_custom")
+async def _cb_rep_all_custom(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    context.user_data["await_all_range_for"] = True
+    await safe_edit_message(
+        q,
+        "Введи даты форматом: 01.06.2025-07.06.2025",
+        reply_markup=reports_periods_kb("rep_all"),
+    )
 
-    if data == "mon_curweek_vs_lastweek":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для сравнения: текущая неделя vs прошлая (по вчера)",
-            reply_markup=monitoring_compare_accounts_kb("moncmp_curweek"),
-        )
-        return
 
-    if data.startswith("moncmp_yday|"):
-        aid = data.split("|", 1)[1]
-        now = datetime.now(ALMATY_TZ)
-        yday = (now - timedelta(days=1)).date()
-        byday = (now - timedelta(days=2)).date()
+@_CB_ROUTER.exact("rep_all_compare")
+async def _cb_rep_all_compare(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    context.user_data["await_all_cmp_for"] = True
+    await safe_edit_message(
+        q,
+        "Отправь два диапазона дат через ';' или с новой строки.\n"
+        "Пример: 01.06.2025-07.06.2025;08.06.2025-14.06.2025",
+        reply_markup=reports_periods_kb("rep_all"),
+    )
 
-        period_old = {"since": byday.strftime("%Y-%m-%d"), "until": byday.strftime("%Y-%m-%d")}
-        period_new = {"since": yday.strftime("%Y-%m-%d"), "until": yday.strftime("%Y-%m-%d")}
-        label_old = byday.strftime("%d.%m.%Y")
-        label_new = yday.strftime("%d.%m.%Y")
 
-        await safe_edit_message(
-            q,
-            f"Сравниваю {get_account_name(aid)}: {label_new} vs {label_old}…",
-            reply_markup=monitoring_menu_kb(),
-        )
+@_CB_ROUTER.exact("hm_menu")
+async def _cb_hm_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для тепловой карты:",
+        reply_markup=accounts_kb("hmacc"),
+    )
 
-        txt = build_comparison_report(aid, period_old, label_old, period_new, label_new)
-        if not txt:
-            await context.bot.send_message(chat_id=chat_id, text="Нет данных/нет доступа.")
-            return
-        await context.bot.send_message(chat_id=chat_id, text=txt, parse_mode="HTML")
-        return
 
-    if data.startswith("moncmp_lastweek|"):
-        aid = data.split("|", 1)[1]
+@_CB_ROUTER.prefix("hmacc|")
+async def _cb_hmacc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    context.user_data["heatmap_aid"] = aid
+    await safe_edit_message(
+        q,
+        f"Выберите период тепловой карты для {get_account_name(aid)}:",
+        reply_markup=heatmap_menu(aid),
+    )
 
-        # Полные недели (пн–вс): прошлая vs позапрошлая.
-        now = datetime.now(ALMATY_TZ)
-        start_this_week = (now - timedelta(days=now.weekday())).date()
-        start_last_week = start_this_week - timedelta(days=7)
-        start_prev_week = start_this_week - timedelta(days=14)
-        end_last_week = start_this_week - timedelta(days=1)
-        end_prev_week = start_last_week - timedelta(days=1)
 
-        period_old = {"since": start_prev_week.strftime("%Y-%m-%d"), "until": end_prev_week.strftime("%Y-%m-%d")}
-        period_new = {"since": start_last_week.strftime("%Y-%m-%d"), "until": end_last_week.strftime("%Y-%m-%d")}
-        label_old = f"{start_prev_week.strftime('%d.%m')}-{end_prev_week.strftime('%d.%m')}"
-        label_new = f"{start_last_week.strftime('%d.%m')}-{end_last_week.strftime('%d.%m')}"
+@_CB_ROUTER.prefix("hmdebug|")
+async def _cb_hmdebug(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    if not aid.startswith("act_"):
+        aid = "act_" + aid
+    txt = _build_heatmap_debug_last_text(aid=str(aid))
+    await safe_edit_message(
+        q,
+        txt,
+        reply_markup=main_menu(
+            uid=uid,
+            chat_id=str(chat_id),
+            chat_type=str(update.effective_chat.type) if update.effective_chat else None,
+        ),
+    )
+
 
-        await safe_edit_message(
-            q,
-            f"Сравниваю недели {get_account_name(aid)}: {label_new} vs {label_old}…",
-            reply_markup=monitoring_menu_kb(),
-        )
+@_CB_ROUTER.prefix("hm7|")
+async def _cb_hm7(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|")[1]
+    heat = build_heatmap_for_account(aid, get_account_name, mode="7")
+    await safe_edit_message(q, heat, parse_mode="HTML")
 
-        txt = build_comparison_report(aid, period_old, label_old, period_new, label_new)
-        if not txt:
-            await context.bot.send_message(chat_id=chat_id, text="Нет данных/нет доступа.")
-            return
-        await context.bot.send_message(chat_id=chat_id, text=txt, parse_mode="HTML")
-        return
 
-    if data.startswith("moncmp_curweek|"):
-        aid = data.split("|", 1)[1]
+@_CB_ROUTER.prefix("hm14|")
+async def _cb_hm14(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|")[1]
+    heat = build_heatmap_for_account(aid, get_account_name, mode="14")
+    await q.edit_message_text(heat, parse_mode="HTML")
 
-        now = datetime.now(ALMATY_TZ)
-        yday = (now - timedelta(days=1)).date()
-        start_this_week = (now - timedelta(days=now.weekday())).date()
-        start_last_week = start_this_week - timedelta(days=7)
-
-        # Текущая неделя: пн..вчера
-        # Прошлая неделя: пн..(пн+N), где N соответствует "вчера" в текущей неделе
-        days_since_monday = (yday - start_this_week).days
-        if days_since_monday < 0:
-            days_since_monday = 0
-        end_last_week = start_last_week + timedelta(days=days_since_monday)
-
-        period_old = {"since": start_last_week.strftime("%Y-%m-%d"), "until": end_last_week.strftime("%Y-%m-%d")}
-        period_new = {"since": start_this_week.strftime("%Y-%m-%d"), "until": yday.strftime("%Y-%m-%d")}
-        label_old = f"{start_last_week.strftime('%d.%m')}-{end_last_week.strftime('%d.%m')}"
-        label_new = f"{start_this_week.strftime('%d.%m')}-{yday.strftime('%d.%m')}"
 
-        await safe_edit_message(
-            q,
-            f"Сравниваю накопление {get_account_name(aid)}: {label_new} vs {label_old}…",
-            reply_markup=monitoring_menu_kb(),
-        )
+@_CB_ROUTER.prefix("hmmonth|")
+async def _cb_hmmonth(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|")[1]
+    heat = build_heatmap_for_account(aid, get_account_name, mode="month")
+    await q.edit_message_text(heat, parse_mode="HTML")
 
-        txt = build_comparison_report(aid, period_old, label_old, period_new, label_new)
-        if not txt:
-            await context.bot.send_message(chat_id=chat_id, text="Нет данных/нет доступа.")
-            return
-        await context.bot.send_message(chat_id=chat_id, text=txt, parse_mode="HTML")
-        return
 
-    if data == "mon_custom_period":
-        await safe_edit_message(
-            q,
-            "Кастомный период мониторинга пока не реализован.\n"
-            "Дальше здесь появится выбор диапазона дат и сравнение с таким же по "
-            "длине предыдущим периодом.",
-            reply_markup=monitoring_menu_kb(),
-        )
-        return
+@_CB_ROUTER.exact("billing")
+async def _cb_billing(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Что показать по биллингу?",
+        reply_markup=billing_menu(),
+    )
 
-    if data == "mon_settings":
-        await safe_edit_message(
-            q,
-            "⚙️ Мониторинг — выбери аккаунты для сравнения периодов:\n\n"
-            "✅ — включён\n"
-            "(Если снять со всех — сравнение не будет отправлять отчёты)",
-            reply_markup=monitoring_accounts_kb(),
-        )
+
+@_CB_ROUTER.exact("billing_current")
+async def _cb_billing_current(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(q, "📋 Биллинги (текущие):")
+    await send_billing(context, chat_id, only_inactive=False)
+
+
+@_CB_ROUTER.exact("billing_forecast")
+async def _cb_billing_forecast(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(q, "🔮 Считаю прогноз списаний…")
+    await send_billing_forecast(context, chat_id)
+
+
+@_CB_ROUTER.exact("leads_plan_soon")
+async def _cb_leads_plan_soon(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    text = (
+        "📈 План заявок\n\n"
+        "В этом разделе позже будет аналитика: план заявок на месяц/неделю и "
+        "сравнение с фактом — на сколько отстаём или перевыполняем план.\n\n"
+        "Пока это информационная кнопка, функционал в разработке."
+    )
+    await safe_edit_message(q, text, reply_markup=monitoring_menu_kb())
+
+
+# ====== Мониторинг: заглушки режимов сравнения и настроек ======
+@_CB_ROUTER.exact("mon_yday_vs_byday")
+async def _cb_mon_yday_vs_byday(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для сравнения: вчера vs позавчера",
+        reply_markup=monitoring_compare_accounts_kb("moncmp_yday"),
+    )
+
+
+@_CB_ROUTER.exact("mon_lastweek_vs_prevweek")
+async def _cb_mon_lastweek_vs_prevweek(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для сравнения: прошлая неделя vs позапрошлая",
+        reply_markup=monitoring_compare_accounts_kb("moncmp_lastweek"),
+    )
+
+
+@_CB_ROUTER.exact("mon_curweek_vs_lastweek")
+async def _cb_mon_curweek_vs_lastweek(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для сравнения: текущая неделя vs прошлая (по вчера)",
+        reply_markup=monitoring_compare_accounts_kb("moncmp_curweek"),
+    )
+
+
+@_CB_ROUTER.prefix("moncmp_yday|")
+async def _cb_moncmp_yday(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    now = datetime.now(ALMATY_TZ)
+    yday = (now - timedelta(days=1)).date()
+    byday = (now - timedelta(days=2)).date()
+
+    period_old = {"since": byday.strftime("%Y-%m-%d"), "until": byday.strftime("%Y-%m-%d")}
+    period_new = {"since": yday.strftime("%Y-%m-%d"), "until": yday.strftime("%Y-%m-%d")}
+    label_old = byday.strftime("%d.%m.%Y")
+    label_new = yday.strftime("%d.%m.%Y")
+
+    await safe_edit_message(
+        q,
+        f"Сравниваю {get_account_name(aid)}: {label_new} vs {label_old}…",
+        reply_markup=monitoring_menu_kb(),
+    )
+
+    txt = await run_fb_io(build_comparison_report, aid, period_old, label_old, period_new, label_new)
+    if not txt:
+        await context.bot.send_message(chat_id=chat_id, text="Нет данных/нет доступа.")
         return
+    await context.bot.send_message(chat_id=chat_id, text=txt, parse_mode="HTML")
 
-    if data.startswith("mon_acc_toggle|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {}) or {}
-        mon = row.get("monitoring") or {}
-        if not isinstance(mon, dict):
-            mon = {}
 
-        cur = bool(mon.get("compare_enabled", True))
-        mon["compare_enabled"] = not cur
-        row["monitoring"] = mon
-        st[aid] = row
-        save_accounts(st)
+@_CB_ROUTER.prefix("moncmp_lastweek|")
+async def _cb_moncmp_lastweek(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
 
-        await safe_edit_message(
-            q,
-            "⚙️ Мониторинг — выбери аккаунты для сравнения периодов:\n\n"
-            "✅ — включён\n"
-            "(Если снять со всех — сравнение не будет отправлять отчёты)",
-            reply_markup=monitoring_accounts_kb(),
-        )
+    # Полные недели (пн–вс): прошлая vs позапрошлая.
+    now = datetime.now(ALMATY_TZ)
+    start_this_week = (now - timedelta(days=now.weekday())).date()
+    start_last_week = start_this_week - timedelta(days=7)
+    start_prev_week = start_this_week - timedelta(days=14)
+    end_last_week = start_this_week - timedelta(days=1)
+    end_prev_week = start_last_week - timedelta(days=1)
+
+    period_old = {"since": start_prev_week.strftime("%Y-%m-%d"), "until": end_prev_week.strftime("%Y-%m-%d")}
+    period_new = {"since": start_last_week.strftime("%Y-%m-%d"), "until": end_last_week.strftime("%Y-%m-%d")}
+    label_old = f"{start_prev_week.strftime('%d.%m')}-{end_prev_week.strftime('%d.%m')}"
+    label_new = f"{start_last_week.strftime('%d.%m')}-{end_last_week.strftime('%d.%m')}"
+
+    await safe_edit_message(
+        q,
+        f"Сравниваю недели {get_account_name(aid)}: {label_new} vs {label_old}…",
+        reply_markup=monitoring_menu_kb(),
+    )
+
+    txt = await run_fb_io(build_comparison_report, aid, period_old, label_old, period_new, label_new)
+    if not txt:
+        await context.bot.send_message(chat_id=chat_id, text="Нет данных/нет доступа.")
         return
+    await context.bot.send_message(chat_id=chat_id, text=txt, parse_mode="HTML")
 
-    if data == "sync_bm":
-        try:
-            res = upsert_from_bm()
-            last_sync_h = human_last_sync()
-            await safe_edit_message(
-                q,
-                f"✅ Синк завершён. Добавлено: {res['added']}, "
-                f"обновлено: {res['updated']}, пропущено: {res['skipped']}. "
-                f"Всего: {res['total']}\n"
-                f"🕓 Последняя синхронизация: {last_sync_h}",
-                reply_markup=main_menu(),
-            )
-        except Exception as e:
-            await safe_editMessage(
-                q,
-                f"⚠️ Ошибка синка: {e}",
-                reply_markup=main_menu(),
-            )
+
+@_CB_ROUTER.prefix("moncmp_curweek|")
+async def _cb_moncmp_curweek(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+
+    now = datetime.now(ALMATY_TZ)
+    yday = (now - timedelta(days=1)).date()
+    start_this_week = (now - timedelta(days=now.weekday())).date()
+    start_last_week = start_this_week - timedelta(days=7)
+
+    # Текущая неделя: пн..вчера
+    # Прошлая неделя: пн..(пн+N), где N соответствует "вчера" в текущей неделе
+    days_since_monday = (yday - start_this_week).days
+    if days_since_monday < 0:
+        days_since_monday = 0
+    end_last_week = start_last_week + timedelta(days=days_since_monday)
+
+    period_old = {"since": start_last_week.strftime("%Y-%m-%d"), "until": end_last_week.strftime("%Y-%m-%d")}
+    period_new = {"since": start_this_week.strftime("%Y-%m-%d"), "until": yday.strftime("%Y-%m-%d")}
+    label_old = f"{start_last_week.strftime('%d.%m')}-{end_last_week.strftime('%d.%m')}"
+    label_new = f"{start_this_week.strftime('%d.%m')}-{yday.strftime('%d.%m')}"
+
+    await safe_edit_message(
+        q,
+        f"Сравниваю накопление {get_account_name(aid)}: {label_new} vs {label_old}…",
+        reply_markup=monitoring_menu_kb(),
+    )
+
+    txt = await run_fb_io(build_comparison_report, aid, period_old, label_old, period_new, label_new)
+    if not txt:
+        await context.bot.send_message(chat_id=chat_id, text="Нет данных/нет доступа.")
         return
+    await context.bot.send_message(chat_id=chat_id, text=txt, parse_mode="HTML")
+
+
+@_CB_ROUTER.exact("mon_custom_period")
+async def _cb_mon_custom_period(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Кастомный период мониторинга пока не реализован.\n"
+        "Дальше здесь появится выбор диапазона дат и сравнение с таким же по "
+        "длине предыдущим периодом.",
+        reply_markup=monitoring_menu_kb(),
+    )
+
+
+@_CB_ROUTER.exact("mon_settings")
+async def _cb_mon_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "⚙️ Мониторинг — выбери аккаунты для сравнения периодов:\n\n"
+        "✅ — включён\n"
+        "(Если снять со всех — сравнение не будет отправлять отчёты)",
+        reply_markup=monitoring_accounts_kb(),
+    )
+
+
+@_CB_ROUTER.prefix("mon_acc_toggle|")
+async def _cb_mon_acc_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {}) or {}
+    mon = row.get("monitoring") or {}
+    if not isinstance(mon, dict):
+        mon = {}
+
+    cur = bool(mon.get("compare_enabled", True))
+    mon["compare_enabled"] = not cur
+    row["monitoring"] = mon
+    st[aid] = row
+    save_accounts(st)
+
+    await safe_edit_message(
+        q,
+        "⚙️ Мониторинг — выбери аккаунты для сравнения периодов:\n\n"
+        "✅ — включён\n"
+        "(Если снять со всех — сравнение не будет отправлять отчёты)",
+        reply_markup=monitoring_accounts_kb(),
+    )
+
 
-    if data == "choose_acc_report":
+@_CB_ROUTER.exact("sync_bm")
+async def _cb_sync_bm(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    try:
+        res = await run_fb_io(upsert_from_bm)
+        last_sync_h = human_last_sync()
         await safe_edit_message(
             q,
-            "Выберите аккаунт:",
-            reply_markup=accounts_kb("rep1"),
+            f"✅ Синк завершён. Добавлено: {res['added']}, "
+            f"обновлено: {res['updated']}, пропущено: {res['skipped']}. "
+            f"Всего: {res['total']}\n"
+            f"🕓 Последняя синхронизация: {last_sync_h}",
+            reply_markup=main_menu(),
         )
-        return
-
-    if data.startswith("rep1|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
+    except Exception as e:
+        await safe_editMessage(
             q,
-            f"Отчёт по: {get_account_name(aid)}\nВыберите тип отчёта:",
-            reply_markup=account_report_mode_kb(aid),
+            f"⚠️ Ошибка синка: {e}",
+            reply_markup=main_menu(),
         )
-        return
 
-    if data.startswith("one_mode_acc|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"Отчёт по: {get_account_name(aid)}\nВыбери период:",
-            reply_markup=period_kb_for(aid),
-        )
-        return
 
-    if data.startswith("one_mode_adsets|"):
-        aid = data.split("|", 1)[1]
-        await q.edit_message_text(
-            f"Готовлю отчёт по адсетам для {get_account_name(aid)} "
-            f"за последние 7 дней…"
-        )
-        await send_adset_report(context, chat_id, aid)
-        return
+@_CB_ROUTER.exact("choose_acc_report")
+async def _cb_choose_acc_report(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт:",
+        reply_markup=accounts_kb("rep1"),
+    )
 
-    if data.startswith("one_today|"):
-        aid = data.split("|", 1)[1]
-        label = datetime.now(ALMATY_TZ).strftime("%d.%m.%Y")
-        await safe_edit_message(
-            q,
-            f"Отчёт по {get_account_name(aid)} за {label}:",
-        )
-        txt = get_cached_report(aid, "today", label)
-        await context.bot.send_message(
-            chat_id,
-            txt or "Нет данных/нет доступа.",
-            parse_mode="HTML",
-        )
-        return
 
-    if data.startswith("one_yday|"):
-        aid = data.split("|", 1)[1]
-        label = (datetime.now(ALMATY_TZ) - timedelta(days=1)).strftime("%d.%m.%Y")
-        await q.edit_message_text(
-            f"Отчёт по {get_account_name(aid)} за {label}:"
-        )
-        txt = get_cached_report(aid, "yesterday", label)
-        await context.bot.send_message(
-            chat_id,
-            txt or "Нет данных/нет доступа.",
-            parse_mode="HTML",
-        )
-        return
+@_CB_ROUTER.prefix("rep1|")
+async def _cb_rep1(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Отчёт по: {get_account_name(aid)}\nВыберите тип отчёта:",
+        reply_markup=account_report_mode_kb(aid),
+    )
 
-    if data.startswith("one_week|"):
-        aid = data.split("|", 1)[1]
-        until = datetime.now(ALMATY_TZ) - timedelta(days=1)
-        since = until - timedelta(days=6)
-        period = {
-            "since": since.strftime("%Y-%m-%d"),
-            "until": until.strftime("%Y-%m-%d"),
-        }
-        label = f"{since.strftime('%d.%m')}-{until.strftime('%d.%m')}"
-        await q.edit_message_text(
-            f"Отчёт по {get_account_name(aid)} за {label}:"
-        )
-        txt = get_cached_report(aid, period, label)
-        await context.bot.send_message(
-            chat_id,
-            txt or "Нет данных/нет доступа.",
-            parse_mode="HTML",
-        )
-        return
 
-    if data.startswith("one_custom|"):
-        aid = data.split("|", 1)[1]
-        context.user_data["await_range_for"] = aid
-        await safe_edit_message(
-            q,
-            f"Введи даты для {get_account_name(aid)} форматом: 01.06.2025-07.06.2025",
-            reply_markup=period_kb_for(aid),
-        )
-        return
+@_CB_ROUTER.prefix("one_mode_acc|")
+async def _cb_one_mode_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Отчёт по: {get_account_name(aid)}\nВыбери период:",
+        reply_markup=period_kb_for(aid),
+    )
 
-    if data.startswith("cmp_menu|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"Сравнение периодов для {get_account_name(aid)}:",
-            reply_markup=compare_kb_for(aid),
-        )
-        return
 
-    if data.startswith("back_periods|"):
-        aid = data.split("|", 1)[1]
-        await q.edit_message_text(
-            f"Отчёт по: {get_account_name(aid)}\nВыбери период:",
-            reply_markup=period_kb_for(aid),
-        )
-        return
+@_CB_ROUTER.prefix("one_mode_adsets|")
+async def _cb_one_mode_adsets(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await q.edit_message_text(
+        f"Готовлю отчёт по адсетам для {get_account_name(aid)} "
+        f"за последние 7 дней…"
+    )
+    await send_adset_report(context, chat_id, aid)
 
-    if data.startswith("cmp_week|"):
-        aid = data.split("|", 1)[1]
-        now = datetime.now(ALMATY_TZ)
-        until2 = now - timedelta(days=1)
-        since2 = until2 - timedelta(days=6)
-        until1 = since2 - timedelta(days=1)
-        since1 = until1 - timedelta(days=6)
-        period1 = {
-            "since": since1.strftime("%Y-%m-%d"),
-            "until": until1.strftime("%Y-%m-%d"),
-        }
-        period2 = {
-            "since": since2.strftime("%Y-%m-%d"),
-            "until": until2.strftime("%Y-%m-%d"),
-        }
-        label1 = f"{since1.strftime('%d.%m')}-{until1.strftime('%d.%m')}"
-        label2 = f"{since2.strftime('%d.%m')}-{until2.strftime('%d.%m')}"
 
-        await safe_edit_message(q, f"Сравниваю {label1} vs {label2}…")
-        txt = build_comparison_report(aid, period1, label1, period2, label2)
-        await context.bot.send_message(chat_id, txt, parse_mode="HTML")
-        return
+@_CB_ROUTER.prefix("one_today|")
+async def _cb_one_today(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    label = datetime.now(ALMATY_TZ).strftime("%d.%m.%Y")
+    await safe_edit_message(
+        q,
+        f"Отчёт по {get_account_name(aid)} за {label}:",
+    )
+    txt = await run_fb_io(get_cached_report, aid, "today", label)
+    await context.bot.send_message(
+        chat_id,
+        txt or "Нет данных/нет доступа.",
+        parse_mode="HTML",
+    )
 
-    if data.startswith("cmp_custom|"):
-        aid = data.split("|", 1)[1]
-        context.user_data["await_cmp_for"] = aid
-        await safe_edit_message(
-            q,
-            "Отправь два диапазона дат через ';' или с новой строки.\n"
-            "Например:\n"
-            "01.06.2025-07.06.2025;08.06.2025-14.06.2025",
-            reply_markup=compare_kb_for(aid),
-        )
-        return
 
-    if data.startswith("hmcustom|"):
-        aid = data.split("|", 1)[1]
-        context.user_data["await_heatmap_range_for"] = aid
-        await safe_edit_message(
-            q,
-            "Введи даты для тепловой карты форматом: 01.06.2025-07.06.2025",
-            reply_markup=heatmap_menu(aid),
-        )
-        return
+@_CB_ROUTER.prefix("one_yday|")
+async def _cb_one_yday(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    label = (datetime.now(ALMATY_TZ) - timedelta(days=1)).strftime("%d.%m.%Y")
+    await q.edit_message_text(
+        f"Отчёт по {get_account_name(aid)} за {label}:"
+    )
+    txt = await run_fb_io(get_cached_report, aid, "yesterday", label)
+    await context.bot.send_message(
+        chat_id,
+        txt or "Нет данных/нет доступа.",
+        parse_mode="HTML",
+    )
 
-    if data == "hm_hourly_menu":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для почасовой тепловой карты:",
-            reply_markup=heatmap_hourly_accounts_kb(),
-        )
-        return
 
-    if data == "mon_heatmap_menu":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для тепловой карты:",
-            reply_markup=heatmap_monitoring_accounts_kb(),
-        )
-        return
+@_CB_ROUTER.prefix("one_week|")
+async def _cb_one_week(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    until = datetime.now(ALMATY_TZ) - timedelta(days=1)
+    since = until - timedelta(days=6)
+    period = {
+        "since": since.strftime("%Y-%m-%d"),
+        "until": until.strftime("%Y-%m-%d"),
+    }
+    label = f"{since.strftime('%d.%m')}-{until.strftime('%d.%m')}"
+    await q.edit_message_text(
+        f"Отчёт по {get_account_name(aid)} за {label}:"
+    )
+    txt = await run_fb_io(get_cached_report, aid, period, label)
+    await context.bot.send_message(
+        chat_id,
+        txt or "Нет данных/нет доступа.",
+        parse_mode="HTML",
+    )
 
-    if data.startswith("mon_hm_acc|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"🔥 Тепловая карта — {get_account_name(aid)}\nВыберите режим:",
-            reply_markup=heatmap_monitoring_modes_kb(aid),
-        )
-        return
 
-    if data.startswith("mon_hmh|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"Выберите период для почасовой тепловой карты по {get_account_name(aid)}:",
-            reply_markup=heatmap_monitoring_hourly_periods_kb(aid),
-        )
-        return
+@_CB_ROUTER.prefix("one_custom|")
+async def _cb_one_custom(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    context.user_data["await_range_for"] = aid
+    await safe_edit_message(
+        q,
+        f"Введи даты для {get_account_name(aid)} форматом: 01.06.2025-07.06.2025",
+        reply_markup=period_kb_for(aid),
+    )
 
-    if data.startswith("mon_hmh_p|"):
-        _, aid, mode = data.split("|", 2)
 
-        text_hm, summary = build_hourly_heatmap_for_account(aid, get_account_name, mode)
+@_CB_ROUTER.prefix("cmp_menu|")
+async def _cb_cmp_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Сравнение периодов для {get_account_name(aid)}:",
+        reply_markup=compare_kb_for(aid),
+    )
 
-        await safe_edit_message(q, text_hm)
 
-        try:
-            total_convs_all = int((summary or {}).get("total_conversions_all", 0) or 0)
-            total_spend_all = float((summary or {}).get("total_spend_all", 0.0) or 0.0)
-            live_today = (summary or {}).get("live_today") or {}
-            live_spend = float((live_today or {}).get("spend", 0.0) or 0.0)
-            live_total = int((live_today or {}).get("total_conversions", 0) or 0)
-        except Exception:
-            total_convs_all = 0
-            total_spend_all = 0.0
-            live_spend = 0.0
-            live_total = 0
+@_CB_ROUTER.prefix("back_periods|")
+async def _cb_back_periods(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await q.edit_message_text(
+        f"Отчёт по: {get_account_name(aid)}\nВыбери период:",
+        reply_markup=period_kb_for(aid),
+    )
 
-        if total_convs_all <= 0 and total_spend_all <= 0 and live_spend <= 0 and live_total <= 0:
-            return
 
-        chat_id = str(q.message.chat.id)
-        stop_event = asyncio.Event()
-        typing_task = asyncio.create_task(_typing_loop(context.bot, chat_id, stop_event))
+@_CB_ROUTER.prefix("cmp_week|")
+async def _cb_cmp_week(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    now = datetime.now(ALMATY_TZ)
+    until2 = now - timedelta(days=1)
+    since2 = until2 - timedelta(days=6)
+    until1 = since2 - timedelta(days=1)
+    since1 = until1 - timedelta(days=6)
+    period1 = {
+        "since": since1.strftime("%Y-%m-%d"),
+        "until": until1.strftime("%Y-%m-%d"),
+    }
+    period2 = {
+        "since": since2.strftime("%Y-%m-%d"),
+        "until": until2.strftime("%Y-%m-%d"),
+    }
+    label1 = f"{since1.strftime('%d.%m')}-{until1.strftime('%d.%m')}"
+    label2 = f"{since2.strftime('%d.%m')}-{until2.strftime('%d.%m')}"
+
+    await safe_edit_message(q, f"Сравниваю {label1} vs {label2}…")
+    txt = await run_fb_io(build_comparison_report, aid, period1, label1, period2, label2)
+    await context.bot.send_message(chat_id, txt, parse_mode="HTML")
+
+
+@_CB_ROUTER.prefix("cmp_custom|")
+async def _cb_cmp_custom(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    context.user_data["await_cmp_for"] = aid
+    await safe_edit_message(
+        q,
+        "Отправь два диапазона дат через ';' или с новой строки.\n"
+        "Например:\n"
+        "01.06.2025-07.06.2025;08.06.2025-14.06.2025",
+        reply_markup=compare_kb_for(aid),
+    )
 
-        focus_comment = None
-        try:
-            system_msg = (
-                "Ты — продвинутый аналитик по почасовой активности рекламы. "
-                "Отвечай ТОЛЬКО на русском языке. "
-                "Тебе дана матрица заявок по дням и часам, а также суммарные заявки и затраты. "
-                "Определи лучшие часы по заявкам, 'мёртвые' часы, различия между буднями и выходными (если есть) "
-                "и предложи 2–3 практических рекомендации по бюджетам/ставкам. "
-                "Отвечай кратко (до 5–7 строк обычного текста), без JSON."
-            )
 
-            summary_for_ai = dict(summary or {})
-            user_msg = json.dumps(summary_for_ai, ensure_ascii=False)
+@_CB_ROUTER.prefix("hmcustom|")
+async def _cb_hmcustom(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    context.user_data["await_heatmap_range_for"] = aid
+    await safe_edit_message(
+        q,
+        "Введи даты для тепловой карты форматом: 01.06.2025-07.06.2025",
+        reply_markup=heatmap_menu(aid),
+    )
 
-            ds_resp = await ask_deepseek(
-                [
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": user_msg},
-                ],
-                json_mode=False,
-                andrey_tone=True,
-            )
-            choice = (ds_resp.get("choices") or [{}])[0]
-            focus_comment = (choice.get("message") or {}).get("content")
-        except Exception as e:
-            focus_comment = (
-                "Фокус-ИИ по тепловой карте сейчас недоступен (ошибка ИИ-сервиса). "
-                f"Причина: {type(e).__name__}. Данные выше показаны без анализа."
-            )
-        finally:
-            stop_event.set()
-            try:
-                await typing_task
-            except Exception:
-                pass
 
-            return
+@_CB_ROUTER.exact("hm_hourly_menu")
+async def _cb_hm_hourly_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для почасовой тепловой карты:",
+        reply_markup=heatmap_hourly_accounts_kb(),
+    )
 
-        if focus_comment:
-            await context.bot.send_message(
-                chat_id,
-                f"🤖 Анализ почасовой тепловой карты:\n{focus_comment.strip()}",
-            )
-        return
 
-    if data.startswith("mon_hmdow|"):
-        aid = data.split("|", 1)[1]
-        text_dow, _summary = build_weekday_heatmap_for_account(aid, get_account_name)
-        await safe_edit_message(q, text_dow)
-        return
+@_CB_ROUTER.exact("mon_heatmap_menu")
+async def _cb_mon_heatmap_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для тепловой карты:",
+        reply_markup=heatmap_monitoring_accounts_kb(),
+    )
 
-    if data.startswith("mon_hmsum|"):
-        aid = data.split("|", 1)[1]
-        text_sum, summary = build_heatmap_monitoring_summary(aid, get_account_name)
-        await safe_edit_message(q, text_sum)
 
-        chat_id = str(q.message.chat.id)
-        stop_event = asyncio.Event()
-        typing_task = asyncio.create_task(
-            _typing_loop(context.bot, chat_id, stop_event)
-        )
+@_CB_ROUTER.prefix("mon_hm_acc|")
+async def _cb_mon_hm_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"🔥 Тепловая карта — {get_account_name(aid)}\nВыберите режим:",
+        reply_markup=heatmap_monitoring_modes_kb(aid),
+    )
 
-        focus_comment = None
-        try:
-            system_msg = (
-                "Ты — продвинутый аналитик по недельной и почасовой активности рекламы. "
-                "Отвечай ТОЛЬКО на русском языке. "
-                "Тебе дана сводка по дням недели и по часам (агрегаты заявок и затрат). "
-                "Сформулируй рекомендации: какие дни недели и часы усиливать, какие можно отключать/снижать, "
-                "и как перераспределить бюджеты в течение недели. "
-                "Отвечай кратко (до 7–10 строк обычного текста), без JSON."
-            )
 
-            user_msg = json.dumps(summary or {}, ensure_ascii=False)
-            ds_resp = await ask_deepseek(
-                [
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": user_msg},
-                ],
-                json_mode=False,
-                andrey_tone=True,
-            )
-            choice = (ds_resp.get("choices") or [{}])[0]
-            focus_comment = (choice.get("message") or {}).get("content")
-        except Exception as e:
-            focus_comment = (
-                "Фокус-ИИ по тепловой карте сейчас недоступен (ошибка ИИ-сервиса). "
-                f"Причина: {type(e).__name__}. Данные выше показаны без анализа."
-            )
-        finally:
-            stop_event.set()
-            try:
-                await typing_task
-            except Exception:
-                pass
+@_CB_ROUTER.prefix("mon_hmh|")
+async def _cb_mon_hmh(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Выберите период для почасовой тепловой карты по {get_account_name(aid)}:",
+        reply_markup=heatmap_monitoring_hourly_periods_kb(aid),
+    )
 
-        if focus_comment:
-            await context.bot.send_message(
-                chat_id,
-                f"🤖 Рекомендации по тепловой карте:\n{focus_comment.strip()}",
-            )
-        return
 
-    if data.startswith("hmh_acc|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"Выберите период для почасовой тепловой карты по {get_account_name(aid)}:",
-            reply_markup=heatmap_hourly_periods_kb(aid),
-        )
+@_CB_ROUTER.prefix("mon_hmh_p|")
+async def _cb_mon_hmh_p(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, mode = data.split("|", 2)
+
+    text_hm, summary = build_hourly_heatmap_for_account(aid, get_account_name, mode)
+
+    await safe_edit_message(q, text_hm)
+
+    try:
+        total_convs_all = int((summary or {}).get("total_conversions_all", 0) or 0)
+        total_spend_all = float((summary or {}).get("total_spend_all", 0.0) or 0.0)
+        live_today = (summary or {}).get("live_today") or {}
+        live_spend = float((live_today or {}).get("spend", 0.0) or 0.0)
+        live_total = int((live_today or {}).get("total_conversions", 0) or 0)
+    except Exception:
+        total_convs_all = 0
+        total_spend_all = 0.0
+        live_spend = 0.0
+        live_total = 0
+
+    if total_convs_all <= 0 and total_spend_all <= 0 and live_spend <= 0 and live_total <= 0:
         return
 
-    if data.startswith("hmh_p|"):
-        _, aid, mode = data.split("|", 2)
+    chat_id = str(q.message.chat.id)
+    stop_event = asyncio.Event()
+    typing_task = asyncio.create_task(_typing_loop(context.bot, chat_id, stop_event))
 
-        text_hm, summary = build_hourly_heatmap_for_account(aid, get_account_name, mode)
+    focus_comment = None
+    try:
+        system_msg = (
+            "Ты — продвинутый аналитик по почасовой активности рекламы. "
+            "Отвечай ТОЛЬКО на русском языке. "
+            "Тебе дана матрица заявок по дням и часам, а также суммарные заявки и затраты. "
+            "Определи лучшие часы по заявкам, 'мёртвые' часы, различия между буднями и выходными (если есть) "
+            "и предложи 2–3 практических рекомендации по бюджетам/ставкам. "
+            "Отвечай кратко (до 5–7 строк обычного текста), без JSON."
+        )
 
-        await safe_edit_message(q, text_hm)
+        summary_for_ai = dict(summary or {})
+        user_msg = json.dumps(summary_for_ai, ensure_ascii=False)
 
+        ds_resp = await ask_deepseek(
+            [
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": user_msg},
+            ],
+            json_mode=False,
+            andrey_tone=True,
+        )
+        choice = (ds_resp.get("choices") or [{}])[0]
+        focus_comment = (choice.get("message") or {}).get("content")
+    except Exception as e:
+        focus_comment = (
+            "Фокус-ИИ по тепловой карте сейчас недоступен (ошибка ИИ-сервиса). "
+            f"Причина: {type(e).__name__}. Данные выше показаны без анализа."
+        )
+    finally:
+        stop_event.set()
         try:
-            total_convs_all = int((summary or {}).get("total_conversions_all", 0) or 0)
-            total_spend_all = float((summary or {}).get("total_spend_all", 0.0) or 0.0)
-            live_today = (summary or {}).get("live_today") or {}
-            live_spend = float((live_today or {}).get("spend", 0.0) or 0.0)
-            live_total = int((live_today or {}).get("total_conversions", 0) or 0)
+            await typing_task
         except Exception:
-            total_convs_all = 0
-            total_spend_all = 0.0
-            live_spend = 0.0
-            live_total = 0
+            pass
 
-        if total_convs_all <= 0 and total_spend_all <= 0 and live_spend <= 0 and live_total <= 0:
-            return
+        return
 
-        # ИИ-анализ почасовой карты с анимацией "бот печатает"
-        chat_id = str(q.message.chat.id)
-        stop_event = asyncio.Event()
-        typing_task = asyncio.create_task(
-            _typing_loop(context.bot, chat_id, stop_event)
+    if focus_comment:
+        await context.bot.send_message(
+            chat_id,
+            f"🤖 Анализ почасовой тепловой карты:\n{focus_comment.strip()}",
         )
 
-        focus_comment = None
-        try:
-            system_msg = (
-                "Ты — продвинутый аналитик по почасовой активности рекламы. "
-                "Отвечай ТОЛЬКО на русском языке. "
-                "Тебе дана матрица заявок по дням и часам, а также суммарные заявки и затраты. "
-                "Определи лучшие часы по заявкам, 'мёртвые' часы, различия между буднями и выходными (если есть) "
-                "и предложи 2–3 практических рекомендации по бюджетам/ставкам. "
-                "Отвечай кратко (до 5–7 строк обычного текста), без JSON."
-            )
-
-            summary_for_ai = dict(summary or {})
-            try:
-                raw = json.dumps(summary_for_ai, ensure_ascii=False)
-                if len(raw) > 30000:
-                    days = summary_for_ai.get("days") or []
-                    summary_for_ai["days"] = days[-3:]
-                    raw = json.dumps(summary_for_ai, ensure_ascii=False)
-            except Exception:
-                raw = json.dumps(summary, ensure_ascii=False)
 
-            user_msg = raw
+@_CB_ROUTER.prefix("mon_hmdow|")
+async def _cb_mon_hmdow(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    text_dow, _summary = build_weekday_heatmap_for_account(aid, get_account_name)
+    await safe_edit_message(q, text_dow)
 
-            ds_resp = await ask_deepseek(
-                [
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": user_msg},
-                ],
-                json_mode=False,
-                andrey_tone=True,
-            )
 
-            choice = (ds_resp.get("choices") or [{}])[0]
-            focus_comment = (choice.get("message") or {}).get("content")
-        except Exception as e:
-            # Явно помечаем, что ИИ-анализ недоступен, чтобы пользователь видел причину.
-            focus_comment = (
-                "Фокус-ИИ по тепловой карте сейчас недоступен (ошибка ИИ-сервиса). "
-                f"Причина: {type(e).__name__}. Данные выше показаны без анализа."
-            )
-        finally:
-            stop_event.set()
-            try:
-                await typing_task
-            except Exception:
-                pass
+@_CB_ROUTER.prefix("mon_hmsum|")
+async def _cb_mon_hmsum(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    text_sum, summary = build_heatmap_monitoring_summary(aid, get_account_name)
+    await safe_edit_message(q, text_sum)
 
-        if focus_comment:
-            await context.bot.send_message(
-                chat_id,
-                f"🤖 Анализ почасовой тепловой карты:\n{focus_comment.strip()}",
-            )
-        return
+    chat_id = str(q.message.chat.id)
+    stop_event = asyncio.Event()
+    typing_task = asyncio.create_task(
+        _typing_loop(context.bot, chat_id, stop_event)
+    )
 
-    if data == "choose_acc_settings":
-        await safe_edit_message(
-            q,
-            "Выберите аккаунт для настроек:",
-            reply_markup=accounts_kb("set1"),
+    focus_comment = None
+    try:
+        system_msg = (
+            "Ты — продвинутый аналитик по недельной и почасовой активности рекламы. "
+            "Отвечай ТОЛЬКО на русском языке. "
+            "Тебе дана сводка по дням недели и по часам (агрегаты заявок и затрат). "
+            "Сформулируй рекомендации: какие дни недели и часы усиливать, какие можно отключать/снижать, "
+            "и как перераспределить бюджеты в течение недели. "
+            "Отвечай кратко (до 7–10 строк обычного текста), без JSON."
         )
-        return
 
-    if data.startswith("set1|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"Настройки: {get_account_name(aid)}",
-            reply_markup=settings_kb(aid),
+        user_msg = json.dumps(summary or {}, ensure_ascii=False)
+        ds_resp = await ask_deepseek(
+            [
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": user_msg},
+            ],
+            json_mode=False,
+            andrey_tone=True,
         )
-        return
-
-    if data.startswith("lead_metric"):
-        try:
-            aid = data.split("|", 1)[1]
-        except Exception:
-            aid = ""
+        choice = (ds_resp.get("choices") or [{}])[0]
+        focus_comment = (choice.get("message") or {}).get("content")
+    except Exception as e:
+        focus_comment = (
+            "Фокус-ИИ по тепловой карте сейчас недоступен (ошибка ИИ-сервиса). "
+            f"Причина: {type(e).__name__}. Данные выше показаны без анализа."
+        )
+    finally:
+        stop_event.set()
         try:
-            await q.answer("Метрика лидов фиксирована: Website Submit Applications / SubmitApplication", show_alert=True)
+            await typing_task
         except Exception:
             pass
-        kb = InlineKeyboardMarkup(
-            [[InlineKeyboardButton("⬅️ Назад", callback_data=f"set1|{aid}")]]
-        )
-        await safe_edit_message(
-            q,
-            "📩 Лиды считаются строго по: Website Submit Applications / SubmitApplication",
-            reply_markup=kb,
-        )
-        return
 
-    if data.startswith("toggle_enabled|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {})
-        row["enabled"] = not row.get("enabled", True)
-        st[aid] = row
-        save_accounts(st)
-        await q.edit_message_text(
-            f"Настройки: {get_account_name(aid)}",
-            reply_markup=settings_kb(aid),
+    if focus_comment:
+        await context.bot.send_message(
+            chat_id,
+            f"🤖 Рекомендации по тепловой карте:\n{focus_comment.strip()}",
         )
-        return
 
-    if data.startswith("cpa_settings|"):
-        aid = data.split("|", 1)[1]
-        text, kb = cpa_settings_kb(aid)
-        await safe_edit_message(q, text, reply_markup=kb)
-        return
 
-    if data.startswith("cpa_campaigns|"):
-        aid = data.split("|", 1)[1]
+@_CB_ROUTER.prefix("hmh_acc|")
+async def _cb_hmh_acc(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Выберите период для почасовой тепловой карты по {get_account_name(aid)}:",
+        reply_markup=heatmap_hourly_periods_kb(aid),
+    )
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        campaign_alerts = alerts.get("campaign_alerts", {}) or {}
 
-        kb_rows = []
-        for camp in _campaign_options_from_snapshots(aid):
-            cid = (camp or {}).get("id")
-            if not cid:
-                continue
-            name = (camp or {}).get("name") or cid
-            cfg_c = (campaign_alerts.get(cid) or {}) if cid in campaign_alerts else {}
-            target = float(cfg_c.get("target_cpa") or 0.0)
-            label_suffix = (
-                f"[CPA {target:.2f}$]" if target > 0 else "[CPA аккаунта]"
-            )
-            enabled_c = bool(cfg_c.get("enabled", False))
-            # В списке кампаний: один индикатор ⚠️, если CPA-алёрт для кампании включён.
-            indicator = "⚠️ " if enabled_c else ""
-            text_btn = f"{indicator}{name} {label_suffix}".strip()
+@_CB_ROUTER.prefix("hmh_p|")
+async def _cb_hmh_p(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, mode = data.split("|", 2)
 
-            kb_rows.append(
-                [
-                    InlineKeyboardButton(
-                        text_btn,
-                        callback_data=f"cpa_campaign|{aid}|{cid}",
-                    )
-                ]
-            )
+    text_hm, summary = build_hourly_heatmap_for_account(aid, get_account_name, mode)
 
-        kb_rows.append(
-            [
-                InlineKeyboardButton(
-                    "⬅️ Назад", callback_data=f"cpa_settings|{aid}"
-                )
-            ]
-        )
+    await safe_edit_message(q, text_hm)
 
-        text = "Выбери кампанию для настройки CPA-алёртов."
-        await safe_edit_message(
-            q,
-            text,
-            reply_markup=InlineKeyboardMarkup(kb_rows),
-        )
+    try:
+        total_convs_all = int((summary or {}).get("total_conversions_all", 0) or 0)
+        total_spend_all = float((summary or {}).get("total_spend_all", 0.0) or 0.0)
+        live_today = (summary or {}).get("live_today") or {}
+        live_spend = float((live_today or {}).get("spend", 0.0) or 0.0)
+        live_total = int((live_today or {}).get("total_conversions", 0) or 0)
+    except Exception:
+        total_convs_all = 0
+        total_spend_all = 0.0
+        live_spend = 0.0
+        live_total = 0
+
+    if total_convs_all <= 0 and total_spend_all <= 0 and live_spend <= 0 and live_total <= 0:
         return
 
-    if data.startswith("cpa_campaign|"):
-        _, aid, campaign_id = data.split("|", 2)
+    # ИИ-анализ почасовой карты с анимацией "бот печатает"
+    chat_id = str(q.message.chat.id)
+    stop_event = asyncio.Event()
+    typing_task = asyncio.create_task(
+        _typing_loop(context.bot, chat_id, stop_event)
+    )
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        campaign_alerts = alerts.setdefault("campaign_alerts", {})
-        cfg = campaign_alerts.get(campaign_id) or {}
+    focus_comment = None
+    try:
+        system_msg = (
+            "Ты — продвинутый аналитик по почасовой активности рекламы. "
+            "Отвечай ТОЛЬКО на русском языке. "
+            "Тебе дана матрица заявок по дням и часам, а также суммарные заявки и затраты. "
+            "Определи лучшие часы по заявкам, 'мёртвые' часы, различия между буднями и выходными (если есть) "
+            "и предложи 2–3 практических рекомендации по бюджетам/ставкам. "
+            "Отвечай кратко (до 5–7 строк обычного текста), без JSON."
+        )
 
-        camp_name = _campaign_name_from_snapshots(aid, campaign_id) or campaign_id
+        summary_for_ai = dict(summary or {})
+        try:
+            raw = json.dumps(summary_for_ai, ensure_ascii=False)
+            if len(raw) > 30000:
+                days = summary_for_ai.get("days") or []
+                summary_for_ai["days"] = days[-3:]
+                raw = json.dumps(summary_for_ai, ensure_ascii=False)
+        except Exception:
+            raw = json.dumps(summary, ensure_ascii=False)
 
-        account_cpa = _resolve_account_cpa(alerts)
-        target_cpa = float(cfg.get("target_cpa") or 0.0)
-        effective_target = target_cpa if target_cpa > 0 else account_cpa
-        enabled = bool(cfg.get("enabled", True))
+        user_msg = raw
 
-        mode_str = "свой таргет" if target_cpa > 0 else "наследует CPA аккаунта"
-        status_str = "ВКЛ" if enabled else "ВЫКЛ"
+        ds_resp = await ask_deepseek(
+            [
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": user_msg},
+            ],
+            json_mode=False,
+            andrey_tone=True,
+        )
 
-        text = (
-            "CPA-алёрты для кампании:\n\n"
-            f"{camp_name}\n\n"
-            f"Эффективный target CPA: {effective_target:.2f} $ ({mode_str})\n"
-            f"Статус CPA-алёртов кампании: {status_str}"
+        choice = (ds_resp.get("choices") or [{}])[0]
+        focus_comment = (choice.get("message") or {}).get("content")
+    except Exception as e:
+        # Явно помечаем, что ИИ-анализ недоступен, чтобы пользователь видел причину.
+        focus_comment = (
+            "Фокус-ИИ по тепловой карте сейчас недоступен (ошибка ИИ-сервиса). "
+            f"Причина: {type(e).__name__}. Данные выше показаны без анализа."
         )
+    finally:
+        stop_event.set()
+        try:
+            await typing_task
+        except Exception:
+            pass
 
-        toggle_text = (
-            "⚠️ CPA-алёрты кампании: ON" if enabled else "⚠️ CPA-алёрты кампании: OFF"
+    if focus_comment:
+        await context.bot.send_message(
+            chat_id,
+            f"🤖 Анализ почасовой тепловой карты:\n{focus_comment.strip()}",
         )
 
-        kb = InlineKeyboardMarkup(
+
+@_CB_ROUTER.exact("choose_acc_settings")
+async def _cb_choose_acc_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    await safe_edit_message(
+        q,
+        "Выберите аккаунт для настроек:",
+        reply_markup=accounts_kb("set1"),
+    )
+
+
+@_CB_ROUTER.prefix("set1|")
+async def _cb_set1(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Настройки: {get_account_name(aid)}",
+        reply_markup=settings_kb(aid),
+    )
+
+
+@_CB_ROUTER.prefix("lead_metric")
+async def _cb_lead_metric(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    try:
+        aid = data.split("|", 1)[1]
+    except Exception:
+        aid = ""
+    try:
+        await q.answer("Метрика лидов фиксирована: Website Submit Applications / SubmitApplication", show_alert=True)
+    except Exception:
+        pass
+    kb = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("⬅️ Назад", callback_data=f"set1|{aid}")]]
+    )
+    await safe_edit_message(
+        q,
+        "📩 Лиды считаются строго по: Website Submit Applications / SubmitApplication",
+        reply_markup=kb,
+    )
+
+
+@_CB_ROUTER.prefix("toggle_enabled|")
+async def _cb_toggle_enabled(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {})
+    row["enabled"] = not row.get("enabled", True)
+    st[aid] = row
+    save_accounts(st)
+    await q.edit_message_text(
+        f"Настройки: {get_account_name(aid)}",
+        reply_markup=settings_kb(aid),
+    )
+
+
+@_CB_ROUTER.prefix("cpa_settings|")
+async def _cb_cpa_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    text, kb = cpa_settings_kb(aid)
+    await safe_edit_message(q, text, reply_markup=kb)
+
+
+@_CB_ROUTER.prefix("cpa_campaigns|")
+async def _cb_cpa_campaigns(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+
+    st = load_accounts_view()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    campaign_alerts = alerts.get("campaign_alerts", {}) or {}
+
+    kb_rows = []
+    for camp in _campaign_options_from_snapshots(aid):
+        cid = (camp or {}).get("id")
+        if not cid:
+            continue
+        name = (camp or {}).get("name") or cid
+        cfg_c = (campaign_alerts.get(cid) or {}) if cid in campaign_alerts else {}
+        target = float(cfg_c.get("target_cpa") or 0.0)
+        label_suffix = (
+            f"[CPA {target:.2f}$]" if target > 0 else "[CPA аккаунта]"
+        )
+        enabled_c = bool(cfg_c.get("enabled", False))
+        # В списке кампаний: один индикатор ⚠️, если CPA-алёрт для кампании включён.
+        indicator = "⚠️ " if enabled_c else ""
+        text_btn = f"{indicator}{name} {label_suffix}".strip()
+
+        kb_rows.append(
             [
-                [
-                    InlineKeyboardButton(
-                        toggle_text,
-                        callback_data=f"cpa_campaign_toggle|{aid}|{campaign_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "✏️ Задать CPA для кампании",
-                        callback_data=f"cpa_campaign_set|{aid}|{campaign_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "↩️ Наследовать CPA аккаунта",
-                        callback_data=f"cpa_campaign_inherit|{aid}|{campaign_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "⬅️ Назад к списку кампаний",
-                        callback_data=f"cpa_campaigns|{aid}",
-                    )
-                ],
+                InlineKeyboardButton(
+                    text_btn,
+                    callback_data=f"cpa_campaign|{aid}|{cid}",
+                )
             ]
         )
 
-        await safe_edit_message(
-            q,
-            text,
-            reply_markup=kb,
-        )
-        return
+    kb_rows.append(
+        [
+            InlineKeyboardButton(
+                "⬅️ Назад", callback_data=f"cpa_settings|{aid}"
+            )
+        ]
+    )
 
-    if data.startswith("cpa_campaign_toggle|"):
-        _, aid, campaign_id = data.split("|", 2)
+    text = "Выбери кампанию для настройки CPA-алёртов."
+    await safe_edit_message(
+        q,
+        text,
+        reply_markup=InlineKeyboardMarkup(kb_rows),
+    )
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        campaign_alerts = alerts.setdefault("campaign_alerts", {})
-        cfg = campaign_alerts.get(campaign_id) or {}
 
-        cfg["enabled"] = not bool(cfg.get("enabled", True))
-        campaign_alerts[campaign_id] = cfg
-        alerts["campaign_alerts"] = campaign_alerts
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
+@_CB_ROUTER.prefix("cpa_campaign|")
+async def _cb_cpa_campaign(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, campaign_id = data.split("|", 2)
 
-        # После переключения статуса возвращаемся к списку кампаний
-        new_data = f"cpa_campaigns|{aid}"
-        await _on_cb_internal(update, context, q, chat_id, new_data)
-        return
+    st = load_accounts_view()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    campaign_alerts = alerts.get("campaign_alerts") or {}
+    cfg = campaign_alerts.get(campaign_id) or {}
 
-    if data.startswith("cpa_campaign_set|"):
-        _, aid, campaign_id = data.split("|", 2)
+    camp_name = _campaign_name_from_snapshots(aid, campaign_id) or campaign_id
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        campaign_alerts = alerts.setdefault("campaign_alerts", {})
-        cfg = campaign_alerts.get(campaign_id) or {}
+    account_cpa = _resolve_account_cpa(alerts)
+    target_cpa = float(cfg.get("target_cpa") or 0.0)
+    effective_target = target_cpa if target_cpa > 0 else account_cpa
+    enabled = bool(cfg.get("enabled", True))
 
-        current = float(cfg.get("target_cpa") or 0.0)
+    mode_str = "свой таргет" if target_cpa > 0 else "наследует CPA аккаунта"
+    status_str = "ВКЛ" if enabled else "ВЫКЛ"
 
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
+    text = (
+        "CPA-алёрты для кампании:\n\n"
+        f"{camp_name}\n\n"
+        f"Эффективный target CPA: {effective_target:.2f} $ ({mode_str})\n"
+        f"Статус CPA-алёртов кампании: {status_str}"
+    )
 
-        await safe_edit_message(
-            q,
-            (
-                f"⚠️ Текущий CPA для кампании: {current:.2f} $.\n"
-                "Напиши в чат число в долларах (например 1.2). 0 — будет наследовать CPA аккаунта."
-            ),
-        )
+    toggle_text = (
+        "⚠️ CPA-алёрты кампании: ON" if enabled else "⚠️ CPA-алёрты кампании: OFF"
+    )
 
-        context.user_data["await_cpa_campaign_for"] = {
-            "aid": aid,
-            "campaign_id": campaign_id,
-        }
-        return
+    kb = InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    toggle_text,
+                    callback_data=f"cpa_campaign_toggle|{aid}|{campaign_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "✏️ Задать CPA для кампании",
+                    callback_data=f"cpa_campaign_set|{aid}|{campaign_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "↩️ Наследовать CPA аккаунта",
+                    callback_data=f"cpa_campaign_inherit|{aid}|{campaign_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад к списку кампаний",
+                    callback_data=f"cpa_campaigns|{aid}",
+                )
+            ],
+        ]
+    )
 
-    if data.startswith("cpa_campaign_inherit|"):
-        _, aid, campaign_id = data.split("|", 2)
+    await safe_edit_message(
+        q,
+        text,
+        reply_markup=kb,
+    )
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        campaign_alerts = alerts.setdefault("campaign_alerts", {})
-        cfg = campaign_alerts.get(campaign_id) or {}
 
-        cfg["target_cpa"] = 0.0
-        campaign_alerts[campaign_id] = cfg
-        alerts["campaign_alerts"] = campaign_alerts
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
+@_CB_ROUTER.prefix("cpa_campaign_toggle|")
+async def _cb_cpa_campaign_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, campaign_id = data.split("|", 2)
 
-        new_data = f"cpa_campaign|{aid}|{campaign_id}"
-        await _on_cb_internal(update, context, q, chat_id, new_data)
-        return
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    campaign_alerts = alerts.get("campaign_alerts") or {}
+    cfg = campaign_alerts.get(campaign_id) or {}
 
-    if data.startswith("cpa_ai|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        alerts["ai_enabled"] = not bool(alerts.get("ai_enabled", True))
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
-        text, kb = cpa_settings_kb(aid)
-        await safe_edit_message(q, text, reply_markup=kb)
-        return
+    cfg["enabled"] = not bool(cfg.get("enabled", True))
+    campaign_alerts[campaign_id] = cfg
+    alerts["campaign_alerts"] = campaign_alerts
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
 
-    if data.startswith("cpa_freq|"):
-        _, aid, freq = data.split("|", 2)
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        alerts["freq"] = freq if freq in ("3x", "hourly") else "3x"
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
-        text, kb = cpa_settings_kb(aid)
-        await safe_edit_message(q, text, reply_markup=kb)
-        return
+    # После переключения статуса возвращаемся к списку кампаний
+    new_data = f"cpa_campaigns|{aid}"
+    await _on_cb_internal(update, context, q, chat_id, new_data)
 
-    if data.startswith("cpa_day|"):
-        _, aid, day_key = data.split("|", 2)
-        all_days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-        if day_key not in all_days:
-            return
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        days = alerts.get("days") or []
-        if day_key in days:
-            days = [d for d in days if d != day_key]
-        else:
-            days = list({*days, day_key})
-        alerts["days"] = days
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
-        text, kb = cpa_settings_kb(aid)
-        await safe_edit_message(q, text, reply_markup=kb)
-        return
 
-    if data.startswith("cpa_days_all|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        alerts["days"] = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
-        text, kb = cpa_settings_kb(aid)
-        await safe_edit_message(q, text, reply_markup=kb)
-        return
+@_CB_ROUTER.prefix("cpa_campaign_set|")
+async def _cb_cpa_campaign_set(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, campaign_id = data.split("|", 2)
+
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    campaign_alerts = alerts.get("campaign_alerts") or {}
+    cfg = campaign_alerts.get(campaign_id) or {}
+
+    current = float(cfg.get("target_cpa") or 0.0)
+
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+
+    await safe_edit_message(
+        q,
+        (
+            f"⚠️ Текущий CPA для кампании: {current:.2f} $.\n"
+            "Напиши в чат число в долларах (например 1.2). 0 — будет наследовать CPA аккаунта."
+        ),
+    )
+
+    context.user_data["await_cpa_campaign_for"] = {
+        "aid": aid,
+        "campaign_id": campaign_id,
+    }
+
+
+@_CB_ROUTER.prefix("cpa_campaign_inherit|")
+async def _cb_cpa_campaign_inherit(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, campaign_id = data.split("|", 2)
+
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    campaign_alerts = alerts.get("campaign_alerts") or {}
+    cfg = campaign_alerts.get(campaign_id) or {}
+
+    cfg["target_cpa"] = 0.0
+    campaign_alerts[campaign_id] = cfg
+    alerts["campaign_alerts"] = campaign_alerts
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+
+    new_data = f"cpa_campaign|{aid}|{campaign_id}"
+    await _on_cb_internal(update, context, q, chat_id, new_data)
 
-    if data.startswith("cpa_adsets|"):
-        aid = data.split("|", 1)[1]
 
-        text = "Выбери адсет для настройки CPA-алёртов."
-        await safe_edit_message(q, text, reply_markup=cpa_adsets_kb(aid))
+@_CB_ROUTER.prefix("cpa_ai|")
+async def _cb_cpa_ai(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    alerts["ai_enabled"] = not bool(alerts.get("ai_enabled", True))
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+    text, kb = cpa_settings_kb(aid)
+    await safe_edit_message(q, text, reply_markup=kb)
+
+
+@_CB_ROUTER.prefix("cpa_freq|")
+async def _cb_cpa_freq(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, freq = data.split("|", 2)
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    alerts["freq"] = freq if freq in ("3x", "hourly") else "3x"
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+    text, kb = cpa_settings_kb(aid)
+    await safe_edit_message(q, text, reply_markup=kb)
+
+
+@_CB_ROUTER.prefix("cpa_day|")
+async def _cb_cpa_day(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, day_key = data.split("|", 2)
+    all_days = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+    if day_key not in all_days:
         return
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    days = alerts.get("days") or []
+    if day_key in days:
+        days = [d for d in days if d != day_key]
+    else:
+        days = list({*days, day_key})
+    alerts["days"] = days
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+    text, kb = cpa_settings_kb(aid)
+    await safe_edit_message(q, text, reply_markup=kb)
 
-    if data.startswith("cpa_adset|"):
-        _, aid, adset_id = data.split("|", 2)
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        adset_alerts = alerts.setdefault("adset_alerts", {})
-        cfg = adset_alerts.get(adset_id) or {}
+@_CB_ROUTER.prefix("cpa_days_all|")
+async def _cb_cpa_days_all(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    alerts["days"] = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+    text, kb = cpa_settings_kb(aid)
+    await safe_edit_message(q, text, reply_markup=kb)
 
-        adset_name = _adset_name_from_snapshots(aid, adset_id) or adset_id
 
-        account_cpa = float(
-            alerts.get("account_cpa", alerts.get("target_cpl", 0.0)) or 0.0
-        )
-        adset_target = float(cfg.get("target_cpa") or 0.0)
-        effective_target = adset_target if adset_target > 0 else account_cpa
+@_CB_ROUTER.prefix("cpa_adsets|")
+async def _cb_cpa_adsets(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
 
-        enabled = bool(cfg.get("enabled", True))
+    text = "Выбери адсет для настройки CPA-алёртов."
+    await safe_edit_message(q, text, reply_markup=cpa_adsets_kb(aid))
 
-        mode_str = "свой таргет" if adset_target > 0 else "наследует CPA аккаунта"
-        status_str = "ВКЛ" if enabled else "ВЫКЛ"
 
-        text = (
-            f"CPA-алёрты для адсета:\n\n"
-            f"{adset_name}\n\n"
-            f"Эффективный target CPA: {effective_target:.2f} $ ({mode_str})\n"
-            f"Статус: CPA-алёрты адсета: {status_str}"
-        )
+@_CB_ROUTER.prefix("cpa_adset|")
+async def _cb_cpa_adset(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, adset_id = data.split("|", 2)
 
-        toggle_text = (
-            "⚠️ CPA-алёрты адсета: ON" if enabled else "⚠️ CPA-алёрты адсета: OFF"
-        )
+    st = load_accounts_view()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    adset_alerts = alerts.get("adset_alerts") or {}
+    cfg = adset_alerts.get(adset_id) or {}
 
-        kb = InlineKeyboardMarkup(
+    adset_name = _adset_name_from_snapshots(aid, adset_id) or adset_id
+
+    account_cpa = float(
+        alerts.get("account_cpa", alerts.get("target_cpl", 0.0)) or 0.0
+    )
+    adset_target = float(cfg.get("target_cpa") or 0.0)
+    effective_target = adset_target if adset_target > 0 else account_cpa
+
+    enabled = bool(cfg.get("enabled", True))
+
+    mode_str = "свой таргет" if adset_target > 0 else "наследует CPA аккаунта"
+    status_str = "ВКЛ" if enabled else "ВЫКЛ"
+
+    text = (
+        f"CPA-алёрты для адсета:\n\n"
+        f"{adset_name}\n\n"
+        f"Эффективный target CPA: {effective_target:.2f} $ ({mode_str})\n"
+        f"Статус: CPA-алёрты адсета: {status_str}"
+    )
+
+    toggle_text = (
+        "⚠️ CPA-алёрты адсета: ON" if enabled else "⚠️ CPA-алёрты адсета: OFF"
+    )
+
+    kb = InlineKeyboardMarkup(
+        [
             [
-                [
-                    InlineKeyboardButton(
-                        toggle_text,
-                        callback_data=f"cpa_adset_toggle|{aid}|{adset_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "✏️ Задать CPA для адсета",
-                        callback_data=f"cpa_adset_set|{aid}|{adset_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "↩️ Наследовать CPA аккаунта",
-                        callback_data=f"cpa_adset_inherit|{aid}|{adset_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "⬅️ Назад к списку адсетов",
-                        callback_data=f"cpa_adsets|{aid}",
-                    )
-                ],
-            ]
+                InlineKeyboardButton(
+                    toggle_text,
+                    callback_data=f"cpa_adset_toggle|{aid}|{adset_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "✏️ Задать CPA для адсета",
+                    callback_data=f"cpa_adset_set|{aid}|{adset_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "↩️ Наследовать CPA аккаунта",
+                    callback_data=f"cpa_adset_inherit|{aid}|{adset_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад к списку адсетов",
+                    callback_data=f"cpa_adsets|{aid}",
+                )
+            ],
+        ]
+    )
+
+    await safe_edit_message(
+        q,
+        text,
+        reply_markup=kb,
+    )
+
+
+@_CB_ROUTER.prefix("cpa_adset_toggle|")
+async def _cb_cpa_adset_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, adset_id = data.split("|", 2)
+
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    adset_alerts = alerts.get("adset_alerts") or {}
+    cfg = adset_alerts.get(adset_id) or {}
+
+    cfg["enabled"] = not bool(cfg.get("enabled", True))
+    adset_alerts[adset_id] = cfg
+    alerts["adset_alerts"] = adset_alerts
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+
+    # Перерисовываем экран настроек адсета
+    new_data = f"cpa_adset|{aid}|{adset_id}"
+    await _on_cb_internal(update, context, q, chat_id, new_data)
+
+
+@_CB_ROUTER.prefix("cpa_ads|")
+async def _cb_cpa_ads(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+
+    st = load_accounts_view()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    ad_alerts = alerts.get("ad_alerts", {}) or {}
+
+    # No ad-level rows in snapshots.
+    ads: list[dict] = []
+    ad_status: dict[str, str] = {}
+    ad_to_adset: dict[str, str] = {}
+    allowed_adset_ids: set[str] = set()
+
+    kb_rows = []
+    for ad in ads:
+        ad_id = ad.get("ad_id") or ad.get("id")
+        if not ad_id:
+            continue
+
+        spend = float(ad.get("spend", 0.0) or 0.0)
+        if ad_id not in ad_alerts and spend <= 0:
+            continue
+
+        status = ad_status.get(str(ad_id), "")
+        adset_id = str(ad.get("adset_id") or ad_to_adset.get(str(ad_id)) or "")
+        adset_active = adset_id in allowed_adset_ids
+
+        # В списке объявлений показываем только активные креативы с активным адсетом.
+        if str(status or "").upper() not in {"ACTIVE", "SCHEDULED"} or not adset_active:
+            continue
+
+        name = ad.get("name") or ad_id
+        cfg = ad_alerts.get(ad_id) or {}
+        enabled_ad = bool(cfg.get("enabled", False))
+        target = float(cfg.get("target_cpa") or 0.0)
+        label_suffix = (
+            f"[CPA {target:.2f}$]" if target > 0 else "[CPA вышестоящего уровня]"
         )
+        # Индикатор ⚠️ только если объявление активно, его адсет активен и алёрт включён.
+        indicator = "⚠️ " if enabled_ad else ""
+        text_btn = f"{indicator}{name} {label_suffix}".strip()
 
-        await safe_edit_message(
-            q,
-            text,
-            reply_markup=kb,
+        kb_rows.append(
+            [
+                InlineKeyboardButton(
+                    text_btn,
+                    callback_data=f"cpa_ad_cfg|{aid}|{ad_id}",
+                )
+            ]
         )
-        return
-
-    if data.startswith("cpa_adset_toggle|"):
-        _, aid, adset_id = data.split("|", 2)
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        adset_alerts = alerts.setdefault("adset_alerts", {})
-        cfg = adset_alerts.get(adset_id) or {}
+    kb_rows.append(
+        [
+            InlineKeyboardButton(
+                "⬅️ Назад", callback_data=f"cpa_settings|{aid}"
+            )
+        ]
+    )
 
-        cfg["enabled"] = not bool(cfg.get("enabled", True))
-        adset_alerts[adset_id] = cfg
-        alerts["adset_alerts"] = adset_alerts
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
+    text = "Выбери объявление для настройки CPA-алёртов."
+    await safe_edit_message(
+        q,
+        text,
+        reply_markup=InlineKeyboardMarkup(kb_rows),
+    )
 
-        # Перерисовываем экран настроек адсета
-        new_data = f"cpa_adset|{aid}|{adset_id}"
-        await _on_cb_internal(update, context, q, chat_id, new_data)
-        return
 
-    if data.startswith("cpa_ads|"):
-        aid = data.split("|", 1)[1]
+@_CB_ROUTER.prefix("cpa_ad_cfg|")
+async def _cb_cpa_ad_cfg(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, ad_id = data.split("|", 2)
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        ad_alerts = alerts.get("ad_alerts", {}) or {}
-
-        # No ad-level rows in snapshots.
-        ads: list[dict] = []
-        ad_status: dict[str, str] = {}
-        ad_to_adset: dict[str, str] = {}
-        allowed_adset_ids: set[str] = set()
-
-        kb_rows = []
-        for ad in ads:
-            ad_id = ad.get("ad_id") or ad.get("id")
-            if not ad_id:
-                continue
+    st = load_accounts_view()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    ad_alerts = alerts.get("ad_alerts") or {}
+    cfg = ad_alerts.get(ad_id) or {}
 
-            spend = float(ad.get("spend", 0.0) or 0.0)
-            if ad_id not in ad_alerts and spend <= 0:
-                continue
+    ad_name = ad_id
 
-            status = ad_status.get(str(ad_id), "")
-            adset_id = str(ad.get("adset_id") or ad_to_adset.get(str(ad_id)) or "")
-            adset_active = adset_id in allowed_adset_ids
+    enabled = bool(cfg.get("enabled", True))
+    target_cpa = float(cfg.get("target_cpa") or 0.0)
+    silent = bool(cfg.get("silent", False))
 
-            # В списке объявлений показываем только активные креативы с активным адсетом.
-            if str(status or "").upper() not in {"ACTIVE", "SCHEDULED"} or not adset_active:
-                continue
+    mode_str = (
+        "свой таргет" if target_cpa > 0 else "наследует CPA вышестоящего уровня"
+    )
+    effective_str = f"{target_cpa:.2f} $" if target_cpa > 0 else "—"
+    status_str = "ВКЛ" if enabled else "ВЫКЛ"
+    silent_str = "ВКЛ" if silent else "ВЫКЛ"
 
-            name = ad.get("name") or ad_id
-            cfg = ad_alerts.get(ad_id) or {}
-            enabled_ad = bool(cfg.get("enabled", False))
-            target = float(cfg.get("target_cpa") or 0.0)
-            label_suffix = (
-                f"[CPA {target:.2f}$]" if target > 0 else "[CPA вышестоящего уровня]"
-            )
-            # Индикатор ⚠️ только если объявление активно, его адсет активен и алёрт включён.
-            indicator = "⚠️ " if enabled_ad else ""
-            text_btn = f"{indicator}{name} {label_suffix}".strip()
+    text = (
+        "CPA-алёрты для объявления:\n\n"
+        f"{ad_name}\n\n"
+        f"Эффективный target CPA: {effective_str} ({mode_str})\n"
+        f"Статус CPA-алёртов: {status_str}\n"
+        f"Тихий режим: {silent_str}"
+    )
 
-            kb_rows.append(
-                [
-                    InlineKeyboardButton(
-                        text_btn,
-                        callback_data=f"cpa_ad_cfg|{aid}|{ad_id}",
-                    )
-                ]
-            )
+    toggle_text = (
+        "⚠️ CPA-алёрты объявления: ON"
+        if enabled
+        else "⚠️ CPA-алёрты объявления: OFF"
+    )
+    silent_btn_text = (
+        "🔕 Тихий режим: OFF" if silent else "🔕 Тихий режим: ON"
+    )
 
-        kb_rows.append(
+    kb = InlineKeyboardMarkup(
+        [
             [
                 InlineKeyboardButton(
-                    "⬅️ Назад", callback_data=f"cpa_settings|{aid}"
+                    toggle_text,
+                    callback_data=f"cpa_ad_cfg_toggle|{aid}|{ad_id}",
                 )
-            ]
-        )
+            ],
+            [
+                InlineKeyboardButton(
+                    "✏️ Задать CPA объявления",
+                    callback_data=f"cpa_ad_cfg_set|{aid}|{ad_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "↩️ Наследовать CPA вышестоящего уровня",
+                    callback_data=f"cpa_ad_cfg_inherit|{aid}|{ad_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    silent_btn_text,
+                    callback_data=f"cpa_ad_silent|{aid}|{ad_id}",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    "⬅️ Назад к списку объявлений",
+                    callback_data=f"cpa_ads|{aid}",
+                )
+            ],
+        ]
+    )
 
-        text = "Выбери объявление для настройки CPA-алёртов."
-        await safe_edit_message(
-            q,
-            text,
-            reply_markup=InlineKeyboardMarkup(kb_rows),
-        )
-        return
+    await safe_edit_message(
+        q,
+        text,
+        reply_markup=kb,
+    )
 
-    if data.startswith("cpa_ad_cfg|"):
-        _, aid, ad_id = data.split("|", 2)
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        ad_alerts = alerts.setdefault("ad_alerts", {})
-        cfg = ad_alerts.get(ad_id) or {}
+@_CB_ROUTER.prefix("cpa_ad_cfg_toggle|")
+async def _cb_cpa_ad_cfg_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, ad_id = data.split("|", 2)
 
-        ad_name = ad_id
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    ad_alerts = alerts.get("ad_alerts") or {}
+    cfg = ad_alerts.get(ad_id) or {}
 
-        enabled = bool(cfg.get("enabled", True))
-        target_cpa = float(cfg.get("target_cpa") or 0.0)
-        silent = bool(cfg.get("silent", False))
+    cfg["enabled"] = not bool(cfg.get("enabled", True))
+    ad_alerts[ad_id] = cfg
+    alerts["ad_alerts"] = ad_alerts
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
 
-        mode_str = (
-            "свой таргет" if target_cpa > 0 else "наследует CPA вышестоящего уровня"
-        )
-        effective_str = f"{target_cpa:.2f} $" if target_cpa > 0 else "—"
-        status_str = "ВКЛ" if enabled else "ВЫКЛ"
-        silent_str = "ВКЛ" if silent else "ВЫКЛ"
+    # После переключения статуса возвращаемся к списку объявлений
+    new_data = f"cpa_ads|{aid}"
+    await _on_cb_internal(update, context, q, chat_id, new_data)
 
-        text = (
-            "CPA-алёрты для объявления:\n\n"
-            f"{ad_name}\n\n"
-            f"Эффективный target CPA: {effective_str} ({mode_str})\n"
-            f"Статус CPA-алёртов: {status_str}\n"
-            f"Тихий режим: {silent_str}"
-        )
 
-        toggle_text = (
-            "⚠️ CPA-алёрты объявления: ON"
-            if enabled
-            else "⚠️ CPA-алёрты объявления: OFF"
-        )
-        silent_btn_text = (
-            "🔕 Тихий режим: OFF" if silent else "🔕 Тихий режим: ON"
-        )
+@_CB_ROUTER.prefix("cpa_ad_cfg_set|")
+async def _cb_cpa_ad_cfg_set(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, ad_id = data.split("|", 2)
 
-        kb = InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        toggle_text,
-                        callback_data=f"cpa_ad_cfg_toggle|{aid}|{ad_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "✏️ Задать CPA объявления",
-                        callback_data=f"cpa_ad_cfg_set|{aid}|{ad_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "↩️ Наследовать CPA вышестоящего уровня",
-                        callback_data=f"cpa_ad_cfg_inherit|{aid}|{ad_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        silent_btn_text,
-                        callback_data=f"cpa_ad_silent|{aid}|{ad_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        "⬅️ Назад к списку объявлений",
-                        callback_data=f"cpa_ads|{aid}",
-                    )
-                ],
-            ]
-        )
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    ad_alerts = alerts.get("ad_alerts") or {}
+    cfg = ad_alerts.get(ad_id) or {}
 
-        await safe_edit_message(
-            q,
-            text,
-            reply_markup=kb,
-        )
-        return
+    current = float(cfg.get("target_cpa") or 0.0)
 
-    if data.startswith("cpa_ad_cfg_toggle|"):
-        _, aid, ad_id = data.split("|", 2)
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        ad_alerts = alerts.setdefault("ad_alerts", {})
-        cfg = ad_alerts.get(ad_id) or {}
+    await safe_edit_message(
+        q,
+        (
+            f"⚠️ Текущий CPA для объявления: {current:.2f} $.\n"
+            "Напиши в чат число в долларах (например 1.2). 0 — будет наследовать CPA вышестоящего уровня."
+        ),
+    )
 
-        cfg["enabled"] = not bool(cfg.get("enabled", True))
-        ad_alerts[ad_id] = cfg
-        alerts["ad_alerts"] = ad_alerts
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
+    context.user_data["await_cpa_ad_for"] = {"aid": aid, "ad_id": ad_id}
 
-        # После переключения статуса возвращаемся к списку объявлений
-        new_data = f"cpa_ads|{aid}"
-        await _on_cb_internal(update, context, q, chat_id, new_data)
-        return
 
-    if data.startswith("cpa_ad_cfg_set|"):
-        _, aid, ad_id = data.split("|", 2)
+@_CB_ROUTER.prefix("cpa_adset_set|")
+async def _cb_cpa_adset_set(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, adset_id = data.split("|", 2)
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        ad_alerts = alerts.setdefault("ad_alerts", {})
-        cfg = ad_alerts.get(ad_id) or {}
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    adset_alerts = alerts.get("adset_alerts") or {}
+    cfg = adset_alerts.get(adset_id) or {}
 
-        current = float(cfg.get("target_cpa") or 0.0)
+    current = float(cfg.get("target_cpa") or 0.0)
 
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
 
-        await safe_edit_message(
-            q,
-            (
-                f"⚠️ Текущий CPA для объявления: {current:.2f} $.\n"
-                "Напиши в чат число в долларах (например 1.2). 0 — будет наследовать CPA вышестоящего уровня."
-            ),
-        )
+    await safe_edit_message(
+        q,
+        (
+            f"⚠️ Текущий CPA для адсета: {current:.2f} $.\n"
+            f"Напиши в чат число в долларах (например 1.2). 0 — будет наследовать CPA аккаунта."
+        ),
+    )
 
-        context.user_data["await_cpa_ad_for"] = {"aid": aid, "ad_id": ad_id}
-        return
+    context.user_data["await_cpa_adset_for"] = {"aid": aid, "adset_id": adset_id}
 
-    if data.startswith("cpa_adset_set|"):
-        _, aid, adset_id = data.split("|", 2)
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        adset_alerts = alerts.setdefault("adset_alerts", {})
-        cfg = adset_alerts.get(adset_id) or {}
+@_CB_ROUTER.prefix("cpa_adset_inherit|")
+async def _cb_cpa_adset_inherit(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _, aid, adset_id = data.split("|", 2)
 
-        current = float(cfg.get("target_cpa") or 0.0)
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    adset_alerts = alerts.get("adset_alerts") or {}
+    cfg = adset_alerts.get(adset_id) or {}
+
+    # Наследование CPA аккаунта: обнуляем собственный таргет.
+    cfg["target_cpa"] = 0.0
+    adset_alerts[adset_id] = cfg
+    alerts["adset_alerts"] = adset_alerts
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
 
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
+    new_data = f"cpa_adset|{aid}|{adset_id}"
+    await _on_cb_internal(update, context, q, chat_id, new_data)
 
-        await safe_edit_message(
-            q,
-            (
-                f"⚠️ Текущий CPA для адсета: {current:.2f} $.\n"
-                f"Напиши в чат число в долларах (например 1.2). 0 — будет наследовать CPA аккаунта."
-            ),
-        )
 
-        context.user_data["await_cpa_adset_for"] = {"aid": aid, "adset_id": adset_id}
-        return
+@_CB_ROUTER.prefix("toggle_m|")
+async def _cb_toggle_m(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {"metrics": {}})
+    row["metrics"] = row.get("metrics", {})
+    row["metrics"]["messaging"] = not row["metrics"].get("messaging", True)
+    st[aid] = row
+    save_accounts(st)
+    await q.edit_message_text(
+        f"Настройки: {get_account_name(aid)}",
+        reply_markup=settings_kb(aid),
+    )
 
-    if data.startswith("cpa_adset_inherit|"):
-        _, aid, adset_id = data.split("|", 2)
 
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        adset_alerts = alerts.setdefault("adset_alerts", {})
-        cfg = adset_alerts.get(adset_id) or {}
+@_CB_ROUTER.prefix("toggle_l|")
+async def _cb_toggle_l(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {"metrics": {}})
+    row["metrics"] = row.get("metrics", {})
+    row["metrics"]["leads"] = not row["metrics"].get("leads", False)
+    st[aid] = row
+    save_accounts(st)
+    await q.edit_message_text(
+        f"Настройки: {get_account_name(aid)}",
+        reply_markup=settings_kb(aid),
+    )
 
-        # Наследование CPA аккаунта: обнуляем собственный таргет.
-        cfg["target_cpa"] = 0.0
-        adset_alerts[adset_id] = cfg
-        alerts["adset_alerts"] = adset_alerts
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
 
-        new_data = f"cpa_adset|{aid}|{adset_id}"
-        await _on_cb_internal(update, context, q, chat_id, new_data)
-        return
+@_CB_ROUTER.prefix("toggle_alert|")
+async def _cb_toggle_alert(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
 
-    if data.startswith("toggle_m|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {"metrics": {}})
-        row["metrics"] = row.get("metrics", {})
-        row["metrics"]["messaging"] = not row["metrics"].get("messaging", True)
-        st[aid] = row
-        save_accounts(st)
-        await q.edit_message_text(
-            f"Настройки: {get_account_name(aid)}",
-            reply_markup=settings_kb(aid),
-        )
-        return
+    # Переключатель включает/выключает алёрты целиком.
+    # Логика включения: есть ли ненулевой таргет CPA (account_cpa/target_cpl).
+    if alerts.get("enabled", False):
+        alerts["enabled"] = False
+    else:
+        acc_cpa = float(alerts.get("account_cpa", 0.0) or 0.0)
+        old = float(alerts.get("target_cpl", 0.0) or 0.0)
+        alerts["enabled"] = (acc_cpa > 0) or (old > 0)
 
-    if data.startswith("toggle_l|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {"metrics": {}})
-        row["metrics"] = row.get("metrics", {})
-        row["metrics"]["leads"] = not row["metrics"].get("leads", False)
-        st[aid] = row
-        save_accounts(st)
-        await q.edit_message_text(
-            f"Настройки: {get_account_name(aid)}",
-            reply_markup=settings_kb(aid),
-        )
-        return
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+    await q.edit_message_text(
+        f"Настройки: {get_account_name(aid)}",
+        reply_markup=settings_kb(aid),
+    )
 
-    if data.startswith("toggle_alert|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
 
-        # Переключатель включает/выключает алёрты целиком.
-        # Логика включения: есть ли ненулевой таргет CPA (account_cpa/target_cpl).
-        if alerts.get("enabled", False):
-            alerts["enabled"] = False
-        else:
-            acc_cpa = float(alerts.get("account_cpa", 0.0) or 0.0)
-            old = float(alerts.get("target_cpl", 0.0) or 0.0)
-            alerts["enabled"] = (acc_cpa > 0) or (old > 0)
+@_CB_ROUTER.prefix("set_cpa|")
+async def _cb_set_cpa(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    st = load_accounts()
+    row = st.get(aid, {"alerts": {}})
+    alerts = row.get("alerts", {}) or {}
+    current = float(
+        alerts.get("account_cpa", alerts.get("target_cpl", 0.0)) or 0.0
+    )
+    row["alerts"] = alerts
+    st[aid] = row
+    save_accounts(st)
+    await safe_edit_message(
+        q,
+        f"⚠️ Текущий target CPA: {current:.2f} $.\n"
+        f"Напиши в чат число (например 2.5). 0 — выключит алерты.",
+        reply_markup=settings_kb(aid),
+    )
+    context.user_data["await_cpa_for"] = aid
 
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
-        await q.edit_message_text(
-            f"Настройки: {get_account_name(aid)}",
-            reply_markup=settings_kb(aid),
-        )
-        return
 
-    if data.startswith("set_cpa|"):
-        aid = data.split("|", 1)[1]
-        st = load_accounts()
-        row = st.get(aid, {"alerts": {}})
-        alerts = row.get("alerts", {}) or {}
-        current = float(
-            alerts.get("account_cpa", alerts.get("target_cpl", 0.0)) or 0.0
-        )
-        row["alerts"] = alerts
-        st[aid] = row
-        save_accounts(st)
-        await safe_edit_message(
-            q,
-            f"⚠️ Текущий target CPA: {current:.2f} $.\n"
-            f"Напиши в чат число (например 2.5). 0 — выключит алерты.",
-            reply_markup=settings_kb(aid),
-        )
-        context.user_data["await_cpa_for"] = aid
-        return
+@_CB_ROUTER.prefix("mr_menu|")
+async def _cb_mr_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"🌅 Утренний отчёт: {get_account_name(aid)}\nВыберите уровень:",
+        reply_markup=morning_report_level_kb(aid),
+    )
 
-    if data.startswith("mr_menu|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"🌅 Утренний отчёт: {get_account_name(aid)}\nВыберите уровень:",
-            reply_markup=morning_report_level_kb(aid),
-        )
-        return
 
-    if data.startswith("mr_back|"):
-        aid = data.split("|", 1)[1]
-        await safe_edit_message(
-            q,
-            f"Настройки: {get_account_name(aid)}",
-            reply_markup=settings_kb(aid),
-        )
-        return
+@_CB_ROUTER.prefix("mr_back|")
+async def _cb_mr_back(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    aid = data.split("|", 1)[1]
+    await safe_edit_message(
+        q,
+        f"Настройки: {get_account_name(aid)}",
+        reply_markup=settings_kb(aid),
+    )
 
-    if data.startswith("mr_set|"):
-        _p, aid, lvl = data.split("|", 2)
-        lvl_u = str(lvl or "ACCOUNT").upper()
-        if lvl_u not in {"OFF", "ACCOUNT", "CAMPAIGN", "ADSET", "AD"}:
-            lvl_u = "ACCOUNT"
 
-        st = load_accounts()
-        row = st.get(str(aid), {})
-        mr = (row or {}).get("morning_report") or {}
-        if not isinstance(mr, dict):
-            mr = {}
-        mr["level"] = str(lvl_u)
-        row["morning_report"] = mr
-        st[str(aid)] = row
-        save_accounts(st)
+@_CB_ROUTER.prefix("mr_set|")
+async def _cb_mr_set(update: Update, context: ContextTypes.DEFAULT_TYPE, q, chat_id: str, data: str, *, uid, is_sa: bool):
+    _p, aid, lvl = data.split("|", 2)
+    lvl_u = str(lvl or "ACCOUNT").upper()
+    if lvl_u not in {"OFF", "ACCOUNT", "CAMPAIGN", "ADSET", "AD"}:
+        lvl_u = "ACCOUNT"
 
-        await safe_edit_message(
-            q,
-            f"🌅 Утренний отчёт: {get_account_name(aid)}\nВыберите уровень:",
-            reply_markup=morning_report_level_kb(aid),
-        )
-        return
+    st = load_accounts()
+    row = st.get(str(aid), {})
+    mr = (row or {}).get("morning_report") or {}
+    if not isinstance(mr, dict):
+        mr = {}
+    mr["level"] = str(lvl_u)
+    row["morning_report"] = mr
+    st[str(aid)] = row
+    save_accounts(st)
+
+    await safe_edit_message(
+        q,
+        f"🌅 Утренний отчёт: {get_account_name(aid)}\nВыберите уровень:",
+        reply_markup=morning_report_level_kb(aid),
+    )
 
 
 async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -8392,13 +8567,13 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if lvl == "OFF":
             return
         if lvl == "ACCOUNT":
-            txt = get_cached_report(str(aid), period, label)
+            txt = await run_fb_io(get_cached_report, str(aid), period, label)
         elif lvl == "CAMPAIGN":
-            txt = build_account_report(str(aid), period, "CAMPAIGN", label=label)
+            txt = await run_fb_io(build_account_report, str(aid), period, "CAMPAIGN", label=label)
         elif lvl == "ADSET":
-            txt = build_account_report(str(aid), period, "ADSET", label=label)
+            txt = await run_fb_io(build_account_report, str(aid), period, "ADSET", label=label)
         else:
-            txt = build_account_report(str(aid), period, "AD", label=label)
+            txt = await run_fb_io(build_account_report, str(aid), period, "AD", label=label)
         if txt:
             await context.bot.send_message(chat_id=str(chat_id), text=str(txt), parse_mode="HTML")
         return
@@ -8793,7 +8968,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         with allow_fb_api_calls(reason="ai_focus_apply_budget"):
-            res = set_adset_budget(str(adset_id), float(val))
+            res = await run_fb_io(set_adset_budget, str(adset_id), float(val))
         if res.get("status") != "ok":
             msg = res.get("message") or ""
             await update.message.reply_text(f"❌ Не удалось применить действие: {msg}")
@@ -8852,7 +9027,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if mode == "general":
             await update.message.reply_text(f"Готовлю отчёт по {name} за {label}…")
-            txt = get_cached_report(aid, period, label)
+            txt = await run_fb_io(get_cached_report, aid, period, label)
             await update.message.reply_text(
                 txt or "Нет данных/нет доступа.",
                 parse_mode="HTML",
@@ -8861,7 +9036,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if mode == "campaigns":
             await update.message.reply_text(f"Готовлю отчёт по кампаниям для {name} ({label})…")
-            txt = build_account_report(aid, period, "CAMPAIGN", label=label)
+            txt = await run_fb_io(build_account_report, aid, period, "CAMPAIGN", label=label)
             await update.message.reply_text(
                 txt or "Нет данных/нет доступа.",
                 parse_mode="HTML",
@@ -8870,7 +9045,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if mode == "adsets":
             await update.message.reply_text(f"Готовлю отчёт по адсетам для {name} ({label})…")
-            txt = build_account_report(aid, period, "ADSET", label=label)
+            txt = await run_fb_io(build_account_report, aid, period, "ADSET", label=label)
             await update.message.reply_text(
                 txt or "Нет данных/нет доступа.",
                 parse_mode="HTML",
@@ -8879,7 +9054,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if mode == "ads":
             await update.message.reply_text(f"Готовлю отчёт по объявлениям для {name} ({label})…")
-            txt = build_account_report(aid, period, "AD", label=label)
+            txt = await run_fb_io(build_account_report, aid, period, "AD", label=label)
             await update.message.reply_text(
                 txt or "Нет данных/нет доступа.",
                 parse_mode="HTML",
@@ -8941,7 +9116,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data["await_range_for"] = aid
             return
         period, label = parsed
-        txt = get_cached_report(aid, period, label)
+        txt = await run_fb_io(get_cached_report, aid, period, label)
         await update.message.reply_text(
             txt or "Нет данных/нет доступа.", parse_mode="HTML"
         )
@@ -8957,7 +9132,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         (p1, label1), (p2, label2) = parsed
-        txt = build_comparison_report(aid, p1, label1, p2, label2)
+        txt = await run_fb_io(build_comparison_report, aid, p1, label1, p2, label2)
         await update.message.reply_text(txt, parse_mode="HTML")
         return
 
@@ -9013,7 +9188,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
         st = load_accounts()
         row = st.get(aid, {"alerts": {}})
         alerts = row.get("alerts", {}) or {}
-        campaign_alerts = alerts.setdefault("campaign_alerts", {})
+        campaign_alerts = alerts.get("campaign_alerts") or {}
         cfg = campaign_alerts.get(campaign_id) or {}
 
         new_cpa = float(val)
@@ -9050,7 +9225,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
         st = load_accounts()
         row = st.get(aid, {"alerts": {}})
         alerts = row.get("alerts", {}) or {}
-        adset_alerts = alerts.setdefault("adset_alerts", {})
+        adset_alerts = alerts.get("adset_alerts") or {}
         cfg = adset_alerts.get(adset_id) or {}
 
         new_cpa = float(val)
@@ -9088,7 +9263,7 @@ async def on_text_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
         st = load_accounts()
         row = st.get(aid, {"alerts": {}})
         alerts = row.get("alerts", {}) or {}
-        ad_alerts = alerts.setdefault("ad_alerts", {})
+        ad_alerts = alerts.get("ad_alerts") or {}
         cfg = ad_alerts.get(ad_id) or {}
 
         new_cpa = float(val)
@@ -9147,6 +9322,13 @@ def build_app() -> Application:
             type(e).__name__,
         )
 
+    # Апдейты разных чатов обрабатываются параллельно (до TG_CONCURRENT_UPDATES),
+    # внутри одного чата — по порядку (fb_report/update_processor.py).
+    builder = builder.concurrent_updates(PerChatUpdateProcessor(TG_CONCURRENT_UPDATES))
+
+    # Сторож event loop: лаг и стеки зависаний (fb_report/loop_watchdog.py, /loop_stats).
+    builder = builder.post_init(start_loop_watchdog).post_shutdown(stop_loop_watchdog)
+
     app = builder.build()
 
     async def _on_error(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -9170,6 +9352,9 @@ def build_app() -> Application:
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CommandHandler("version", cmd_version))
+    app.add_handler(CommandHandler("cb_stats", cmd_cb_stats))
+    app.add_handler(CommandHandler("fb_dedupe", cmd_fb_dedupe))
+    app.add_handler(CommandHandler("loop_stats", cmd_loop_stats))
     app.add_handler(CommandHandler("ap_here", cmd_ap_here))
     app.add_handler(CommandHandler("billing", cmd_billing))
     app.add_handler(CommandHandler("billing_debug", cmd_billing_debug))
@@ -9192,6 +9377,8 @@ def build_app() -> Application:
 
     schedule_client_groups_morning_report(app)
 
+    schedule_account_meta_refresh(app)
+
     schedule_heatmap_snapshot_collector(app)
     schedule_cpa_alerts(app)
 
@@ -9200,6 +9387,12 @@ def build_app() -> Application:
     except Exception:
         pass
 
+    # Поднять персистентный кэш каталога (кампании/адсеты/объявления/инсайты) до первых кнопок.
+    try:
+        warm_catalog_cache()
+    except Exception:
+        pass
+
     # Stagger hourly jobs to reduce FB burst: hourly autopilot starts at :05 each hour.
     try:
         now = datetime.now(ALMATY_TZ)
@@ -3,7 +3,6 @@ from datetime import datetime, timedelta
 import logging
 
 from facebook_business.adobjects.adaccount import AdAccount
-from facebook_business.exceptions import FacebookRequestError
 from telegram.ext import ContextTypes
 
 from .constants import ALMATY_TZ, usd_to_kzt, kzt_round_up_1000
@@ -16,7 +15,15 @@ except Exception:  # noqa: BLE001
     def _billing_cache_get_usd(_aid: str):  # type: ignore[override]
         return None
 
-from services.facebook_api import allow_fb_api_calls
+from services.account_meta import remember_accounts_meta
+from services.facebook_api import allow_fb_api_calls, fetch_accounts_info, run_fb_io
+
+
+def _err_http_status(err: dict | None) -> int | None:
+    try:
+        return int((err or {}).get("http_status"))
+    except Exception:
+        return None
 
 
 def _is_no_access_error(http_status: int | None, message: str | None) -> bool:
@@ -50,51 +57,24 @@ async def send_billing(ctx: ContextTypes.DEFAULT_TYPE, chat_id: str, only_inacti
     failed: list[str] = []
 
     with allow_fb_api_calls(reason="billing_current"):
+        infos = await run_fb_io(fetch_accounts_info, [str(x) for x in enabled_ids], caller="billing_current")
+        remember_accounts_meta({a: i for a, (i, _e) in infos.items()}, full=False)
         for aid in enabled_ids:
-            try:
-                info = AdAccount(str(aid)).api_get(fields=["name", "account_status", "balance"])
-                if hasattr(info, "export_all_data"):
-                    info = info.export_all_data()
-            except FacebookRequestError as e:
-                http_status = None
-                fb_code = None
-                try:
-                    http_status = int(getattr(e, "http_status", None)() if callable(getattr(e, "http_status", None)) else getattr(e, "http_status", None))
-                except Exception:
-                    http_status = None
-                try:
-                    fb_code = int(e.api_error_code())
-                except Exception:
-                    fb_code = None
-                msg = None
-                try:
-                    msg = str(e)
-                except Exception:
-                    msg = None
-
+            info, err = infos.get(str(aid), (None, None))
+            if err:
                 logging.getLogger(__name__).warning(
                     "billing_api_error caller=billing_current aid=%s http_status=%s fb_code=%s message=%s",
                     str(aid),
-                    str(http_status),
-                    str(fb_code),
-                    str(msg or ""),
+                    str(err.get("http_status") or ""),
+                    str(err.get("code") or ""),
+                    str(err.get("message") or ""),
                 )
 
-                if _is_no_access_error(http_status, msg):
+                if _is_no_access_error(_err_http_status(err), err.get("message")):
                     no_access.append(str(aid))
                 else:
                     failed.append(str(aid))
                 continue
-            except Exception as e:
-                logging.getLogger(__name__).warning(
-                    "billing_api_error caller=billing_current aid=%s http_status=%s fb_code=%s message=%s",
-                    str(aid),
-                    "",
-                    "",
-                    str(e),
-                )
-                failed.append(str(aid))
-                continue
 
             if not isinstance(info, dict):
                 failed.append(str(aid))
@@ -158,33 +138,16 @@ async def send_billing_for_accounts(
     failed: list[str] = []
 
     with allow_fb_api_calls(reason="billing_current_client_group"):
+        infos = await run_fb_io(fetch_accounts_info, ids, caller="billing_current_client_group")
+        remember_accounts_meta({a: i for a, (i, _e) in infos.items()}, full=False)
         for aid in ids:
-            try:
-                info = AdAccount(str(aid)).api_get(fields=["name", "account_status", "balance"])
-                if hasattr(info, "export_all_data"):
-                    info = info.export_all_data()
-            except FacebookRequestError as e:
-                http_status = None
-                try:
-                    http_status = int(
-                        getattr(e, "http_status", None)() if callable(getattr(e, "http_status", None)) else getattr(e, "http_status", None)
-                    )
-                except Exception:
-                    http_status = None
-                msg = None
-                try:
-                    msg = str(e)
-                except Exception:
-                    msg = None
-
-                if _is_no_access_error(http_status, msg):
+            info, err = infos.get(str(aid), (None, None))
+            if err:
+                if _is_no_access_error(_err_http_status(err), err.get("message")):
                     no_access.append(str(aid))
                 else:
                     failed.append(str(aid))
                 continue
-            except Exception:
-                failed.append(str(aid))
-                continue
 
             if not isinstance(info, dict):
                 failed.append(str(aid))
@@ -236,14 +199,20 @@ async def send_billing_for_accounts(
     await ctx.bot.send_message(chat_id=chat_id, text="\n".join(lines))
 
 
-def _compute_billing_forecast_for_account(aid: str, rate_kzt: float, lookback_days: int = 7):
-    try:
-        with allow_fb_api_calls(reason="billing_forecast"):
-            info = AdAccount(str(aid)).api_get(fields=["name", "account_status", "balance"])
-            if hasattr(info, "export_all_data"):
-                info = info.export_all_data()
-    except Exception:
-        return None
+def _compute_billing_forecast_for_account(
+    aid: str,
+    rate_kzt: float,
+    lookback_days: int = 7,
+    info: dict | None = None,
+):
+    if info is None:
+        try:
+            with allow_fb_api_calls(reason="billing_forecast"):
+                info = AdAccount(str(aid)).api_get(fields=["name", "account_status", "balance"])
+                if hasattr(info, "export_all_data"):
+                    info = info.export_all_data()
+        except Exception:
+            return None
     if not isinstance(info, dict):
         return None
 
@@ -309,8 +278,14 @@ async def send_billing_forecast(ctx: ContextTypes.DEFAULT_TYPE, chat_id: str):
     """Прогноз списаний по всем активным аккаунтам (только enabled=True)."""
     rate = float(usd_to_kzt() or 0.0)
     items = []
-    for aid in iter_enabled_accounts_only():
-        fc = _compute_billing_forecast_for_account(aid, rate_kzt=rate)
+    ids = [str(x) for x in iter_enabled_accounts_only()]
+    with allow_fb_api_calls(reason="billing_forecast"):
+        infos = await run_fb_io(fetch_accounts_info, ids, caller="billing_forecast")
+    for aid in ids:
+        info, err = infos.get(str(aid), (None, None))
+        if err or not isinstance(info, dict):
+            continue
+        fc = await run_fb_io(_compute_billing_forecast_for_account, aid, rate_kzt=rate, info=info)
         if fc:
             items.append(fc)
 
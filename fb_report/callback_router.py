@@ -0,0 +1,195 @@
+# fb_report/callback_router.py
+
+"""
+Таблица маршрутов для callback-кнопок.
+
+Вместо длинной цепочки `if data == ... / if data.startswith(...)`
+обработчики регистрируются декораторами:
+
+    router = CallbackRouter("main")
+
+    @router.exact("menu")
+    async def _cb_menu(...): ...
+
+    @router.prefix("rep1|")        # "rep1|<aid>|..." — по голове до "|"
+    async def _cb_rep1(...): ...
+
+    @router.prefix("am_")          # произвольный префикс (префиксное дерево)
+    async def _cb_ads_manage(...): ...
+
+Поиск: точное совпадение -> голова `prefix|` -> самый длинный свободный
+префикс. callback_data разбирается один раз (parse_callback_data).
+По каждому маршруту копятся счётчики вызовов/ошибок и латентность.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+Handler = Callable[..., Awaitable[Any]]
+
+try:
+    _SLOW_MS = float(os.getenv("CALLBACK_SLOW_MS", "1500") or 1500)
+except Exception:
+    _SLOW_MS = 1500.0
+
+
+@dataclass(frozen=True)
+class CallbackData:
+    raw: str
+    head: str
+    args: Tuple[str, ...]
+
+    def arg(self, i: int, default: str = "") -> str:
+        return self.args[i] if 0 <= i < len(self.args) else default
+
+
+def parse_callback_data(data: Any) -> CallbackData:
+    raw = str(data or "")
+    parts = raw.split("|")
+    return CallbackData(raw=raw, head=parts[0], args=tuple(parts[1:]))
+
+
+@dataclass
+class _Route:
+    name: str
+    handler: Handler
+    count: int = 0
+    errors: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+
+
+class CallbackRouter:
+    def __init__(self, name: str):
+        self.name = str(name)
+        self._exact: Dict[str, _Route] = {}
+        self._heads: Dict[str, _Route] = {}
+        self._trie: Dict[str, Any] = {}
+        self._routes: List[_Route] = []
+        self._lock = threading.Lock()
+
+    # ===== регистрация =====
+
+    def _new_route(self, name: str, handler: Handler) -> _Route:
+        route = _Route(name=name, handler=handler)
+        self._routes.append(route)
+        return route
+
+    def exact(self, *values: str) -> Callable[[Handler], Handler]:
+        def deco(fn: Handler) -> Handler:
+            route = self._new_route(str(values[0]) if values else fn.__name__, fn)
+            for v in values:
+                if str(v) in self._exact:
+                    raise ValueError(f"callback route already registered: {v}")
+                self._exact[str(v)] = route
+            return fn
+
+        return deco
+
+    def prefix(self, *prefixes: str) -> Callable[[Handler], Handler]:
+        def deco(fn: Handler) -> Handler:
+            route = self._new_route(str(prefixes[0]) + "*" if prefixes else fn.__name__, fn)
+            for p in prefixes:
+                p = str(p)
+                if p.endswith("|") and "|" not in p[:-1]:
+                    if p[:-1] in self._heads:
+                        raise ValueError(f"callback route already registered: {p}")
+                    self._heads[p[:-1]] = route
+                    continue
+                node = self._trie
+                for ch in p:
+                    node = node.setdefault(ch, {})
+                if "" in node:
+                    raise ValueError(f"callback route already registered: {p}")
+                node[""] = route
+            return fn
+
+        return deco
+
+    # ===== поиск =====
+
+    def _longest_prefix(self, raw: str) -> Optional[_Route]:
+        node = self._trie
+        found = node.get("")
+        for ch in raw:
+            node = node.get(ch)
+            if node is None:
+                break
+            found = node.get("", found)
+        return found
+
+    def resolve(self, data: Any) -> Tuple[Optional[_Route], CallbackData]:
+        cb = parse_callback_data(data)
+        route = self._exact.get(cb.raw)
+        if route is None and cb.args:
+            route = self._heads.get(cb.head)
+        if route is None and self._trie:
+            route = self._longest_prefix(cb.raw)
+        return route, cb
+
+    async def dispatch(self, data: Any, *args: Any, **kwargs: Any) -> bool:
+        """Вызывает обработчик маршрута. False — маршрут не найден."""
+        route, cb = self.resolve(data)
+        if route is None:
+            return False
+        t0 = time.monotonic()
+        ok = False
+        try:
+            await route.handler(*args, **kwargs)
+            ok = True
+        finally:
+            dt = time.monotonic() - t0
+            with self._lock:
+                route.count += 1
+                route.total_s += dt
+                route.max_s = max(route.max_s, dt)
+                if not ok:
+                    route.errors += 1
+            if dt * 1000.0 >= _SLOW_MS:
+                logging.getLogger(__name__).warning(
+                    "callback_slow router=%s route=%s head=%s ms=%s ok=%s",
+                    self.name,
+                    route.name,
+                    cb.head,
+                    str(int(dt * 1000.0)),
+                    str(ok),
+                )
+        return True
+
+    # ===== статистика =====
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Счётчики по маршрутам, самые "дорогие" по суммарному времени — первыми."""
+        with self._lock:
+            out = [
+                {
+                    "route": r.name,
+                    "count": int(r.count),
+                    "errors": int(r.errors),
+                    "avg_ms": (r.total_s / r.count * 1000.0) if r.count else 0.0,
+                    "max_ms": r.max_s * 1000.0,
+                    "total_ms": r.total_s * 1000.0,
+                }
+                for r in self._routes
+                if r.count
+            ]
+        out.sort(key=lambda x: x["total_ms"], reverse=True)
+        return out
+
+
+def format_route_stats(routers: List[CallbackRouter], *, limit: int = 20) -> str:
+    lines: List[str] = []
+    for router in routers:
+        rows = router.stats()
+        lines.append(f"<b>{router.name}</b>: маршрутов с вызовами {len(rows)}")
+        for r in rows[: max(1, int(limit))]:
+            lines.append(
+                f"• <code>{r['route']}</code> n={r['count']} err={r['errors']} "
+                f"avg={r['avg_ms']:.0f}ms max={r['max_ms']:.0f}ms"
+            )
+    return "\n".join(lines) if lines else "Нет данных"
@@ -1,6 +1,4 @@
-import json
 import os
-import shutil
 import time
 from datetime import datetime
 
@@ -11,6 +9,7 @@ from fb_report.constants import (
     SUPERADMIN_USER_ID,
     ALMATY_TZ,
 )
+from services.sqlite_store import doc_lock, load_doc, save_doc
 
 
 def is_superadmin(user_id: int | None) -> bool:
@@ -20,34 +19,20 @@ def is_superadmin(user_id: int | None) -> bool:
         return False
 
 
-def _atomic_write_json(path: str, obj: dict) -> None:
-    tmp = f"{path}.tmp"
-    bak = f"{path}.bak"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-        f.flush()
-        os.fsync(f.fileno())
-    try:
-        if os.path.exists(path):
-            shutil.copy2(path, bak)
-    except Exception:
-        pass
-    os.replace(tmp, path)
+def _doc_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(str(path)))[0]
 
 
 def _load_json(path: str) -> dict:
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return obj if isinstance(obj, dict) else {}
+        return load_doc(_doc_name(path), path)
     except Exception:
         return {}
 
 
 def _save_json(path: str, obj: dict) -> None:
     try:
-        _atomic_write_json(path, obj if isinstance(obj, dict) else {})
+        save_doc(_doc_name(path), path, obj if isinstance(obj, dict) else {})
     except Exception:
         pass
 
@@ -98,68 +83,72 @@ def list_groups() -> list[tuple[str, dict]]:
 
 
 def activate_group(*, chat_id: str, title: str, actor_user_id: int | None) -> None:
-    st = _ensure_schema(load_client_groups())
-    groups = st.get("groups") if isinstance(st.get("groups"), dict) else {}
-    cid = str(chat_id)
-    cur = (groups or {}).get(cid)
-    if not isinstance(cur, dict):
-        cur = {
-            "active": False,
-            "title": str(title or ""),
-            "created_by": int(actor_user_id or 0),
-            "created_at": int(time.time()),
-            "accounts": {},
-        }
-    cur["active"] = True
-    if title:
-        cur["title"] = str(title)
-    if "accounts" not in cur or not isinstance(cur.get("accounts"), dict):
-        cur["accounts"] = {}
-    groups[cid] = cur
-    st["groups"] = groups
-    save_client_groups(st)
+    with doc_lock(_doc_name(CLIENT_GROUPS_FILE)):
+        st = _ensure_schema(load_client_groups())
+        groups = st.get("groups") if isinstance(st.get("groups"), dict) else {}
+        cid = str(chat_id)
+        cur = (groups or {}).get(cid)
+        if not isinstance(cur, dict):
+            cur = {
+                "active": False,
+                "title": str(title or ""),
+                "created_by": int(actor_user_id or 0),
+                "created_at": int(time.time()),
+                "accounts": {},
+            }
+        cur["active"] = True
+        if title:
+            cur["title"] = str(title)
+        if "accounts" not in cur or not isinstance(cur.get("accounts"), dict):
+            cur["accounts"] = {}
+        groups[cid] = cur
+        st["groups"] = groups
+        save_client_groups(st)
 
 
 def deactivate_group(*, chat_id: str) -> None:
-    st = _ensure_schema(load_client_groups())
-    groups = st.get("groups") if isinstance(st.get("groups"), dict) else {}
-    cid = str(chat_id)
-    cur = (groups or {}).get(cid)
-    if not isinstance(cur, dict):
-        return
-    cur["active"] = False
-    groups[cid] = cur
-    st["groups"] = groups
-    save_client_groups(st)
+    with doc_lock(_doc_name(CLIENT_GROUPS_FILE)):
+        st = _ensure_schema(load_client_groups())
+        groups = st.get("groups") if isinstance(st.get("groups"), dict) else {}
+        cid = str(chat_id)
+        cur = (groups or {}).get(cid)
+        if not isinstance(cur, dict):
+            return
+        cur["active"] = False
+        groups[cid] = cur
+        st["groups"] = groups
+        save_client_groups(st)
 
 
 def set_group_account(*, chat_id: str, aid: str, enabled: bool) -> None:
-    st = _ensure_schema(load_client_groups())
-    groups = st.get("groups") if isinstance(st.get("groups"), dict) else {}
-    cid = str(chat_id)
-    g = (groups or {}).get(cid)
-    if not isinstance(g, dict):
-        g = {
-            "active": False,
-            "title": "",
-            "created_by": int(SUPERADMIN_USER_ID),
-            "created_at": int(time.time()),
-            "accounts": {},
-        }
-    acc = g.get("accounts") if isinstance(g.get("accounts"), dict) else {}
-    acc[str(aid)] = bool(enabled)
-    g["accounts"] = acc
-    groups[cid] = g
-    st["groups"] = groups
-    save_client_groups(st)
+    with doc_lock(_doc_name(CLIENT_GROUPS_FILE)):
+        st = _ensure_schema(load_client_groups())
+        groups = st.get("groups") if isinstance(st.get("groups"), dict) else {}
+        cid = str(chat_id)
+        g = (groups or {}).get(cid)
+        if not isinstance(g, dict):
+            g = {
+                "active": False,
+                "title": "",
+                "created_by": int(SUPERADMIN_USER_ID),
+                "created_at": int(time.time()),
+                "accounts": {},
+            }
+        acc = g.get("accounts") if isinstance(g.get("accounts"), dict) else {}
+        acc[str(aid)] = bool(enabled)
+        g["accounts"] = acc
+        groups[cid] = g
+        st["groups"] = groups
+        save_client_groups(st)
 
 
 def toggle_group_account(*, chat_id: str, aid: str) -> bool:
-    g = get_group(str(chat_id)) or {}
-    acc = g.get("accounts") if isinstance(g.get("accounts"), dict) else {}
-    cur = bool(acc.get(str(aid)) is True)
-    set_group_account(chat_id=str(chat_id), aid=str(aid), enabled=(not cur))
-    return not cur
+    with doc_lock(_doc_name(CLIENT_GROUPS_FILE)):
+        g = get_group(str(chat_id)) or {}
+        acc = g.get("accounts") if isinstance(g.get("accounts"), dict) else {}
+        cur = bool(acc.get(str(aid)) is True)
+        set_group_account(chat_id=str(chat_id), aid=str(aid), enabled=(not cur))
+        return not cur
 
 
 def enabled_accounts_for_group(chat_id: str) -> list[str]:
@@ -53,6 +53,8 @@ REPO_ACCOUNTS_JSON = os.path.join(os.path.dirname(__file__), "accounts.json")
 
 REPORT_CACHE_FILE = os.path.join(DATA_DIR, "report_cache.json")
 REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "3600"))  # сек, по умолчанию 1 час
+# "Сегодня" меняется в течение дня даже без новых снапшотов — короткий TTL.
+REPORT_TODAY_CACHE_TTL = int(os.getenv("REPORT_TODAY_CACHE_TTL", "60"))  # сек
 
 DAILY_REPORT_CACHE_FILE = os.path.join(DATA_DIR, "daily_report_cache.json")
 
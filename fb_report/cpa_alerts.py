@@ -6,24 +6,26 @@ import hashlib
 import json
 import logging
 import os
-import shutil
 import time
 from dataclasses import dataclass
 from datetime import datetime, timedelta, time as dt_time
 from typing import Any, Dict, List, Optional, Tuple
 
 from fb_report.constants import ALMATY_TZ, DATA_DIR, SUPERADMIN_USER_ID
-from fb_report.storage import get_account_name, load_accounts
+from fb_report.storage import get_account_name, load_accounts_view
 from services.ai_focus import ask_deepseek, sanitize_ai_text
 from services.analytics import (
     count_leads_from_actions,
     count_started_conversations_from_actions,
 )
-from services.facebook_api import allow_fb_api_calls, fetch_insights_bulk
+from services.facebook_api import allow_fb_api_calls, fetch_insights_bulk, run_fb_io
+from services.sqlite_store import doc_lock, load_doc, save_doc
 from services.heatmap_store import (
     find_latest_ready_snapshots,
     get_heatmap_dataset,
+    load_day_rollups,
     prev_full_hour_window,
+    rollup_totals,
 )
 
 _LOG = logging.getLogger(__name__)
@@ -32,31 +34,6 @@ CPA_ALERTS_FILE = os.path.join(DATA_DIR, "cpa_alerts.json")
 CPA_ALERTS_DAILY_CACHE_FILE = os.path.join(DATA_DIR, "cpa_alerts_daily_cache.json")
 
 
-def _atomic_write_json(path: str, obj: dict) -> None:
-    tmp = f"{path}.tmp"
-    bak = f"{path}.bak"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-        f.flush()
-        os.fsync(f.fileno())
-    try:
-        if os.path.exists(path):
-            shutil.copy2(path, bak)
-    except Exception:
-        pass
-    os.replace(tmp, path)
-
-
-def _load_json(path: str) -> dict:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return obj if isinstance(obj, dict) else {}
-    except Exception:
-        return {}
-
-
 def _ensure_state_schema(st: dict) -> dict:
     if not isinstance(st, dict):
         st = {}
@@ -68,12 +45,15 @@ def _ensure_state_schema(st: dict) -> dict:
 
 
 def load_cpa_alerts_state() -> dict:
-    return _ensure_state_schema(_load_json(CPA_ALERTS_FILE))
+    try:
+        return _ensure_state_schema(load_doc("cpa_alerts", CPA_ALERTS_FILE))
+    except Exception:
+        return _ensure_state_schema({})
 
 
 def save_cpa_alerts_state(st: dict) -> None:
     try:
-        _atomic_write_json(CPA_ALERTS_FILE, _ensure_state_schema(st))
+        save_doc("cpa_alerts", CPA_ALERTS_FILE, _ensure_state_schema(st))
     except Exception:
         pass
 
@@ -84,14 +64,15 @@ def _new_rule_id(prefix: str, parts: List[str]) -> str:
 
 
 def ensure_cpa_alerts_state_initialized() -> None:
-    st = load_cpa_alerts_state()
-    if not isinstance(st.get("targets"), list):
-        st["targets"] = []
-    if st.get("enabled") is None:
-        st["enabled"] = True
-    if not st.get("timezone"):
-        st["timezone"] = "Asia/Almaty"
-    save_cpa_alerts_state(st)
+    with doc_lock("cpa_alerts"):
+        st = load_cpa_alerts_state()
+        if not isinstance(st.get("targets"), list):
+            st["targets"] = []
+        if st.get("enabled") is None:
+            st["enabled"] = True
+        if not st.get("timezone"):
+            st["timezone"] = "Asia/Almaty"
+        save_cpa_alerts_state(st)
 
 
 def ensure_default_rules_from_legacy_accounts() -> None:
@@ -100,57 +81,58 @@ def ensure_default_rules_from_legacy_accounts() -> None:
     Creates ACCOUNT-scope rules if there are no rules yet.
     """
 
-    st = load_cpa_alerts_state()
-    targets = st.get("targets") if isinstance(st.get("targets"), list) else []
-    if targets:
-        return
+    with doc_lock("cpa_alerts"):
+        st = load_cpa_alerts_state()
+        targets = st.get("targets") if isinstance(st.get("targets"), list) else []
+        if targets:
+            return
 
-    store = load_accounts() or {}
-    new_targets: List[Dict[str, Any]] = []
-    for aid, row in (store or {}).items():
-        if not isinstance(row, dict):
-            continue
-        alerts = (row or {}).get("alerts") or {}
-        if not isinstance(alerts, dict):
-            continue
-        if not bool(alerts.get("enabled", False)):
-            continue
+        store = load_accounts_view() or {}
+        new_targets: List[Dict[str, Any]] = []
+        for aid, row in (store or {}).items():
+            if not isinstance(row, dict):
+                continue
+            alerts = (row or {}).get("alerts") or {}
+            if not isinstance(alerts, dict):
+                continue
+            if not bool(alerts.get("enabled", False)):
+                continue
 
-        target = 0.0
-        try:
-            target = float(alerts.get("account_cpa", alerts.get("target_cpl", 0.0)) or 0.0)
-        except Exception:
             target = 0.0
-        if target <= 0:
-            continue
-
-        freq = str(alerts.get("freq", "3x") or "3x")
-        schedule = "HOURLY" if freq == "hourly" else "DAILY"
-        rid = _new_rule_id("legacy", ["ACCOUNT", str(aid), schedule, "BLENDED"])
-        nm = str(get_account_name(str(aid)) or aid)
-        name = f"{nm} ({schedule.lower()})"
+            try:
+                target = float(alerts.get("account_cpa", alerts.get("target_cpl", 0.0)) or 0.0)
+            except Exception:
+                target = 0.0
+            if target <= 0:
+                continue
 
-        new_targets.append(
-            {
-                "id": rid,
-                "name": name,
-                "scope_type": "ACCOUNT",
-                "scope_id": str(aid),
-                "result_type": "BLENDED",
-                "target_cpa_usd": float(target),
-                "schedule": schedule,
-                "active_hours": {"from": "10:30", "to": "21:30"},
-                "send_time": "10:45",
-                "min_spend_to_trigger_usd": 0.0,
-                "top_ads_limit": 5,
-                "enabled": True,
-                "last_run_at": None,
-            }
-        )
+            freq = str(alerts.get("freq", "3x") or "3x")
+            schedule = "HOURLY" if freq == "hourly" else "DAILY"
+            rid = _new_rule_id("legacy", ["ACCOUNT", str(aid), schedule, "BLENDED"])
+            nm = str(get_account_name(str(aid)) or aid)
+            name = f"{nm} ({schedule.lower()})"
+
+            new_targets.append(
+                {
+                    "id": rid,
+                    "name": name,
+                    "scope_type": "ACCOUNT",
+                    "scope_id": str(aid),
+                    "result_type": "BLENDED",
+                    "target_cpa_usd": float(target),
+                    "schedule": schedule,
+                    "active_hours": {"from": "10:30", "to": "21:30"},
+                    "send_time": "10:45",
+                    "min_spend_to_trigger_usd": 0.0,
+                    "top_ads_limit": 5,
+                    "enabled": True,
+                    "last_run_at": None,
+                }
+            )
 
-    if new_targets:
-        st["targets"] = new_targets
-        save_cpa_alerts_state(st)
+        if new_targets:
+            st["targets"] = new_targets
+            save_cpa_alerts_state(st)
 
 
 def _ensure_rule_defaults(r: Dict[str, Any]) -> Dict[str, Any]:
@@ -217,68 +199,75 @@ def create_default_rule(*, name: str = "") -> Dict[str, Any]:
 
 
 def upsert_rule(rule: Dict[str, Any]) -> Dict[str, Any]:
-    rr = _ensure_rule_defaults(rule)
-    rid = str(rr.get("id") or "").strip()
-    if not rid:
-        rr["id"] = hashlib.sha1(f"new_rule:{time.time()}".encode("utf-8")).hexdigest()[:12]
+    with doc_lock("cpa_alerts"):
+        rr = _ensure_rule_defaults(rule)
         rid = str(rr.get("id") or "").strip()
-
-    st = load_cpa_alerts_state()
-    targets = st.get("targets") if isinstance(st.get("targets"), list) else []
-    out_targets: List[Dict[str, Any]] = []
-    replaced = False
-    for it in targets:
-        if not isinstance(it, dict):
-            continue
-        if str(it.get("id") or "").strip() == rid:
+        if not rid:
+            rr["id"] = hashlib.sha1(f"new_rule:{time.time()}".encode("utf-8")).hexdigest()[:12]
+            rid = str(rr.get("id") or "").strip()
+
+        st = load_cpa_alerts_state()
+        targets = st.get("targets") if isinstance(st.get("targets"), list) else []
+        out_targets: List[Dict[str, Any]] = []
+        replaced = False
+        for it in targets:
+            if not isinstance(it, dict):
+                continue
+            if str(it.get("id") or "").strip() == rid:
+                out_targets.append(rr)
+                replaced = True
+            else:
+                out_targets.append(it)
+        if not replaced:
             out_targets.append(rr)
-            replaced = True
-        else:
-            out_targets.append(it)
-    if not replaced:
-        out_targets.append(rr)
-    st["targets"] = out_targets
-    save_cpa_alerts_state(st)
-    return rr
+        st["targets"] = out_targets
+        save_cpa_alerts_state(st)
+        return rr
 
 
 def delete_rule(rule_id: str) -> bool:
-    rid = str(rule_id or "").strip()
-    if not rid:
-        return False
-    st = load_cpa_alerts_state()
-    targets = st.get("targets") if isinstance(st.get("targets"), list) else []
-    out_targets: List[Dict[str, Any]] = []
-    removed = False
-    for it in targets:
-        if not isinstance(it, dict):
-            continue
-        if str(it.get("id") or "").strip() == rid:
-            removed = True
-            continue
-        out_targets.append(it)
-    st["targets"] = out_targets
-    save_cpa_alerts_state(st)
-    return bool(removed)
+    with doc_lock("cpa_alerts"):
+        rid = str(rule_id or "").strip()
+        if not rid:
+            return False
+        st = load_cpa_alerts_state()
+        targets = st.get("targets") if isinstance(st.get("targets"), list) else []
+        out_targets: List[Dict[str, Any]] = []
+        removed = False
+        for it in targets:
+            if not isinstance(it, dict):
+                continue
+            if str(it.get("id") or "").strip() == rid:
+                removed = True
+                continue
+            out_targets.append(it)
+        st["targets"] = out_targets
+        save_cpa_alerts_state(st)
+        return bool(removed)
 
 
 def toggle_rule_enabled(rule_id: str) -> Optional[Dict[str, Any]]:
-    rr = get_rule(rule_id)
-    if not rr:
-        return None
-    rr2 = dict(rr)
-    rr2["enabled"] = not bool(rr.get("enabled") is True)
-    return upsert_rule(rr2)
+    with doc_lock("cpa_alerts"):
+        rr = get_rule(rule_id)
+        if not rr:
+            return None
+        rr2 = dict(rr)
+        rr2["enabled"] = not bool(rr.get("enabled") is True)
+        return upsert_rule(rr2)
 
 
 def set_global_enabled(enabled: bool) -> None:
-    st = load_cpa_alerts_state()
-    st["enabled"] = bool(enabled)
-    save_cpa_alerts_state(st)
+    with doc_lock("cpa_alerts"):
+        st = load_cpa_alerts_state()
+        st["enabled"] = bool(enabled)
+        save_cpa_alerts_state(st)
 
 
 def _daily_cache_load() -> dict:
-    st = _load_json(CPA_ALERTS_DAILY_CACHE_FILE)
+    try:
+        st = load_doc("cpa_alerts_daily_cache", CPA_ALERTS_DAILY_CACHE_FILE)
+    except Exception:
+        st = {}
     if not isinstance(st, dict):
         st = {}
     st.setdefault("items", {})
@@ -289,7 +278,7 @@ def _daily_cache_load() -> dict:
 
 def _daily_cache_save(st: dict) -> None:
     try:
-        _atomic_write_json(CPA_ALERTS_DAILY_CACHE_FILE, st if isinstance(st, dict) else {})
+        save_doc("cpa_alerts_daily_cache", CPA_ALERTS_DAILY_CACHE_FILE, st if isinstance(st, dict) else {})
     except Exception:
         pass
 
@@ -359,7 +348,7 @@ def _find_aid_for_entity_from_snapshots(*, entity_kind: str, entity_id: str, now
     if not ek or not eid:
         return None
 
-    store = load_accounts() or {}
+    store = load_accounts_view() or {}
     aids = [str(aid) for aid, row in (store or {}).items() if isinstance(row, dict) and bool(row.get("enabled", True))]
     # Deterministic order.
     aids.sort()
@@ -390,7 +379,7 @@ def _resolve_entity_group_campaigns(group_id: str) -> Tuple[Optional[str], List[
     if not gid:
         return None, [], "group_id_empty"
 
-    st = load_accounts() or {}
+    st = load_accounts_view() or {}
     for aid, row in (st or {}).items():
         ap = (row or {}).get("autopilot") or {}
         groups = ap.get("campaign_groups") or {}
@@ -458,23 +447,39 @@ def _periods_for_mode(*, mode: str, now: datetime) -> Tuple[PeriodDef, Optional[
     return main, None
 
 
-def _collect_snapshots_for_dates(*, aid: str, dates: set[str], now: datetime) -> List[Dict[str, Any]]:
+def _collect_rollups_for_dates(*, aid: str, dates: set[str]) -> Dict[str, Dict[str, Any]]:
     if not dates:
-        return []
-    # Fetch enough history.
-    try:
-        days = len(dates)
-        max_hours = max(24, int(days) * 24 + 72)
-    except Exception:
-        max_hours = 120
+        return {}
+    rollups = load_day_rollups(str(aid), dates=sorted(dates))
+    return {d: r for d, r in rollups.items() if r.get("ready_hours")}
 
-    snaps = find_latest_ready_snapshots(str(aid), max_hours=max_hours, now=now) or []
-    out: List[Dict[str, Any]] = []
-    for s in snaps:
-        d = str((s or {}).get("date") or "")
-        if d and d in dates:
-            out.append(s)
-    return out
+
+def _sum_rollups(
+    rollups: Dict[str, Dict[str, Any]],
+    *,
+    scope_type: str,
+    scope_id: str,
+    result_type: str,
+    campaign_ids_for_group: Optional[set[str]] = None,
+) -> Tuple[float, int]:
+    st = str(scope_type or "ACCOUNT").upper().strip()
+    level = {"ACCOUNT": "account", "CAMPAIGN": "campaign", "ADSET": "adset", "ENTITY_GROUP": "campaigns"}.get(st)
+    if not level:
+        return 0.0, 0
+    rt = str(result_type or "BLENDED").upper().strip()
+    key = "msgs" if rt == "MESSAGES" else "leads" if rt == "SUBMIT_APPLICATION" else "total"
+    spend = 0.0
+    results = 0
+    for r in (rollups or {}).values():
+        t = rollup_totals(
+            r,
+            level=level,
+            entity_id=str(scope_id or "").strip(),
+            campaign_ids=campaign_ids_for_group,
+        )
+        spend += float(t.get("spend") or 0.0)
+        results += int(t.get(key) or 0)
+    return float(spend), int(results)
 
 
 def _rows_for_scope_from_snapshot_rows(
@@ -1004,23 +1009,18 @@ async def build_cpa_alert_message(
     except Exception:
         dates = set([str(main_pd.since), str(main_pd.until)])
 
-    snaps = _collect_snapshots_for_dates(aid=str(aid), dates=dates, now=now)
+    rollups = _collect_rollups_for_dates(aid=str(aid), dates=dates)
 
     spend = 0.0
     results = 0
-    if snaps:
-        scoped_rows: List[Dict[str, Any]] = []
-        for s in snaps:
-            rr = list((s or {}).get("rows") or [])
-            scoped_rows.extend(
-                _rows_for_scope_from_snapshot_rows(
-                    rr,
-                    scope_type=scope_type,
-                    scope_id=scope_id,
-                    campaign_ids_for_group=campaign_set,
-                )
-            )
-        spend, results = _sum_snapshot_rows(scoped_rows, result_type=result_type)
+    if rollups:
+        spend, results = _sum_rollups(
+            rollups,
+            scope_type=scope_type,
+            scope_id=scope_id,
+            result_type=result_type,
+            campaign_ids_for_group=campaign_set,
+        )
         source = "почасовой кэш"
         source_code = "hourly_cache"
     else:
@@ -1058,7 +1058,8 @@ async def build_cpa_alert_message(
                 fb_scope_id = aid
                 fb_campaigns = group_campaigns
 
-            spend, results, st_fb = _fetch_overall_via_fb(
+            spend, results, st_fb = await run_fb_io(
+                _fetch_overall_via_fb,
                 aid=str(aid),
                 scope_type=fb_scope_type,
                 scope_id=fb_scope_id,
@@ -1119,7 +1120,8 @@ async def build_cpa_alert_message(
                     fb_scope_type2 = "ENTITY_GROUP"
                     fb_scope_id2 = aid
                     fb_campaigns2 = group_campaigns
-                sp2, re2, st_fb2 = _fetch_overall_via_fb(
+                sp2, re2, st_fb2 = await run_fb_io(
+                    _fetch_overall_via_fb,
                     aid=str(aid),
                     scope_type=fb_scope_type2,
                     scope_id=fb_scope_id2,
@@ -1163,7 +1165,8 @@ async def build_cpa_alert_message(
         if isinstance(hit_ads, dict) and isinstance(hit_ads.get("items"), list):
             ads = list(hit_ads.get("items") or [])
         else:
-            ads, st_ads = _fetch_ads_via_fb(
+            ads, st_ads = await run_fb_io(
+                _fetch_ads_via_fb,
                 aid=str(aid),
                 scope_type=scope_type,
                 scope_id=scope_id,
@@ -1336,20 +1339,21 @@ async def run_cpa_alerts_for_mode(
             try:
                 rid = str((r or {}).get("id") or "").strip()
                 if rid:
-                    st2 = load_cpa_alerts_state()
-                    targets = st2.get("targets") if isinstance(st2.get("targets"), list) else []
-                    out_targets = []
-                    for it in targets:
-                        if not isinstance(it, dict):
-                            continue
-                        if str(it.get("id") or "").strip() == rid:
-                            it2 = dict(it)
-                            it2["last_run_at"] = now.isoformat()
-                            out_targets.append(it2)
-                        else:
-                            out_targets.append(it)
-                    st2["targets"] = out_targets
-                    save_cpa_alerts_state(st2)
+                    with doc_lock("cpa_alerts"):
+                        st2 = load_cpa_alerts_state()
+                        targets = st2.get("targets") if isinstance(st2.get("targets"), list) else []
+                        out_targets = []
+                        for it in targets:
+                            if not isinstance(it, dict):
+                                continue
+                            if str(it.get("id") or "").strip() == rid:
+                                it2 = dict(it)
+                                it2["last_run_at"] = now.isoformat()
+                                out_targets.append(it2)
+                            else:
+                                out_targets.append(it)
+                        st2["targets"] = out_targets
+                        save_cpa_alerts_state(st2)
             except Exception:
                 pass
 
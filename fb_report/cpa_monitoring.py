@@ -6,7 +6,7 @@ from typing import Any, Dict, List, Optional, Tuple
 from fb_report.constants import ALMATY_TZ
 from fb_report.storage import get_account_name
 from services.facebook_api import deny_fb_api_calls
-from services.heatmap_store import find_latest_ready_snapshots, get_heatmap_dataset, prev_full_hour_window
+from services.heatmap_store import get_heatmap_dataset, load_day_rollups, prev_full_hour_window, rollup_totals
 
 
 def _build_day_period(day: datetime) -> Dict[str, str]:
@@ -45,73 +45,18 @@ def compute_effective_cpa(insight: Dict[str, Any], *, aid: str) -> Tuple[Optiona
     return float(spend) / float(total_actions), total_actions
 
 
-def _sum_row_metrics(rows: List[Dict[str, Any]]) -> Tuple[float, int, int, int]:
-    spend = 0.0
-    msgs = 0
-    leads = 0
-    total = 0
-    for r in rows or []:
-        if not isinstance(r, dict):
-            continue
-        try:
-            spend += float(r.get("spend") or 0.0)
-        except Exception:
-            pass
-        try:
-            msgs += int(r.get("msgs") or 0)
-        except Exception:
-            pass
-        try:
-            leads += int(r.get("leads") or 0)
-        except Exception:
-            pass
-        try:
-            t = r.get("total")
-            if t is None:
-                t = int(r.get("msgs") or 0) + int(r.get("leads") or 0)
-            total += int(t or 0)
-        except Exception:
-            pass
-    return float(spend), int(msgs), int(leads), int(total)
-
-
-def _filter_rows_for_scope(
-    rows: List[Dict[str, Any]],
-    *,
-    lvl: str,
-    entity_id: Optional[str],
-) -> List[Dict[str, Any]]:
-    if lvl == "account":
-        return list(rows or [])
-    if not entity_id:
-        return []
-    eid = str(entity_id)
-    if lvl == "campaign":
-        return [r for r in (rows or []) if str((r or {}).get("campaign_id") or "") == eid]
-    if lvl == "adset":
-        return [r for r in (rows or []) if str((r or {}).get("adset_id") or "") == eid]
-    return []
-
-
-def _aggregate_day_from_snapshots(
-    snaps: List[Dict[str, Any]],
+def _aggregate_day_from_rollup(
+    rollup: Optional[Dict[str, Any]],
     *,
     lvl: str,
     entity_id: Optional[str],
 ) -> Dict[str, Any]:
-    day_rows: List[Dict[str, Any]] = []
-    for snap in snaps or []:
-        rows = (snap or {}).get("rows") or []
-        if not isinstance(rows, list):
-            continue
-        day_rows.extend(_filter_rows_for_scope(rows, lvl=lvl, entity_id=entity_id))
-
-    spend, msgs, leads, total = _sum_row_metrics(day_rows)
+    t = rollup_totals(rollup, level=lvl, entity_id=entity_id)
     return {
-        "spend": spend,
-        "msgs": msgs,
-        "leads": leads,
-        "total": total,
+        "spend": float(t.get("spend") or 0.0),
+        "msgs": int(t.get("msgs") or 0),
+        "leads": int(t.get("leads") or 0),
+        "total": int(t.get("total") or 0),
     }
 
 
@@ -157,23 +102,11 @@ def build_monitor_snapshot(
     lvl = str(level or "account").lower()
     periods = list(reversed(_iter_last_days(history_days)))
 
-    now = datetime.now(ALMATY_TZ)
-    max_hours = max(1, int(history_days) * 24 + 48)
     with deny_fb_api_calls(reason="anomalies_snapshot_series"):
-        snaps = find_latest_ready_snapshots(str(aid), max_hours=max_hours, now=now)
-
-    snaps_by_date: Dict[str, List[Dict[str, Any]]] = {}
-    for s in snaps or []:
-        d = str((s or {}).get("date") or "")
-        if not d:
-            continue
-        snaps_by_date.setdefault(d, []).append(s)
-
-    for d, items in snaps_by_date.items():
-        try:
-            items.sort(key=lambda x: int((x or {}).get("hour") or 0))
-        except Exception:
-            pass
+        rollups = load_day_rollups(
+            str(aid),
+            dates=[str((p or {}).get("since") or "") for p in periods],
+        )
 
     series: List[Optional[float]] = []
     totals: List[int] = []
@@ -182,8 +115,8 @@ def build_monitor_snapshot(
 
     for p in periods:
         date_str = str((p or {}).get("since") or "")
-        daily = _aggregate_day_from_snapshots(
-            snaps_by_date.get(date_str, []),
+        daily = _aggregate_day_from_rollup(
+            rollups.get(date_str),
             lvl=lvl,
             entity_id=str(entity_id) if entity_id is not None else None,
         )
@@ -9,11 +9,18 @@ from services.storage import (
     save_local_insights as _save_local_insights,
 )
 
-from services.heatmap_store import load_snapshot, list_snapshot_hours
+from services.heatmap_store import (
+    CUBE_STATES,
+    cube_days,
+    cube_field,
+    load_day_rollup,
+    manifest_hour,
+    rollup_totals,
+)
 from services.facebook_api import deny_fb_api_calls
 
 from .constants import ALMATY_TZ
-from .storage import get_account_name, load_accounts
+from .storage import get_account_name, load_accounts_view
 
 from services.analytics import (
     count_leads_from_actions,
@@ -156,8 +163,29 @@ def _load_daily_totals_for_account(
     days = _iter_days_for_mode(mode)
     result: List[Dict[str, Optional[float]]] = []
 
+    # Суммы готовых часов берутся из куба час×день (services/heatmap_store.py).
+    try:
+        with deny_fb_api_calls(reason="insights_daily_from_snapshots"):
+            cube = cube_days(str(aid), dates=[d.strftime("%Y-%m-%d") for d in days])
+    except Exception:
+        cube = None
+
+    ready_states = {CUBE_STATES["ready"], CUBE_STATES["ready_low_confidence"]}
+    f_state = cube_field("state")
     for day in days:
-        daily_from_snapshots = _get_daily_stats_from_snapshots(aid, day)
+        if cube is None:
+            daily_from_snapshots = _get_daily_stats_from_snapshots(aid, day)
+        else:
+            cells = [c for c in (cube.get(day.strftime("%Y-%m-%d")) or []) if int(c[f_state]) in ready_states]
+            daily_from_snapshots = None
+            if cells:
+                daily_from_snapshots = {
+                    "date": day,
+                    "messages": int(round(sum(c[cube_field("msgs")] for c in cells))),
+                    "leads": int(round(sum(c[cube_field("leads")] for c in cells))),
+                    "total_conversions": int(round(sum(c[cube_field("total")] for c in cells))),
+                    "spend": round(sum(float(c[cube_field("spend")]) for c in cells), 2),
+                }
         if daily_from_snapshots is not None:
             result.append(daily_from_snapshots)
         else:
@@ -177,59 +205,17 @@ def _load_daily_totals_for_account(
 def _get_daily_stats_from_snapshots(aid: str, day: datetime) -> Optional[Dict[str, Any]]:
     date_str = day.strftime("%Y-%m-%d")
 
-    msgs = 0
-    leads = 0
-    total = 0
-    spend = 0.0
-    any_ready = False
-
     with deny_fb_api_calls(reason="insights_daily_from_snapshots"):
-        for h in list_snapshot_hours(str(aid), date_str=str(date_str)):
-            snap = load_snapshot(str(aid), date_str=str(date_str), hour=int(h)) or {}
-            if str(snap.get("status") or "") not in {"ready", "ready_low_confidence"}:
-                continue
-            any_ready = True
-            for r in (snap.get("rows") or []):
-                if not isinstance(r, dict):
-                    continue
-                try:
-                    msgs += int(r.get("started_conversations") or r.get("msgs") or 0)
-                except Exception:
-                    pass
-                try:
-                    actions_map = (r or {}).get("actions")
-                    if isinstance(actions_map, dict) and actions_map:
-                        leads += int(count_leads_from_actions(actions_map, aid=str(aid), lead_action_type=None) or 0)
-                    else:
-                        leads += int(r.get("website_submit_applications") or r.get("leads") or 0)
-                except Exception:
-                    pass
-                try:
-                    t = r.get("total")
-                    if t is None:
-                        t = int(r.get("started_conversations") or r.get("msgs") or 0) + int(
-                            (
-                                int(count_leads_from_actions((r or {}).get("actions") or {}, aid=str(aid), lead_action_type=None) or 0)
-                                if isinstance((r or {}).get("actions"), dict)
-                                else int(r.get("website_submit_applications") or r.get("leads") or 0)
-                            )
-                        )
-                    total += int(t or 0)
-                except Exception:
-                    pass
-                try:
-                    spend += float(r.get("spend") or 0.0)
-                except Exception:
-                    pass
-
-    if not any_ready:
+        rollup = load_day_rollup(str(aid), date_str=str(date_str))
+    if not rollup or not rollup.get("ready_hours"):
         return None
+    t = rollup_totals(rollup)
     return {
         "date": day,
-        "messages": int(msgs or 0),
-        "leads": int(leads or 0),
-        "total_conversions": int(total or 0),
-        "spend": float(spend or 0.0),
+        "messages": int(t.get("msgs") or 0),
+        "leads": int(t.get("leads") or 0),
+        "total_conversions": int(t.get("total") or 0),
+        "spend": float(t.get("spend") or 0.0),
     }
 
 
@@ -275,11 +261,14 @@ def build_hourly_heatmap_for_account(
     acc_name = get_account_name_fn(aid)
     mode_label = _hourly_mode_label(mode)
 
+    try:
+        acc_row = load_accounts_view().get(str(aid)) or {}
+    except Exception:
+        acc_row = {}
+
     def _resolve_result_mode() -> str:
         try:
-            store = load_accounts() or {}
-            row = store.get(str(aid)) or {}
-            hm = (row or {}).get("heatmap") or {}
+            hm = (acc_row or {}).get("heatmap") or {}
             if isinstance(hm, dict):
                 v = str(hm.get("result_mode") or "").strip().lower()
                 if v in {"messages", "website", "blended"}:
@@ -291,9 +280,7 @@ def build_hourly_heatmap_for_account(
 
     def _resolve_include_paused() -> bool:
         try:
-            store = load_accounts() or {}
-            row = store.get(str(aid)) or {}
-            hm = (row or {}).get("heatmap") or {}
+            hm = (acc_row or {}).get("heatmap") or {}
             if isinstance(hm, dict) and "include_paused" in hm:
                 return bool(hm.get("include_paused", False))
         except Exception:
@@ -319,8 +306,18 @@ def build_hourly_heatmap_for_account(
     total_convs_all = 0
     total_spend_all = 0.0
 
+    with deny_fb_api_calls(reason="insights_hour_bucket"):
+        cube = cube_days(str(aid), dates=[d.strftime("%Y-%m-%d") for d in days])
+    f_state = cube_field("state")
+    f_rows = cube_field("rows")
+    sfx = "" if include_paused else "_active"
+    f_spend = cube_field("spend" + sfx)
+    f_msgs = cube_field("msgs" + sfx)
+    f_leads = cube_field("leads" + sfx)
+
     for day in days:
         day_key = day.strftime("%Y-%m-%d")
+        cells = cube.get(day_key) or []
 
         coverage_hours = 0
         missing_hours: list[str] = []
@@ -338,74 +335,45 @@ def build_hourly_heatmap_for_account(
             except Exception:
                 h_int = 0
 
-            with deny_fb_api_calls(reason="insights_hour_bucket"):
-                snap = load_snapshot(str(aid), date_str=str(day_key), hour=int(h_int))
-            if not snap:
+            cell = cells[h_int] if h_int < len(cells) else None
+            state = int(cell[f_state]) if cell else 0
+            if state == 0:
+                missing_hours.append(f"{h}")
+                val = 0
+                sp = 0.0
+            elif state == CUBE_STATES["failed"]:
+                failed_hours.append(f"{h}")
+                try:
+                    head = manifest_hour(str(aid), date_str=str(day_key), hour=int(h_int)) or {}
+                    failed_reasons[str(h)] = str(head.get("reason") or "snapshot_failed")
+                except Exception:
+                    pass
+                val = 0
+                sp = 0.0
+            elif state not in {CUBE_STATES["ready"], CUBE_STATES["ready_low_confidence"]}:
                 missing_hours.append(f"{h}")
                 val = 0
                 sp = 0.0
+            elif int(cell[f_rows]) <= 0:
+                failed_hours.append(f"{h}")
+                try:
+                    failed_reasons[str(h)] = "empty_rows"
+                except Exception:
+                    pass
+                val = 0
+                sp = 0.0
             else:
-                st = str(snap.get("status") or "missing")
-                if st == "failed":
-                    failed_hours.append(f"{h}")
-                    try:
-                        failed_reasons[str(h)] = str(snap.get("reason") or "snapshot_failed")
-                    except Exception:
-                        pass
-                    val = 0
-                    sp = 0.0
-                elif st not in {"ready", "ready_low_confidence"}:
-                    missing_hours.append(f"{h}")
-                    val = 0
-                    sp = 0.0
-                elif int(snap.get("rows_count") or 0) <= 0:
-                    failed_hours.append(f"{h}")
-                    try:
-                        failed_reasons[str(h)] = "empty_rows"
-                    except Exception:
-                        pass
-                    val = 0
-                    sp = 0.0
+                coverage_hours += 1
+                started = int(round(cell[f_msgs]))
+                website = int(round(cell[f_leads]))
+
+                if result_mode == "messages":
+                    val = int(started or 0)
+                elif result_mode == "website":
+                    val = int(website or 0)
                 else:
-                    coverage_hours += 1
-                    started = 0
-                    website = 0
-                    spend = 0.0
-                    for r in (snap.get("rows") or []):
-                        if not isinstance(r, dict):
-                            continue
-                        row_status = r.get("adset_status")
-                        if not include_paused:
-                            try:
-                                st = str(row_status).upper() if row_status is not None else ""
-                                if st and st not in {"ACTIVE", "UNKNOWN"}:
-                                    continue
-                            except Exception:
-                                pass
-                        try:
-                            started += int(r.get("started_conversations") or r.get("msgs") or 0)
-                        except Exception:
-                            pass
-                        try:
-                            actions_map = (r or {}).get("actions")
-                            if isinstance(actions_map, dict) and actions_map:
-                                website += int(count_leads_from_actions(actions_map, aid=str(aid), lead_action_type=None) or 0)
-                            else:
-                                website += int(r.get("website_submit_applications") or r.get("leads") or 0)
-                        except Exception:
-                            pass
-                        try:
-                            spend += float(r.get("spend") or 0.0)
-                        except Exception:
-                            pass
-
-                    if result_mode == "messages":
-                        val = int(started or 0)
-                    elif result_mode == "website":
-                        val = int(website or 0)
-                    else:
-                        val = int((started or 0) + (website or 0))
-                    sp = float(spend or 0.0)
+                    val = int((started or 0) + (website or 0))
+                sp = round(float(cell[f_spend] or 0.0), 2)
 
             row_totals.append(val)
             row_spends.append(sp)
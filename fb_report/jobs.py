@@ -20,26 +20,27 @@ from .constants import (
     ALLOWED_USER_IDS,
     MORNING_REPORT_STATE_FILE,
 )
-from .storage import load_accounts, get_account_name, resolve_autopilot_chat_id
+from .storage import load_accounts_view, get_account_name, resolve_autopilot_chat_id
 from .reporting import resolve_report_profile, get_cached_report, build_report_with_caller, build_account_report
 from .cpa_monitoring import format_cpa_anomaly_message
 from .autopilot_format import ap_action_text
+from services.sqlite_store import load_doc, save_doc
 
 try:  # pragma: no cover
-    from services.heatmap_store import load_snapshot, prev_full_hour_window
+    from services.heatmap_store import load_snapshot, manifest_hour
 except Exception:  # noqa: BLE001
     def load_snapshot(_aid: str, *, date_str: str, hour: int):  # type: ignore[override]
         return None
 
-    def prev_full_hour_window(now: datetime | None = None):  # type: ignore[override]
-        return {}
+    def manifest_hour(_aid: str, *, date_str: str, hour: int):  # type: ignore[override]
+        return None
 
 try:  # pragma: no cover
     from services.facebook_api import safe_api_call, _normalize_insight
     from services.analytics import (
         parse_insight,
-        count_started_conversations_from_actions,
-        count_leads_from_actions,
+        classify_actions,
+        DERIVED_SCHEMA,
     )
     from services.facebook_api import (
         is_rate_limited_now,
@@ -48,6 +49,7 @@ try:  # pragma: no cover
         classify_api_error,
         allow_fb_api_calls,
         deny_fb_api_calls,
+        run_fb_io,
     )
 except Exception:  # noqa: BLE001
     def safe_api_call(_fn, *args, **kwargs):  # type: ignore[override]
@@ -59,11 +61,10 @@ except Exception:  # noqa: BLE001
     def parse_insight(_ins: dict, **_kwargs) -> dict:  # type: ignore[override]
         return {"msgs": 0, "leads": 0, "total": 0, "spend": 0.0, "cpa": None}
 
-    def count_started_conversations_from_actions(_actions: dict) -> int:  # type: ignore[override]
-        return 0
+    DERIVED_SCHEMA = 0
 
-    def count_website_submit_applications_from_actions(_actions: dict) -> int:  # type: ignore[override]
-        return 0
+    def classify_actions(_actions: dict) -> dict:  # type: ignore[override]
+        return {"started_conversations": 0, "website_submit_applications": 0}
 
     def is_rate_limited_now() -> bool:  # type: ignore[override]
         return False
@@ -90,6 +91,9 @@ except Exception:  # noqa: BLE001
     def deny_fb_api_calls(_reason: str | None = None):  # type: ignore[override]
         return _Allow()
 
+    async def run_fb_io(fn, *args, **kwargs):  # type: ignore[override]
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
 
 try:  # pragma: no cover
     from services.heatmap_store import (
@@ -519,40 +523,15 @@ async def daily_report_job(context: ContextTypes.DEFAULT_TYPE):
     return
 
 
-def _atomic_write_json(path: str, obj: dict) -> None:
-    try:
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-    except Exception:
-        pass
-    tmp = str(path) + ".tmp"
-    try:
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(obj, f, ensure_ascii=False, indent=2)
-            f.flush()
-            try:
-                os.fsync(f.fileno())
-            except Exception:
-                pass
-        os.replace(tmp, path)
-    except Exception:
-        try:
-            if os.path.exists(tmp):
-                os.remove(tmp)
-        except Exception:
-            pass
-
-
 def _load_morning_report_state() -> dict:
     try:
-        with open(MORNING_REPORT_STATE_FILE, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return obj if isinstance(obj, dict) else {}
+        return load_doc("morning_report_state", MORNING_REPORT_STATE_FILE)
     except Exception:
         return {}
 
 
 def _save_morning_report_state(d: dict) -> None:
-    _atomic_write_json(MORNING_REPORT_STATE_FILE, d if isinstance(d, dict) else {})
+    save_doc("morning_report_state", MORNING_REPORT_STATE_FILE, d if isinstance(d, dict) else {})
 
 
 def _job_next_run_str(job: Any) -> str:
@@ -589,7 +568,7 @@ async def morning_report_job(context: ContextTypes.DEFAULT_TYPE) -> None:
         yday = (now.date() - timedelta(days=1)).strftime("%Y-%m-%d")
         period = {"since": str(yday), "until": str(yday)}
 
-        accounts = load_accounts() or {}
+        accounts = load_accounts_view() or {}
         selected: list[tuple[str, str]] = []
         for aid, row in (accounts or {}).items():
             if not isinstance(row, dict) or not row.get("enabled", True):
@@ -646,7 +625,7 @@ async def send_morning_report_to_chat(
     yday = (now.date() - timedelta(days=1)).strftime("%Y-%m-%d")
     period = {"since": str(yday), "until": str(yday)}
 
-    accounts = load_accounts() or {}
+    accounts = load_accounts_view() or {}
     for aid in [str(x) for x in (account_ids or []) if str(x).strip()]:
         row = (accounts or {}).get(str(aid)) or {}
 
@@ -692,7 +671,7 @@ async def send_morning_report_to_chat(
             lvl = "ACCOUNT"
 
         if lvl in {"CAMPAIGN", "ADSET"}:
-            t = build_account_report(str(aid), dict(period), level=str(lvl))
+            t = await run_fb_io(build_account_report, str(aid), dict(period), level=str(lvl))
             if t:
                 try:
                     parts = [p for p in str(t).split("\n────────────\n") if str(p).strip()]
@@ -762,13 +741,13 @@ async def client_groups_morning_report_job(context: ContextTypes.DEFAULT_TYPE) -
                     continue
 
                 if lvl == "ACCOUNT":
-                    txt = get_cached_report(str(aid), period, label)
+                    txt = await run_fb_io(get_cached_report, str(aid), period, label)
                 elif lvl == "CAMPAIGN":
-                    txt = build_account_report(str(aid), period, "CAMPAIGN", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), period, "CAMPAIGN", label=label)
                 elif lvl == "ADSET":
-                    txt = build_account_report(str(aid), period, "ADSET", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), period, "ADSET", label=label)
                 else:
-                    txt = build_account_report(str(aid), period, "AD", label=label)
+                    txt = await run_fb_io(build_account_report, str(aid), period, "AD", label=label)
 
                 if txt:
                     await context.bot.send_message(chat_id=str(cid), text=str(txt), parse_mode="HTML")
@@ -776,6 +755,33 @@ async def client_groups_morning_report_job(context: ContextTypes.DEFAULT_TYPE) -
             log.exception("client_group_morning_error chat_id=%s", str(cid), exc_info=e)
 
 
+async def account_meta_refresh_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пакетно обновляет кэш метаданных (пояс/валюта/статус) всех аккаунтов с истёкшим TTL."""
+    log = logging.getLogger(__name__)
+    try:
+        from services.account_meta import refresh_accounts_meta
+
+        aids = [str(a) for a in (load_accounts_view() or {}).keys()]
+        n = await run_fb_io(refresh_accounts_meta, aids, caller="account_meta_refresh_job")
+        log.info("job_done name=account_meta_refresh accounts=%s refreshed=%s", str(len(aids)), str(n))
+    except Exception as e:
+        log.exception("account_meta_refresh_error", exc_info=e)
+
+
+def schedule_account_meta_refresh(app: Application) -> None:
+    log = logging.getLogger(__name__)
+    app.job_queue.run_once(account_meta_refresh_job, when=timedelta(minutes=2), name="account_meta_refresh_startup")
+    job = app.job_queue.run_daily(
+        account_meta_refresh_job,
+        time=time(hour=4, minute=30, tzinfo=ALMATY_TZ),
+        name="account_meta_refresh",
+    )
+    log.info(
+        "job_registered name=account_meta_refresh next_run_at=%s",
+        _job_next_run_str(job),
+    )
+
+
 def schedule_client_groups_morning_report(app: Application) -> None:
     log = logging.getLogger(__name__)
     job = app.job_queue.run_daily(
@@ -1322,64 +1328,74 @@ def _is_adset_cache_fresh(obj: dict, *, ttl_hours: int = 6) -> bool:
     return age_s >= 0 and age_s <= float(ttl_hours) * 3600.0
 
 
-def _refresh_adset_status_cache(aid: str, *, log: logging.Logger) -> dict[str, str]:
-    try:
-        from facebook_business.adobjects.adaccount import AdAccount
-    except Exception:
-        return {}
-
-    acc = AdAccount(str(aid))
-    fields = ["id", "effective_status", "campaign_id", "name"]
-    params = {"limit": 500}
-    data = safe_api_call(
-        acc.get_ad_sets,
-        fields=fields,
-        params=params,
-        _meta={"endpoint": "adsets", "params": params},
-        _caller="heatmap_snapshot_collector",
-    )
+def _adset_status_cache_obj(aid: str, items: Any) -> dict:
     out: dict[str, dict] = {}
-    if data:
-        try:
-            items = None
-            try:
-                items = list(data)
-            except Exception:
-                items = data
-            for r in (items or []):
-                if not isinstance(r, dict):
-                    try:
-                        r = dict(r)
-                    except Exception:
-                        continue
-                sid = str(r.get("id") or "")
-                if not sid:
-                    continue
-                out[sid] = {
-                    "effective_status": str(r.get("effective_status") or "UNKNOWN"),
-                    "campaign_id": str(r.get("campaign_id") or ""),
-                    "name": str(r.get("name") or ""),
-                }
-        except Exception:
-            out = {}
-
-    obj = {
+    for it in (items or []):
+        sid = str((it or {}).get("id") or "")
+        if not sid:
+            continue
+        out[sid] = {
+            "effective_status": str((it or {}).get("effective_status") or "UNKNOWN"),
+            "campaign_id": str((it or {}).get("campaign_id") or ""),
+            "name": str((it or {}).get("name") or ""),
+        }
+    return {
         "account_id": str(aid),
         "updated_at": datetime.now(ALMATY_TZ).isoformat(),
         "adsets": out,
     }
+
+
+def _refresh_adset_status_cache(aid: str, *, log: logging.Logger) -> dict[str, str]:
+    """Adset statuses from the adsets catalog (delta sync, see fetch_adsets)."""
+    from services.facebook_api import fetch_adsets
+
+    obj = _adset_status_cache_obj(str(aid), fetch_adsets(str(aid), force=True, caller="heatmap_snapshot_collector"))
     _save_adset_status_cache(str(aid), obj)
     try:
         log.info(
             "🟦 FB ADSET STATUS CACHE UPDATED aid=%s adsets=%s",
             str(aid),
-            str(int(len(out or {}))),
+            str(int(len(obj.get("adsets") or {}))),
         )
     except Exception:
         pass
     return _adset_status_map_from_cache(obj)
 
 
+def _refresh_adset_status_caches_batch(aids: list[str], *, log: logging.Logger) -> int:
+    """Refreshes adset status caches of many accounts in one Graph batch round trip."""
+    from services.facebook_api import prefetch_catalogs, fetch_adsets
+
+    if not aids:
+        return 0
+    with allow_fb_api_calls(reason="heatmap_snapshot_collector_adset_status"):
+        errors = prefetch_catalogs(
+            [str(a) for a in aids],
+            kinds=("adsets",),
+            force=True,
+            caller="heatmap_snapshot_collector",
+        )
+
+    refreshed = 0
+    for aid in aids:
+        if (errors or {}).get(f"adsets:{aid}"):
+            continue
+        with deny_fb_api_calls(reason="heatmap_snapshot_collector_adset_status_cached"):
+            items = fetch_adsets(str(aid))
+        _save_adset_status_cache(str(aid), _adset_status_cache_obj(str(aid), items))
+        refreshed += 1
+    try:
+        log.info(
+            "🟦 FB ADSET STATUS CACHE BATCH accounts=%s refreshed=%s",
+            str(int(len(aids))),
+            str(int(refreshed)),
+        )
+    except Exception:
+        pass
+    return refreshed
+
+
 def _has_real_reason(snap: dict) -> bool:
     try:
         r = str((snap or {}).get("reason") or "")
@@ -1406,739 +1422,1072 @@ def _map_fb_reason(info: dict, et: str) -> str:
     return "snapshot_failed"
 
 
-async def _heatmap_snapshot_collector_job(
-    context: ContextTypes.DEFAULT_TYPE,
-    *,
-    manual: bool = False,
-    manual_aid: str | None = None,
-):
-    from services.heatmap_store import load_snapshot, save_snapshot, build_snapshot_shell
+HOURLY_INSIGHTS_FIELDS = [
+    "spend",
+    "actions",
+    "impressions",
+    "clicks",
+    "frequency",
+    "adset_id",
+    "adset_name",
+    "campaign_id",
+    "campaign_name",
+]
 
-    now = datetime.now(ALMATY_TZ)
-    end_dt_base = now.replace(minute=0, second=0, microsecond=0)
-    collector_deadline_dt = end_dt_base + timedelta(minutes=30)
 
-    try:
-        backfill_lookback_hours = int(os.getenv("HEATMAP_BACKFILL_LOOKBACK_HOURS", "48") or 48)
-    except Exception:
-        backfill_lookback_hours = 48
-    if backfill_lookback_hours < 1:
-        backfill_lookback_hours = 1
-    if backfill_lookback_hours > 96:
-        backfill_lookback_hours = 96
+def _hourly_insights_params(date_str: str) -> dict:
+    return {
+        "level": "adset",
+        "time_range": {"since": str(date_str), "until": str(date_str)},
+        "breakdowns": ["hourly_stats_aggregated_by_advertiser_time_zone"],
+        "time_increment": 1,
+    }
 
-    try:
-        min_rows_required = int(os.getenv("HEATMAP_MIN_ROWS_REQUIRED", "30") or 30)
-    except Exception:
-        min_rows_required = 30
 
+def _insight_row_hour(d: dict) -> int | None:
+    raw_hour = str((d or {}).get("hourly_stats_aggregated_by_advertiser_time_zone") or "").strip()
+    if not raw_hour:
+        return None
+    m = re.match(r"(\d{1,2})\s*:", raw_hour)
+    if not m:
+        return None
     try:
-        max_calls = int(os.getenv("FB_MAX_CALLS_PER_ATTEMPT", "1") or 1)
+        h = int(m.group(1))
     except Exception:
-        max_calls = 1
-    max_calls = 1
+        return None
+    if h < 0 or h > 23:
+        return None
+    return h
+
+
+def _snapshot_rows_by_hour(
+    data: Any,
+    *,
+    aid: str,
+    adset_status_map: dict[str, str],
+    lead_action_type: str | None = None,
+) -> dict[int, list[dict]]:
+    """Splits one hourly-breakdown insights response into snapshot rows per hour."""
+    out: dict[int, list[dict]] = {}
+    for rr in (data or []):
+        d = _normalize_insight(rr)
+        hour = _insight_row_hour(d or {})
+        if hour is None:
+            continue
+
+        try:
+            parsed = parse_insight(d or {}, aid=str(aid), lead_action_type=lead_action_type)
+        except Exception:
+            parsed = {"msgs": 0, "leads": 0, "total": 0, "spend": 0.0, "cpa": None}
+
+        actions_map: dict[str, float] = {}
+        try:
+            for a in (d or {}).get("actions") or []:
+                if not isinstance(a, dict):
+                    continue
+                at = str(a.get("action_type") or "")
+                if not at:
+                    continue
+                try:
+                    v = float(a.get("value") or 0)
+                except Exception:
+                    v = 0.0
+                actions_map[at] = actions_map.get(at, 0.0) + float(v)
+        except Exception:
+            actions_map = {}
+
+        # Categories are classified once here; readers use the stored columns
+        # while derived_schema matches (services/analytics.py).
+        try:
+            cats = classify_actions(actions_map)
+            started_conversations = int(cats.get("started_conversations") or 0)
+            website_submit = int(cats.get("website_submit_applications") or 0)
+        except Exception:
+            started_conversations = int(parsed.get("msgs") or 0)
+            website_submit = 0
+
+        adset_id = str((d or {}).get("adset_id") or "")
+        if not adset_id:
+            continue
+        blended_total = int((started_conversations or 0) + (website_submit or 0))
+        spend = float(parsed.get("spend") or 0.0)
+        stt = None
+        try:
+            stt = adset_status_map.get(str(adset_id))
+        except Exception:
+            stt = None
+        out.setdefault(int(hour), []).append(
+            {
+                "adset_id": adset_id,
+                "name": (d or {}).get("adset_name") or (d or {}).get("name"),
+                "adset_status": str(stt or "UNKNOWN"),
+                "campaign_id": (d or {}).get("campaign_id"),
+                "campaign_name": (d or {}).get("campaign_name"),
+                "impressions": int((d or {}).get("impressions") or 0),
+                "clicks": int((d or {}).get("clicks") or 0),
+                "spend": spend,
+                "started_conversations": int(started_conversations or 0),
+                "website_submit_applications": int(website_submit or 0),
+                "actions": dict(actions_map or {}),
+                "msgs": int(started_conversations or 0),
+                "leads": int(website_submit or 0),
+                "total": int(blended_total or 0),
+                "results": int(blended_total or 0),
+                "cpl": parsed.get("cpa"),
+                "derived_schema": DERIVED_SCHEMA,
+                "hour": int(hour),
+            }
+        )
+    return out
+
+
+def _ready_status_for_rows(rows_cnt: int, spend_total: float, min_rows: int) -> tuple[str, str] | None:
+    if rows_cnt > 0 and spend_total > 0 and rows_cnt >= min_rows:
+        return "ready", ""
+    if rows_cnt > 0 and spend_total > 0:
+        return "ready_low_confidence", "low_volume"
+    return None
+
+
+def _harvest_hours_from_response(
+    aid: str,
+    *,
+    date_str: str,
+    rows_by_hour: dict[int, list[dict]],
+    skip_hour: int | None,
+    now: datetime,
+    min_rows_required: int,
+    meta: dict | None,
+    log: logging.Logger,
+) -> list[int]:
+    """Finalizes other hours of date_str from an already fetched hourly response.
+
+    An hour is written only when its own deadline (end + 30 min) has passed and
+    the response carries spend for it; empty hours stay on the regular
+    per-hour retry path.
+    """
+    from services.heatmap_store import load_manifest_day, load_day_snapshots, save_day_snapshots, build_snapshot_shell
 
     try:
-        max_attempts = int(os.getenv("FB_MAX_ATTEMPTS_PER_HOUR", "3") or 3)
+        day = datetime.strptime(str(date_str), "%Y-%m-%d")
     except Exception:
-        max_attempts = 3
-    if max_attempts < 1:
-        max_attempts = 1
+        return []
+    manifest = load_manifest_day(str(aid), date_str=str(date_str))
+    stored: dict[int, dict] | None = None
 
-    log = logging.getLogger(__name__)
+    harvested: dict[int, dict] = {}
+    for h in sorted(rows_by_hour or {}):
+        if skip_hour is not None and int(h) == int(skip_hour):
+            continue
+        rows = list(rows_by_hour.get(h) or [])
+        if not rows:
+            continue
+        try:
+            start_dt = ALMATY_TZ.localize(day.replace(hour=int(h)))
+        except Exception:
+            continue
+        end_dt = start_dt + timedelta(hours=1)
+        deadline_dt = end_dt + timedelta(minutes=30)
+        if now <= deadline_dt:
+            continue
 
-    accounts = load_accounts() or {}
-    if manual_aid:
-        accounts = {str(manual_aid): accounts.get(str(manual_aid))}
+        try:
+            spend_total = float(sum(float((r or {}).get("spend") or 0.0) for r in rows))
+        except Exception:
+            spend_total = 0.0
 
-    for aid, row in (accounts or {}).items():
+        head = manifest.get(int(h)) or {}
+        st_old = str(head.get("status") or "")
+        if st_old == "ready":
+            continue
+        if st_old == "ready_low_confidence" and int(head.get("rows_count") or 0) >= len(rows):
+            continue
+        snap = None
+        if head:
+            if stored is None:
+                stored = load_day_snapshots(str(aid), date_str=str(date_str))
+            snap = stored.get(int(h))
+        if not snap:
+            snap = build_snapshot_shell(
+                str(aid),
+                date_str=str(date_str),
+                hour=int(h),
+                start_dt=start_dt,
+                end_dt=end_dt,
+                deadline_dt=deadline_dt,
+                min_rows_required=min_rows_required,
+            )
+
+        min_rows = int(snap.get("min_rows_required") or min_rows_required)
+        status = _ready_status_for_rows(len(rows), spend_total, min_rows)
+        if not status:
+            continue
+
+        snap["source"] = "heatmap_cache"
+        snap["status"], snap["reason"] = status
+        snap["rows"] = rows
+        snap["collected_rows"] = int(len(rows))
+        snap["rows_count"] = int(len(rows))
+        snap["spend"] = float(spend_total)
+        snap["error"] = None
+        snap["next_try_at"] = None
+        snap["last_try_at"] = now.isoformat()
+        try:
+            snap["attempts"] = int(snap.get("attempts") or 0) + 1
+        except Exception:
+            snap["attempts"] = 1
+        snap_meta = dict(meta or {})
+        snap_meta["harvested"] = True
+        snap["meta"] = snap_meta
+        harvested[int(h)] = snap
+
+    if harvested:
+        # One write of the day file for all harvested hours.
+        save_day_snapshots(str(aid), str(date_str), harvested)
         try:
-            if not row:
+            log.info(
+                "🟦 SNAPSHOT HARVESTED aid=%s date=%s hours=%s",
+                str(aid),
+                str(date_str),
+                ",".join(f"{int(x):02d}" for x in sorted(harvested)),
+            )
+        except Exception:
+            pass
+    return sorted(harvested)
+
+
+def _harvest_gap_dates(
+    aid: str,
+    *,
+    search_start: datetime,
+    search_end: datetime,
+    skip_date: str,
+    max_dates: int,
+    now: datetime,
+    adset_status_map: dict[str, str],
+    lead_action_type: str | None,
+    min_rows_required: int,
+    log: logging.Logger,
+) -> int:
+    """Closes snapshot gaps on other dates of the lookback window, one call per date."""
+    from services.heatmap_store import load_manifest_day
+
+    if max_dates <= 0:
+        return 0
+
+    gap_dates: list[str] = []
+    manifest: dict[str, dict] = {}
+    dt_cur = search_start
+    with deny_fb_api_calls(reason="heatmap_snapshot_collector_backfill_probe"):
+        while dt_cur <= search_end and len(gap_dates) < int(max_dates):
+            ds = dt_cur.strftime("%Y-%m-%d")
+            hh = int(dt_cur.strftime("%H"))
+            dt_cur = dt_cur + timedelta(hours=1)
+            if ds == str(skip_date) or ds in gap_dates:
                 continue
-            if not (row or {}).get("enabled", True):
+            # Only hours past their own deadline can be harvested.
+            if now <= (dt_cur + timedelta(minutes=30)):
                 continue
+            if ds not in manifest:
+                manifest[ds] = load_manifest_day(str(aid), date_str=str(ds))
+            if int(hh) not in manifest[ds]:
+                gap_dates.append(ds)
+
+    calls = 0
+    for ds in gap_dates:
+        if is_rate_limited_now():
+            break
+        try:
+            from facebook_business.adobjects.adaccount import AdAccount
+        except Exception:
+            break
+        acc = AdAccount(str(aid))
+        params = _hourly_insights_params(str(ds))
+        fields = list(HOURLY_INSIGHTS_FIELDS)
+        with allow_fb_api_calls(reason="heatmap_snapshot_collector_harvest"):
+            data = safe_api_call(
+                acc.get_insights,
+                fields=fields,
+                params=params,
+                _meta={"endpoint": "insights/adset/hourly", "params": params},
+                _caller="heatmap_snapshot_collector",
+            )
+        calls += 1
+        if not data:
+            continue
+        rows_by_hour = _snapshot_rows_by_hour(
+            data,
+            aid=str(aid),
+            adset_status_map=adset_status_map,
+            lead_action_type=lead_action_type,
+        )
+        try:
+            _harvest_hours_from_response(
+                str(aid),
+                date_str=str(ds),
+                rows_by_hour=rows_by_hour,
+                skip_hour=None,
+                now=now,
+                min_rows_required=min_rows_required,
+                meta={"endpoint": "insights/adset/hourly", "fields": fields, "params": params},
+                log=log,
+            )
+        except Exception as e:
+            log.warning("heatmap_harvest_error aid=%s date=%s err=%s", str(aid), str(ds), str(e))
+    return calls
 
-            target_start_dt = None
-            target_end_dt = None
-            target_date_str = None
-            target_hour_int = None
-            target_window_label = None
-
-            try:
-                search_start = end_dt_base - timedelta(hours=int(backfill_lookback_hours))
-                search_end = end_dt_base - timedelta(hours=1)
-                dt_cur = search_start
-                while dt_cur <= search_end:
-                    ds = dt_cur.strftime("%Y-%m-%d")
-                    hh = int(dt_cur.strftime("%H"))
-                    with deny_fb_api_calls(reason="heatmap_snapshot_collector_backfill_probe"):
-                        s_probe = load_snapshot(str(aid), date_str=str(ds), hour=int(hh))
-                    if not s_probe:
-                        target_start_dt = dt_cur
-                        target_end_dt = dt_cur + timedelta(hours=1)
-                        target_date_str = str(ds)
-                        target_hour_int = int(hh)
-                        break
-                    dt_cur = dt_cur + timedelta(hours=1)
-            except Exception:
-                target_start_dt = None
 
-            if not target_start_dt:
-                target_end_dt = end_dt_base
-                target_start_dt = end_dt_base - timedelta(hours=1)
-                target_date_str = target_start_dt.strftime("%Y-%m-%d")
-                target_hour_int = int(target_start_dt.strftime("%H"))
+def _collect_account_snapshot(
+    aid: str,
+    row: dict | None,
+    *,
+    now: datetime,
+    end_dt_base: datetime,
+    collector_deadline_dt: datetime,
+    backfill_lookback_hours: int,
+    min_rows_required: int,
+    max_calls: int,
+    max_attempts: int,
+    harvest_enabled: bool,
+    harvest_max_dates: int,
+    log: logging.Logger,
+) -> None:
+    """Collects (or finalizes) the next pending hourly snapshot of one account.
 
-            try:
-                target_window_label = f"{target_start_dt.strftime('%Y-%m-%d %H:00')}–{target_end_dt.strftime('%H:00')}"
-            except Exception:
-                target_window_label = f"{str(target_date_str)} {int(target_hour_int):02d}:00–{(int(target_hour_int) + 1) % 24:02d}:00"
+    Blocking: runs in a worker thread of the collector pool.
+    """
+    from services.heatmap_store import (
+        build_snapshot_shell,
+        load_manifest_day,
+        load_snapshot,
+        save_snapshot,
+        snapshot_day_path,
+    )
 
-            snap = load_snapshot(str(aid), date_str=str(target_date_str), hour=int(target_hour_int))
-            if not snap:
-                snap = build_snapshot_shell(
-                    str(aid),
-                    date_str=str(target_date_str),
-                    hour=int(target_hour_int),
-                    start_dt=target_start_dt,
-                    end_dt=target_end_dt,
-                    deadline_dt=collector_deadline_dt,
-                    min_rows_required=min_rows_required,
-                )
+    try:
+        if not row:
+            return
+        if not (row or {}).get("enabled", True):
+            return
 
-            # Ensure snapshot schema fields exist.
-            snap["source"] = "heatmap_cache"
-            if "reason" not in snap:
-                snap["reason"] = "snapshot_collecting"
-            if "rows_count" not in snap:
-                try:
-                    snap["rows_count"] = int(len(snap.get("rows") or []))
-                except Exception:
-                    snap["rows_count"] = 0
-            if "spend" not in snap:
-                snap["spend"] = 0.0
+        target_start_dt = None
+        target_end_dt = None
+        target_date_str = None
+        target_hour_int = None
+        target_window_label = None
 
-            if str((snap or {}).get("status") or "") == "ready":
-                continue
+        try:
+            search_start = end_dt_base - timedelta(hours=int(backfill_lookback_hours))
+            search_end = end_dt_base - timedelta(hours=1)
+            manifest: dict[str, dict] = {}
+            dt_cur = search_start
+            while dt_cur <= search_end:
+                ds = dt_cur.strftime("%Y-%m-%d")
+                hh = int(dt_cur.strftime("%H"))
+                if ds not in manifest:
+                    with deny_fb_api_calls(reason="heatmap_snapshot_collector_backfill_probe"):
+                        manifest[ds] = load_manifest_day(str(aid), date_str=str(ds))
+                if int(hh) not in manifest[ds]:
+                    target_start_dt = dt_cur
+                    target_end_dt = dt_cur + timedelta(hours=1)
+                    target_date_str = str(ds)
+                    target_hour_int = int(hh)
+                    break
+                dt_cur = dt_cur + timedelta(hours=1)
+        except Exception:
+            target_start_dt = None
 
-            attempt_next = int((snap or {}).get("attempts") or 0) + 1
-            window_label = str(target_window_label or "")
+        if not target_start_dt:
+            target_end_dt = end_dt_base
+            target_start_dt = end_dt_base - timedelta(hours=1)
+            target_date_str = target_start_dt.strftime("%Y-%m-%d")
+            target_hour_int = int(target_start_dt.strftime("%H"))
 
-            preserve_existing_failure = False
-            try:
-                preserve_existing_failure = str((snap or {}).get("status") or "") == "failed" or _has_real_reason(snap)
-            except Exception:
-                preserve_existing_failure = False
+        try:
+            target_window_label = f"{target_start_dt.strftime('%Y-%m-%d %H:00')}–{target_end_dt.strftime('%H:00')}"
+        except Exception:
+            target_window_label = f"{str(target_date_str)} {int(target_hour_int):02d}:00–{(int(target_hour_int) + 1) % 24:02d}:00"
 
-            log.info(
-                "🟦 FB COLLECTOR START aid=%s window=%s attempt=%s/%s allow_fb_api_calls=TRUE",
+        snap = load_snapshot(str(aid), date_str=str(target_date_str), hour=int(target_hour_int))
+        if not snap:
+            snap = build_snapshot_shell(
                 str(aid),
-                str(window_label),
-                str(attempt_next),
-                str(max_attempts),
+                date_str=str(target_date_str),
+                hour=int(target_hour_int),
+                start_dt=target_start_dt,
+                end_dt=target_end_dt,
+                deadline_dt=collector_deadline_dt,
+                min_rows_required=min_rows_required,
             )
 
+        # Ensure snapshot schema fields exist.
+        snap["source"] = "heatmap_cache"
+        if "reason" not in snap:
+            snap["reason"] = "snapshot_collecting"
+        if "rows_count" not in snap:
             try:
-                dl_raw = (snap or {}).get("deadline_at")
-                dl = datetime.fromisoformat(str(dl_raw)) if dl_raw else collector_deadline_dt
+                snap["rows_count"] = int(len(snap.get("rows") or []))
             except Exception:
-                dl = collector_deadline_dt
-
-            if now > dl:
-                err = (snap or {}).get("error")
-                if not isinstance(err, dict):
-                    err = {"type": "api_error"}
-
-                existing_reason = str((snap or {}).get("reason") or "")
-                existing_type = str((err or {}).get("type") or "")
-                is_invalid_fields = existing_reason in {"invalid_fields", "fb_invalid_fields"} or existing_type in {
-                    "invalid_fields",
-                    "fb_invalid_fields",
-                }
+                snap["rows_count"] = 0
+        if "spend" not in snap:
+            snap["spend"] = 0.0
+
+        if str((snap or {}).get("status") or "") == "ready":
+            return
+
+        attempt_next = int((snap or {}).get("attempts") or 0) + 1
+        window_label = str(target_window_label or "")
+
+        preserve_existing_failure = False
+        try:
+            preserve_existing_failure = str((snap or {}).get("status") or "") == "failed" or _has_real_reason(snap)
+        except Exception:
+            preserve_existing_failure = False
+
+        log.info(
+            "🟦 FB COLLECTOR START aid=%s window=%s attempt=%s/%s allow_fb_api_calls=TRUE",
+            str(aid),
+            str(window_label),
+            str(attempt_next),
+            str(max_attempts),
+        )
+
+        try:
+            dl_raw = (snap or {}).get("deadline_at")
+            dl = datetime.fromisoformat(str(dl_raw)) if dl_raw else collector_deadline_dt
+        except Exception:
+            dl = collector_deadline_dt
+
+        if now > dl:
+            err = (snap or {}).get("error")
+            if not isinstance(err, dict):
+                err = {"type": "api_error"}
+
+            existing_reason = str((snap or {}).get("reason") or "")
+            existing_type = str((err or {}).get("type") or "")
+            is_invalid_fields = existing_reason in {"invalid_fields", "fb_invalid_fields"} or existing_type in {
+                "invalid_fields",
+                "fb_invalid_fields",
+            }
 
+            has_any = False
+            try:
+                has_any = bool(snap.get("rows")) and float(snap.get("spend") or 0.0) > 0.0
+            except Exception:
                 has_any = False
-                try:
-                    has_any = bool(snap.get("rows")) and float(snap.get("spend") or 0.0) > 0.0
-                except Exception:
-                    has_any = False
 
+            preserve_now = False
+            try:
+                preserve_now = str((snap or {}).get("status") or "") == "failed" or _has_real_reason(snap)
+            except Exception:
                 preserve_now = False
-                try:
-                    preserve_now = str((snap or {}).get("status") or "") == "failed" or _has_real_reason(snap)
-                except Exception:
-                    preserve_now = False
 
-                if has_any:
-                    snap["status"] = "ready_low_confidence"
-                    snap["reason"] = "low_volume"
-                    snap["error"] = None
-                    snap["next_try_at"] = None
-                else:
-                    # Hard rule: if snapshot already failed or has a real reason, do not overwrite.
-                    if preserve_now:
-                        # Preserve reason/error/meta/next_try_at, but finalize as failed after deadline.
-                        try:
-                            if str(snap.get("status") or "") != "failed":
-                                snap["status"] = "failed"
-                        except Exception:
-                            snap["status"] = "failed"
-                        snap["reason"] = snap.get("reason")
-                        snap["error"] = snap.get("error")
-                        snap["meta"] = snap.get("meta")
-                        snap["next_try_at"] = snap.get("next_try_at")
-                    else:
-                        # No real reason yet -> mark as failed with fallback reason.
-                        snap["status"] = "failed"
-                        et = str((err or {}).get("type") or "api_error")
-                        info_like = {}
-                        try:
-                            info_like = {
-                                "code": (err or {}).get("fb_code"),
-                                "subcode": (err or {}).get("fb_subcode"),
-                                "fbtrace_id": (err or {}).get("fbtrace_id"),
-                                "message": (err or {}).get("message") or (err or {}).get("fb_message"),
-                                "http_status": (err or {}).get("http_status"),
-                            }
-                        except Exception:
-                            info_like = {}
-                        rr = "fb_invalid_fields" if is_invalid_fields else _map_fb_reason(info_like, et)
-                        snap["reason"] = rr
-                        snap["error"] = err
-
-                save_snapshot(snap)
-
-                hh = "00"
-                try:
-                    hh = f"{int((snap or {}).get('hour') if isinstance(snap, dict) else 0):02d}"
-                except Exception:
+            if has_any:
+                snap["status"] = "ready_low_confidence"
+                snap["reason"] = "low_volume"
+                snap["error"] = None
+                snap["next_try_at"] = None
+            else:
+                # Hard rule: if snapshot already failed or has a real reason, do not overwrite.
+                if preserve_now:
+                    # Preserve reason/error/meta/next_try_at, but finalize as failed after deadline.
                     try:
-                        hh = f"{int(target_hour_int):02d}"
+                        if str(snap.get("status") or "") != "failed":
+                            snap["status"] = "failed"
                     except Exception:
-                        hh = "00"
-                date_s_for_path = ""
-                try:
-                    date_s_for_path = str((snap or {}).get("date") or "")
-                except Exception:
-                    date_s_for_path = ""
-                if not date_s_for_path:
+                        snap["status"] = "failed"
+                    snap["reason"] = snap.get("reason")
+                    snap["error"] = snap.get("error")
+                    snap["meta"] = snap.get("meta")
+                    snap["next_try_at"] = snap.get("next_try_at")
+                else:
+                    # No real reason yet -> mark as failed with fallback reason.
+                    snap["status"] = "failed"
+                    et = str((err or {}).get("type") or "api_error")
+                    info_like = {}
                     try:
-                        date_s_for_path = str(target_date_str or "")
+                        info_like = {
+                            "code": (err or {}).get("fb_code"),
+                            "subcode": (err or {}).get("fb_subcode"),
+                            "fbtrace_id": (err or {}).get("fbtrace_id"),
+                            "message": (err or {}).get("message") or (err or {}).get("fb_message"),
+                            "http_status": (err or {}).get("http_status"),
+                        }
                     except Exception:
-                        date_s_for_path = ""
-                snap_path = os.path.join(
-                    str(os.getenv("DATA_DIR", "")) or "DATA_DIR",
-                    "heatmap_snapshots",
-                    str(aid),
-                    str(date_s_for_path),
-                    hh,
-                    "snapshot.json",
-                )
-                log.info(
-                    "🟦 SNAPSHOT SAVED aid=%s status=%s reason=%s rows=%s spend=%s window=%s path=%s",
-                    str(aid),
-                    str(snap.get("status") or ""),
-                    str(snap.get("reason") or ""),
-                    str(int(snap.get("rows_count") or 0)),
-                    str(float(snap.get("spend") or 0.0)),
-                    str(window_label),
-                    str(snap_path),
-                )
-                continue
-
-            try:
-                ntry = str((snap or {}).get("next_try_at") or "")
-                if ntry:
-                    ntd = datetime.fromisoformat(ntry)
-                    if not ntd.tzinfo:
-                        ntd = ALMATY_TZ.localize(ntd)
-                    ntd = ntd.astimezone(ALMATY_TZ)
-                    if now < ntd:
-                        mins = int(max(0.0, (ntd - now).total_seconds()) / 60.0)
-                        log.info(
-                            "🟦 FB COLLECTOR WAIT aid=%s until=%s in_min=%s",
-                            str(aid),
-                            str(ntd.isoformat()),
-                            str(mins),
-                        )
-                        continue
-            except Exception:
-                pass
+                        info_like = {}
+                    rr = "fb_invalid_fields" if is_invalid_fields else _map_fb_reason(info_like, et)
+                    snap["reason"] = rr
+                    snap["error"] = err
 
-            try:
-                attempts_done = int((snap or {}).get("attempts") or 0)
-            except Exception:
-                attempts_done = 0
-            if attempts_done >= int(max_attempts):
-                snap["status"] = "collecting"
-                snap["reason"] = "snapshot_collecting"
-                snap["error"] = {"type": "attempts_exceeded"}
-                snap["last_try_at"] = snap.get("last_try_at")
-                snap["next_try_at"] = snap.get("deadline_at")
-                save_snapshot(snap)
-                log.info(
-                    "🟦 FB COLLECTOR SKIP aid=%s reason=attempts_exceeded attempts=%s/%s",
-                    str(aid),
-                    str(attempts_done),
-                    str(max_attempts),
-                )
-                continue
+            save_snapshot(snap)
 
-            snap["status"] = "collecting"
-            snap["reason"] = "snapshot_collecting"
-            snap["last_try_at"] = now.isoformat()
-            try:
-                delay_min = random.randint(2, 5)
-            except Exception:
-                delay_min = 3
+            date_s_for_path = ""
             try:
-                snap["next_try_at"] = (now + timedelta(minutes=int(delay_min))).isoformat()
+                date_s_for_path = str((snap or {}).get("date") or "")
             except Exception:
-                snap["next_try_at"] = None
-
-            if is_rate_limited_now():
-                info = get_last_api_error_info() or {}
-                # Retryable: keep status collecting, but record a real reason + meta.
-                snap["reason"] = "fb_rate_limit"
-                snap["error"] = {
-                    "type": "fb_rate_limit",
-                    "fb_code": (info or {}).get("code") or 17,
-                    "fb_subcode": (info or {}).get("subcode"),
-                    "fbtrace_id": (info or {}).get("fbtrace_id"),
-                    "message": (info or {}).get("message"),
-                    "http_status": (info or {}).get("http_status"),
-                }
-                snap["meta"] = {
-                    "endpoint": (info or {}).get("endpoint") or "insights/adset/hourly",
-                    "fields": None,
-                    "params": (info or {}).get("params"),
-                    "last_http_status": (info or {}).get("http_status"),
-                    "fb_code": (info or {}).get("code") or 17,
-                    "fb_subcode": (info or {}).get("subcode"),
-                    "fbtrace_id": (info or {}).get("fbtrace_id"),
-                    "message": (info or {}).get("message"),
-                }
-                save_snapshot(snap)
-
+                date_s_for_path = ""
+            if not date_s_for_path:
                 try:
-                    log.warning(
-                        "🟦 FB RATE LIMIT aid=%s retry_after=%ss",
-                        str(aid),
-                        str(rate_limit_retry_after_seconds()),
-                    )
+                    date_s_for_path = str(target_date_str or "")
                 except Exception:
-                    pass
-                continue
+                    date_s_for_path = ""
+            snap_path = snapshot_day_path(str(aid), date_str=str(date_s_for_path))
+            log.info(
+                "🟦 SNAPSHOT SAVED aid=%s status=%s reason=%s rows=%s spend=%s window=%s path=%s",
+                str(aid),
+                str(snap.get("status") or ""),
+                str(snap.get("reason") or ""),
+                str(int(snap.get("rows_count") or 0)),
+                str(float(snap.get("spend") or 0.0)),
+                str(window_label),
+                str(snap_path),
+            )
+            return
 
-            try:
-                snap["attempts"] = int((snap or {}).get("attempts") or 0) + 1
-            except Exception:
-                snap["attempts"] = 1
+        try:
+            ntry = str((snap or {}).get("next_try_at") or "")
+            if ntry:
+                ntd = datetime.fromisoformat(ntry)
+                if not ntd.tzinfo:
+                    ntd = ALMATY_TZ.localize(ntd)
+                ntd = ntd.astimezone(ALMATY_TZ)
+                if now < ntd:
+                    mins = int(max(0.0, (ntd - now).total_seconds()) / 60.0)
+                    log.info(
+                        "🟦 FB COLLECTOR WAIT aid=%s until=%s in_min=%s",
+                        str(aid),
+                        str(ntd.isoformat()),
+                        str(mins),
+                    )
+                    return
+        except Exception:
+            pass
 
-            calls_used = 0
+        try:
+            attempts_done = int((snap or {}).get("attempts") or 0)
+        except Exception:
+            attempts_done = 0
+        if attempts_done >= int(max_attempts):
+            snap["status"] = "collecting"
+            snap["reason"] = "snapshot_collecting"
+            snap["error"] = {"type": "attempts_exceeded"}
+            snap["last_try_at"] = snap.get("last_try_at")
+            snap["next_try_at"] = snap.get("deadline_at")
+            save_snapshot(snap)
+            log.info(
+                "🟦 FB COLLECTOR SKIP aid=%s reason=attempts_exceeded attempts=%s/%s",
+                str(aid),
+                str(attempts_done),
+                str(max_attempts),
+            )
+            return
 
-            # Standard leads are global; do not depend on per-account selection.
-            lead_action_type = None
+        snap["status"] = "collecting"
+        snap["reason"] = "snapshot_collecting"
+        snap["last_try_at"] = now.isoformat()
+        try:
+            delay_min = random.randint(2, 5)
+        except Exception:
+            delay_min = 3
+        try:
+            snap["next_try_at"] = (now + timedelta(minutes=int(delay_min))).isoformat()
+        except Exception:
+            snap["next_try_at"] = None
+
+        if is_rate_limited_now():
+            info = get_last_api_error_info() or {}
+            # Retryable: keep status collecting, but record a real reason + meta.
+            snap["reason"] = "fb_rate_limit"
+            snap["error"] = {
+                "type": "fb_rate_limit",
+                "fb_code": (info or {}).get("code") or 17,
+                "fb_subcode": (info or {}).get("subcode"),
+                "fbtrace_id": (info or {}).get("fbtrace_id"),
+                "message": (info or {}).get("message"),
+                "http_status": (info or {}).get("http_status"),
+            }
+            snap["meta"] = {
+                "endpoint": (info or {}).get("endpoint") or "insights/adset/hourly",
+                "fields": None,
+                "params": (info or {}).get("params"),
+                "last_http_status": (info or {}).get("http_status"),
+                "fb_code": (info or {}).get("code") or 17,
+                "fb_subcode": (info or {}).get("subcode"),
+                "fbtrace_id": (info or {}).get("fbtrace_id"),
+                "message": (info or {}).get("message"),
+            }
+            save_snapshot(snap)
 
-            adset_status_map: dict[str, str] = {}
             try:
-                cache_obj = _load_adset_status_cache(str(aid))
-                adset_status_map = _adset_status_map_from_cache(cache_obj)
-                if not _is_adset_cache_fresh(cache_obj, ttl_hours=6):
-                    with allow_fb_api_calls(reason="heatmap_snapshot_collector_adset_status"):
-                        refreshed = _refresh_adset_status_cache(str(aid), log=log)
-                    if refreshed:
-                        adset_status_map = dict(refreshed)
+                log.warning(
+                    "🟦 FB RATE LIMIT aid=%s retry_after=%ss",
+                    str(aid),
+                    str(rate_limit_retry_after_seconds()),
+                )
             except Exception:
-                adset_status_map = {}
+                pass
+            return
 
-            data = None
-            with allow_fb_api_calls(reason="heatmap_snapshot_collector"):
-                if max_calls > 0:
-                    calls_used += 1
-                    try:
-                        from facebook_business.adobjects.adaccount import AdAccount
-
-                        acc = AdAccount(str(aid))
-                        params = {
-                            "level": "adset",
-                            "time_range": {"since": str(target_date_str), "until": str(target_date_str)},
-                            "breakdowns": ["hourly_stats_aggregated_by_advertiser_time_zone"],
-                            "time_increment": 1,
-                        }
-                        fields = [
-                            "spend",
-                            "actions",
-                            "impressions",
-                            "clicks",
-                            "frequency",
-                            "adset_id",
-                            "adset_name",
-                            "campaign_id",
-                            "campaign_name",
-                        ]
-
-                        # Persist meta for this attempt (snapshots-only debug relies on it).
-                        try:
-                            snap["meta"] = {
-                                "endpoint": "insights/adset/hourly",
-                                "fields": list(fields or []),
-                                "params": params,
-                                "last_http_status": None,
-                                "fb_code": None,
-                                "fb_subcode": None,
-                                "fbtrace_id": None,
-                                "message": None,
-                            }
-                        except Exception:
-                            pass
-
-                        try:
-                            log.info(
-                                "🟦 FB REQUEST aid=%s endpoint=%s date=%s hour=%s window=%s fields=%s",
-                                str(aid),
-                                "insights/adset/hourly",
-                                str(target_date_str),
-                                str(int(target_hour_int)),
-                                str(window_label),
-                                str(",".join([str(x) for x in (fields or [])])),
-                            )
-                        except Exception:
-                            pass
-
-                        data = safe_api_call(
-                            acc.get_insights,
-                            fields=fields,
-                            params=params,
-                            _meta={"endpoint": "insights/adset/hourly", "params": params},
-                            _caller="heatmap_snapshot_collector",
-                        )
-                    except Exception:
-                        data = None
+        try:
+            snap["attempts"] = int((snap or {}).get("attempts") or 0) + 1
+        except Exception:
+            snap["attempts"] = 1
 
-            if not data:
-                info = get_last_api_error_info() or {}
-                try:
-                    et = str(classify_api_error(info))
-                except Exception:
-                    et = "api_error"
+        calls_used = 0
 
-                # Always attach error meta for debug (do not clear existing if preservation rule triggers).
-                try:
-                    if not preserve_existing_failure:
-                        snap_meta = snap.get("meta") if isinstance(snap.get("meta"), dict) else {}
-                        if not isinstance(snap_meta, dict):
-                            snap_meta = {}
-                        snap_meta.update(
-                            {
-                                "endpoint": (info or {}).get("endpoint")
-                                or (snap_meta or {}).get("endpoint")
-                                or "insights/adset/hourly",
-                                "last_http_status": (info or {}).get("http_status"),
-                                "fb_code": (info or {}).get("code"),
-                                "fb_subcode": (info or {}).get("subcode"),
-                                "fbtrace_id": (info or {}).get("fbtrace_id"),
-                                "message": (info or {}).get("message"),
-                                "params": (info or {}).get("params") or (snap_meta or {}).get("params"),
-                            }
-                        )
-                        snap["meta"] = snap_meta
-                except Exception:
-                    pass
+        # Standard leads are global; do not depend on per-account selection.
+        lead_action_type = None
 
+        adset_status_map: dict[str, str] = {}
+        try:
+            cache_obj = _load_adset_status_cache(str(aid))
+            adset_status_map = _adset_status_map_from_cache(cache_obj)
+            if not _is_adset_cache_fresh(cache_obj, ttl_hours=6):
+                with allow_fb_api_calls(reason="heatmap_snapshot_collector_adset_status"):
+                    refreshed = _refresh_adset_status_cache(str(aid), log=log)
+                if refreshed:
+                    adset_status_map = dict(refreshed)
+        except Exception:
+            adset_status_map = {}
+
+        data = None
+        # Worker threads run concurrently: use the per-call error info rather
+        # than the process-wide "last error".
+        call_info: dict | None = None
+        with allow_fb_api_calls(reason="heatmap_snapshot_collector"):
+            if max_calls > 0:
+                calls_used += 1
                 try:
-                    log.warning(
-                        "🟦 FB ERROR aid=%s fb_code=%s message=%s window=%s",
-                        str(aid),
-                        str((info or {}).get("code")),
-                        str((info or {}).get("message") or ""),
-                        str(window_label),
-                    )
-                except Exception:
-                    pass
+                    from facebook_business.adobjects.adaccount import AdAccount
 
-            rows_out: list[dict] = []
-            if data:
-                for rr in (data or []):
-                    d = _normalize_insight(rr)
-                    raw_hour = str((d or {}).get("hourly_stats_aggregated_by_advertiser_time_zone") or "")
-                    if not raw_hour:
-                        continue
-                    hh_ok = raw_hour.startswith(f"{int(target_hour_int):02d}") or (f" {int(target_hour_int):02d}:" in raw_hour)
-                    if not hh_ok:
-                        continue
-
-                    try:
-                        parsed = parse_insight(d or {}, aid=str(aid), lead_action_type=lead_action_type)
-                    except Exception:
-                        parsed = {"msgs": 0, "leads": 0, "total": 0, "spend": 0.0, "cpa": None}
-
-                    actions_map: dict[str, float] = {}
-                    try:
-                        for a in (d or {}).get("actions") or []:
-                            if not isinstance(a, dict):
-                                continue
-                            at = str(a.get("action_type") or "")
-                            if not at:
-                                continue
-                            try:
-                                v = float(a.get("value") or 0)
-                            except Exception:
-                                v = 0.0
-                            actions_map[at] = actions_map.get(at, 0.0) + float(v)
-                    except Exception:
-                        actions_map = {}
+                    acc = AdAccount(str(aid))
+                    params = _hourly_insights_params(str(target_date_str))
+                    fields = list(HOURLY_INSIGHTS_FIELDS)
 
+                    # Persist meta for this attempt (snapshots-only debug relies on it).
                     try:
-                        started_conversations = int(count_started_conversations_from_actions(actions_map) or 0)
+                        snap["meta"] = {
+                            "endpoint": "insights/adset/hourly",
+                            "fields": list(fields or []),
+                            "params": params,
+                            "last_http_status": None,
+                            "fb_code": None,
+                            "fb_subcode": None,
+                            "fbtrace_id": None,
+                            "message": None,
+                        }
                     except Exception:
-                        started_conversations = int(parsed.get("msgs") or 0)
+                        pass
 
                     try:
-                        website_submit = int(count_leads_from_actions(actions_map, aid=str(aid), lead_action_type=None) or 0)
+                        log.info(
+                            "🟦 FB REQUEST aid=%s endpoint=%s date=%s hour=%s window=%s fields=%s",
+                            str(aid),
+                            "insights/adset/hourly",
+                            str(target_date_str),
+                            str(int(target_hour_int)),
+                            str(window_label),
+                            str(",".join([str(x) for x in (fields or [])])),
+                        )
                     except Exception:
-                        website_submit = 0
+                        pass
 
-                    adset_id = str((d or {}).get("adset_id") or "")
-                    if not adset_id:
-                        continue
-                    blended_total = int((started_conversations or 0) + (website_submit or 0))
-                    spend = float(parsed.get("spend") or 0.0)
-                    stt = None
-                    try:
-                        stt = adset_status_map.get(str(adset_id))
-                    except Exception:
-                        stt = None
-                    row_out = {
-                        "adset_id": adset_id,
-                        "name": (d or {}).get("adset_name") or (d or {}).get("name"),
-                        "adset_status": str(stt or "UNKNOWN"),
-                        "campaign_id": (d or {}).get("campaign_id"),
-                        "campaign_name": (d or {}).get("campaign_name"),
-                        "impressions": int((d or {}).get("impressions") or 0),
-                        "clicks": int((d or {}).get("clicks") or 0),
-                        "spend": spend,
-                        "started_conversations": int(started_conversations or 0),
-                        "website_submit_applications": int(website_submit or 0),
-                        "actions": dict(actions_map or {}),
-                        "msgs": int(started_conversations or 0),
-                        "leads": int(website_submit or 0),
-                        "total": int(blended_total or 0),
-                        "results": int(blended_total or 0),
-                        "cpl": parsed.get("cpa"),
-                        "hour": int(target_hour_int),
-                    }
-                    rows_out.append(row_out)
+                    data, call_info = safe_api_call(
+                        acc.get_insights,
+                        fields=fields,
+                        params=params,
+                        _meta={"endpoint": "insights/adset/hourly", "params": params},
+                        _caller="heatmap_snapshot_collector",
+                        _return_error_info=True,
+                    )
+                except Exception:
+                    data = None
 
+        if not data:
+            info = call_info or get_last_api_error_info() or {}
             try:
-                log.info(
-                    "🟦 FB RESPONSE aid=%s endpoint=%s rows=%s spend=%s window=%s",
-                    str(aid),
-                    "insights/adset/hourly",
-                    str(int(len(rows_out or []))),
-                    str(float(sum(float((r or {}).get("spend") or 0.0) for r in (rows_out or [])))),
-                    str(window_label),
-                )
+                et = str(classify_api_error(info))
             except Exception:
-                pass
+                et = "api_error"
 
+            # Always attach error meta for debug (do not clear existing if preservation rule triggers).
             try:
-                started_total = int(
-                    sum(
-                        int((r or {}).get("started_conversations") or 0)
-                        for r in (rows_out or [])
-                        if isinstance(r, dict)
-                    )
-                )
-            except Exception:
-                started_total = 0
-            try:
-                website_total = int(
-                    sum(
-                        int((r or {}).get("website_submit_applications") or 0)
-                        for r in (rows_out or [])
-                        if isinstance(r, dict)
-                    )
-                )
-            except Exception:
-                website_total = 0
-            try:
-                spend_total_actions = float(
-                    sum(
-                        float((r or {}).get("spend") or 0.0)
-                        for r in (rows_out or [])
-                        if isinstance(r, dict)
+                if not preserve_existing_failure:
+                    snap_meta = snap.get("meta") if isinstance(snap.get("meta"), dict) else {}
+                    if not isinstance(snap_meta, dict):
+                        snap_meta = {}
+                    snap_meta.update(
+                        {
+                            "endpoint": (info or {}).get("endpoint")
+                            or (snap_meta or {}).get("endpoint")
+                            or "insights/adset/hourly",
+                            "last_http_status": (info or {}).get("http_status"),
+                            "fb_code": (info or {}).get("code"),
+                            "fb_subcode": (info or {}).get("subcode"),
+                            "fbtrace_id": (info or {}).get("fbtrace_id"),
+                            "message": (info or {}).get("message"),
+                            "params": (info or {}).get("params") or (snap_meta or {}).get("params"),
+                        }
                     )
-                )
+                    snap["meta"] = snap_meta
             except Exception:
-                spend_total_actions = 0.0
+                pass
+
             try:
-                log.info(
-                    "🟦 FB ACTIONS PARSED aid=%s started_conversations=%s website_submit_applications=%s spend=%s rows=%s window=%s",
+                log.warning(
+                    "🟦 FB ERROR aid=%s fb_code=%s message=%s window=%s",
                     str(aid),
-                    str(int(started_total)),
-                    str(int(website_total)),
-                    str(float(spend_total_actions)),
-                    str(int(len(rows_out or []))),
+                    str((info or {}).get("code")),
+                    str((info or {}).get("message") or ""),
                     str(window_label),
                 )
             except Exception:
                 pass
 
-            snap["rows"] = rows_out
-            snap["collected_rows"] = int(len(rows_out))
-            snap["rows_count"] = int(len(rows_out))
-            try:
-                snap["spend"] = float(sum(float((r or {}).get("spend") or 0.0) for r in (rows_out or [])))
-            except Exception:
-                snap["spend"] = 0.0
+        rows_by_hour: dict[int, list[dict]] = {}
+        if data:
+            rows_by_hour = _snapshot_rows_by_hour(
+                data,
+                aid=str(aid),
+                adset_status_map=adset_status_map,
+                lead_action_type=lead_action_type,
+            )
+        rows_out: list[dict] = list(rows_by_hour.get(int(target_hour_int)) or [])
 
-            try:
-                rows_cnt = int(len(rows_out or []))
-            except Exception:
-                rows_cnt = 0
-            try:
-                spend_total = float(snap.get("spend") or 0.0)
-            except Exception:
-                spend_total = 0.0
+        try:
+            log.info(
+                "🟦 FB RESPONSE aid=%s endpoint=%s rows=%s spend=%s window=%s",
+                str(aid),
+                "insights/adset/hourly",
+                str(int(len(rows_out or []))),
+                str(float(sum(float((r or {}).get("spend") or 0.0) for r in (rows_out or [])))),
+                str(window_label),
+            )
+        except Exception:
+            pass
 
-            min_rows = int(snap.get("min_rows_required") or min_rows_required)
+        try:
+            started_total = int(
+                sum(
+                    int((r or {}).get("started_conversations") or 0)
+                    for r in (rows_out or [])
+                    if isinstance(r, dict)
+                )
+            )
+        except Exception:
+            started_total = 0
+        try:
+            website_total = int(
+                sum(
+                    int((r or {}).get("website_submit_applications") or 0)
+                    for r in (rows_out or [])
+                    if isinstance(r, dict)
+                )
+            )
+        except Exception:
+            website_total = 0
+        try:
+            spend_total_actions = float(
+                sum(
+                    float((r or {}).get("spend") or 0.0)
+                    for r in (rows_out or [])
+                    if isinstance(r, dict)
+                )
+            )
+        except Exception:
+            spend_total_actions = 0.0
+        try:
+            log.info(
+                "🟦 FB ACTIONS PARSED aid=%s started_conversations=%s website_submit_applications=%s spend=%s rows=%s window=%s",
+                str(aid),
+                str(int(started_total)),
+                str(int(website_total)),
+                str(float(spend_total_actions)),
+                str(int(len(rows_out or []))),
+                str(window_label),
+            )
+        except Exception:
+            pass
 
-            if rows_cnt > 0 and spend_total > 0 and rows_cnt >= min_rows:
-                snap["status"] = "ready"
-                snap["reason"] = ""
-                snap["next_try_at"] = None
-                snap["error"] = None
-            elif rows_cnt > 0 and spend_total > 0:
-                snap["status"] = "ready_low_confidence"
-                snap["reason"] = "low_volume"
-                snap["next_try_at"] = None
-                snap["error"] = None
-            else:
-                info = get_last_api_error_info() or {}
+        snap["rows"] = rows_out
+        snap["collected_rows"] = int(len(rows_out))
+        snap["rows_count"] = int(len(rows_out))
+        try:
+            snap["spend"] = float(sum(float((r or {}).get("spend") or 0.0) for r in (rows_out or [])))
+        except Exception:
+            snap["spend"] = 0.0
+
+        try:
+            rows_cnt = int(len(rows_out or []))
+        except Exception:
+            rows_cnt = 0
+        try:
+            spend_total = float(snap.get("spend") or 0.0)
+        except Exception:
+            spend_total = 0.0
+
+        min_rows = int(snap.get("min_rows_required") or min_rows_required)
+
+        ready_status = _ready_status_for_rows(rows_cnt, spend_total, min_rows)
+        if ready_status:
+            snap["status"], snap["reason"] = ready_status
+            snap["next_try_at"] = None
+            snap["error"] = None
+        else:
+            info = call_info or get_last_api_error_info() or {}
+            et = "api_error"
+            try:
+                et = str(classify_api_error(info))
+            except Exception:
                 et = "api_error"
-                try:
-                    et = str(classify_api_error(info))
-                except Exception:
-                    et = "api_error"
 
+            preserve_now = False
+            try:
+                preserve_now = str((snap or {}).get("status") or "") == "failed" or _has_real_reason(snap)
+            except Exception:
                 preserve_now = False
-                try:
-                    preserve_now = str((snap or {}).get("status") or "") == "failed" or _has_real_reason(snap)
-                except Exception:
-                    preserve_now = False
-
-                # If we already have a real reason (or failed), do not overwrite anything.
-                if preserve_now:
-                    snap["reason"] = snap.get("reason")
-                    snap["error"] = snap.get("error")
-                    snap["meta"] = snap.get("meta")
-                    snap["next_try_at"] = snap.get("next_try_at")
-                else:
-                    rr = _map_fb_reason(info, et)
-                    snap["reason"] = rr
-                    if rr == "fb_invalid_fields":
-                        snap["status"] = "failed"
-                        try:
-                            snap["next_try_at"] = (now + timedelta(hours=6)).isoformat()
-                        except Exception:
-                            snap["next_try_at"] = snap.get("next_try_at")
-                    elif rr in {"fb_auth", "fb_permission"}:
-                        snap["status"] = "failed"
-                    else:
-                        snap["status"] = "collecting"
-
-                    snap["error"] = {
-                        "type": rr,
-                        "fb_code": (info or {}).get("code"),
-                        "fb_subcode": (info or {}).get("subcode"),
-                        "fbtrace_id": (info or {}).get("fbtrace_id"),
-                        "message": (info or {}).get("message"),
-                        "http_status": (info or {}).get("http_status"),
-                    }
 
+            # If we already have a real reason (or failed), do not overwrite anything.
+            if preserve_now:
+                snap["reason"] = snap.get("reason")
+                snap["error"] = snap.get("error")
+                snap["meta"] = snap.get("meta")
+                snap["next_try_at"] = snap.get("next_try_at")
+            else:
+                rr = _map_fb_reason(info, et)
+                snap["reason"] = rr
+                if rr == "fb_invalid_fields":
+                    snap["status"] = "failed"
                     try:
-                        snap_meta = snap.get("meta") if isinstance(snap.get("meta"), dict) else {}
-                        if not isinstance(snap_meta, dict):
-                            snap_meta = {}
-                        snap_meta.update(
-                            {
-                                "endpoint": (info or {}).get("endpoint") or (snap_meta or {}).get("endpoint"),
-                                "last_http_status": (info or {}).get("http_status"),
-                                "fb_code": (info or {}).get("code"),
-                                "fb_subcode": (info or {}).get("subcode"),
-                                "fbtrace_id": (info or {}).get("fbtrace_id"),
-                                "message": (info or {}).get("message"),
-                                "params": (info or {}).get("params") or (snap_meta or {}).get("params"),
-                            }
-                        )
-                        snap["meta"] = snap_meta
+                        snap["next_try_at"] = (now + timedelta(hours=6)).isoformat()
                     except Exception:
-                        pass
+                        snap["next_try_at"] = snap.get("next_try_at")
+                elif rr in {"fb_auth", "fb_permission"}:
+                    snap["status"] = "failed"
+                else:
+                    snap["status"] = "collecting"
 
-            save_snapshot(snap)
+                snap["error"] = {
+                    "type": rr,
+                    "fb_code": (info or {}).get("code"),
+                    "fb_subcode": (info or {}).get("subcode"),
+                    "fbtrace_id": (info or {}).get("fbtrace_id"),
+                    "message": (info or {}).get("message"),
+                    "http_status": (info or {}).get("http_status"),
+                }
 
-            hh = "00"
-            try:
-                hh = f"{int((snap or {}).get('hour') if isinstance(snap, dict) else 0):02d}"
-            except Exception:
                 try:
-                    hh = f"{int(target_hour_int):02d}"
+                    snap_meta = snap.get("meta") if isinstance(snap.get("meta"), dict) else {}
+                    if not isinstance(snap_meta, dict):
+                        snap_meta = {}
+                    snap_meta.update(
+                        {
+                            "endpoint": (info or {}).get("endpoint") or (snap_meta or {}).get("endpoint"),
+                            "last_http_status": (info or {}).get("http_status"),
+                            "fb_code": (info or {}).get("code"),
+                            "fb_subcode": (info or {}).get("subcode"),
+                            "fbtrace_id": (info or {}).get("fbtrace_id"),
+                            "message": (info or {}).get("message"),
+                            "params": (info or {}).get("params") or (snap_meta or {}).get("params"),
+                        }
+                    )
+                    snap["meta"] = snap_meta
                 except Exception:
-                    hh = "00"
+                    pass
+
+        save_snapshot(snap)
+
+        date_s_for_path = ""
+        try:
+            date_s_for_path = str((snap or {}).get("date") or "")
+        except Exception:
             date_s_for_path = ""
+        if not date_s_for_path:
             try:
-                date_s_for_path = str((snap or {}).get("date") or "")
+                date_s_for_path = str(target_date_str or "")
             except Exception:
                 date_s_for_path = ""
-            if not date_s_for_path:
+        snap_path = snapshot_day_path(str(aid), date_str=str(date_s_for_path))
+        log.info(
+            "🟦 SNAPSHOT SAVED aid=%s status=%s reason=%s rows=%s spend=%s window=%s path=%s",
+            str(aid),
+            str(snap.get("status") or ""),
+            str(snap.get("reason") or ""),
+            str(int(snap.get("rows_count") or 0)),
+            str(float(snap.get("spend") or 0.0)),
+            str(window_label),
+            str(snap_path),
+        )
+
+        if harvest_enabled and rows_by_hour:
+            try:
+                _harvest_hours_from_response(
+                    str(aid),
+                    date_str=str(target_date_str),
+                    rows_by_hour=rows_by_hour,
+                    skip_hour=int(target_hour_int),
+                    now=now,
+                    min_rows_required=min_rows_required,
+                    meta=snap.get("meta") if isinstance(snap.get("meta"), dict) else None,
+                    log=log,
+                )
+            except Exception as e:
+                log.warning("heatmap_harvest_error aid=%s date=%s err=%s", str(aid), str(target_date_str), str(e))
+
+            if harvest_max_dates > 1:
                 try:
-                    date_s_for_path = str(target_date_str or "")
-                except Exception:
-                    date_s_for_path = ""
-            snap_path = os.path.join(
-                str(os.getenv("DATA_DIR", "")) or "DATA_DIR",
-                "heatmap_snapshots",
-                str(aid),
-                str(date_s_for_path),
-                hh,
-                "snapshot.json",
-            )
-            log.info(
-                "🟦 SNAPSHOT SAVED aid=%s status=%s reason=%s rows=%s spend=%s window=%s path=%s",
+                    _harvest_gap_dates(
+                        str(aid),
+                        search_start=end_dt_base - timedelta(hours=int(backfill_lookback_hours)),
+                        search_end=end_dt_base - timedelta(hours=1),
+                        skip_date=str(target_date_str),
+                        max_dates=int(harvest_max_dates) - 1,
+                        now=now,
+                        adset_status_map=adset_status_map,
+                        lead_action_type=lead_action_type,
+                        min_rows_required=min_rows_required,
+                        log=log,
+                    )
+                except Exception as e:
+                    log.warning("heatmap_harvest_gap_error aid=%s err=%s", str(aid), str(e))
+
+    except Exception as e:
+        try:
+            log.exception("heatmap_snapshot_collector_account_error aid=%s", str(aid), exc_info=e)
+        except Exception:
+            pass
+        try:
+            # Best-effort: if we have a snapshot dict in scope, mark it failed.
+            if "snap" in locals() and isinstance(locals().get("snap"), dict):
+                s3 = locals().get("snap")
+                if isinstance(s3, dict):
+                    if str(s3.get("status") or "") != "failed":
+                        s3["status"] = "failed"
+                    if not str(s3.get("reason") or ""):
+                        s3["reason"] = "snapshot_failed"
+                    try:
+                        save_snapshot(s3)
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+        return
+
+
+async def _heatmap_snapshot_collector_job(
+    context: ContextTypes.DEFAULT_TYPE,
+    *,
+    manual: bool = False,
+    manual_aid: str | None = None,
+):
+    now = datetime.now(ALMATY_TZ)
+    end_dt_base = now.replace(minute=0, second=0, microsecond=0)
+    collector_deadline_dt = end_dt_base + timedelta(minutes=30)
+
+    try:
+        backfill_lookback_hours = int(os.getenv("HEATMAP_BACKFILL_LOOKBACK_HOURS", "48") or 48)
+    except Exception:
+        backfill_lookback_hours = 48
+    if backfill_lookback_hours < 1:
+        backfill_lookback_hours = 1
+    if backfill_lookback_hours > 96:
+        backfill_lookback_hours = 96
+
+    try:
+        min_rows_required = int(os.getenv("HEATMAP_MIN_ROWS_REQUIRED", "30") or 30)
+    except Exception:
+        min_rows_required = 30
+
+    try:
+        max_calls = int(os.getenv("FB_MAX_CALLS_PER_ATTEMPT", "1") or 1)
+    except Exception:
+        max_calls = 1
+    max_calls = 1
+
+    try:
+        max_attempts = int(os.getenv("FB_MAX_ATTEMPTS_PER_HOUR", "3") or 3)
+    except Exception:
+        max_attempts = 3
+    if max_attempts < 1:
+        max_attempts = 1
+
+    # Multi-hour harvest: one hourly-breakdown response fills every completed
+    # hour of its date, plus up to N-1 other gap dates in the lookback window.
+    harvest_enabled = str(os.getenv("HEATMAP_MULTI_HOUR_HARVEST", "1") or "1").strip() not in {
+        "0",
+        "false",
+        "False",
+        "no",
+        "NO",
+    }
+    try:
+        harvest_max_dates = int(os.getenv("HEATMAP_HARVEST_MAX_DATES", "3") or 3)
+    except Exception:
+        harvest_max_dates = 3
+    if harvest_max_dates < 1:
+        harvest_max_dates = 1
+
+    log = logging.getLogger(__name__)
+
+    accounts = load_accounts_view() or {}
+    if manual_aid:
+        accounts = {str(manual_aid): accounts.get(str(manual_aid))}
+
+    try:
+        concurrency = int(os.getenv("HEATMAP_COLLECTOR_CONCURRENCY", "4") or 4)
+    except Exception:
+        concurrency = 4
+    if concurrency < 1:
+        concurrency = 1
+    sem = asyncio.Semaphore(concurrency)
+
+    # One batch round trip refreshes stale adset status caches of the whole fleet;
+    # workers then fall back to per-account refresh only for what is still stale.
+    try:
+        stale_aids = [
+            str(aid)
+            for aid, row in (accounts or {}).items()
+            if row
+            and (row or {}).get("enabled", True)
+            and not _is_adset_cache_fresh(_load_adset_status_cache(str(aid)), ttl_hours=6)
+        ]
+        if stale_aids:
+            await asyncio.to_thread(_refresh_adset_status_caches_batch, stale_aids, log=log)
+    except Exception as e:
+        log.warning("heatmap_adset_status_batch_error err=%s", str(e))
+
+    async def _run_one(aid: str, row: dict | None) -> None:
+        async with sem:
+            await asyncio.to_thread(
+                _collect_account_snapshot,
                 str(aid),
-                str(snap.get("status") or ""),
-                str(snap.get("reason") or ""),
-                str(int(snap.get("rows_count") or 0)),
-                str(float(snap.get("spend") or 0.0)),
-                str(window_label),
-                str(snap_path),
+                row,
+                now=now,
+                end_dt_base=end_dt_base,
+                collector_deadline_dt=collector_deadline_dt,
+                backfill_lookback_hours=backfill_lookback_hours,
+                min_rows_required=min_rows_required,
+                max_calls=max_calls,
+                max_attempts=max_attempts,
+                harvest_enabled=harvest_enabled,
+                harvest_max_dates=harvest_max_dates,
+                log=log,
             )
 
-            if manual and manual_aid:
-                # One attempt in manual mode.
-                break
-
-        except Exception as e:
-            try:
-                log.exception("heatmap_snapshot_collector_account_error aid=%s", str(aid), exc_info=e)
-            except Exception:
-                pass
-            try:
-                # Best-effort: if we have a snapshot dict in scope, mark it failed.
-                if "snap" in locals() and isinstance(locals().get("snap"), dict):
-                    s3 = locals().get("snap")
-                    if isinstance(s3, dict):
-                        if str(s3.get("status") or "") != "failed":
-                            s3["status"] = "failed"
-                        if not str(s3.get("reason") or ""):
-                            s3["reason"] = "snapshot_failed"
-                        try:
-                            save_snapshot(s3)
-                        except Exception:
-                            pass
-            except Exception:
-                pass
-            continue
+    t0 = _time.monotonic()
+    results = await asyncio.gather(
+        *[_run_one(str(aid), row) for aid, row in (accounts or {}).items()],
+        return_exceptions=True,
+    )
+    for res in results:
+        if isinstance(res, BaseException):
+            log.warning("heatmap_snapshot_collector_worker_error err=%s", str(res))
+    log.info(
+        "🟦 FB COLLECTOR PASS accounts=%s concurrency=%s elapsed_s=%.2f",
+        str(int(len(accounts or {}))),
+        str(int(concurrency)),
+        float(_time.monotonic() - t0),
+    )
 
 
 async def run_heatmap_snapshot_collector_once(
@@ -2188,7 +2537,7 @@ def build_heatmap_status_text(*, aid: str, now: datetime | None = None) -> str:
     hour_int = int(win.get("hour") or 0)
     window_label = f"{(win.get('window') or {}).get('start','')}–{(win.get('window') or {}).get('end','')}"
 
-    snap = load_snapshot(str(aid), date_str=date_str, hour=hour_int) or {}
+    snap = manifest_hour(str(aid), date_str=date_str, hour=hour_int) or {}
     status = str(snap.get("status") or "missing")
     reason = str(snap.get("reason") or "no_snapshot")
     attempts = int(snap.get("attempts") or 0)
@@ -2216,6 +2565,16 @@ def build_heatmap_status_text(*, aid: str, now: datetime | None = None) -> str:
     ]
     if next_try:
         lines.append(f"  next_try={next_try}")
+    try:
+        from services.heatmap_store import snapshot_cache_stats
+
+        cs = snapshot_cache_stats()
+        lines.append(
+            f"Кэш снапшотов: hits={int(cs.get('hits') or 0)} misses={int(cs.get('misses') or 0)} "
+            f"files={int(cs.get('entries') or 0)} size={int(cs.get('bytes') or 0) // 1024}KB"
+        )
+    except Exception:
+        pass
     return "\n".join(lines)
 
 
@@ -2228,7 +2587,7 @@ async def _cpa_alerts_job(context: ContextTypes.DEFAULT_TYPE):
     """
 
     now = datetime.now(ALMATY_TZ)
-    accounts = load_accounts() or {}
+    accounts = load_accounts_view() or {}
 
     # Алёрты шлём напрямую владельцу в личку (первый ID из ALLOWED_USER_IDS).
     # Если по какой-то причине список пуст, используем дефолтный чат как фолбэк.
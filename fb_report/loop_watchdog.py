@@ -0,0 +1,246 @@
+# fb_report/loop_watchdog.py
+
+"""
+Сторож event loop: измеряет задержку цикла и ловит "зависания".
+
+- heartbeat-корутина спит LOOP_WATCHDOG_INTERVAL_S и замеряет, на сколько
+  позже запланированного она проснулась (лаг цикла);
+- фоновый поток следит за heartbeat: если цикл не отвечает дольше
+  LOOP_STALL_MS, он снимает стек потока event loop (там выполняется
+  блокирующий код) и пишет его в лог вместе с именем обработчика PTB
+  или джобы, внутри которых это произошло (on_cb > _cb_menu,
+  job:_heatmap_snapshot_collector_job и т.п.);
+- когда цикл оживает, зависание фиксируется с полной длительностью.
+
+Счётчики и перцентили лага — loop_stats() / format_loop_stats()
+(команда /loop_stats). LOOP_STALL_MS<=0 выключает сторожа.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+
+try:
+    LOOP_WATCHDOG_INTERVAL_S = max(0.05, float(os.getenv("LOOP_WATCHDOG_INTERVAL_S", "0.5") or 0.5))
+except Exception:
+    LOOP_WATCHDOG_INTERVAL_S = 0.5
+
+try:
+    LOOP_STALL_MS = float(os.getenv("LOOP_STALL_MS", "1000") or 1000)
+except Exception:
+    LOOP_STALL_MS = 1000.0
+
+# Сколько последних замеров лага хранится для перцентилей.
+_SAMPLES = 2000
+# Сколько последних зависаний показывается в /loop_stats.
+_RECENT = 10
+# Глубина стека в логе.
+_STACK_LIMIT = 30
+
+_LOG = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+_STATE: Dict[str, Any] = {
+    "loop_thread": None,
+    "beat_seq": 0,
+    "beat_at": 0.0,
+    "captured_seq": -1,
+    "captured": None,
+    "started_at": 0.0,
+}
+_LAGS_MS: Deque[float] = deque(maxlen=_SAMPLES)
+_STALLS: Deque[Dict[str, Any]] = deque(maxlen=_RECENT)
+_COUNTERS: Dict[str, Any] = {"beats": 0, "stalls": 0, "stall_ms_total": 0.0, "max_lag_ms": 0.0}
+_BY_LABEL: Dict[str, int] = {}
+
+_TASK: Optional["asyncio.Task[Any]"] = None
+_THREAD: Optional[threading.Thread] = None
+_STOP = threading.Event()
+
+
+# ========= СТЕК И ИМЯ ОБРАБОТЧИКА =========
+
+def _is_ptb_frame(frame: Any) -> bool:
+    return "telegram" in str(frame.f_code.co_filename or "")
+
+
+def _handler_label(frames: List[Any]) -> str:
+    """Имя обработчика PTB/джобы по стеку (frames — от внешнего к внутреннему).
+
+    Колбэк — кадр сразу после BaseHandler.handle_update / Job._run; для
+    callback-роутера добавляется маршрут (кадр после CallbackRouter.dispatch).
+    """
+    parts: List[str] = []
+    for i, f in enumerate(frames[:-1]):
+        name = f.f_code.co_name
+        nxt = frames[i + 1].f_code.co_name
+        if name == "handle_update" and _is_ptb_frame(f):
+            parts.append(nxt)
+        elif name == "_run" and _is_ptb_frame(f):
+            parts.append(f"job:{nxt}")
+        elif name == "dispatch" and str(f.f_code.co_filename or "").endswith("callback_router.py"):
+            parts.append(nxt)
+    return " > ".join(parts) if parts else "unknown"
+
+
+def _capture_loop_stack(thread_id: int) -> Optional[Dict[str, Any]]:
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return None
+    frames: List[Any] = []
+    f = frame
+    while f is not None:
+        frames.append(f)
+        f = f.f_back
+    frames.reverse()
+    top = frames[-1]
+    return {
+        "label": _handler_label(frames),
+        "where": f"{os.path.basename(top.f_code.co_filename)}:{top.f_lineno} {top.f_code.co_name}",
+        "stack": "".join(traceback.format_stack(frame, limit=_STACK_LIMIT)),
+    }
+
+
+# ========= HEARTBEAT / СТОРОЖ =========
+
+def _beat() -> None:
+    with _LOCK:
+        _STATE["beat_seq"] = int(_STATE["beat_seq"]) + 1
+        _STATE["beat_at"] = time.monotonic()
+
+
+def _record_lag(lag_ms: float) -> None:
+    with _LOCK:
+        _COUNTERS["beats"] += 1
+        _LAGS_MS.append(float(lag_ms))
+        _COUNTERS["max_lag_ms"] = max(float(_COUNTERS["max_lag_ms"]), float(lag_ms))
+        if LOOP_STALL_MS <= 0 or lag_ms < LOOP_STALL_MS:
+            return
+        captured = _STATE.get("captured") if _STATE.get("captured_seq") == _STATE.get("beat_seq") else None
+        label = str((captured or {}).get("label") or "unknown")
+        where = str((captured or {}).get("where") or "")
+        _COUNTERS["stalls"] += 1
+        _COUNTERS["stall_ms_total"] += float(lag_ms)
+        _BY_LABEL[label] = int(_BY_LABEL.get(label) or 0) + 1
+        _STALLS.append({"ts": time.time(), "ms": float(lag_ms), "label": label, "where": where})
+    _LOG.warning("event_loop_stall ms=%s handler=%s where=%s", str(int(lag_ms)), label, where)
+
+
+async def _heartbeat() -> None:
+    interval = float(LOOP_WATCHDOG_INTERVAL_S)
+    while True:
+        _beat()
+        t0 = time.monotonic()
+        await asyncio.sleep(interval)
+        _record_lag(max(0.0, (time.monotonic() - t0 - interval) * 1000.0))
+
+
+def _watch() -> None:
+    """Фоновый поток: снимает стек, пока event loop ещё заблокирован."""
+    threshold_s = float(LOOP_STALL_MS) / 1000.0
+    interval = float(LOOP_WATCHDOG_INTERVAL_S)
+    while not _STOP.wait(min(interval, max(0.05, threshold_s / 4.0))):
+        with _LOCK:
+            seq = int(_STATE["beat_seq"])
+            overdue = time.monotonic() - float(_STATE["beat_at"]) - interval
+            need = overdue >= threshold_s and _STATE.get("captured_seq") != seq
+            thread_id = _STATE.get("loop_thread")
+        if not need or thread_id is None:
+            continue
+        try:
+            captured = _capture_loop_stack(int(thread_id))
+        except Exception:
+            captured = None
+        with _LOCK:
+            _STATE["captured_seq"] = seq
+            _STATE["captured"] = captured
+        if captured:
+            _LOG.warning(
+                "event_loop_blocked ms>=%s handler=%s where=%s\n%s",
+                str(int(overdue * 1000.0)),
+                captured.get("label"),
+                captured.get("where"),
+                captured.get("stack"),
+            )
+
+
+async def start_loop_watchdog(*_args: Any) -> None:
+    """Запускает heartbeat и поток-сторож (post_init приложения)."""
+    global _TASK, _THREAD
+    if LOOP_STALL_MS <= 0 or _TASK is not None:
+        return
+    with _LOCK:
+        _STATE["loop_thread"] = threading.get_ident()
+        _STATE["started_at"] = time.time()
+    _beat()
+    _STOP.clear()
+    _TASK = asyncio.get_running_loop().create_task(_heartbeat())
+    _THREAD = threading.Thread(target=_watch, name="loop_watchdog", daemon=True)
+    _THREAD.start()
+
+
+async def stop_loop_watchdog(*_args: Any) -> None:
+    """Останавливает сторожа (post_shutdown приложения)."""
+    global _TASK, _THREAD
+    _STOP.set()
+    task, _TASK = _TASK, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+    _THREAD = None
+
+
+# ========= СТАТИСТИКА =========
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return float(sorted_vals[idx])
+
+
+def loop_stats() -> Dict[str, Any]:
+    with _LOCK:
+        lags = sorted(_LAGS_MS)
+        out: Dict[str, Any] = dict(_COUNTERS)
+        out["by_label"] = sorted(_BY_LABEL.items(), key=lambda x: x[1], reverse=True)
+        out["recent"] = list(_STALLS)
+        out["started_at"] = float(_STATE.get("started_at") or 0.0)
+    out["samples"] = len(lags)
+    for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        out[name] = _percentile(lags, q)
+    return out
+
+
+def format_loop_stats(*, limit: int = 10) -> str:
+    s = loop_stats()
+    if LOOP_STALL_MS <= 0:
+        return "Сторож event loop выключен (LOOP_STALL_MS<=0)"
+    if not s.get("started_at"):
+        return "Сторож event loop не запущен"
+    lines = [
+        f"Event loop: heartbeat {LOOP_WATCHDOG_INTERVAL_S:g}s, порог зависания {LOOP_STALL_MS:.0f}ms",
+        f"Лаг (последние {int(s['samples'])}): p50={s['p50_ms']:.0f}ms p95={s['p95_ms']:.0f}ms "
+        f"p99={s['p99_ms']:.0f}ms max={float(s['max_lag_ms']):.0f}ms",
+        f"Зависаний: {int(s['stalls'])}, суммарно {float(s['stall_ms_total']) / 1000.0:.1f}s",
+    ]
+    if s["by_label"]:
+        lines.append("По обработчикам:")
+        for label, n in s["by_label"][: max(1, int(limit))]:
+            lines.append(f"• {label}: {int(n)}")
+    if s["recent"]:
+        lines.append("Последние:")
+        for r in reversed(s["recent"]):
+            ts = time.strftime("%m-%d %H:%M:%S", time.localtime(float(r.get("ts") or 0.0)))
+            lines.append(f"• {ts} {float(r.get('ms') or 0.0):.0f}ms {r.get('label')} @ {r.get('where') or '?'}")
+    return "\n".join(lines)
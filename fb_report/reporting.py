@@ -1,7 +1,6 @@
 # fb_report/reporting.py
 
 import json
-import os
 from datetime import datetime, timedelta
 import re
 import time
@@ -14,7 +13,7 @@ from telegram.ext import ContextTypes
 from .constants import (
     ALMATY_TZ,
     REPORT_CACHE_FILE,
-    REPORT_CACHE_TTL,
+    REPORT_TODAY_CACHE_TTL,
     DEFAULT_REPORT_CHAT,
     MORNING_REPORT_CACHE_FILE,
     MORNING_REPORT_CACHE_TTL,
@@ -24,9 +23,12 @@ from .storage import (
     get_account_name,
     metrics_flags,
     is_active,
-    load_accounts,
+    load_accounts_view,
 )
 from services.storage import period_key
+from services.account_meta import account_now
+from services.data_generation import bump_generation, get_generation
+from services.sqlite_store import get_row, load_doc, save_doc, upsert_row
 from .insights import (
     load_local_insights,
     save_local_insights,
@@ -35,46 +37,34 @@ from .insights import (
     _blend_totals,
 )
 
-from services.analytics import count_leads_from_actions, count_started_conversations_from_actions
+from services.analytics import (
+    apply_derived_metrics,
+    count_leads_from_actions,
+    count_started_conversations_from_actions,
+    row_derived_metrics,
+)
 
-from services.facebook_api import allow_fb_api_calls, fetch_insights_bulk, safe_api_call
+from services.facebook_api import allow_fb_api_calls, fetch_insights_bulk, run_fb_io
 from services.facebook_api import deny_fb_api_calls
-from services.heatmap_store import load_snapshot, list_snapshot_hours
+from services.heatmap_store import load_day_rollup, load_snapshot, list_snapshot_hours, rollup_totals
 
 
-REPORT_TEXT_CACHE_VERSION = 3
+# 4: из кэша выброшены закреплённые тексты ошибок.
+REPORT_TEXT_CACHE_VERSION = 4
 
 
 def _load_daily_report_cache() -> dict:
     try:
-        with open(DAILY_REPORT_CACHE_FILE, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return obj if isinstance(obj, dict) else {}
+        return load_doc("daily_report_cache", DAILY_REPORT_CACHE_FILE)
     except Exception:
         return {}
 
 
 def _save_daily_report_cache(d: dict) -> None:
     try:
-        os.makedirs(os.path.dirname(DAILY_REPORT_CACHE_FILE), exist_ok=True)
+        save_doc("daily_report_cache", DAILY_REPORT_CACHE_FILE, d)
     except Exception:
         pass
-    tmp = str(DAILY_REPORT_CACHE_FILE) + ".tmp"
-    try:
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(d, f, ensure_ascii=False, indent=2)
-            f.flush()
-            try:
-                os.fsync(f.fileno())
-            except Exception:
-                pass
-        os.replace(tmp, DAILY_REPORT_CACHE_FILE)
-    except Exception:
-        try:
-            if os.path.exists(tmp):
-                os.remove(tmp)
-        except Exception:
-            pass
 
 
 def _daily_cache_key(*, scope: str, scope_id: str, date_str: str, level: str, metrics_hash: str) -> str:
@@ -92,8 +82,10 @@ def _daily_ttl_seconds(*, date_str: str) -> int:
 
 
 def _daily_cache_get(key: str, *, ttl_seconds: int) -> tuple[Any | None, bool]:
-    store = _load_daily_report_cache() or {}
-    item = store.get(str(key))
+    try:
+        item = get_row("daily_report_cache", DAILY_REPORT_CACHE_FILE, str(key))
+    except Exception:
+        item = None
     now_ts = time.time()
     if isinstance(item, dict):
         try:
@@ -105,10 +97,15 @@ def _daily_cache_get(key: str, *, ttl_seconds: int) -> tuple[Any | None, bool]:
     return None, False
 
 
+def _insight_values(d: dict) -> dict:
+    return {k: v for k, v in (d or {}).items() if not str(k).startswith("_")}
+
+
 def _daily_cache_set(key: str, value: Any) -> None:
-    store = _load_daily_report_cache() or {}
-    store[str(key)] = {"ts": time.time(), "value": value}
-    _save_daily_report_cache(store)
+    try:
+        upsert_row("daily_report_cache", DAILY_REPORT_CACHE_FILE, str(key), {"ts": time.time(), "value": value})
+    except Exception:
+        pass
 
 
 def _report_source_footer_lines(*, mode: str, cache_state: str) -> list[str]:
@@ -154,63 +151,27 @@ def _actions_list_from_map(actions_map: dict[str, float]) -> list[dict]:
 
 def _aggregate_account_day_from_hourly_snapshots(aid: str, *, date_str: str) -> dict | None:
     with deny_fb_api_calls(reason="reporting_hourly_account"):
-        hours = list_snapshot_hours(str(aid), date_str=str(date_str))
-        if not hours:
-            return None
-
-        spend = 0.0
-        impressions = 0
-        clicks = 0
-        actions_map: dict[str, float] = {}
-        any_ready = False
-
-        for h in hours:
-            snap = load_snapshot(str(aid), date_str=str(date_str), hour=int(h)) or {}
-            if str(snap.get("status") or "") not in {"ready", "ready_low_confidence"}:
-                continue
-            rows = snap.get("rows") or []
-            if not isinstance(rows, list) or not rows:
-                continue
-            any_ready = True
-            for r in rows:
-                if not isinstance(r, dict):
-                    continue
-                try:
-                    spend += float(r.get("spend") or 0.0)
-                except Exception:
-                    pass
-                try:
-                    impressions += int((r or {}).get("impressions") or 0)
-                except Exception:
-                    pass
-                try:
-                    clicks += int((r or {}).get("clicks") or 0)
-                except Exception:
-                    pass
-                acts = (r or {}).get("actions")
-                if isinstance(acts, dict) and acts:
-                    for k, v in acts.items():
-                        try:
-                            actions_map[str(k)] = float(actions_map.get(str(k), 0.0) or 0.0) + float(v or 0.0)
-                        except Exception:
-                            continue
-
-        if not any_ready:
-            return None
+        rollup = load_day_rollup(str(aid), date_str=str(date_str))
+    if not rollup or int(rollup.get("rows_count") or 0) <= 0:
+        return None
 
-        cpm = (float(spend) / float(impressions) * 1000.0) if int(impressions) > 0 else 0.0
-        cpc = (float(spend) / float(clicks)) if int(clicks) > 0 else 0.0
-        return {
-            "impressions": int(impressions),
-            "cpm": float(cpm),
-            "clicks": int(clicks),
-            "cpc": float(cpc),
-            "spend": float(spend),
-            "actions": _actions_list_from_map(actions_map),
-            "cost_per_action_type": [],
-            "_source": "hourly_cache",
-            "_meta": {"date": str(date_str), "level": "account"},
-        }
+    t = rollup_totals(rollup)
+    spend = float(t.get("spend") or 0.0)
+    impressions = int(t.get("impressions") or 0)
+    clicks = int(t.get("clicks") or 0)
+    cpm = (float(spend) / float(impressions) * 1000.0) if int(impressions) > 0 else 0.0
+    cpc = (float(spend) / float(clicks)) if int(clicks) > 0 else 0.0
+    return {
+        "impressions": int(impressions),
+        "cpm": float(cpm),
+        "clicks": int(clicks),
+        "cpc": float(cpc),
+        "spend": float(spend),
+        "actions": _actions_list_from_map(dict(t.get("actions") or {})),
+        "cost_per_action_type": [],
+        "_source": "hourly_cache",
+        "_meta": {"date": str(date_str), "level": "account"},
+    }
 
 
 def _fetch_account_day_insight(
@@ -302,7 +263,15 @@ def _fetch_account_day_insight(
     except Exception:
         pass
 
+    try:
+        prev = (get_row("daily_report_cache", DAILY_REPORT_CACHE_FILE, str(key)) or {}).get("value")
+    except Exception:
+        prev = None
     _daily_cache_set(key, dict(ins_dict))
+    # Заполнение кэша не меняет входные данные отчётов: поколение сдвигается,
+    # только если FB вернул другие значения, чем уже лежали в кэше.
+    if isinstance(prev, dict) and _insight_values(prev) != _insight_values(ins_dict):
+        bump_generation(str(aid))
     try:
         log.info(
             "caller=%s mode=daily_fallback cache=write scope=account scope_id=%s date=%s level=ACCOUNT",
@@ -317,34 +286,16 @@ def _fetch_account_day_insight(
 
 def _load_morning_report_cache() -> dict:
     try:
-        with open(MORNING_REPORT_CACHE_FILE, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return obj if isinstance(obj, dict) else {}
+        return load_doc("morning_report_cache", MORNING_REPORT_CACHE_FILE)
     except Exception:
         return {}
 
 
 def _save_morning_report_cache(d: dict) -> None:
     try:
-        os.makedirs(os.path.dirname(MORNING_REPORT_CACHE_FILE), exist_ok=True)
+        save_doc("morning_report_cache", MORNING_REPORT_CACHE_FILE, d)
     except Exception:
         pass
-    tmp = str(MORNING_REPORT_CACHE_FILE) + ".tmp"
-    try:
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(d, f, ensure_ascii=False, indent=2)
-            f.flush()
-            try:
-                os.fsync(f.fileno())
-            except Exception:
-                pass
-        os.replace(tmp, MORNING_REPORT_CACHE_FILE)
-    except Exception:
-        try:
-            if os.path.exists(tmp):
-                os.remove(tmp)
-        except Exception:
-            pass
 
 
 def _metrics_hash(metrics_set: str, lead_action_type: str | None) -> str:
@@ -357,8 +308,10 @@ def _cache_key(*, scope: str, scope_id: str, since: str, until: str, mode: str,
 
 
 def _cache_get_morning(key: str) -> tuple[dict | None, bool]:
-    store = _load_morning_report_cache() or {}
-    item = store.get(str(key))
+    try:
+        item = get_row("morning_report_cache", MORNING_REPORT_CACHE_FILE, str(key))
+    except Exception:
+        item = None
     now_ts = time.time()
     hit = False
     if isinstance(item, dict):
@@ -377,13 +330,15 @@ def _cache_get_morning(key: str) -> tuple[dict | None, bool]:
 
 
 def _cache_set_morning(key: str, value: dict) -> None:
-    store = _load_morning_report_cache() or {}
-    store[str(key)] = {"ts": time.time(), "value": value}
+    item = {"ts": time.time(), "value": value}
     try:
-        size_bytes = len(json.dumps(store[str(key)], ensure_ascii=False).encode("utf-8"))
+        size_bytes = len(json.dumps(item, ensure_ascii=False).encode("utf-8"))
     except Exception:
         size_bytes = 0
-    _save_morning_report_cache(store)
+    try:
+        upsert_row("morning_report_cache", MORNING_REPORT_CACHE_FILE, str(key), item)
+    except Exception:
+        pass
     logging.getLogger(__name__).info(
         "cache_write key=%s size_bytes=%s",
         str(key),
@@ -480,7 +435,7 @@ def build_morning_report_text(*, period: str = "yesterday") -> tuple[str, dict]:
         period = "yesterday"
 
     since, until = _yesterday_range_almaty()
-    store = load_accounts() or {}
+    store = load_accounts_view() or {}
     enabled_ids = [aid for aid, row in (store or {}).items() if (row or {}).get("enabled", True)]
 
     cache_hit = 0
@@ -712,9 +667,9 @@ def build_morning_report_text(*, period: str = "yesterday") -> tuple[str, dict]:
 
 def resolve_report_profile(aid: str) -> dict:
     try:
-        from .storage import load_accounts
+        from .storage import load_accounts_view
 
-        st = load_accounts() or {}
+        st = load_accounts_view() or {}
         row = (st or {}).get(str(aid)) or {}
         mr = (row or {}).get("morning_report") or {}
         if not isinstance(mr, dict):
@@ -942,47 +897,9 @@ def build_morning_group_message(*, aid: str, gid: str, grp: dict, since: str, un
 
 
 
-def _account_timezone_info(aid: str) -> dict:
-    try:
-        from facebook_business.adobjects.adaccount import AdAccount
-
-        acc = AdAccount(str(aid))
-        with allow_fb_api_calls(reason="reporting_account_timezone"):
-            info = safe_api_call(
-                acc.api_get,
-                fields=["timezone_name", "timezone_offset_hours_utc"],
-                params={},
-                _meta={"endpoint": "adaccount", "params": {"fields": "timezone_name,timezone_offset_hours_utc"}},
-                _caller="reporting_account_timezone",
-            )
-        if isinstance(info, dict):
-            return info
-    except Exception:
-        pass
-    return {}
-
-
 def _account_now(aid: str) -> tuple[datetime, str, float | None]:
-    tz_name = ""
-    off = None
-    try:
-        info = _account_timezone_info(str(aid)) or {}
-        tz_name = str(info.get("timezone_name") or "")
-        try:
-            off = float(info.get("timezone_offset_hours_utc"))
-        except Exception:
-            off = None
-    except Exception:
-        tz_name = ""
-        off = None
-
-    try:
-        if off is not None:
-            now = datetime.utcnow() + timedelta(hours=float(off))
-            return now, tz_name, float(off)
-    except Exception:
-        pass
-    return datetime.now(ALMATY_TZ), tz_name, off
+    """Текущее время в поясе аккаунта (пояс берётся из кэша метаданных аккаунта)."""
+    return account_now(str(aid))
 
 
 # ========= Утилиты форматирования =========
@@ -995,34 +912,16 @@ def fmt_int(n) -> str:
 
 def _load_report_cache() -> dict:
     try:
-        with open(REPORT_CACHE_FILE, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return obj if isinstance(obj, dict) else {}
+        return load_doc("report_cache", REPORT_CACHE_FILE)
     except Exception:
         return {}
 
 
 def _save_report_cache(d: dict) -> None:
     try:
-        os.makedirs(os.path.dirname(REPORT_CACHE_FILE), exist_ok=True)
+        save_doc("report_cache", REPORT_CACHE_FILE, d)
     except Exception:
         pass
-    tmp = str(REPORT_CACHE_FILE) + ".tmp"
-    try:
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(d, f, ensure_ascii=False, indent=2)
-            f.flush()
-            try:
-                os.fsync(f.fileno())
-            except Exception:
-                pass
-        os.replace(tmp, REPORT_CACHE_FILE)
-    except Exception:
-        try:
-            if os.path.exists(tmp):
-                os.remove(tmp)
-        except Exception:
-            pass
 
 
 # ========== ИНСАЙТЫ (сырые данные) ==========
@@ -1286,30 +1185,69 @@ def _msg_cps_account_level(aid: str, period_for_api: Any) -> tuple[int, float, f
 
 
 # ========== КЭШ ТЕКСТОВЫХ ОТЧЁТОВ ==========
+# Тексты отчётов в памяти: (aid, key) -> (поколение данных, ts, text).
+_REPORT_TEXT_MEMO: dict[tuple[str, str], tuple[int, float, str]] = {}
+
+
+def _report_entry_valid(item: Any, *, gen: int, period, now_ts: float) -> bool:
+    if not isinstance(item, dict) or "gen" not in item:
+        return False
+    try:
+        if int(item.get("gen")) != int(gen):
+            return False
+        # "today" без свежих снапшотов строится из дневного кэша/FB, живые
+        # цифры не должны отставать — для него отдельный короткий TTL.
+        if period == "today" and (now_ts - float(item.get("ts", 0))) > REPORT_TODAY_CACHE_TTL:
+            return False
+    except Exception:
+        return False
+    return True
+
+
 def get_cached_report(aid: str, period, label: str = "") -> str:
     """
-    Возвращает текст отчёта из кеша, если свежий,
-    иначе строит заново и обновляет кеш.
+    Возвращает текст отчёта из кеша, если входные данные аккаунта
+    не менялись (поколение данных совпадает), иначе строит заново
+    и обновляет кеш.
     """
-    # Для "today" всегда считаем отчёт на лету, без использования кэша.
-    if period == "today":
-        return build_report(aid, period, label)
-
-    key = f"v{int(REPORT_TEXT_CACHE_VERSION)}:{period_key(period)}"
+    key = f"v{int(REPORT_TEXT_CACHE_VERSION)}:{period_key(period)}:{label}"
     now_ts = datetime.now().timestamp()
+    gen = get_generation(str(aid))
 
-    cache = _load_report_cache()
-    acc_cache = cache.get(aid, {})
-    item = acc_cache.get(key)
+    memo = _REPORT_TEXT_MEMO.get((str(aid), key))
+    if memo is not None and _report_entry_valid(
+        {"gen": memo[0], "ts": memo[1]}, gen=gen, period=period, now_ts=now_ts
+    ):
+        return memo[2]
+
+    try:
+        acc_cache = get_row("report_cache", REPORT_CACHE_FILE, aid) or {}
+    except Exception:
+        acc_cache = {}
+    item = acc_cache.get(key) if isinstance(acc_cache, dict) else None
 
-    if item and (now_ts - float(item.get("ts", 0))) <= REPORT_CACHE_TTL:
-        return item.get("text", "")
+    if _report_entry_valid(item, gen=gen, period=period, now_ts=now_ts):
+        text = str(item.get("text", ""))
+        _REPORT_TEXT_MEMO[(str(aid), key)] = (int(gen), float(item.get("ts", now_ts)), text)
+        return text
 
-    text = build_report(aid, period, label)
+    text, ok = _build_report_checked(aid, period, label, caller=_report_caller(period))
+    if not ok:
+        # Ошибки FB временные, а поколение тихого аккаунта может не меняться
+        # сутками — такой текст в кэш не кладём.
+        return text
 
-    cache.setdefault(aid, {})
-    cache[aid][key] = {"text": text, "ts": now_ts}
-    _save_report_cache(cache)
+    # Поколение берётся до сборки: если данные поменялись во время неё,
+    # запись сразу окажется устаревшей.
+    if len(_REPORT_TEXT_MEMO) >= 4096:
+        _REPORT_TEXT_MEMO.clear()
+    _REPORT_TEXT_MEMO[(str(aid), key)] = (int(gen), float(now_ts), text)
+    acc_cache = dict(acc_cache) if isinstance(acc_cache, dict) else {}
+    acc_cache[key] = {"text": text, "ts": now_ts, "gen": int(gen)}
+    try:
+        upsert_row("report_cache", REPORT_CACHE_FILE, aid, acc_cache)
+    except Exception:
+        pass
 
     return text
 
@@ -1324,21 +1262,29 @@ def build_report(aid: str, period, label: str = "") -> str:
     - CPC / затраты
     - переписки / лиды / blended CPA (как в старом боте)
     """
-    caller = "report"
+    return build_report_with_caller(aid, period, label=label, caller=_report_caller(period))
+
+
+def _report_caller(period) -> str:
     try:
         if isinstance(period, dict):
-            caller = "report"
-        elif str(period) == "today":
-            caller = "rep_today"
-        elif str(period) == "yesterday":
-            caller = "rep_yday"
+            return "report"
+        if str(period) == "today":
+            return "rep_today"
+        if str(period) == "yesterday":
+            return "rep_yday"
     except Exception:
-        caller = "report"
-
-    return build_report_with_caller(aid, period, label=label, caller=caller)
+        pass
+    return "report"
 
 
 def build_report_with_caller(aid: str, period, label: str = "", *, caller: str) -> str:
+    return _build_report_checked(aid, period, label, caller=caller)[0]
+
+
+def _build_report_checked(aid: str, period, label: str = "", *, caller: str) -> tuple[str, bool]:
+    """(текст, ok): ok=False — запрос к данным упал (текст ошибки или ""
+    при нехватке прав), такой результат не кэшируется."""
     mode = ""
     cache_state = ""
     date_str = ""
@@ -1351,8 +1297,8 @@ def build_report_with_caller(aid: str, period, label: str = "", *, caller: str)
     except Exception as e:
         err = str(e)
         if "code: 200" in err or "403" in err or "permissions" in err.lower():
-            return ""
-        return f"⚠ Ошибка по {get_account_name(aid)}:\n\n{e}"
+            return "", False
+        return f"⚠ Ошибка по {get_account_name(aid)}:\n\n{e}", False
 
     badge = "🟢"
     try:
@@ -1362,7 +1308,7 @@ def build_report_with_caller(aid: str, period, label: str = "", *, caller: str)
         badge = "🟢"
     hdr = f"{badge} <b>{name}</b>{(' (' + label + ')') if label else ''}\n"
     if not ins:
-        return hdr + "Нет данных за выбранный период"
+        return hdr + "Нет данных за выбранный период", True
 
     # Базовые метрики
     impressions = int(ins.get("impressions", 0) or 0)
@@ -1448,7 +1394,7 @@ def build_report_with_caller(aid: str, period, label: str = "", *, caller: str)
     if isinstance(period, str) and str(period) in {"today", "yesterday"}:
         foot = _report_source_footer_lines(mode=str(mode or "daily_fallback"), cache_state=str(cache_state or "write"))
         out = (out.rstrip() + "\n\n" + "\n".join([str(x) for x in foot if str(x).strip()])).rstrip()
-    return out
+    return out, True
 
 
 def format_blended_block(total_spend: float, msgs: int, leads: int) -> str:
@@ -1641,9 +1587,9 @@ def build_account_report(
     acc_blended_block = format_blended_block(acc_spend, acc_msgs, acc_leads)
     acc_blended_after_sections = _strip_leading_separator(acc_blended_block)
 
-    from .storage import load_accounts
+    from .storage import load_accounts_view
 
-    store = load_accounts()
+    store = load_accounts_view()
     mr = (store.get(aid, {}) or {}).get("morning_report", {}) or {}
     show_blended_after_sections = mr.get("show_blended_after_sections", True)
 
@@ -1743,14 +1689,6 @@ def build_account_report(
                     if not isinstance(rr, dict):
                         continue
                     acts = extract_actions(rr)
-                    try:
-                        started = int(count_started_conversations_from_actions(acts) or 0)
-                    except Exception:
-                        started = 0
-                    try:
-                        website = int(count_leads_from_actions(acts, aid=str(aid), lead_action_type=None) or 0)
-                    except Exception:
-                        website = 0
                     try:
                         spend_v = float(rr.get("spend") or 0.0)
                     except Exception:
@@ -1761,14 +1699,9 @@ def build_account_report(
                         "adset_id": rr.get("adset_id"),
                         "name": rr.get("adset_name") or rr.get("name"),
                         "spend": spend_v,
-                        "started_conversations": int(started),
-                        "website_submit_applications": int(website),
                         "actions": dict(acts or {}),
-                        "msgs": int(started),
-                        "leads": int(website),
-                        "total": int(started + website),
                     }
-                    out_rows.append(row_out)
+                    out_rows.append(apply_derived_metrics(row_out))
 
                 all_rows = out_rows
                 _daily_cache_set(key, list(out_rows))
@@ -1792,14 +1725,6 @@ def build_account_report(
                 if not isinstance(rr, dict):
                     continue
                 acts = extract_actions(rr)
-                try:
-                    started = int(count_started_conversations_from_actions(acts) or 0)
-                except Exception:
-                    started = 0
-                try:
-                    website = int(count_leads_from_actions(acts, aid=str(aid), lead_action_type=None) or 0)
-                except Exception:
-                    website = 0
                 try:
                     spend_v = float(rr.get("spend") or 0.0)
                 except Exception:
@@ -1810,14 +1735,9 @@ def build_account_report(
                     "adset_id": rr.get("adset_id"),
                     "name": rr.get("adset_name") or rr.get("name"),
                     "spend": spend_v,
-                    "started_conversations": int(started),
-                    "website_submit_applications": int(website),
                     "actions": dict(acts or {}),
-                    "msgs": int(started),
-                    "leads": int(website),
-                    "total": int(started + website),
                 }
-                out_rows.append(row_out)
+                out_rows.append(apply_derived_metrics(row_out))
             all_rows = out_rows
             entity_cache_state = "write"
 
@@ -1848,20 +1768,7 @@ def build_account_report(
             except Exception:
                 pass
 
-            row_msgs = 0
-            try:
-                row_msgs = int((r or {}).get("started_conversations") or (r or {}).get("msgs") or 0)
-            except Exception:
-                row_msgs = 0
-            row_leads = 0
-            try:
-                actions_map = (r or {}).get("actions")
-                if isinstance(actions_map, dict) and actions_map:
-                    row_leads = int(count_leads_from_actions(actions_map, aid=str(aid), lead_action_type=None) or 0)
-                else:
-                    row_leads = int((r or {}).get("website_submit_applications") or (r or {}).get("leads") or 0)
-            except Exception:
-                row_leads = 0
+            row_msgs, row_leads, _row_total = row_derived_metrics(r or {})
 
             try:
                 a["msgs"] = int(a.get("msgs") or 0) + int(row_msgs or 0)
@@ -2011,9 +1918,9 @@ async def send_period_report(
     За 'today' — всегда живые данные (build_report),
     за остальные периоды — через кеш.
     """
-    from .storage import load_accounts, get_enabled_accounts_in_order
+    from .storage import load_accounts_view, get_enabled_accounts_in_order
 
-    store = load_accounts()
+    store = load_accounts_view()
 
     caller = "report"
     if str(period) == "today":
@@ -2026,9 +1933,9 @@ async def send_period_report(
             continue
 
         if period == "today":
-            txt = build_report_with_caller(aid, period, label, caller=caller)
+            txt = await run_fb_io(build_report_with_caller, aid, period, label, caller=caller)
         else:
-            txt = get_cached_report(aid, period, label)
+            txt = await run_fb_io(get_cached_report, aid, period, label)
 
         if txt:
             await ctx.bot.send_message(
@@ -2,6 +2,7 @@
 import json
 import os
 import shutil
+import threading
 import time
 from datetime import datetime
 
@@ -20,6 +21,9 @@ from .constants import (
     AUTOPILOT_CHAT_ID,
     DEFAULT_REPORT_CHAT,
 )
+from services.account_meta import META_FIELDS, remember_accounts_meta
+from services.data_generation import bump_generations
+from services.sqlite_store import TrackedDoc, doc_stamp, load_doc, save_doc
 
 
 AUTOPILOT_CONFIG_FILE = os.path.join(DATA_DIR, "autopilot_config.json")
@@ -267,12 +271,53 @@ def _migrate_morning_report_schema(store: dict) -> dict:
     return store
 
 
-def load_accounts() -> dict:
+class _ReadOnlyDict(dict):
+    """dict, который нельзя менять: read-only представление кэша аккаунтов."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("accounts view is read-only; use load_accounts() for a mutable copy")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+class _ReadOnlyList(list):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("accounts view is read-only; use load_accounts() for a mutable copy")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return _ReadOnlyDict((k, _freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return _ReadOnlyList(_freeze(v) for v in obj)
+    return obj
+
+
+# Процессный кэш accounts: мигрированный store, его JSON-текст (для дешёвых
+# изменяемых копий) и read-only представление. Инвалидируется по doc_stamp
+# (mtime/size файла или версия строк в SQLite) и при save_accounts().
+_ACCOUNTS_CACHE_LOCK = threading.Lock()
+_ACCOUNTS_CACHE: dict = {"stamp": None, "base": None, "text": None, "view": None}
+
+
+def _accounts_cache_fill() -> dict:
     try:
-        with open(ACCOUNTS_JSON, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        stamp = doc_stamp("accounts", ACCOUNTS_JSON)
     except Exception:
-        return {}
+        stamp = None
+    with _ACCOUNTS_CACHE_LOCK:
+        if stamp is not None and _ACCOUNTS_CACHE.get("stamp") == stamp:
+            return _ACCOUNTS_CACHE
+
+    try:
+        data = load_doc("accounts", ACCOUNTS_JSON)
+    except Exception:
+        data = {}
+    base = getattr(data, "doc_base", None)
 
     # Мягко мигрируем alerts к новой схеме при каждом чтении
     store = _migrate_alerts_schema(data)
@@ -281,23 +326,70 @@ def load_accounts() -> dict:
     store = _migrate_morning_report_schema(store)
     store = _migrate_autopilot_schema(store)
     store = _migrate_monitoring_schema(store)
-    return store
+
+    entry = {
+        "stamp": stamp,
+        "base": base,
+        "text": json.dumps(store, ensure_ascii=False),
+        "view": _freeze(store),
+    }
+    with _ACCOUNTS_CACHE_LOCK:
+        if stamp is not None:
+            _ACCOUNTS_CACHE.update(entry)
+    return entry
+
+
+def _invalidate_accounts_cache() -> None:
+    with _ACCOUNTS_CACHE_LOCK:
+        _ACCOUNTS_CACHE.update({"stamp": None, "base": None, "text": None, "view": None})
+
+
+def load_accounts() -> dict:
+    """Изменяемая копия accounts (для read-modify-write + save_accounts).
+
+    Копия помнит прочитанную версию строк, поэтому save_accounts() пишет
+    только изменённые в ней аккаунты и не затирает параллельные изменения
+    других аккаунтов.
+    """
+    try:
+        entry = _accounts_cache_fill()
+        out = TrackedDoc(json.loads(entry.get("text") or "{}"))
+    except Exception:
+        return {}
+    base = entry.get("base")
+    if isinstance(base, dict):
+        out.doc_base = dict(base)
+    return out
+
+
+def load_accounts_view() -> dict:
+    """Read-only представление accounts без копирования (для чтения в горячих путях)."""
+    try:
+        view = _accounts_cache_fill().get("view")
+    except Exception:
+        view = None
+    return view if view is not None else _ReadOnlyDict()
 
 
 def save_accounts(d: dict):
-    _atomic_write_json(ACCOUNTS_JSON, d)
+    # Пишутся только изменённые аккаунты; accounts.json — периодический экспорт.
+    try:
+        changed = save_doc("accounts", ACCOUNTS_JSON, d)
+    finally:
+        _invalidate_accounts_cache()
+    # Изменённые настройки аккаунта инвалидируют его кэшированные отчёты.
+    bump_generations(changed)
 
 
 def load_sync_meta() -> dict:
     try:
-        with open(SYNC_META_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_doc("sync_meta", SYNC_META_FILE)
     except Exception:
         return {}
 
 
 def save_sync_meta(d: dict):
-    _atomic_write_json(SYNC_META_FILE, d)
+    save_doc("sync_meta", SYNC_META_FILE, d)
 
 
 def human_last_sync() -> str:
@@ -321,7 +413,7 @@ def _norm_act(aid: str) -> str:
 
 
 def get_account_name(aid: str) -> str:
-    store = load_accounts()
+    store = load_accounts_view()
     if aid in store and store[aid].get("name"):
         return store[aid]["name"]
     return ACCOUNT_NAMES.get(aid, aid)
@@ -333,7 +425,7 @@ def get_enabled_accounts_in_order() -> list[str]:
     - сначала все включённые аккаунты,
     - потом выключенные (чтобы были внизу списков).
     """
-    store = load_accounts()
+    store = load_accounts_view()
     if not store:
         return AD_ACCOUNTS_FALLBACK
     enabled = [acc for acc, row in store.items() if row.get("enabled", True)]
@@ -344,7 +436,7 @@ def get_enabled_accounts_in_order() -> list[str]:
 
 def iter_enabled_accounts_only():
     """Итерируем только включённые аккаунты (enabled=True)."""
-    store = load_accounts()
+    store = load_accounts_view()
     ids = get_enabled_accounts_in_order()
     if not store:
         # если нет конфига, считаем все аккаунты включёнными (fallback)
@@ -365,18 +457,21 @@ def upsert_from_bm() -> dict:
     """
     Добавляет новые аккаунты и обновляет ИМЕНА.
     Настройки enabled/metrics/alerts не затирает.
-    Также сохраняет время последней синхронизации.
+    Также сохраняет время последней синхронизации и обновляет кэш
+    метаданных аккаунтов (пояс/валюта/статус) тем же запросом.
     """
     store = load_accounts()
     me = User(fbid="me")
-    fetched = list(me.get_ad_accounts(fields=["account_id", "name", "account_status"]))
+    fetched = list(me.get_ad_accounts(fields=["account_id"] + list(META_FIELDS)))
     added, updated, skipped = 0, 0, 0
+    meta_by_aid: dict = {}
     for it in fetched:
         aid = _norm_act(it.get("account_id"))
         name = it.get("name") or aid
         if aid in EXCLUDED_AD_ACCOUNT_IDS or looks_excluded(name):
             skipped += 1
             continue
+        meta_by_aid[aid] = {f: it.get(f) for f in META_FIELDS}
         ACCOUNT_NAMES.setdefault(aid, name)
         if aid in store:
             if name and store[aid].get("name") != name:
@@ -414,6 +509,7 @@ def upsert_from_bm() -> dict:
             }
             added += 1
     save_accounts(store)
+    remember_accounts_meta(meta_by_aid)
 
     last_sync_iso = datetime.now(ALMATY_TZ).isoformat()
     meta = load_sync_meta()
@@ -430,7 +526,7 @@ def upsert_from_bm() -> dict:
 
 
 def metrics_flags(aid: str) -> dict:
-    st = load_accounts().get(aid, {})
+    st = load_accounts_view().get(aid, {})
     m = st.get("metrics", {}) or {}
     return {
         "messaging": bool(m.get("messaging", False)),
@@ -496,7 +592,7 @@ def set_lead_metric_catalog_for_account(
 def is_active(aid: str) -> bool:
     try:
         # We treat disabled accounts as inactive for UI badges.
-        row = (load_accounts() or {}).get(str(aid)) or {}
+        row = (load_accounts_view() or {}).get(str(aid)) or {}
         if not bool(row.get("enabled", True)):
             return False
     except Exception:
@@ -546,7 +642,7 @@ def user_has_focus_settings(user_id: str) -> bool:
     с enabled=True и хотя бы одним target с active!=False.
     """
     uid = str(user_id)
-    store = load_accounts()
+    store = load_accounts_view()
     for row in store.values():
         focus = row.get("focus") or {}
         u = focus.get(uid)
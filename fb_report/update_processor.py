@@ -0,0 +1,76 @@
+# fb_report/update_processor.py
+
+"""
+Параллельная обработка Telegram-апдейтов с порядком внутри чата.
+
+PTB по умолчанию обрабатывает апдейты строго по одному, и медленный
+heatmap/ИИ-запрос в одном чате задерживает все остальные чаты. Здесь:
+
+- одновременно обрабатывается не больше TG_CONCURRENT_UPDATES апдейтов
+  (семафор базового BaseUpdateProcessor);
+- апдейты одного чата (если чата нет — одного пользователя) выполняются
+  последовательно, в порядке поступления: нажатия одного пользователя не
+  перегоняют друг друга, разные чаты идут параллельно.
+
+TG_CONCURRENT_UPDATES=1 возвращает прежнее последовательное поведение.
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+
+try:
+    TG_CONCURRENT_UPDATES = max(1, int(os.getenv("TG_CONCURRENT_UPDATES", "8") or 8))
+except Exception:
+    TG_CONCURRENT_UPDATES = 8
+
+
+def _ordering_key(update: object) -> Optional[str]:
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None and getattr(chat, "id", None) is not None:
+        return f"chat:{chat.id}"
+    user = getattr(update, "effective_user", None)
+    if user is not None and getattr(user, "id", None) is not None:
+        return f"user:{user.id}"
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Ограниченный параллелизм между чатами, строгий порядок внутри чата."""
+
+    def __init__(self, max_concurrent_updates: int = TG_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates=max(1, int(max_concurrent_updates)))
+        # ключ чата -> [lock, число ожидающих/выполняющихся апдейтов]
+        self._chats: Dict[str, list] = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Очередь чата берётся до общего семафора: апдейты, ждущие свой чат,
+        # не занимают слоты параллелизма других чатов.
+        key = _ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        slot = self._chats.get(key)
+        if slot is None:
+            slot = [asyncio.Lock(), 0]
+            self._chats[key] = slot
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            slot[1] -= 1
+            if slot[1] <= 0 and self._chats.get(key) is slot:
+                self._chats.pop(key, None)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._chats.clear()
@@ -0,0 +1,170 @@
+# services/account_meta.py
+
+"""
+Кэш метаданных рекламных аккаунтов: часовой пояс, валюта, статус, имя.
+
+Эти поля почти не меняются, поэтому не запрашиваются на каждый отчёт:
+одна строка на аккаунт в документе "account_meta" (SQLite, экспорт в
+account_meta.json) плюс in-process копия.
+
+Обновление:
+- upsert_from_bm() запрашивает поля вместе со списком аккаунтов из BM
+  (один проход по всем аккаунтам) и вызывает remember_accounts_meta();
+- refresh_accounts_meta(aids) — пакетный запрос (batch по 50) для
+  аккаунтов без записи или с записью старше ACCOUNT_META_TTL_S;
+- живые ответы биллингов (name/account_status) дописываются в кэш.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from fb_report.constants import ALMATY_TZ, DATA_DIR
+from services.sqlite_store import load_doc, upsert_rows
+
+
+ACCOUNT_META_FILE = os.path.join(DATA_DIR, "account_meta.json")
+
+META_FIELDS: List[str] = [
+    "name",
+    "account_status",
+    "currency",
+    "timezone_name",
+    "timezone_offset_hours_utc",
+]
+
+try:
+    ACCOUNT_META_TTL_S = float(os.getenv("ACCOUNT_META_TTL_S", str(7 * 24 * 3600)) or 7 * 24 * 3600)
+except Exception:
+    ACCOUNT_META_TTL_S = float(7 * 24 * 3600)
+
+_DOC = "account_meta"
+_LOCK = threading.Lock()
+_MEMO: Optional[Dict[str, Dict[str, Any]]] = None
+
+
+def _norm_aid(aid: Any) -> str:
+    s = str(aid or "").strip()
+    if s and not s.startswith("act_"):
+        s = f"act_{s}"
+    return s
+
+
+def _all() -> Dict[str, Dict[str, Any]]:
+    global _MEMO
+    memo = _MEMO
+    if memo is not None:
+        return memo
+    with _LOCK:
+        if _MEMO is None:
+            try:
+                stored = load_doc(_DOC, ACCOUNT_META_FILE)
+            except Exception:
+                stored = {}
+            _MEMO = {k: v for k, v in stored.items() if isinstance(v, dict)}
+        return _MEMO
+
+
+def _is_fresh(meta: Optional[Dict[str, Any]], now_ts: float) -> bool:
+    try:
+        return (now_ts - float((meta or {}).get("fetched_at") or 0.0)) < float(ACCOUNT_META_TTL_S)
+    except Exception:
+        return False
+
+
+def remember_accounts_meta(infos: Dict[str, Any], *, full: bool = True) -> int:
+    """Записывает метаданные из ответов API: {aid: info}.
+
+    full=True — ответ содержит все META_FIELDS (сбрасывает TTL);
+    full=False — частичный ответ (например, биллинг: name/account_status),
+    обновляются только пришедшие поля.
+    """
+    now_ts = time.time()
+    changed: Dict[str, Dict[str, Any]] = {}
+    memo = _all()
+    with _LOCK:
+        for aid, info in (infos or {}).items():
+            key = _norm_aid(aid)
+            if not key or not isinstance(info, dict):
+                continue
+            cur = memo.get(key) or {}
+            rec = dict(cur)
+            for f in META_FIELDS:
+                if f in info and info.get(f) is not None:
+                    rec[f] = info.get(f)
+            if full:
+                rec["fetched_at"] = now_ts
+            if rec != cur:
+                memo[key] = rec
+                changed[key] = rec
+    if changed:
+        try:
+            upsert_rows(_DOC, ACCOUNT_META_FILE, changed)
+        except Exception:
+            pass
+    return len(changed)
+
+
+def refresh_accounts_meta(aids: Iterable[str], *, force: bool = False, caller: str = "account_meta") -> int:
+    """Пакетно обновляет устаревшие/отсутствующие записи. Возвращает число обновлённых."""
+    from services.facebook_api import allow_fb_api_calls, fetch_accounts_info
+
+    now_ts = time.time()
+    memo = _all()
+    stale = []
+    for aid in aids or []:
+        key = _norm_aid(aid)
+        if key and (force or not _is_fresh(memo.get(key), now_ts)):
+            stale.append(key)
+    if not stale:
+        return 0
+    with allow_fb_api_calls(reason=str(caller)):
+        res = fetch_accounts_info(stale, META_FIELDS, caller=str(caller))
+    infos = {aid: info for aid, (info, _err) in res.items() if isinstance(info, dict)}
+    return remember_accounts_meta(infos, full=True)
+
+
+def get_account_meta(aid: str, *, refresh: bool = True) -> Dict[str, Any]:
+    """Метаданные аккаунта ({} если неизвестны). При refresh=True
+    отсутствующая/устаревшая запись догружается одним запросом."""
+    key = _norm_aid(aid)
+    if not key:
+        return {}
+    meta = _all().get(key)
+    if refresh and not _is_fresh(meta, time.time()):
+        try:
+            refresh_accounts_meta([key], caller="account_meta_refresh")
+        except Exception:
+            pass
+        meta = _all().get(key) or meta
+    return dict(meta or {})
+
+
+def account_now(aid: str) -> tuple[datetime, str, float | None]:
+    """Текущее время в часовом поясе аккаунта: (now, timezone_name, offset_hours).
+
+    Время без tzinfo (как и раньше в отчётах). Если пояс неизвестен —
+    время по Алматы.
+    """
+    meta = get_account_meta(aid)
+    tz_name = str(meta.get("timezone_name") or "")
+    try:
+        off = float(meta.get("timezone_offset_hours_utc"))
+    except Exception:
+        off = None
+
+    if tz_name:
+        try:
+            from pytz import timezone
+
+            return datetime.now(timezone(tz_name)).replace(tzinfo=None), tz_name, off
+        except Exception:
+            pass
+    try:
+        if off is not None:
+            return datetime.utcnow() + timedelta(hours=float(off)), tz_name, float(off)
+    except Exception:
+        pass
+    return datetime.now(ALMATY_TZ), tz_name, off
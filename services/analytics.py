@@ -145,6 +145,78 @@ def lead_cost_and_count(
     return int(total_cnt), float(total_cost)
 
 
+# ============================================================
+# 🔥 ПРОИЗВОДНЫЕ МЕТРИКИ СТРОК (считаются один раз при записи)
+# ============================================================
+
+# Версия правил классификации actions. Строки снапшотов/кэшей хранят
+# "derived_schema"; при несовпадении метрики пересчитываются из actions.
+# Увеличивать при изменении ACTION_CATEGORIES / LEAD_ACTION_TYPES.
+DERIVED_SCHEMA = 1
+
+# action_type -> колонка-категория строки.
+ACTION_CATEGORIES: Dict[str, str] = {
+    STARTED_CONVERSATIONS_ACTION_TYPE: "started_conversations",
+    **{str(t): "website_submit_applications" for t in LEAD_ACTION_TYPES},
+}
+
+_CATEGORY_COLUMNS: Tuple[str, ...] = ("started_conversations", "website_submit_applications")
+
+
+def classify_actions(actions: Dict[str, float]) -> Dict[str, int]:
+    """Один проход по actions: {колонка-категория: count}."""
+    out = {c: 0 for c in _CATEGORY_COLUMNS}
+    for t, v in (actions or {}).items():
+        cat = ACTION_CATEGORIES.get(str(t))
+        if cat is None:
+            continue
+        try:
+            out[cat] += int(float(v or 0))
+        except Exception:
+            continue
+    return out
+
+
+def apply_derived_metrics(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Записывает в строку (in place) started_conversations,
+    website_submit_applications, msgs, leads, total и derived_schema."""
+    cats = classify_actions(row.get("actions") if isinstance(row.get("actions"), dict) else {})
+    msgs = int(cats["started_conversations"])
+    leads = int(cats["website_submit_applications"])
+    row.update(cats)
+    row["msgs"] = msgs
+    row["leads"] = leads
+    row["total"] = msgs + leads
+    row["derived_schema"] = DERIVED_SCHEMA
+    return row
+
+
+def row_derived_metrics(row: Dict[str, Any]) -> Tuple[int, int, int]:
+    """(msgs, leads, total) строки. Сохранённые колонки используются, если
+    версия схемы актуальна; иначе пересчёт из actions (для строк без
+    actions — старые колонки как есть)."""
+
+    def _i(v: Any) -> int:
+        try:
+            return int(float(v or 0))
+        except Exception:
+            return 0
+
+    if row.get("derived_schema") == DERIVED_SCHEMA:
+        msgs = _i(row.get("msgs"))
+        leads = _i(row.get("leads"))
+        return msgs, leads, _i(row.get("total")) or msgs + leads
+    acts = row.get("actions")
+    if isinstance(acts, dict) and acts:
+        cats = classify_actions(acts)
+        msgs = int(cats["started_conversations"])
+        leads = int(cats["website_submit_applications"])
+        return msgs, leads, msgs + leads
+    msgs = _i(row.get("msgs") or row.get("started_conversations"))
+    leads = _i(row.get("leads") or row.get("website_submit_applications"))
+    return msgs, leads, _i(row.get("total")) or msgs + leads
+
+
 # ============================================================
 # 🔥 БАЗОВЫЕ ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================================
@@ -0,0 +1,55 @@
+# services/data_generation.py
+
+"""
+Счётчик "поколения данных" по аккаунту.
+
+Увеличивается при любом изменении входных данных отчётов аккаунта:
+новый/изменённый снапшот (save_snapshot), изменение настроек
+(save_accounts), обновление локального кэша инсайтов. Кэши готовых
+текстов считаются валидными, пока поколение аккаунта не изменилось.
+"""
+
+import os
+import threading
+from typing import Iterable
+
+from fb_report.constants import DATA_DIR
+from services.sqlite_store import get_row, upsert_row
+
+
+DATA_GENERATION_FILE = os.path.join(DATA_DIR, "data_generation.json")
+
+_DOC = "data_generation"
+_LOCK = threading.Lock()
+
+
+def get_generation(aid: str) -> int:
+    """Текущее поколение данных аккаунта (0, если изменений ещё не было).
+
+    Читается из хранилища при каждом вызове (одна строка по ключу), чтобы
+    увеличение из другого процесса сразу инвалидировало кэши текстов.
+    """
+    key = str(aid or "")
+    try:
+        return int(get_row(_DOC, DATA_GENERATION_FILE, key) or 0)
+    except Exception:
+        return 0
+
+
+def bump_generation(aid: str) -> int:
+    """Помечает, что входные данные аккаунта изменились. Возвращает новое поколение."""
+    key = str(aid or "")
+    if not key:
+        return 0
+    with _LOCK:
+        g = int(get_generation(key)) + 1
+        try:
+            upsert_row(_DOC, DATA_GENERATION_FILE, key, g)
+        except Exception:
+            pass
+    return g
+
+
+def bump_generations(aids: Iterable[str]) -> None:
+    for aid in aids or []:
+        bump_generation(str(aid))
@@ -0,0 +1,233 @@
+# services/entity_index.py
+
+"""
+Индекс сущностей аккаунта (измерения): кампании, адсеты, объявления.
+
+Для каждой сущности хранится: имя, родительские id, последний
+увиденный статус и дата последнего снапшота, где она встречалась:
+
+    "campaign:<id>" -> {"name", "status", "last_seen"}
+    "adset:<id>"    -> {"name", "campaign_id", "status", "last_seen"}
+    "ad:<id>"       -> {"name", "campaign_id", "adset_id", "status", "last_seen"}
+
+Индекс обновляется коллектором в save_snapshot() (пишутся только
+изменившиеся записи) и читается UI через in-process словарь за O(1),
+без сканирования часовых снапшотов. Для аккаунтов, собранных до появления
+индекса, он один раз заполняется из снапшотов последних дней.
+"""
+
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fb_report.constants import ALMATY_TZ, DATA_DIR
+from services.sqlite_store import load_doc, upsert_rows
+
+
+INDEX_VERSION = 1
+KINDS = ("campaign", "adset", "ad")
+
+# Сколько дней снапшотов просматривается при первичном заполнении индекса.
+_BACKFILL_DAYS = 7
+
+_LOCK = threading.RLock()
+_MEMO: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+
+def _doc(aid: str) -> str:
+    return f"entity_index:{str(aid)}"
+
+
+def _path(aid: str) -> str:
+    return os.path.join(DATA_DIR, "heatmap_snapshots", str(aid), "entities.json")
+
+
+def _key(kind: str, entity_id: str) -> str:
+    return f"{str(kind)}:{str(entity_id)}"
+
+
+def _entities_from_row(r: Dict[str, Any]) -> List[tuple]:
+    """(kind, id, поля) для всех сущностей, упомянутых в строке снапшота."""
+    out: List[tuple] = []
+    cid = str(r.get("campaign_id") or "")
+    asid = str(r.get("adset_id") or "")
+    ad_id = str(r.get("ad_id") or "")
+    if cid:
+        out.append(
+            (
+                "campaign",
+                cid,
+                {
+                    "name": str(r.get("campaign_name") or ""),
+                    "status": str(r.get("campaign_status") or ""),
+                },
+            )
+        )
+    if asid:
+        out.append(
+            (
+                "adset",
+                asid,
+                {
+                    "name": str(r.get("adset_name") or r.get("name") or ""),
+                    "campaign_id": cid,
+                    "status": str(r.get("adset_status") or ""),
+                },
+            )
+        )
+    if ad_id:
+        out.append(
+            (
+                "ad",
+                ad_id,
+                {
+                    "name": str(r.get("ad_name") or ""),
+                    "campaign_id": cid,
+                    "adset_id": asid,
+                    "status": str(r.get("ad_status") or r.get("effective_status") or ""),
+                },
+            )
+        )
+    return out
+
+
+def _merge(cur: Optional[Dict[str, Any]], fields: Dict[str, Any], date_str: str) -> Optional[Dict[str, Any]]:
+    """Новая версия записи или None, если ничего не изменилось.
+
+    Более свежий снапшот перезаписывает непустые поля; более старый
+    (догрузка истории) только заполняет отсутствующие.
+    """
+    base = dict(cur or {})
+    newer = str(date_str) >= str(base.get("last_seen") or "")
+    rec = dict(base)
+    for k, v in fields.items():
+        if not v:
+            continue
+        if newer or not rec.get(k):
+            rec[k] = v
+    if newer:
+        rec["last_seen"] = str(date_str)
+    return rec if rec != base else None
+
+
+def _apply_rows(
+    index: Dict[str, Dict[str, Any]],
+    rows: List[Dict[str, Any]],
+    date_str: str,
+) -> Dict[str, Dict[str, Any]]:
+    """Вносит строки снапшота в index; возвращает изменённые записи."""
+    changed: Dict[str, Dict[str, Any]] = {}
+    for r in rows or []:
+        if not isinstance(r, dict):
+            continue
+        for kind, eid, fields in _entities_from_row(r):
+            key = _key(kind, eid)
+            rec = _merge(changed.get(key) or index.get(key), fields, date_str)
+            if rec is not None:
+                changed[key] = rec
+                index[key] = rec
+    return changed
+
+
+def _backfill(aid: str, index: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    from services.heatmap_store import load_day_snapshots
+
+    changed: Dict[str, Dict[str, Any]] = {}
+    today = datetime.now(ALMATY_TZ).date()
+    for i in range(_BACKFILL_DAYS, -1, -1):
+        d = (today - timedelta(days=i)).strftime("%Y-%m-%d")
+        try:
+            snaps = load_day_snapshots(str(aid), date_str=d)
+        except Exception:
+            continue
+        for h in sorted(snaps):
+            changed.update(_apply_rows(index, (snaps[h] or {}).get("rows") or [], d))
+    return changed
+
+
+def _load(aid: str) -> Dict[str, Dict[str, Any]]:
+    """Индекс аккаунта из памяти (первое обращение — чтение из хранилища)."""
+    key = str(aid or "")
+    index = _MEMO.get(key)
+    if index is not None:
+        return index
+    with _LOCK:
+        index = _MEMO.get(key)
+        if index is not None:
+            return index
+        try:
+            stored = load_doc(_doc(key), _path(key))
+        except Exception:
+            stored = {}
+        meta = stored.pop("_meta", None)
+        index = {k: v for k, v in stored.items() if isinstance(v, dict)}
+        if int((meta or {}).get("v") or 0) != INDEX_VERSION:
+            changed: Dict[str, Any] = dict(_backfill(key, index))
+            changed["_meta"] = {"v": INDEX_VERSION}
+            try:
+                upsert_rows(_doc(key), _path(key), changed)
+            except Exception:
+                pass
+        _MEMO[key] = index
+        return index
+
+
+# ========= ОБНОВЛЕНИЕ (коллектор) =========
+
+def index_snapshot(snapshot: Dict[str, Any]) -> int:
+    """Вносит сущности из строк снапшота. Возвращает число изменённых записей."""
+    aid = str((snapshot or {}).get("account_id") or "")
+    date_str = str((snapshot or {}).get("date") or "")
+    rows = (snapshot or {}).get("rows") or []
+    if not aid or not date_str or not rows:
+        return 0
+    with _LOCK:
+        changed = _apply_rows(_load(aid), rows, date_str)
+        if changed:
+            upsert_rows(_doc(aid), _path(aid), changed)
+    return len(changed)
+
+
+# ========= ЧТЕНИЕ (UI) =========
+
+def get_entity(aid: str, kind: str, entity_id: str) -> Optional[Dict[str, Any]]:
+    """Запись индекса ({"id", "name", ...}) или None."""
+    eid = str(entity_id or "")
+    if not eid:
+        return None
+    rec = _load(aid).get(_key(kind, eid))
+    if not isinstance(rec, dict):
+        return None
+    out = dict(rec)
+    out["id"] = eid
+    return out
+
+
+def entity_name(aid: str, kind: str, entity_id: str, default: Optional[str] = None) -> str:
+    """Имя сущности; если неизвестно — default (по умолчанию сам id)."""
+    eid = str(entity_id or "")
+    rec = _load(aid).get(_key(kind, eid)) if eid else None
+    name = str((rec or {}).get("name") or "")
+    if name:
+        return name
+    return eid if default is None else str(default)
+
+
+def list_entities(aid: str, kind: str, *, since: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Сущности вида kind, встречавшиеся в снапшотах с даты since (YYYY-MM-DD),
+    отсортированные по имени."""
+    prefix = f"{str(kind)}:"
+    out: List[Dict[str, Any]] = []
+    for key, rec in list(_load(aid).items()):
+        if not key.startswith(prefix) or not isinstance(rec, dict):
+            continue
+        if since and str(rec.get("last_seen") or "") < str(since):
+            continue
+        eid = key[len(prefix):]
+        item = dict(rec)
+        item["id"] = eid
+        item["name"] = str(rec.get("name") or eid)
+        out.append(item)
+    out.sort(key=lambda x: str(x.get("name") or ""))
+    return out
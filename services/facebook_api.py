@@ -1,14 +1,20 @@
 # services/facebook_api.py
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 from datetime import datetime
 import json
 import time
 import random
 import os
+import asyncio
 import threading
 import contextlib
+import contextvars
+import functools
 import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
 
 from facebook_business.api import FacebookAdsApi
 from facebook_business.adobjects.adaccount import AdAccount
@@ -18,6 +24,7 @@ from facebook_business.exceptions import FacebookRequestError
 
 from config import FB_ACCESS_TOKEN
 from services.storage import load_local_insights, save_local_insights, period_key
+from services.sqlite_store import delete_row, get_row, load_doc, upsert_row
 
 
 _LAST_API_ERROR: Optional[str] = None
@@ -25,16 +32,39 @@ _LAST_API_ERROR_AT: Optional[str] = None
 _LAST_API_ERROR_INFO: Dict[str, Any] = {}
 _RATE_LIMIT_UNTIL_TS: float = 0.0
 
-_RL_LOCK = threading.Lock()
-_NEXT_ALLOWED_TS: float = 0.0
-_MIN_DELAY_S: float = float(os.getenv("FB_MIN_DELAY_S", "0.35") or 0.35)
-_JITTER_S: float = float(os.getenv("FB_JITTER_S", "0.20") or 0.20)
-
-_FB_API_ALLOW_DEPTH: int = 0
-_FB_API_ALLOW_REASON: Optional[str] = None
-
-_FB_API_DENY_DEPTH: int = 0
-_FB_API_DENY_REASON: Optional[str] = None
+_RL_RATE_PER_S: float = float(os.getenv("FB_RL_RATE_PER_S", "3.0") or 3.0)
+_RL_BURST: float = float(os.getenv("FB_RL_BURST", "6") or 6)
+# Usage percent (max over FB usage headers) above which pacing slows down.
+_RL_USAGE_SOFT_PCT: float = float(os.getenv("FB_RL_USAGE_SOFT_PCT", "50") or 50)
+
+# Usage readings decay with this half-life instead of being overwritten: a low
+# reading from a quiet account must not cancel the backoff caused by a busy one.
+try:
+    _RL_USAGE_HALF_LIFE_S: float = max(1.0, float(os.getenv("FB_RL_USAGE_HALF_LIFE_S", "60") or 60))
+except Exception:
+    _RL_USAGE_HALF_LIFE_S = 60.0
+
+_USAGE_LOCK = threading.Lock()
+# (pct, ts): decaying max of the readings, as of ts.
+_USAGE_GLOBAL: Tuple[float, float] = (0.0, 0.0)
+_USAGE_BY_AID: Dict[str, Tuple[float, float]] = {}
+_USAGE_UPDATED_AT: float = 0.0
+
+# Политика allow/deny хранится в contextvars, а не в глобальных счётчиках:
+# у каждой корутины (задачи PTB) и каждого потока своя копия, так что
+# пересекающиеся scope'ы не портят друг другу состояние.
+# asyncio.to_thread() переносит контекст в поток сам; для своих executor'ов —
+# submit_with_policy().
+class _FbPolicy(NamedTuple):
+    allow_depth: int = 0
+    allow_reason: Optional[str] = None
+    deny_depth: int = 0
+    deny_reason: Optional[str] = None
+    # Явное разрешение/запрет для scope (фоновые обновления кэша): True/False/None.
+    explicit: Optional[bool] = None
+
+
+_FB_POLICY: contextvars.ContextVar[_FbPolicy] = contextvars.ContextVar("fb_api_policy", default=_FbPolicy())
 
 _FB_API_DEFAULT_DENY: bool = str(os.getenv("FB_API_DEFAULT_DENY", "1") or "1").strip() not in {
     "0",
@@ -47,30 +77,47 @@ _FB_API_DEFAULT_DENY: bool = str(os.getenv("FB_API_DEFAULT_DENY", "1") or "1").s
 
 @contextlib.contextmanager
 def allow_fb_api_calls(reason: str | None = None):
-    global _FB_API_ALLOW_DEPTH, _FB_API_ALLOW_REASON
-    _FB_API_ALLOW_DEPTH += 1
-    if reason:
-        _FB_API_ALLOW_REASON = str(reason)
+    cur = _FB_POLICY.get()
+    token = _FB_POLICY.set(
+        cur._replace(
+            allow_depth=int(cur.allow_depth) + 1,
+            allow_reason=str(reason) if reason else cur.allow_reason,
+        )
+    )
     try:
         yield
     finally:
-        _FB_API_ALLOW_DEPTH = max(0, int(_FB_API_ALLOW_DEPTH) - 1)
-        if _FB_API_ALLOW_DEPTH <= 0:
-            _FB_API_ALLOW_REASON = None
+        _FB_POLICY.reset(token)
 
 
 @contextlib.contextmanager
 def deny_fb_api_calls(reason: str | None = None):
-    global _FB_API_DENY_DEPTH, _FB_API_DENY_REASON
-    _FB_API_DENY_DEPTH += 1
-    if reason:
-        _FB_API_DENY_REASON = str(reason)
+    cur = _FB_POLICY.get()
+    token = _FB_POLICY.set(
+        cur._replace(
+            deny_depth=int(cur.deny_depth) + 1,
+            deny_reason=str(reason) if reason else cur.deny_reason,
+        )
+    )
+    try:
+        yield
+    finally:
+        _FB_POLICY.reset(token)
+
+
+@contextlib.contextmanager
+def _explicit_fb_policy(allow: Optional[bool]):
+    token = _FB_POLICY.set(_FB_POLICY.get()._replace(explicit=allow))
     try:
         yield
     finally:
-        _FB_API_DENY_DEPTH = max(0, int(_FB_API_DENY_DEPTH) - 1)
-        if _FB_API_DENY_DEPTH <= 0:
-            _FB_API_DENY_REASON = None
+        _FB_POLICY.reset(token)
+
+
+def submit_with_policy(executor: Any, fn: Any, *args: Any, **kwargs: Any) -> Future:
+    """executor.submit() с текущим контекстом (политика FB API едет в поток)."""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
 
 
 def get_last_api_error() -> Dict[str, Optional[str]]:
@@ -107,6 +154,9 @@ def _set_last_error_info(info: Dict[str, Any]) -> None:
     if not isinstance(info, dict):
         info = {"message": str(info)}
     _LAST_API_ERROR_INFO = info
+    failures = _SF_FAILURES.get()
+    if failures is not None:
+        failures.append(info)
 
 
 def classify_api_error(info: Dict[str, Any]) -> str:
@@ -149,21 +199,259 @@ def _sanitize_params(params: Any) -> Any:
     return out
 
 
-def _rate_limit_wait() -> None:
-    global _NEXT_ALLOWED_TS
-    if float(_MIN_DELAY_S or 0.0) <= 0:
+class _TokenBucket:
+    """Process-wide token bucket shared by all FB calls (all threads).
+
+    Tokens may go negative: a caller reserves its slot under the lock and
+    sleeps outside of it, so concurrent workers queue up fairly.
+    """
+
+    def __init__(self, rate_per_s: float, burst: float) -> None:
+        self.rate_per_s = max(0.01, float(rate_per_s or 0.0))
+        self.burst = max(1.0, float(burst or 0.0))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, scale: float = 1.0) -> float:
+        rate = self.rate_per_s * max(0.01, min(1.0, float(scale)))
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= 1.0
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / rate
+
+
+_RL_BUCKET = _TokenBucket(_RL_RATE_PER_S, _RL_BURST)
+
+
+def _usage_pct_from_headers(headers: Any) -> Tuple[float, Optional[float], float]:
+    """Parses FB usage headers.
+
+    Returns (max_global_pct, ad_account_pct or None, regain_access_minutes).
+    """
+    if not headers:
+        return 0.0, None, 0.0
+    try:
+        hmap = {str(k).lower(): v for k, v in dict(headers).items()}
+    except Exception:
+        return 0.0, None, 0.0
+
+    def _obj(name: str) -> Any:
+        raw = hmap.get(name)
+        if not raw:
+            return None
+        if isinstance(raw, (dict, list)):
+            return raw
+        try:
+            return json.loads(str(raw))
+        except Exception:
+            return None
+
+    def _pct(d: Any, keys: Tuple[str, ...]) -> float:
+        out = 0.0
+        if not isinstance(d, dict):
+            return out
+        for k in keys:
+            try:
+                out = max(out, float(d.get(k) or 0.0))
+            except Exception:
+                continue
+        return out
+
+    usage_keys = ("call_count", "total_cputime", "total_time")
+    global_pct = _pct(_obj("x-app-usage"), usage_keys)
+    regain_min = 0.0
+
+    buc = _obj("x-business-use-case-usage")
+    if isinstance(buc, dict):
+        for items in buc.values():
+            for it in (items if isinstance(items, list) else [items]):
+                global_pct = max(global_pct, _pct(it, usage_keys))
+                try:
+                    regain_min = max(regain_min, float((it or {}).get("estimated_time_to_regain_access") or 0.0))
+                except Exception:
+                    pass
+
+    acc_pct = None
+    acc = _obj("x-ad-account-usage")
+    if isinstance(acc, dict):
+        acc_pct = _pct(acc, ("acc_id_util_pct",))
+
+    return global_pct, acc_pct, regain_min
+
+
+def _decayed_usage(entry: Optional[Tuple[float, float]], now: float) -> float:
+    if not entry:
+        return 0.0
+    pct, ts = entry
+    age = max(0.0, float(now) - float(ts))
+    return float(pct) * (0.5 ** (age / float(_RL_USAGE_HALF_LIFE_S)))
+
+
+def _update_usage_from_headers(headers: Any, aid: Any = None) -> None:
+    global _USAGE_GLOBAL, _USAGE_UPDATED_AT
+    if not headers:
         return
+    global_pct, acc_pct, regain_min = _usage_pct_from_headers(headers)
     now = time.time()
-    with _RL_LOCK:
-        base = max(float(_NEXT_ALLOWED_TS or 0.0), now)
-        jitter = random.random() * float(_JITTER_S or 0.0)
-        next_ts = base + float(_MIN_DELAY_S) + jitter
-        wait_s = max(0.0, base - now)
-        _NEXT_ALLOWED_TS = next_ts
+    with _USAGE_LOCK:
+        _USAGE_GLOBAL = (max(float(global_pct), _decayed_usage(_USAGE_GLOBAL, now)), now)
+        if acc_pct is not None and aid:
+            key = str(aid)
+            _USAGE_BY_AID[key] = (max(float(acc_pct), _decayed_usage(_USAGE_BY_AID.get(key), now)), now)
+        _USAGE_UPDATED_AT = now
+    if regain_min > 0:
+        _mark_rate_limited_for(float(regain_min) * 60.0)
+
+
+def _headers_of(obj: Any) -> Any:
+    for attr in ("headers", "http_headers"):
+        h = getattr(obj, attr, None)
+        try:
+            if callable(h):
+                h = h()
+        except Exception:
+            h = None
+        if h:
+            return h
+    return None
+
+
+def _usage_scale(pct: float) -> float:
+    """Maps usage percent to a pacing factor: 1.0 below the soft threshold,
+    linearly down to 0.05 when usage approaches 100%.
+    """
+    soft = float(_RL_USAGE_SOFT_PCT or 0.0)
+    if pct <= soft or soft >= 100.0:
+        return 1.0
+    return max(0.05, (100.0 - float(pct)) / (100.0 - soft))
+
+
+def get_fb_usage() -> Dict[str, Any]:
+    now = time.time()
+    with _USAGE_LOCK:
+        return {
+            "global_pct": _decayed_usage(_USAGE_GLOBAL, now),
+            "by_aid": {k: _decayed_usage(v, now) for k, v in _USAGE_BY_AID.items()},
+            "updated_at": float(_USAGE_UPDATED_AT),
+        }
+
+
+def _rate_limit_wait(aid: Any = None) -> None:
+    now = time.time()
+    with _USAGE_LOCK:
+        pct = _decayed_usage(_USAGE_GLOBAL, now)
+        if aid:
+            pct = max(pct, _decayed_usage(_USAGE_BY_AID.get(str(aid)), now))
+    wait_s = _RL_BUCKET.reserve(_usage_scale(pct))
     if wait_s > 0:
         time.sleep(wait_s)
 
 
+def _request_error_info(
+    e: FacebookRequestError,
+    *,
+    endpoint: Any = None,
+    path: Any = None,
+    aid: Any = None,
+    caller: Any = None,
+    params: Any = None,
+) -> Dict[str, Any]:
+    code = None
+    subcode = None
+    http_status = None
+    try:
+        code = int(e.api_error_code())
+    except Exception:
+        code = None
+    try:
+        subcode = int(e.api_error_subcode())
+    except Exception:
+        subcode = None
+    try:
+        hs = getattr(e, "http_status", None)
+        if callable(hs):
+            http_status = hs()
+        else:
+            http_status = hs
+    except Exception:
+        http_status = None
+    try:
+        message = str(e)
+    except Exception:
+        message = "<unprintable error>"
+
+    info = {
+        "kind": "fb_request_error",
+        "code": code,
+        "subcode": subcode,
+        "message": message,
+        "endpoint": endpoint,
+        "path": path,
+        "aid": str(aid or ""),
+        "caller": str(caller or ""),
+        "http_status": http_status,
+        "params": params,
+    }
+    try:
+        fbtrace_id = getattr(e, "api_error_trace_id", None)
+        if callable(fbtrace_id):
+            info["fbtrace_id"] = fbtrace_id()
+    except Exception:
+        pass
+    return info
+
+
+def _log_request_error(info: Dict[str, Any]) -> None:
+    """Logs a FB request error and starts the rate-limit backoff on code 17."""
+    code = info.get("code")
+    endpoint = info.get("endpoint")
+    path = info.get("path")
+    aid = info.get("aid")
+    if code == 17:
+        try:
+            base_min = int(os.getenv("FB_RL_BACKOFF_MIN", "10") or 10)
+        except Exception:
+            base_min = 10
+        try:
+            base_max = int(os.getenv("FB_RL_BACKOFF_MAX", "20") or 20)
+        except Exception:
+            base_max = 20
+        jitter_m = random.randint(0, 5)
+        minutes = random.randint(base_min, max(base_min, base_max)) + jitter_m
+        _mark_rate_limited_for(float(minutes) * 60.0)
+
+        try:
+            logging.getLogger(__name__).warning(
+                "🟦 FB RATE LIMIT endpoint=%s path=%s aid=%s retry_after=%ss fb_code=%s fb_subcode=%s",
+                str(endpoint),
+                str(path or ""),
+                str(aid or ""),
+                str(rate_limit_retry_after_seconds()),
+                str(code),
+                str(info.get("subcode")),
+            )
+        except Exception:
+            pass
+
+    try:
+        logging.getLogger(__name__).warning(
+            "🟦 FB ERROR endpoint=%s path=%s aid=%s fb_code=%s fb_subcode=%s message=%s",
+            str(endpoint),
+            str(path or ""),
+            str(aid or ""),
+            str(code),
+            str(info.get("subcode")),
+            str(info.get("message") or ""),
+        )
+    except Exception:
+        pass
+
+
 # ИНИЦИАЛИЗАЦИЯ FACEBOOK API (один раз для всего проекта)
 if FB_ACCESS_TOKEN:
     # Используем токен без app_id/app_secret, как в config.py.
@@ -210,16 +498,19 @@ def safe_api_call(fn, *args, **kwargs):
     # - if deny_fb_api_calls() is active -> block by default
     # - allow_fb_api_calls() overrides deny
     # - callers can set _allow_fb_api explicitly (True/False)
+    policy = _FB_POLICY.get()
     allow = kwargs.pop("_allow_fb_api", None)
+    if allow is None:
+        allow = policy.explicit
     caller = kwargs.pop("_caller", None)
 
     effective_caller = str(caller or "")
     if not effective_caller:
         # Prefer deny reason (where the protection boundary is defined), then allow reason.
-        effective_caller = str(_FB_API_DENY_REASON or _FB_API_ALLOW_REASON or "")
+        effective_caller = str(policy.deny_reason or policy.allow_reason or "")
 
-    deny_active = int(_FB_API_DENY_DEPTH or 0) > 0
-    allow_active = int(_FB_API_ALLOW_DEPTH or 0) > 0
+    deny_active = int(policy.deny_depth or 0) > 0
+    allow_active = int(policy.allow_depth or 0) > 0
 
     effective_allow = True
     if allow is True:
@@ -250,8 +541,8 @@ def safe_api_call(fn, *args, **kwargs):
                 str(path or ""),
                 str(aid or ""),
                 str(effective_caller or ""),
-                str(_FB_API_ALLOW_REASON or ""),
-                str(_FB_API_DENY_REASON or ""),
+                str(policy.allow_reason or ""),
+                str(policy.deny_reason or ""),
             )
         except Exception:
             pass
@@ -292,8 +583,12 @@ def safe_api_call(fn, *args, **kwargs):
             )
         except Exception:
             pass
-        _rate_limit_wait()
+        _rate_limit_wait(aid)
         res = fn(*args, **kwargs)
+        try:
+            _update_usage_from_headers(_headers_of(res), aid)
+        except Exception:
+            pass
         try:
             n = None
             try:
@@ -311,93 +606,25 @@ def safe_api_call(fn, *args, **kwargs):
             pass
         return (res, None) if return_error_info else res
     except FacebookRequestError as e:
-        code = None
-        subcode = None
-        http_status = None
         try:
-            code = int(e.api_error_code())
-        except Exception:
-            code = None
-        try:
-            subcode = int(e.api_error_subcode())
-        except Exception:
-            subcode = None
-        try:
-            hs = getattr(e, "http_status", None)
-            if callable(hs):
-                http_status = hs()
-            else:
-                http_status = hs
+            _update_usage_from_headers(_headers_of(e), aid)
         except Exception:
-            http_status = None
-
-        try:
-            _LAST_API_ERROR = str(e)
-        except Exception:
-            _LAST_API_ERROR = "<unprintable error>"
+            pass
+        info = _request_error_info(
+            e,
+            endpoint=endpoint,
+            path=path,
+            aid=aid,
+            caller=effective_caller,
+            params=_sanitize_params(meta_params) or _sanitize_params(kwargs.get("params")),
+        )
+        _LAST_API_ERROR = info.get("message")
         try:
             _LAST_API_ERROR_AT = datetime.utcnow().isoformat()
         except Exception:
             _LAST_API_ERROR_AT = None
-
-        info = {
-            "kind": "fb_request_error",
-            "code": code,
-            "subcode": subcode,
-            "message": _LAST_API_ERROR,
-            "endpoint": endpoint,
-            "path": path,
-            "aid": str(aid or ""),
-            "caller": str(effective_caller or ""),
-            "http_status": http_status,
-            "params": _sanitize_params(meta_params) or _sanitize_params(kwargs.get("params")),
-        }
-        try:
-            fbtrace_id = getattr(e, "api_error_trace_id", None)
-            if callable(fbtrace_id):
-                info["fbtrace_id"] = fbtrace_id()
-        except Exception:
-            pass
         _set_last_error_info(info)
-
-        if code == 17:
-            try:
-                base_min = int(os.getenv("FB_RL_BACKOFF_MIN", "10") or 10)
-            except Exception:
-                base_min = 10
-            try:
-                base_max = int(os.getenv("FB_RL_BACKOFF_MAX", "20") or 20)
-            except Exception:
-                base_max = 20
-            jitter_m = random.randint(0, 5)
-            minutes = random.randint(base_min, max(base_min, base_max)) + jitter_m
-            _mark_rate_limited_for(float(minutes) * 60.0)
-
-            try:
-                logging.getLogger(__name__).warning(
-                    "🟦 FB RATE LIMIT endpoint=%s path=%s aid=%s retry_after=%ss fb_code=%s fb_subcode=%s",
-                    str(endpoint),
-                    str(path or ""),
-                    str(aid or ""),
-                    str(rate_limit_retry_after_seconds()),
-                    str(code),
-                    str(subcode),
-                )
-            except Exception:
-                pass
-
-        try:
-            logging.getLogger(__name__).warning(
-                "🟦 FB ERROR endpoint=%s path=%s aid=%s fb_code=%s fb_subcode=%s message=%s",
-                str(endpoint),
-                str(path or ""),
-                str(aid or ""),
-                str(code),
-                str(subcode),
-                str(_LAST_API_ERROR or ""),
-            )
-        except Exception:
-            pass
+        _log_request_error(info)
         return (None, info) if return_error_info else None
     except Exception as e:
         try:
@@ -430,6 +657,145 @@ def safe_api_call(fn, *args, **kwargs):
         return (None, info) if return_error_info else None
 
 
+_BATCH_MAX_SIZE = 50
+
+
+def batch_api_call(
+    requests: List[Dict[str, Any]],
+    *,
+    caller: Optional[str] = None,
+    allow_fb_api: Optional[bool] = None,
+) -> Dict[str, Tuple[Any, Optional[Dict[str, Any]]]]:
+    """
+    Пакетные GET-запросы к Graph API (FacebookAdsApi.new_batch()).
+
+    requests: [{"key": ..., "path": "act_1/campaigns", "params": {...}, "aid": "act_1"}, ...]
+    До 50 запросов уходят одним POST на "/" через safe_api_call (политика,
+    rate limit и лог как у одиночных вызовов).
+
+    Возвращает {key: (json_body | None, error_info | None)}; error_info в том же
+    формате, что и safe_api_call(..., _return_error_info=True).
+    """
+    out: Dict[str, Tuple[Any, Optional[Dict[str, Any]]]] = {}
+    items: List[Dict[str, Any]] = []
+    for r in (requests or []):
+        if not isinstance(r, dict) or not r.get("path"):
+            continue
+        items.append(r)
+
+    def _key(r: Dict[str, Any]) -> str:
+        return str(r.get("key") or r.get("path"))
+
+    def _item_error(r: Dict[str, Any], base: Dict[str, Any]) -> Dict[str, Any]:
+        info = dict(base or {})
+        info["endpoint"] = r.get("endpoint") or r.get("path")
+        info["path"] = r.get("path")
+        info["aid"] = str(r.get("aid") or "")
+        return info
+
+    def _on_success(r: Dict[str, Any], resp: Any) -> None:
+        try:
+            body = resp.json()
+        except Exception:
+            body = None
+        try:
+            _update_usage_from_headers(resp.headers(), r.get("aid"))
+        except Exception:
+            pass
+        out[_key(r)] = (body, None)
+
+    def _on_failure(r: Dict[str, Any], resp: Any) -> None:
+        try:
+            err = resp.error()
+        except Exception:
+            err = None
+        if isinstance(err, FacebookRequestError):
+            info = _request_error_info(
+                err,
+                endpoint=r.get("endpoint") or r.get("path"),
+                path=r.get("path"),
+                aid=r.get("aid"),
+                caller=caller,
+                params=_sanitize_params(r.get("params")),
+            )
+        else:
+            info = _item_error(r, {"kind": "exception", "message": "batch item failed", "caller": str(caller or "")})
+        _set_last_error_info(info)
+        _log_request_error(info)
+        out[_key(r)] = (None, info)
+
+    for start in range(0, len(items), _BATCH_MAX_SIZE):
+        pending = items[start:start + _BATCH_MAX_SIZE]
+        try:
+            api = FacebookAdsApi.get_default_api()
+        except Exception:
+            api = None
+        if api is None:
+            base = {"kind": "exception", "message": "FB API is not initialized", "caller": str(caller or "")}
+            for r in pending:
+                out[_key(r)] = (None, _item_error(r, base))
+            continue
+
+        # Items without a response (FB returns null for them under load) are retried.
+        for _attempt in range(3):
+            if not pending:
+                break
+            batch = api.new_batch()
+            for r in pending:
+                params = dict(r.get("params") or {})
+                if isinstance(params.get("fields"), (list, tuple)):
+                    params["fields"] = ",".join(str(x) for x in params["fields"])
+                batch.add(
+                    "GET",
+                    str(r.get("path")).lstrip("/"),
+                    params=params,
+                    success=(lambda resp, _r=r: _on_success(_r, resp)),
+                    failure=(lambda resp, _r=r: _on_failure(_r, resp)),
+                )
+            _res, info = safe_api_call(
+                batch.execute,
+                _return_error_info=True,
+                _meta={"endpoint": "batch", "path": "/", "params": {"size": len(pending)}},
+                _caller=caller,
+                _allow_fb_api=allow_fb_api,
+            )
+            if info:
+                for r in pending:
+                    out[_key(r)] = (None, _item_error(r, info))
+                pending = []
+                break
+            pending = [r for r in pending if _key(r) not in out]
+
+        for r in pending:
+            out[_key(r)] = (
+                None,
+                _item_error(r, {"kind": "batch_no_response", "message": "no response in batch", "caller": str(caller or "")}),
+            )
+
+    return out
+
+
+def fetch_accounts_info(
+    aids: List[str],
+    fields: Optional[List[str]] = None,
+    *,
+    caller: Optional[str] = None,
+) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+    """Поля рекламных аккаунтов одним batch-запросом: {aid: (info | None, error_info | None)}."""
+    flds = list(fields or ["name", "account_status", "balance"])
+    reqs = [
+        {"key": str(aid), "path": str(aid), "aid": str(aid), "endpoint": "account", "params": {"fields": flds}}
+        for aid in (aids or [])
+        if str(aid or "").strip()
+    ]
+    res = batch_api_call(reqs, caller=caller)
+    out: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]] = {}
+    for aid in (aids or []):
+        body, info = res.get(str(aid), (None, None))
+        out[str(aid)] = (body if isinstance(body, dict) else None, info)
+    return out
+
+
 def fetch_insights_bulk(
     aid: str,
     *,
@@ -452,31 +818,234 @@ def fetch_insights_bulk(
     cache_key = f"insights_bulk:{aid}:{str(level)}:{pkey}:{fields_key}:{extra_key}"
 
     ttl_s = 600.0 if (isinstance(period, str) and period == "today") else 3600.0
-    cached = _cache_get(cache_key, ttl_s=ttl_s)
-    if cached is not None:
-        return list(cached)
 
+    def _load() -> List[Dict[str, Any]]:
+        acc = AdAccount(aid)
+        params = _period_to_params(period)
+        params["level"] = str(level)
+        if params_extra:
+            params.update(params_extra)
+
+        out: List[Dict[str, Any]] = []
+        if _use_async_insights(aid, level=str(level), period=period):
+            rows = fetch_insights_async(aid, fields=fields, params=params)
+            if rows is None:
+                stale = _cache_get(cache_key, ttl_s=24 * 3600.0)
+                return list(stale) if stale is not None else []
+            out = list(rows)
+        else:
+            data = safe_api_call(acc.get_insights, fields=fields, params=params)
+            if not data:
+                stale = _cache_get(cache_key, ttl_s=24 * 3600.0)
+                return list(stale) if stale is not None else []
+            for row in data:
+                out.append(_normalize_insight(row))
+        _ROWS_HINT[(str(aid), str(level))] = int(len(out))
+        _cache_set(cache_key, out)
+        return out
+
+    # Устаревшие инсайты отдаются не дольше 6×TTL (1ч для today, 6ч для прочих).
+    return _swr_fetch(cache_key, _load, ttl_s=ttl_s, max_stale_s=ttl_s * 6)
+
+
+# ========= ASYNC REPORT RUNS =========
+
+_ASYNC_LEVELS = {"adset", "ad"}
+_ASYNC_MIN_DAYS: int = int(os.getenv("FB_ASYNC_INSIGHTS_MIN_DAYS", "14") or 14)
+_ASYNC_MIN_ROWS: int = int(os.getenv("FB_ASYNC_INSIGHTS_MIN_ROWS", "500") or 500)
+_ASYNC_TIMEOUT_S: float = float(os.getenv("FB_ASYNC_INSIGHTS_TIMEOUT_S", "300") or 300)
+_ASYNC_POLL_MAX_S: float = float(os.getenv("FB_ASYNC_INSIGHTS_POLL_MAX_S", "15") or 15)
+
+# Last result size per (aid, level): used as the row-count estimate for the next call.
+_ROWS_HINT: Dict[Tuple[str, str], int] = {}
+
+
+def _period_days(period: Any) -> int:
+    if isinstance(period, dict):
+        try:
+            since = datetime.strptime(str(period.get("since")), "%Y-%m-%d")
+            until = datetime.strptime(str(period.get("until")), "%Y-%m-%d")
+            return max(1, (until - since).days + 1)
+        except Exception:
+            return 1
+    p = str(period or "")
+    if p in {"this_month", "last_month"}:
+        return 31
+    if p in {"this_year", "last_year", "maximum"}:
+        return 365
+    if p.startswith("last_") and p.endswith("d"):
+        try:
+            return max(1, int(p[len("last_"):-1]))
+        except Exception:
+            return 1
+    if p.startswith("last_") and p.endswith("_days"):
+        try:
+            return max(1, int(p[len("last_"):-len("_days")]))
+        except Exception:
+            return 1
+    return 1
+
+
+def _use_async_insights(aid: str, *, level: str, period: Any) -> bool:
+    if str(level) not in _ASYNC_LEVELS:
+        return False
+    if _ASYNC_MIN_DAYS > 0 and _period_days(period) >= _ASYNC_MIN_DAYS:
+        return True
+    hint = _ROWS_HINT.get((str(aid), str(level)))
+    return bool(_ASYNC_MIN_ROWS > 0 and hint is not None and hint >= _ASYNC_MIN_ROWS)
+
+
+def iter_insights_async(
+    aid: str,
+    *,
+    fields: List[str],
+    params: Dict[str, Any],
+    caller: Optional[str] = None,
+):
+    """
+    Асинхронный отчёт (is_async=True): создаёт AdReportRun, опрашивает статус
+    с экспоненциальным backoff и отдаёт строки результата постранично.
+
+    Бросает RuntimeError, если отчёт не удалось создать/дождаться.
+    """
     acc = AdAccount(aid)
-    params = _period_to_params(period)
-    params["level"] = str(level)
-    if params_extra:
-        params.update(params_extra)
-    data = safe_api_call(acc.get_insights, fields=fields, params=params)
-    if not data:
-        stale = _cache_get(cache_key, ttl_s=24 * 3600.0)
-        return list(stale) if stale is not None else []
-    out: List[Dict[str, Any]] = []
-    for row in data:
-        out.append(_normalize_insight(row))
-    _cache_set(cache_key, out)
-    return out
+    meta = {"endpoint": "insights/async", "aid": str(aid), "params": params}
+    job = safe_api_call(acc.get_insights, fields=fields, params=params, is_async=True, _meta=meta, _caller=caller)
+    if job is None:
+        raise RuntimeError("async insights: report run was not created")
+
+    started = time.time()
+    delay = 1.0
+    status = ""
+    while True:
+        time.sleep(delay)
+        polled = safe_api_call(
+            job.api_get,
+            fields=["async_status", "async_percent_completion"],
+            _meta={"endpoint": "insights/async/status", "aid": str(aid)},
+            _caller=caller,
+        )
+        if polled is not None:
+            try:
+                status = str(polled.get("async_status") or "")
+            except Exception:
+                status = ""
+        if status == "Job Completed":
+            break
+        if status in {"Job Failed", "Job Skipped"}:
+            raise RuntimeError(f"async insights: {status}")
+        if (time.time() - started) > float(_ASYNC_TIMEOUT_S):
+            raise RuntimeError("async insights: timeout")
+        delay = min(float(_ASYNC_POLL_MAX_S), delay * 2.0)
+
+    result = safe_api_call(
+        job.get_result,
+        params={"limit": 500},
+        _meta={"endpoint": "insights/async/result", "aid": str(aid)},
+        _caller=caller,
+    )
+    if result is None:
+        raise RuntimeError("async insights: result fetch failed")
+    # Cursor loads further pages lazily while iterating.
+    for row in result:
+        yield _normalize_insight(row)
+
 
+def fetch_insights_async(
+    aid: str,
+    *,
+    fields: List[str],
+    params: Dict[str, Any],
+    caller: Optional[str] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """Обёртка над iter_insights_async: список строк или None при ошибке."""
+    try:
+        return list(iter_insights_async(aid, fields=fields, params=params, caller=caller))
+    except Exception as e:
+        try:
+            logging.getLogger(__name__).warning(
+                "🟦 FB ASYNC INSIGHTS FAILED aid=%s level=%s message=%s",
+                str(aid),
+                str((params or {}).get("level") or ""),
+                str(e),
+            )
+        except Exception:
+            pass
+        return None
 
-_CATALOG_CACHE: Dict[str, Dict[str, Any]] = {}
+
+# Кэш каталога/инсайтов в два уровня:
+# L1 — словарь в памяти процесса (LRU, не больше FB_CATALOG_CACHE_MAX записей);
+# L2 — документ "fb_catalog_cache" во встроенном SQLite (services.sqlite_store),
+# по строке на ключ {"ts", "value"}. L2 загружается в L1 при первом обращении
+# после старта, поэтому рестарт не даёт всплеска запросов к Graph API.
+# В L2 пишутся только каталоги (campaigns/adsets/ads): инсайты объёмные,
+# живут минуты (TTL 10 мин/1 ч), и синхронная запись строки в SQLite на
+# каждое чтение из FB стоила бы больше, чем повторный запрос после рестарта.
+# Записи старше _CATALOG_STALE_S (горизонт stale-фолбэка) не загружаются и
+# удаляются при вытеснении.
+_CATALOG_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_CATALOG_LOCK = threading.Lock()
+_CATALOG_DOC = "fb_catalog_cache"
+_CATALOG_STALE_S = 24 * 3600.0
+_CATALOG_WARM = False
+_CATALOG_L1_ONLY_PREFIXES = ("insights_bulk:",)
+
+try:
+    _CATALOG_MAX = max(1, int(os.getenv("FB_CATALOG_CACHE_MAX", "2000") or 2000))
+except Exception:
+    _CATALOG_MAX = 2000
+
+
+def warm_catalog_cache() -> None:
+    """Однократно поднимает L2 (SQLite) в L1: самые свежие записи, не больше _CATALOG_MAX."""
+    global _CATALOG_WARM
+    if _CATALOG_WARM:
+        return
+    with _CATALOG_LOCK:
+        if _CATALOG_WARM:
+            return
+        _CATALOG_WARM = True
+        try:
+            stored = load_doc(_CATALOG_DOC, None)
+        except Exception:
+            stored = {}
+        now = time.time()
+        fresh = []
+        expired = []
+        for k, it in stored.items():
+            try:
+                ts = float((it or {}).get("ts") or 0.0)
+            except Exception:
+                ts = 0.0
+            if ts and (now - ts) <= _CATALOG_STALE_S and _cache_persisted(k):
+                fresh.append((ts, k, it))
+            else:
+                expired.append(k)
+        fresh.sort(key=lambda x: x[0])
+        expired.extend(k for _ts, k, _it in fresh[:-_CATALOG_MAX])
+        for _ts, k, it in fresh[-_CATALOG_MAX:]:
+            if k not in _CATALOG_CACHE:
+                _CATALOG_CACHE[k] = it
+        for k in expired:
+            try:
+                delete_row(_CATALOG_DOC, None, k)
+            except Exception:
+                pass
+        try:
+            logging.getLogger(__name__).info(
+                "fb_catalog_cache_warm loaded=%s dropped=%s", str(len(_CATALOG_CACHE)), str(len(expired))
+            )
+        except Exception:
+            pass
 
 
 def _cache_get(key: str, ttl_s: float) -> Any:
-    it = _CATALOG_CACHE.get(key) or {}
+    warm_catalog_cache()
+    with _CATALOG_LOCK:
+        it = _CATALOG_CACHE.get(key) or {}
+        if it:
+            _CATALOG_CACHE.move_to_end(key)
     try:
         ts = float(it.get("ts") or 0.0)
     except Exception:
@@ -488,8 +1057,555 @@ def _cache_get(key: str, ttl_s: float) -> Any:
     return it.get("value")
 
 
+def _cache_persisted(key: str) -> bool:
+    return not str(key).startswith(_CATALOG_L1_ONLY_PREFIXES)
+
+
 def _cache_set(key: str, value: Any) -> None:
-    _CATALOG_CACHE[key] = {"ts": time.time(), "value": value}
+    warm_catalog_cache()
+    it = {"ts": time.time(), "value": value}
+    evicted: List[str] = []
+    with _CATALOG_LOCK:
+        _CATALOG_CACHE[key] = it
+        _CATALOG_CACHE.move_to_end(key)
+        while len(_CATALOG_CACHE) > _CATALOG_MAX:
+            evicted.append(_CATALOG_CACHE.popitem(last=False)[0])
+    evicted = [k for k in evicted if _cache_persisted(k)]
+    if not evicted and not _cache_persisted(key):
+        return
+    try:
+        if _cache_persisted(key):
+            upsert_row(_CATALOG_DOC, None, key, it)
+        for k in evicted:
+            delete_row(_CATALOG_DOC, None, k)
+    except Exception as e:
+        logging.getLogger(__name__).warning("fb_catalog_cache_l2_error key=%s err=%s", str(key), str(e))
+
+
+# ========= SINGLE-FLIGHT =========
+#
+# Одинаковые одновременные запросы (тот же ключ кэша) выполняются один раз:
+# первый вызвавший ("лидер") делает запрос, остальные ждут его Future и
+# получают тот же результат. Запросы делятся только между вызывающими с
+# одинаковым решением политики allow/deny. Если у лидера запрос был
+# заблокирован (политика, rate limit), упал с ошибкой FB или исключением,
+# его результат ([]/stale) не раздаётся — ожидающие выполняют fn() сами.
+# Ожидание ограничено FB_SINGLE_FLIGHT_WAIT_S: зависший лидер (например,
+# async-отчёт с опросом до 300 с) не должен занимать потоки пула FB I/O,
+# после таймаута ожидающий выполняет fn() сам.
+try:
+    _SF_WAIT_S = max(0.1, float(os.getenv("FB_SINGLE_FLIGHT_WAIT_S", "30") or 30))
+except Exception:
+    _SF_WAIT_S = 30.0
+
+_INFLIGHT: Dict[Tuple[str, bool], Tuple[Future, int]] = {}
+_INFLIGHT_LOCK = threading.Lock()
+_SF_STATS: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+_SF_STATS_MAX = 500
+_SF_RETRY = object()
+# Ошибки safe_api_call внутри fn() лидера (см. _set_last_error_info).
+_SF_FAILURES: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "fb_single_flight_failures", default=None
+)
+
+
+def _sf_count(key: str, field: str) -> None:
+    st = _SF_STATS.get(key)
+    if st is None:
+        st = {"calls": 0, "joined": 0, "errors": 0, "unshared": 0, "timeouts": 0}
+        _SF_STATS[key] = st
+        while len(_SF_STATS) > _SF_STATS_MAX:
+            _SF_STATS.popitem(last=False)
+    st[field] = int(st.get(field) or 0) + 1
+
+
+def _single_flight(key: str, fn: Any) -> Any:
+    key = str(key)
+    flight = (key, _fb_calls_allowed_here())
+    me = threading.get_ident()
+    with _INFLIGHT_LOCK:
+        it = _INFLIGHT.get(flight)
+        if it is not None and it[1] != me:
+            _sf_count(key, "joined")
+            fut = it[0]
+            leader = False
+        elif it is not None:
+            # Повторный вход из потока-лидера: ждать самого себя нельзя.
+            fut = None
+            leader = False
+        else:
+            fut = Future()
+            _INFLIGHT[flight] = (fut, me)
+            _sf_count(key, "calls")
+            leader = True
+    if fut is None:
+        return fn()
+    if not leader:
+        try:
+            res = fut.result(timeout=_SF_WAIT_S)
+        except FutureTimeout:
+            with _INFLIGHT_LOCK:
+                _sf_count(key, "timeouts")
+            return fn()
+        return fn() if res is _SF_RETRY else res
+
+    outer = _SF_FAILURES.get()
+    failures: List[Dict[str, Any]] = []
+    token = _SF_FAILURES.set(failures)
+    try:
+        res = fn()
+    except BaseException:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(flight, None)
+            _sf_count(key, "errors")
+        fut.set_result(_SF_RETRY)
+        raise
+    finally:
+        _SF_FAILURES.reset(token)
+        if outer is not None:
+            outer.extend(failures)
+    with _INFLIGHT_LOCK:
+        _INFLIGHT.pop(flight, None)
+        if failures:
+            _sf_count(key, "unshared")
+    fut.set_result(_SF_RETRY if failures else res)
+    return res
+
+
+def single_flight_stats(limit: int = 50) -> List[Dict[str, Any]]:
+    """Счётчики дедупликации по ключам: calls — реальные запросы, joined —
+    вызовы, дождавшиеся чужого запроса. Сначала ключи с наибольшим joined."""
+    with _INFLIGHT_LOCK:
+        rows = [{"key": k, **v} for k, v in _SF_STATS.items()]
+    rows.sort(key=lambda x: (int(x.get("joined") or 0), int(x.get("calls") or 0)), reverse=True)
+    return rows[: max(1, int(limit))]
+
+
+# ========= FB I/O EXECUTOR =========
+#
+# Синхронный SDK (api_get/get_insights/api_update, batch) блокирует поток.
+# Async-обработчики не вызывают его напрямую, а уводят в отдельный пул
+# FB_IO_CONCURRENCY потоков: event loop продолжает polling и другие чаты.
+# Контекст (политика allow/deny) переносится в поток.
+try:
+    FB_IO_CONCURRENCY = max(1, int(os.getenv("FB_IO_CONCURRENCY", "4") or 4))
+except Exception:
+    FB_IO_CONCURRENCY = 4
+
+_FB_IO_EXECUTOR = ThreadPoolExecutor(max_workers=FB_IO_CONCURRENCY, thread_name_prefix="fb_io")
+
+
+async def run_fb_io(fn: Any, *args: Any, **kwargs: Any) -> Any:
+    """await-обёртка: fn(*args, **kwargs) в FB I/O пуле с текущей политикой."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_FB_IO_EXECUTOR, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+async def fb_call(fn: Any, *args: Any, **kwargs: Any) -> Any:
+    """await-версия safe_api_call (те же аргументы, включая _caller/_aid/...)."""
+    return await run_fb_io(safe_api_call, fn, *args, **kwargs)
+
+
+# ========= STALE-WHILE-REVALIDATE =========
+#
+# Если запись кэша старше TTL, но не старше max_stale_s, вызывающий сразу
+# получает её, а обновление уходит в фоновый пул (FB_SWR_CONCURRENCY потоков,
+# те же safe_api_call/rate limiter, single-flight по ключу кэша).
+# Результат — CachedRows: list с метаданными свежести для UI.
+try:
+    _SWR_CONCURRENCY = max(1, int(os.getenv("FB_SWR_CONCURRENCY", "2") or 2))
+except Exception:
+    _SWR_CONCURRENCY = 2
+
+_SWR_EXECUTOR = ThreadPoolExecutor(max_workers=_SWR_CONCURRENCY, thread_name_prefix="fb_swr")
+_SWR_PENDING: set = set()
+_SWR_LOCK = threading.Lock()
+
+
+class CachedRows(list):
+    """Список строк из кэша: fetched_at (unix ts, 0 — неизвестно),
+    stale (отдана устаревшая запись), refreshing (идёт фоновое обновление)."""
+
+    fetched_at: float = 0.0
+    stale: bool = False
+    refreshing: bool = False
+
+    def age_s(self) -> Optional[float]:
+        if not self.fetched_at:
+            return None
+        return max(0.0, time.time() - float(self.fetched_at))
+
+
+def _cached_rows(value: Any, ts: float, *, stale: bool = False, refreshing: bool = False) -> CachedRows:
+    out = CachedRows(value or [])
+    out.fetched_at = float(ts or 0.0)
+    out.stale = bool(stale)
+    out.refreshing = bool(refreshing)
+    return out
+
+
+def _cache_entry(key: str) -> Tuple[Any, float]:
+    warm_catalog_cache()
+    with _CATALOG_LOCK:
+        it = _CATALOG_CACHE.get(key) or {}
+        if it:
+            _CATALOG_CACHE.move_to_end(key)
+    try:
+        ts = float(it.get("ts") or 0.0)
+    except Exception:
+        ts = 0.0
+    return (it.get("value") if ts else None), ts
+
+
+def _fb_calls_allowed_here() -> bool:
+    """Разрешил бы safe_api_call запрос из текущего контекста (без явного _allow_fb_api)."""
+    policy = _FB_POLICY.get()
+    if policy.explicit is not None:
+        return bool(policy.explicit)
+    if int(policy.allow_depth or 0) > 0:
+        return True
+    if int(policy.deny_depth or 0) > 0:
+        return False
+    return not _FB_API_DEFAULT_DENY
+
+
+def _swr_schedule(key: str, loader: Any, caller: str) -> bool:
+    with _SWR_LOCK:
+        if key in _SWR_PENDING:
+            return True
+        _SWR_PENDING.add(key)
+
+    def _run() -> None:
+        try:
+            with _explicit_fb_policy(True):
+                _single_flight(key, loader)
+        except Exception as e:
+            logging.getLogger(__name__).warning("fb_swr_refresh_error key=%s caller=%s err=%s", str(key), str(caller), str(e))
+        finally:
+            with _SWR_LOCK:
+                _SWR_PENDING.discard(key)
+
+    try:
+        submit_with_policy(_SWR_EXECUTOR, _run)
+    except Exception:
+        with _SWR_LOCK:
+            _SWR_PENDING.discard(key)
+        return False
+    return True
+
+
+def _swr_fetch(
+    key: str,
+    loader: Any,
+    *,
+    ttl_s: float,
+    max_stale_s: float,
+    force: bool = False,
+) -> CachedRows:
+    """Кэш с stale-while-revalidate; промах (или force) — синхронный single-flight запрос."""
+    if not force:
+        value, ts = _cache_entry(key)
+        if value is not None:
+            age = time.time() - ts
+            if age <= float(ttl_s):
+                return _cached_rows(value, ts)
+            if age <= float(max_stale_s) and _fb_calls_allowed_here() and not is_rate_limited_now():
+                caller = str(_FB_POLICY.get().allow_reason or "")
+                return _cached_rows(value, ts, stale=True, refreshing=_swr_schedule(key, loader, caller))
+    res = _single_flight(key, loader)
+    _value, ts = _cache_entry(key)
+    return _cached_rows(res, ts, stale=bool(ts) and (time.time() - ts) > float(ttl_s))
+
+
+_CATALOG_FIELDS: Dict[str, List[str]] = {
+    "campaigns": ["id", "name", "status", "effective_status"],
+    "adsets": ["id", "name", "daily_budget", "lifetime_budget", "status", "effective_status", "campaign_id"],
+    "ads": ["id", "name", "adset_id", "creative", "status", "effective_status"],
+}
+
+
+def _catalog_row(kind: str, row: Any) -> Dict[str, Any]:
+    if kind == "adsets":
+        return {
+            "id": row.get("id"),
+            "name": row.get("name"),
+            "campaign_id": row.get("campaign_id"),
+            "daily_budget": float(row.get("daily_budget", 0)) / 100.0,
+            "lifetime_budget": (float(row.get("lifetime_budget", 0)) / 100.0) if row.get("lifetime_budget") is not None else None,
+            "status": row.get("status"),
+            "effective_status": row.get("effective_status"),
+        }
+    if kind == "ads":
+        creative_id = None
+        try:
+            c = row.get("creative")
+            if c and hasattr(c, "get"):
+                creative_id = c.get("id")
+        except Exception:
+            pass
+        return {
+            "id": row.get("id"),
+            "name": row.get("name"),
+            "adset_id": row.get("adset_id"),
+            "creative_id": creative_id,
+            "status": row.get("status"),
+            "effective_status": row.get("effective_status"),
+        }
+    return {
+        "id": row.get("id"),
+        "name": row.get("name"),
+        "status": row.get("status"),
+        "effective_status": row.get("effective_status"),
+    }
+
+
+def _catalog_rows(kind: str, data: Any) -> List[Dict[str, Any]]:
+    out = []
+    for row in (data or []):
+        try:
+            out.append(_catalog_row(kind, row))
+        except Exception:
+            continue
+    return out
+
+
+# ========= ИНКРЕМЕНТАЛЬНЫЙ СИНК КАТАЛОГА =========
+#
+# Каталог аккаунта (строки в _CATALOG_CACHE, персистентно в SQLite) обновляется
+# дельтами: запрашиваются только объекты с updated_time > watermark, они
+# сливаются в каталог по id (DELETED/ARCHIVED — удаляются). Раз в
+# FB_CATALOG_FULL_SYNC_S (и когда каталога/водяной отметки нет) делается полная
+# выгрузка — она ловит удаления, которые дельта не возвращает.
+# Унаследованный effective_status (CAMPAIGN_PAUSED, ADSET_PAUSED, биллинг-холд
+# аккаунта) не меняет updated_time дочернего объекта, поэтому вместе с каждой
+# дельтой запрашивается дешёвый список id+effective_status всех объектов.
+# Водяные отметки: документ "fb_catalog_sync", строка "<kind>:<aid>".
+_CATALOG_SYNC_DOC = "fb_catalog_sync"
+_CATALOG_DELTA_SKEW_S = 120.0
+_CATALOG_GONE_STATUSES = {"DELETED", "ARCHIVED"}
+_CATALOG_GETTERS = {"campaigns": "get_campaigns", "adsets": "get_ad_sets", "ads": "get_ads"}
+_CATALOG_STATUS_FIELDS = ["id", "effective_status"]
+
+try:
+    _CATALOG_FULL_SYNC_S = float(os.getenv("FB_CATALOG_FULL_SYNC_S", "86400") or 86400)
+except Exception:
+    _CATALOG_FULL_SYNC_S = 86400.0
+
+
+def _catalog_sync_params(kind: str, aid: str) -> Tuple[bool, Dict[str, Any]]:
+    """(delta?, params) для следующей синхронизации каталога kind аккаунта aid."""
+    params: Dict[str, Any] = {"limit": 500}
+    key = f"{kind}:{aid}"
+    try:
+        state = get_row(_CATALOG_SYNC_DOC, None, key) or {}
+        wm = float(state.get("watermark") or 0.0)
+        full_at = float(state.get("full_at") or 0.0)
+    except Exception:
+        return False, params
+    prev, _ts = _cache_entry(key)
+    if prev is None or not wm or (time.time() - full_at) > float(_CATALOG_FULL_SYNC_S):
+        return False, params
+    params["filtering"] = [
+        {"field": "updated_time", "operator": "GREATER_THAN", "value": int(wm - _CATALOG_DELTA_SKEW_S)}
+    ]
+    return True, params
+
+
+def _catalog_status_map(data: Any) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for row in (data or []):
+        try:
+            rid = str(row.get("id") or "")
+            if rid:
+                out[rid] = str(row.get("effective_status") or "")
+        except Exception:
+            continue
+    return out
+
+
+def _catalog_apply(
+    kind: str,
+    aid: str,
+    data: Any,
+    *,
+    delta: bool,
+    started_at: float,
+    statuses: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, Any]]:
+    """Кладёт результат синка в кэш (дельта — слиянием по id) и сдвигает watermark.
+
+    statuses — {id: effective_status} всех объектов (для дельты): обновляет
+    унаследованные статусы строк, которых нет в самой дельте.
+    """
+    key = f"{kind}:{aid}"
+    rows = _catalog_rows(kind, data)
+    if delta:
+        prev, _ts = _cache_entry(key)
+        merged: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        for r in (prev or []):
+            if isinstance(r, dict) and r.get("id"):
+                merged[str(r.get("id"))] = r
+        for r in rows:
+            rid = str(r.get("id") or "")
+            if not rid:
+                continue
+            if str(r.get("effective_status") or "").upper() in _CATALOG_GONE_STATUSES:
+                merged.pop(rid, None)
+            else:
+                merged[rid] = r
+        fresh = {str(r.get("id") or "") for r in rows}
+        for rid, st in (statuses or {}).items():
+            cur = merged.get(rid)
+            if cur is None or rid in fresh or not st or cur.get("effective_status") == st:
+                continue
+            if st.upper() in _CATALOG_GONE_STATUSES:
+                merged.pop(rid, None)
+            else:
+                merged[rid] = dict(cur, effective_status=st)
+        out = list(merged.values())
+    else:
+        out = rows
+    _cache_set(key, out)
+    try:
+        state = get_row(_CATALOG_SYNC_DOC, None, key) or {}
+        state["watermark"] = float(started_at)
+        if not delta:
+            state["full_at"] = float(started_at)
+        state["rows"] = int(len(out))
+        state["last_fetched_rows"] = int(len(rows))
+        if statuses is not None:
+            state["last_status_rows"] = int(len(statuses))
+        upsert_row(_CATALOG_SYNC_DOC, None, key, state)
+    except Exception:
+        pass
+    try:
+        logging.getLogger(__name__).info(
+            "🟦 FB CATALOG SYNC kind=%s aid=%s mode=%s fetched=%s total=%s",
+            str(kind),
+            str(aid),
+            "delta" if delta else "full",
+            str(int(len(rows))),
+            str(int(len(out))),
+        )
+    except Exception:
+        pass
+    return out
+
+
+def _catalog_load(kind: str, aid: str, *, caller: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Синхронизирует каталог (дельта или полная выгрузка); при ошибке — stale-фолбэк."""
+    key = f"{kind}:{aid}"
+    started_at = time.time()
+    delta, params = _catalog_sync_params(kind, aid)
+    acc = AdAccount(aid)
+    getter = getattr(acc, _CATALOG_GETTERS[kind])
+    data, info = safe_api_call(
+        getter,
+        fields=list(_CATALOG_FIELDS[kind]),
+        params=params,
+        _meta={"endpoint": kind, "aid": str(aid), "params": params},
+        _caller=caller,
+        _return_error_info=True,
+    )
+    # Пустой ответ полной выгрузки, как и раньше, считаем сбоем; пустая дельта — норма.
+    if info is not None or data is None or (not delta and not data):
+        stale = _cache_get(key, ttl_s=24 * 3600.0)
+        return list(stale) if stale is not None else []
+    statuses = None
+    if delta:
+        status_params: Dict[str, Any] = {"limit": 500}
+        st_data, st_info = safe_api_call(
+            getter,
+            fields=list(_CATALOG_STATUS_FIELDS),
+            params=status_params,
+            _meta={"endpoint": f"{kind}_status", "aid": str(aid), "params": status_params},
+            _caller=caller,
+            _return_error_info=True,
+        )
+        if st_info is None and st_data is not None:
+            statuses = _catalog_status_map(st_data)
+    return _catalog_apply(kind, aid, data, delta=delta, started_at=started_at, statuses=statuses)
+
+
+def prefetch_catalogs(
+    aids: List[str],
+    kinds: Tuple[str, ...] = ("campaigns", "adsets", "ads"),
+    *,
+    force: bool = False,
+    caller: Optional[str] = None,
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Прогревает кэш fetch_campaigns/fetch_adsets/fetch_ads для набора аккаунтов
+    одним batch-запросом (по 50 запросов на HTTP round trip).
+
+    Ответы, у которых есть следующая страница, дочитываются обычным fetch_*.
+    Возвращает {"<kind>:<aid>": error_info | None}.
+    """
+    fetchers = {"campaigns": fetch_campaigns, "adsets": fetch_adsets, "ads": fetch_ads}
+    reqs: List[Dict[str, Any]] = []
+    for aid in (aids or []):
+        if not str(aid or "").strip():
+            continue
+        for kind in (kinds or ()):
+            if kind not in _CATALOG_FIELDS:
+                continue
+            cache_key = f"{kind}:{aid}"
+            if (not force) and _cache_get(cache_key, ttl_s=21600.0) is not None:
+                continue
+            delta, params = _catalog_sync_params(kind, str(aid))
+            params["fields"] = list(_CATALOG_FIELDS[kind])
+            reqs.append(
+                {
+                    "key": cache_key,
+                    "path": f"{aid}/{kind}",
+                    "aid": str(aid),
+                    "endpoint": kind,
+                    "params": params,
+                    "delta": delta,
+                }
+            )
+            if delta:
+                reqs.append(
+                    {
+                        "key": f"{cache_key}#status",
+                        "path": f"{aid}/{kind}",
+                        "aid": str(aid),
+                        "endpoint": f"{kind}_status",
+                        "params": {"limit": 500, "fields": list(_CATALOG_STATUS_FIELDS)},
+                        "status_of": cache_key,
+                    }
+                )
+
+    started_at = time.time()
+    res = batch_api_call(reqs, caller=caller)
+
+    def _has_next(body: Dict[str, Any]) -> bool:
+        return bool(((body.get("paging") or {}) if isinstance(body.get("paging"), dict) else {}).get("next"))
+
+    out: Dict[str, Optional[Dict[str, Any]]] = {}
+    for r in reqs:
+        if r.get("status_of"):
+            continue
+        cache_key = str(r["key"])
+        kind, aid = cache_key.split(":", 1)
+        body, info = res.get(cache_key, (None, None))
+        out[cache_key] = info
+        if info or not isinstance(body, dict):
+            continue
+        statuses = None
+        if r.get("delta"):
+            st_body, st_info = res.get(f"{cache_key}#status", (None, None))
+            if st_info or not isinstance(st_body, dict) or _has_next(st_body):
+                # Неполный список статусов — дочитываем обычным синком.
+                fetchers[kind](aid, force=True, caller=caller)
+                continue
+            statuses = _catalog_status_map(st_body.get("data") or [])
+        if _has_next(body):
+            fetchers[kind](aid, force=True, caller=caller)
+            continue
+        _catalog_apply(kind, aid, body.get("data") or [], delta=bool(r.get("delta")), started_at=started_at, statuses=statuses)
+    return out
 
 
 # ========= ВСПОМОГАТЕЛЬНЫЕ =========
@@ -593,7 +1709,7 @@ def fetch_insights(aid: str, period: Any) -> Optional[Dict[str, Any]]:
 
 # ========= КАМПАНИИ =========
 
-def fetch_campaigns(aid: str, force: bool = False) -> List[Dict[str, Any]]:
+def fetch_campaigns(aid: str, force: bool = False, caller: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Возвращает список кампаний аккаунта:
     [
@@ -602,35 +1718,11 @@ def fetch_campaigns(aid: str, force: bool = False) -> List[Dict[str, Any]]:
     ]
     """
     cache_key = f"campaigns:{aid}"
-    if not bool(force):
-        cached = _cache_get(cache_key, ttl_s=21600.0)
-        if cached is not None:
-            return list(cached)
 
-    acc = AdAccount(aid)
-    data = safe_api_call(
-        acc.get_campaigns,
-        fields=["id", "name", "status", "effective_status"],
-    )
+    def _load() -> List[Dict[str, Any]]:
+        return _catalog_load("campaigns", aid, caller=caller)
 
-    if not data:
-        stale = _cache_get(cache_key, ttl_s=24 * 3600.0)
-        return list(stale) if stale is not None else []
-
-    out = []
-    for row in data:
-        try:
-            out.append({
-                "id": row.get("id"),
-                "name": row.get("name"),
-                "status": row.get("status"),
-                "effective_status": row.get("effective_status"),
-            })
-        except Exception:
-            continue
-
-    _cache_set(cache_key, out)
-    return out
+    return _swr_fetch(cache_key, _load, ttl_s=21600.0, max_stale_s=_CATALOG_STALE_S, force=bool(force))
 
 
 # ========= AD MANAGEMENT =========
@@ -699,7 +1791,7 @@ def pause_ad(ad_id: str) -> Dict[str, Any]:
 
 # ========= ADSETS =========
 
-def fetch_adsets(aid: str, force: bool = False) -> List[Dict[str, Any]]:
+def fetch_adsets(aid: str, force: bool = False, caller: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Возвращает список адсетов в аккаунте:
     [
@@ -713,43 +1805,16 @@ def fetch_adsets(aid: str, force: bool = False) -> List[Dict[str, Any]]:
     ]
     """
     cache_key = f"adsets:{aid}"
-    if not bool(force):
-        cached = _cache_get(cache_key, ttl_s=21600.0)
-        if cached is not None:
-            return list(cached)
 
-    acc = AdAccount(aid)
-    data = safe_api_call(
-        acc.get_ad_sets,
-        fields=["id", "name", "daily_budget", "lifetime_budget", "status", "effective_status", "campaign_id"],
-    )
+    def _load() -> List[Dict[str, Any]]:
+        return _catalog_load("adsets", aid, caller=caller)
 
-    if not data:
-        stale = _cache_get(cache_key, ttl_s=24 * 3600.0)
-        return list(stale) if stale is not None else []
-
-    out = []
-    for row in data:
-        try:
-            out.append({
-                "id": row.get("id"),
-                "name": row.get("name"),
-                "campaign_id": row.get("campaign_id"),
-                "daily_budget": float(row.get("daily_budget", 0)) / 100.0,
-                "lifetime_budget": (float(row.get("lifetime_budget", 0)) / 100.0) if row.get("lifetime_budget") is not None else None,
-                "status": row.get("status"),
-                "effective_status": row.get("effective_status"),
-            })
-        except Exception:
-            continue
-
-    _cache_set(cache_key, out)
-    return out
+    return _swr_fetch(cache_key, _load, ttl_s=21600.0, max_stale_s=_CATALOG_STALE_S, force=bool(force))
 
 
 # ========= AD CREATIVES =========
 
-def fetch_ads(aid: str, force: bool = False) -> List[Dict[str, Any]]:
+def fetch_ads(aid: str, force: bool = False, caller: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Возвращает объявления:
     [
@@ -763,42 +1828,8 @@ def fetch_ads(aid: str, force: bool = False) -> List[Dict[str, Any]]:
     ]
     """
     cache_key = f"ads:{aid}"
-    if not bool(force):
-        cached = _cache_get(cache_key, ttl_s=21600.0)
-        if cached is not None:
-            return list(cached)
-
-    acc = AdAccount(aid)
-    data = safe_api_call(
-        acc.get_ads,
-        fields=["id", "name", "adset_id", "creative", "status", "effective_status"],
-    )
-
-    if not data:
-        stale = _cache_get(cache_key, ttl_s=24 * 3600.0)
-        return list(stale) if stale is not None else []
-
-    out = []
-    for row in data:
-        creative_id = None
-        try:
-            c = row.get("creative")
-            if c and hasattr(c, "get"):
-                creative_id = c.get("id")
-        except Exception:
-            pass
 
-        try:
-            out.append({
-                "id": row.get("id"),
-                "name": row.get("name"),
-                "adset_id": row.get("adset_id"),
-                "creative_id": creative_id,
-                "status": row.get("status"),
-                "effective_status": row.get("effective_status"),
-            })
-        except Exception:
-            continue
+    def _load() -> List[Dict[str, Any]]:
+        return _catalog_load("ads", aid, caller=caller)
 
-    _cache_set(cache_key, out)
-    return out
+    return _swr_fetch(cache_key, _load, ttl_s=21600.0, max_stale_s=_CATALOG_STALE_S, force=bool(force))
@@ -1,25 +1,38 @@
 import os
+import copy
 import json
+import logging
+import mmap
 import shutil
+import struct
+import threading
+from array import array
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
 from fb_report.constants import ALMATY_TZ, DATA_DIR
 
-from services.analytics import count_leads_from_actions
+from services.analytics import row_derived_metrics
+from services.data_generation import bump_generation, get_generation
+from services.entity_index import index_snapshot
+from services.sqlite_store import get_row, load_doc, upsert_row
 
 
 _BASE_DIR = os.path.join(DATA_DIR, "heatmap_snapshots")
 
 
-def _atomic_write_json(path: str, obj: Any) -> None:
+def _atomic_write_json(path: str, obj: Any, *, compact: bool = False) -> None:
     tmp = f"{path}.tmp"
     bak = f"{path}.bak"
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
     with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+        if compact:
+            json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+        else:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
         f.flush()
         os.fsync(f.fileno())
 
@@ -32,32 +45,293 @@ def _atomic_write_json(path: str, obj: Any) -> None:
     os.replace(tmp, path)
 
 
+# Day-partitioned store: heatmap_snapshots/<aid>/<date>.json holds every hour
+# of that account-day. "hours" is the header index (snapshot fields without
+# rows + row_start/row_count into the table); "rows" is a single table whose
+# cell order is given by "columns". Legacy per-hour files
+# (<aid>/<date>/<hh>/snapshot.json) are still read as a fallback.
+#
+# v2 dictionary-encodes the rows: the repeated adset/campaign ids, names and
+# status live once in "dims" (cell "dim" is an index into it), and "actions"
+# is a flat [type_id, value, ...] array over the day's "action_types" list.
+# v1 files (plain columns, actions as dicts) are still read; a day is
+# rewritten as v2 on its next save.
+DAY_FORMAT = "heatmap_day_v2"
+_DAY_FORMATS = {"heatmap_day_v1", DAY_FORMAT}
+
+DIM_COLUMNS: List[str] = [
+    "adset_id",
+    "campaign_id",
+    "name",
+    "campaign_name",
+    "adset_status",
+]
+
+ROW_COLUMNS: List[str] = [
+    "hour",
+    "dim",
+    "spend",
+    "msgs",
+    "leads",
+    "total",
+    "results",
+    "impressions",
+    "clicks",
+    "started_conversations",
+    "website_submit_applications",
+    "cpl",
+    "derived_schema",
+    "actions",
+    "extra",
+]
+
+_DAY_LOCKS: Dict[str, threading.Lock] = {}
+_DAY_LOCKS_GUARD = threading.Lock()
+
+
+def _day_lock(path: str) -> threading.Lock:
+    with _DAY_LOCKS_GUARD:
+        lk = _DAY_LOCKS.get(path)
+        if lk is None:
+            lk = threading.Lock()
+            _DAY_LOCKS[path] = lk
+        return lk
+
+
 def _snapshot_path(aid: str, *, date_str: str, hour: int) -> str:
     hh = f"{int(hour):02d}"
     return os.path.join(_BASE_DIR, str(aid), str(date_str), hh, "snapshot.json")
 
 
-def load_snapshot(aid: str, *, date_str: str, hour: int) -> Optional[Dict[str, Any]]:
-    path = _snapshot_path(aid, date_str=date_str, hour=hour)
+def snapshot_day_path(aid: str, *, date_str: str) -> str:
+    return os.path.join(_BASE_DIR, str(aid), f"{str(date_str)}.json")
+
+
+def _fresh(v: Any) -> Any:
+    """Own copy of a nested container; scalars are shared as is."""
+    return copy.deepcopy(v) if isinstance(v, (dict, list)) else v
+
+
+class _DayEncoder:
+    """Interns dimension tuples and action types while encoding one day."""
+
+    def __init__(self) -> None:
+        self.dims: List[List[Any]] = []
+        self.action_types: List[str] = []
+        self._dim_ids: Dict[tuple, int] = {}
+        self._action_ids: Dict[str, int] = {}
+
+    def _dim_id(self, row: Dict[str, Any]) -> int:
+        key = tuple(row.get(c) for c in DIM_COLUMNS)
+        idx = self._dim_ids.get(key)
+        if idx is None:
+            idx = len(self.dims)
+            self._dim_ids[key] = idx
+            self.dims.append(list(key))
+        return idx
+
+    def _actions(self, acts: Any) -> Any:
+        if not isinstance(acts, dict):
+            return _fresh(acts)
+        flat: List[Any] = []
+        for t, v in acts.items():
+            idx = self._action_ids.get(str(t))
+            if idx is None:
+                idx = len(self.action_types)
+                self._action_ids[str(t)] = idx
+                self.action_types.append(str(t))
+            flat.extend((idx, v))
+        return flat
+
+    def row(self, row: Dict[str, Any]) -> List[Any]:
+        extra = {k: _fresh(v) for k, v in row.items() if k not in ROW_COLUMNS and k not in DIM_COLUMNS}
+        out: List[Any] = []
+        for col in ROW_COLUMNS:
+            if col == "extra":
+                out.append(extra or None)
+            elif col == "dim":
+                out.append(self._dim_id(row))
+            elif col == "actions":
+                out.append(self._actions(row.get("actions")))
+            else:
+                out.append(_fresh(row.get(col)))
+        return out
+
+
+def _decode_rows(obj: Dict[str, Any], table: List[Any]) -> List[Dict[str, Any]]:
+    columns = list(obj.get("columns") or [])
+    dims = obj.get("dims") or []
+    dim_columns = list(obj.get("dim_columns") or DIM_COLUMNS)
+    action_types = obj.get("action_types")
+    out: List[Dict[str, Any]] = []
+    for vals in (table or []):
+        if not isinstance(vals, list):
+            continue
+        r: Dict[str, Any] = {}
+        extra = None
+        for col, v in zip(columns, vals):
+            if col == "extra":
+                extra = v
+                continue
+            if col == "dim":
+                try:
+                    r.update(zip(dim_columns, dims[int(v)]))
+                except Exception:
+                    pass
+                continue
+            if col == "actions" and isinstance(v, list) and action_types is not None:
+                acts: Dict[str, Any] = {}
+                for i in range(0, len(v) - 1, 2):
+                    try:
+                        acts[str(action_types[int(v[i])])] = v[i + 1]
+                    except Exception:
+                        continue
+                v = acts
+            r[col] = _fresh(v)
+        if isinstance(extra, dict):
+            r.update(_fresh(extra))
+        out.append(r)
+    return out
+
+
+# Parsed-file LRU: path -> ((mtime_ns, size), parsed json). Entries are
+# revalidated with one stat() per read, so a file replaced on disk (another
+# process, manual edit) is re-read. Callers get freshly decoded dicts with
+# their own nested containers (meta, error, v1 actions), the cached object is
+# never handed out. save_day_snapshots() writes through; the encoded day
+# copies nested values, so the caller's snapshot does not alias the cache.
+try:
+    _FILE_CACHE_MAX_BYTES = int(float(os.getenv("HEATMAP_SNAPSHOT_CACHE_MB", "64") or 64) * 1024 * 1024)
+except Exception:
+    _FILE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_FILE_CACHE: "OrderedDict[str, Tuple[Tuple[int, int], Any]]" = OrderedDict()
+_FILE_CACHE_LOCK = threading.Lock()
+_file_cache_bytes = 0
+_file_cache_counts: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _file_sig(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (int(st.st_mtime_ns), int(st.st_size))
+
+
+def _file_cache_put(path: str, sig: Tuple[int, int], obj: Any) -> None:
+    global _file_cache_bytes
+    if sig[1] > _FILE_CACHE_MAX_BYTES:
+        return
+    with _FILE_CACHE_LOCK:
+        old = _FILE_CACHE.pop(path, None)
+        if old is not None:
+            _file_cache_bytes -= int(old[0][1])
+        _FILE_CACHE[path] = (sig, obj)
+        _file_cache_bytes += int(sig[1])
+        while _file_cache_bytes > _FILE_CACHE_MAX_BYTES and _FILE_CACHE:
+            _p, (old_sig, _o) = _FILE_CACHE.popitem(last=False)
+            _file_cache_bytes -= int(old_sig[1])
+            _file_cache_counts["evictions"] += 1
+
+
+def _read_json_cached(path: str) -> Any:
+    """Parsed JSON of path (None if missing/broken), via the LRU above."""
+    sig = _file_sig(path)
+    if sig is None:
+        return None
+    with _FILE_CACHE_LOCK:
+        ent = _FILE_CACHE.get(path)
+        if ent is not None and ent[0] == sig:
+            _FILE_CACHE.move_to_end(path)
+            _file_cache_counts["hits"] += 1
+            return ent[1]
+        _file_cache_counts["misses"] += 1
     try:
         with open(path, "r", encoding="utf-8") as f:
             obj = json.load(f)
-        return obj if isinstance(obj, dict) else None
     except Exception:
         return None
+    _file_cache_put(path, sig, obj)
+    return obj
 
 
-def save_snapshot(snapshot: Dict[str, Any]) -> None:
-    aid = str(snapshot.get("account_id") or "")
-    date_str = str(snapshot.get("date") or "")
-    hour = int(snapshot.get("hour") or 0)
-    if not aid or not date_str:
-        raise ValueError("snapshot missing account_id/date")
-    path = _snapshot_path(aid, date_str=date_str, hour=hour)
-    _atomic_write_json(path, snapshot)
+def snapshot_cache_stats() -> Dict[str, int]:
+    """Counters of the parsed-file cache (hits/misses/evictions/entries/bytes)."""
+    with _FILE_CACHE_LOCK:
+        out = dict(_file_cache_counts)
+        out["entries"] = int(len(_FILE_CACHE))
+        out["bytes"] = int(_file_cache_bytes)
+    return out
 
 
-def list_snapshot_hours(aid: str, *, date_str: str) -> List[int]:
+def _read_day_file(path: str) -> Optional[Dict[str, Any]]:
+    obj = _read_json_cached(path)
+    if not isinstance(obj, dict) or obj.get("format") not in _DAY_FORMATS:
+        return None
+    return obj
+
+
+def _head_to_snapshot(obj: Dict[str, Any], head: Dict[str, Any]) -> Dict[str, Any]:
+    snap = {k: _fresh(v) for k, v in head.items() if k not in {"row_start", "row_count"}}
+    try:
+        start = int(head.get("row_start") or 0)
+        cnt = int(head.get("row_count") or 0)
+    except Exception:
+        start, cnt = 0, 0
+    table = obj.get("rows") or []
+    snap["rows"] = _decode_rows(obj, table[start:start + cnt]) if cnt > 0 else []
+    return snap
+
+
+def _day_snapshots(obj: Optional[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Decodes a day file into {hour: snapshot dict with rows}."""
+    if not obj:
+        return {}
+    out: Dict[int, Dict[str, Any]] = {}
+    for hk, head in (obj.get("hours") or {}).items():
+        if not isinstance(head, dict):
+            continue
+        try:
+            h = int(hk)
+        except Exception:
+            continue
+        out[h] = _head_to_snapshot(obj, head)
+    return out
+
+
+def _encode_day(aid: str, date_str: str, snaps: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    hours: Dict[str, Any] = {}
+    table: List[List[Any]] = []
+    enc = _DayEncoder()
+    for h in sorted(snaps):
+        snap = snaps[h] or {}
+        head = {k: _fresh(v) for k, v in snap.items() if k != "rows"}
+        rows = [r for r in (snap.get("rows") or []) if isinstance(r, dict)]
+        head["row_start"] = int(len(table))
+        head["row_count"] = int(len(rows))
+        for r in rows:
+            table.append(enc.row(r))
+        hours[f"{int(h):02d}"] = head
+    return {
+        "format": DAY_FORMAT,
+        "account_id": str(aid),
+        "date": str(date_str),
+        "hours": hours,
+        "dim_columns": list(DIM_COLUMNS),
+        "dims": enc.dims,
+        "action_types": enc.action_types,
+        "columns": list(ROW_COLUMNS),
+        "rows": table,
+    }
+
+
+def _load_legacy_snapshot(aid: str, *, date_str: str, hour: int) -> Optional[Dict[str, Any]]:
+    obj = _read_json_cached(_snapshot_path(aid, date_str=date_str, hour=hour))
+    return copy.deepcopy(obj) if isinstance(obj, dict) else None
+
+
+def _legacy_hours(aid: str, *, date_str: str) -> List[int]:
     base = os.path.join(_BASE_DIR, str(aid), str(date_str))
     try:
         entries = os.listdir(base)
@@ -72,10 +346,621 @@ def list_snapshot_hours(aid: str, *, date_str: str) -> List[int]:
         path = os.path.join(base, str(e), "snapshot.json")
         if os.path.exists(path):
             out.append(h)
-    out.sort()
     return out
 
 
+def load_day_snapshots(aid: str, *, date_str: str) -> Dict[int, Dict[str, Any]]:
+    """All snapshots of one account-day: {hour: snapshot}. One file open
+    (plus legacy per-hour files for hours not yet in the day file)."""
+    out = _day_snapshots(_read_day_file(snapshot_day_path(aid, date_str=date_str)))
+    for h in _legacy_hours(aid, date_str=date_str):
+        if h in out:
+            continue
+        snap = _load_legacy_snapshot(aid, date_str=date_str, hour=h)
+        if snap:
+            out[h] = snap
+    return out
+
+
+def load_snapshot(aid: str, *, date_str: str, hour: int) -> Optional[Dict[str, Any]]:
+    obj = _read_day_file(snapshot_day_path(aid, date_str=date_str))
+    head = ((obj or {}).get("hours") or {}).get(f"{int(hour):02d}")
+    if obj and isinstance(head, dict):
+        return _head_to_snapshot(obj, head)
+    return _load_legacy_snapshot(aid, date_str=date_str, hour=hour)
+
+
+def _hour_fingerprint(snap: Optional[Dict[str, Any]]) -> Tuple[Any, ...]:
+    """Status plus rows in their stored (encoded) form, so a snapshot read back
+    from the day file compares equal to the one that was written."""
+    enc = _DayEncoder()
+    rows = [enc.row(r) for r in ((snap or {}).get("rows") or []) if isinstance(r, dict)]
+    return str((snap or {}).get("status") or ""), rows, enc.dims, enc.action_types
+
+
+def _report_inputs_changed(prev: Optional[Dict[str, Any]], snap: Optional[Dict[str, Any]]) -> bool:
+    """True when a ready hour appears, goes away or gets different rows."""
+    if not (_is_ready(snap) or _is_ready(prev)):
+        return False
+    return _hour_fingerprint(prev) != _hour_fingerprint(snap)
+
+
+def save_snapshot(snapshot: Dict[str, Any]) -> None:
+    aid = str(snapshot.get("account_id") or "")
+    date_str = str(snapshot.get("date") or "")
+    hour = int(snapshot.get("hour") or 0)
+    if not aid or not date_str:
+        raise ValueError("snapshot missing account_id/date")
+    save_day_snapshots(aid, date_str, {hour: snapshot})
+
+
+def save_day_snapshots(aid: str, date_str: str, snapshots: Dict[int, Dict[str, Any]]) -> None:
+    """Stores several hours of one account-day in one go: the day file is
+    read and written once, the generation moves at most once, and the
+    manifest row, cube slot and rollup are updated once for all hours."""
+    aid = str(aid or "")
+    date_str = str(date_str or "")
+    if not aid or not date_str:
+        raise ValueError("snapshot missing account_id/date")
+    if not snapshots:
+        return
+    path = snapshot_day_path(aid, date_str=date_str)
+    with _day_lock(path):
+        snaps = _day_snapshots(_read_day_file(path))
+        changed = False
+        for h, snap in snapshots.items():
+            prev = snaps.get(int(h)) or {}
+            snaps[int(h)] = dict(snap)
+            # Generation moves only when report inputs change, not on attempt
+            # bookkeeping of collecting/failed hours.
+            changed = changed or _report_inputs_changed(prev, snap)
+        day_obj = _encode_day(aid, date_str, snaps)
+        _atomic_write_json(path, day_obj, compact=True)
+        sig = _file_sig(path)
+        if sig is not None:
+            _file_cache_put(path, sig, day_obj)
+        hours = sorted(int(h) for h in snapshots)
+        gen = bump_generation(aid) if changed else get_generation(aid)
+        try:
+            _update_manifest_day(aid, date_str, snaps, hours=hours, gen=gen)
+        except Exception:
+            pass
+        try:
+            _update_cube(aid, date_str, snaps, hours=hours)
+        except Exception as e:
+            # A half-updated slot would keep serving stale cells; drop it so
+            # cube_days() refills the day from the file just written.
+            logging.getLogger(__name__).warning(
+                "heatmap_cube_update_error aid=%s date=%s err=%s", aid, date_str, str(e)
+            )
+            _invalidate_cube_day(aid, date_str)
+        # Rollup is only affected when a ready hour appears, changes or goes away.
+        if changed:
+            try:
+                _save_day_rollup(aid, date_str, build_day_rollup(snaps, date_str=date_str))
+            except Exception:
+                pass
+    # Entity names/parents/status for UI lookups (services/entity_index.py).
+    for snap in snapshots.values():
+        try:
+            index_snapshot(snap)
+        except Exception:
+            pass
+
+
+# ========= SNAPSHOT MANIFEST =========
+#
+# Per account: one row per day {"HH": entry} with the header of every stored
+# hour, entry = {status, reason, rows_count, spend, attempts, last_try_at,
+# next_try_at, deadline_at, error, gen}. Written by save_day_snapshots() under the
+# day lock, so status/gap checks read one small row instead of the day file.
+# Days stored before the manifest existed are indexed on first read.
+
+
+def _manifest_doc(aid: str) -> str:
+    return f"heatmap_manifest:{str(aid)}"
+
+
+def _manifest_path(aid: str) -> str:
+    return os.path.join(_BASE_DIR, str(aid), "manifest.json")
+
+
+def _manifest_entry(snap: Dict[str, Any], gen: int = 0) -> Dict[str, Any]:
+    spend = 0.0
+    for r in (snap.get("rows") or []):
+        if isinstance(r, dict):
+            try:
+                spend += float(r.get("spend") or 0.0)
+            except Exception:
+                continue
+    err = snap.get("error")
+    try:
+        attempts = int(snap.get("attempts") or 0)
+    except Exception:
+        attempts = 0
+    try:
+        rows_count = int(snap.get("rows_count") or len(snap.get("rows") or []))
+    except Exception:
+        rows_count = 0
+    return {
+        "status": str(snap.get("status") or ""),
+        "reason": str(snap.get("reason") or ""),
+        "rows_count": rows_count,
+        "spend": float(spend),
+        "attempts": attempts,
+        "last_try_at": snap.get("last_try_at"),
+        "next_try_at": snap.get("next_try_at"),
+        "deadline_at": snap.get("deadline_at"),
+        "error": err if isinstance(err, dict) else None,
+        "gen": int(gen or 0),
+    }
+
+
+def _save_manifest_day(aid: str, date_str: str, entries: Dict[int, Dict[str, Any]]) -> None:
+    upsert_row(
+        _manifest_doc(aid),
+        _manifest_path(aid),
+        str(date_str),
+        {f"{int(h):02d}": e for h, e in sorted(entries.items())},
+    )
+
+
+def _update_manifest_day(
+    aid: str,
+    date_str: str,
+    snaps: Dict[int, Dict[str, Any]],
+    *,
+    hours: List[int],
+    gen: int,
+) -> None:
+    """Re-indexes the given hours; a day without a manifest row is indexed in full."""
+    row = get_row(_manifest_doc(aid), _manifest_path(aid), str(date_str))
+    if isinstance(row, dict):
+        entries = _manifest_from_row(row)
+        for h in hours:
+            entries[int(h)] = _manifest_entry(snaps.get(int(h)) or {}, gen)
+    else:
+        entries = {h: _manifest_entry(sn, gen) for h, sn in snaps.items()}
+    _save_manifest_day(aid, date_str, entries)
+
+
+def _day_has_files(aid: str, date_str: str) -> bool:
+    if os.path.exists(snapshot_day_path(aid, date_str=date_str)):
+        return True
+    return os.path.isdir(os.path.join(_BASE_DIR, str(aid), str(date_str)))
+
+
+def _manifest_from_row(row: Any) -> Dict[int, Dict[str, Any]]:
+    out: Dict[int, Dict[str, Any]] = {}
+    for hk, e in (row or {}).items():
+        if not isinstance(e, dict):
+            continue
+        try:
+            out[int(hk)] = e
+        except Exception:
+            continue
+    return out
+
+
+def _backfill_manifest_day(aid: str, date_str: str) -> Dict[int, Dict[str, Any]]:
+    if not _day_has_files(aid, date_str):
+        return {}
+    path = snapshot_day_path(aid, date_str=date_str)
+    with _day_lock(path):
+        entries = {h: _manifest_entry(sn) for h, sn in load_day_snapshots(aid, date_str=date_str).items()}
+        try:
+            _save_manifest_day(aid, date_str, entries)
+        except Exception:
+            pass
+    return entries
+
+
+def load_manifest_day(aid: str, *, date_str: str) -> Dict[int, Dict[str, Any]]:
+    """{hour: manifest entry} of one account-day ({} if nothing stored)."""
+    try:
+        row = get_row(_manifest_doc(aid), _manifest_path(aid), str(date_str))
+    except Exception:
+        row = None
+    if isinstance(row, dict):
+        return _manifest_from_row(row)
+    return _backfill_manifest_day(aid, str(date_str))
+
+
+def load_manifest(aid: str, *, dates: List[str]) -> Dict[str, Dict[int, Dict[str, Any]]]:
+    """{date: {hour: entry}} for several days of one account, one read."""
+    try:
+        stored = load_doc(_manifest_doc(aid), _manifest_path(aid))
+    except Exception:
+        stored = {}
+    out: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for d in dates or []:
+        row = stored.get(str(d))
+        out[str(d)] = _manifest_from_row(row) if isinstance(row, dict) else _backfill_manifest_day(aid, str(d))
+    return out
+
+
+def manifest_hour(aid: str, *, date_str: str, hour: int) -> Optional[Dict[str, Any]]:
+    """Manifest entry of one hour (None if the snapshot does not exist)."""
+    return load_manifest_day(aid, date_str=date_str).get(int(hour))
+
+
+# ========= DAILY ROLLUPS =========
+#
+# Per account-day totals over ready hours, kept next to the snapshots:
+# {"v", "date", "ready_hours", "rows_count",
+#  "account": T, "campaigns": {campaign_id: T}, "adsets": {adset_id: T}}
+# where T = {spend, msgs, leads, total, impressions, clicks, actions}.
+# Rebuilt by save_snapshot() whenever a ready hour changes, so readers of
+# day/week/month totals load one row per day instead of every hour's rows.
+ROLLUP_VERSION = 1
+
+_READY_STATUSES = {"ready", "ready_low_confidence"}
+
+
+def _is_ready(snap: Optional[Dict[str, Any]]) -> bool:
+    return str((snap or {}).get("status") or "") in _READY_STATUSES
+
+
+def _rollup_doc(aid: str) -> str:
+    return f"heatmap_rollup:{str(aid)}"
+
+
+def _rollup_path(aid: str) -> str:
+    return os.path.join(_BASE_DIR, str(aid), "rollup.json")
+
+
+def _empty_totals() -> Dict[str, Any]:
+    return {
+        "spend": 0.0,
+        "msgs": 0,
+        "leads": 0,
+        "total": 0,
+        "impressions": 0,
+        "clicks": 0,
+        "actions": {},
+    }
+
+
+def _add_row_to_totals(t: Dict[str, Any], r: Dict[str, Any]) -> None:
+    try:
+        t["spend"] = float(t["spend"]) + float(r.get("spend") or 0.0)
+    except Exception:
+        pass
+    msgs, leads, tot = row_derived_metrics(r)
+    t["msgs"] = int(t["msgs"]) + msgs
+    t["leads"] = int(t["leads"]) + leads
+    t["total"] = int(t["total"]) + tot
+    for col in ("impressions", "clicks"):
+        try:
+            t[col] = int(t[col]) + int(r.get(col) or 0)
+        except Exception:
+            pass
+    acts = r.get("actions")
+    if isinstance(acts, dict) and acts:
+        am = t["actions"]
+        for k, v in acts.items():
+            try:
+                am[str(k)] = float(am.get(str(k), 0.0) or 0.0) + float(v or 0.0)
+            except Exception:
+                continue
+
+
+def build_day_rollup(snaps: Dict[int, Dict[str, Any]], *, date_str: str) -> Dict[str, Any]:
+    """Sums ready hours of one account-day ({hour: snapshot}) into a rollup."""
+    acc = _empty_totals()
+    campaigns: Dict[str, Dict[str, Any]] = {}
+    adsets: Dict[str, Dict[str, Any]] = {}
+    ready_hours: List[int] = []
+    rows_count = 0
+    for h in sorted(snaps or {}):
+        snap = snaps[h] or {}
+        if not _is_ready(snap):
+            continue
+        ready_hours.append(int(h))
+        for r in (snap.get("rows") or []):
+            if not isinstance(r, dict):
+                continue
+            rows_count += 1
+            _add_row_to_totals(acc, r)
+            cid = str(r.get("campaign_id") or "")
+            if cid:
+                _add_row_to_totals(campaigns.setdefault(cid, _empty_totals()), r)
+            asid = str(r.get("adset_id") or "")
+            if asid:
+                t = adsets.setdefault(asid, _empty_totals())
+                if cid:
+                    t["campaign_id"] = cid
+                _add_row_to_totals(t, r)
+    return {
+        "v": ROLLUP_VERSION,
+        "date": str(date_str),
+        "ready_hours": ready_hours,
+        "rows_count": int(rows_count),
+        "account": acc,
+        "campaigns": campaigns,
+        "adsets": adsets,
+    }
+
+
+def _save_day_rollup(aid: str, date_str: str, rollup: Dict[str, Any]) -> None:
+    upsert_row(_rollup_doc(aid), _rollup_path(aid), str(date_str), rollup)
+
+
+def _valid_rollup(obj: Any) -> bool:
+    return isinstance(obj, dict) and int(obj.get("v") or 0) == ROLLUP_VERSION
+
+
+def _backfill_day_rollup(aid: str, *, date_str: str) -> Dict[str, Any]:
+    """Builds a rollup for a day saved before rollups existed (one-off).
+
+    Days without ready hours get an empty rollup (ready_hours=[]) too, so
+    they are not decoded again on every read; the first ready hour saved
+    later rebuilds it.
+    """
+    rollup = build_day_rollup(load_day_snapshots(aid, date_str=date_str), date_str=date_str)
+    try:
+        _save_day_rollup(aid, date_str, rollup)
+    except Exception:
+        pass
+    return rollup
+
+
+def load_day_rollup(aid: str, *, date_str: str) -> Optional[Dict[str, Any]]:
+    """Rollup of one account-day, or None if it has no ready hours."""
+    try:
+        obj = get_row(_rollup_doc(aid), _rollup_path(aid), str(date_str))
+    except Exception:
+        obj = None
+    if not _valid_rollup(obj):
+        obj = _backfill_day_rollup(aid, date_str=date_str)
+    return obj if obj.get("ready_hours") else None
+
+
+def load_day_rollups(aid: str, *, dates: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Rollups for several days of one account: {date: rollup} (days without
+    ready hours are omitted). One read for all stored days."""
+    try:
+        stored = load_doc(_rollup_doc(aid), _rollup_path(aid))
+    except Exception:
+        stored = {}
+    out: Dict[str, Dict[str, Any]] = {}
+    for d in dates or []:
+        obj = stored.get(str(d))
+        if not _valid_rollup(obj):
+            obj = _backfill_day_rollup(aid, date_str=str(d))
+        if obj.get("ready_hours"):
+            out[str(d)] = obj
+    return out
+
+
+def rollup_totals(
+    rollup: Optional[Dict[str, Any]],
+    *,
+    level: str = "account",
+    entity_id: Optional[str] = None,
+    campaign_ids: Optional[set] = None,
+) -> Dict[str, Any]:
+    """Totals of a rollup for a scope: account | campaign | adset | campaigns
+    (sum over campaign_ids). Missing scope -> zero totals."""
+    lvl = str(level or "account").lower()
+    if not rollup:
+        return _empty_totals()
+    if lvl == "account":
+        return dict(rollup.get("account") or _empty_totals())
+    if lvl == "campaigns":
+        out = _empty_totals()
+        camps = rollup.get("campaigns") or {}
+        for cid in (campaign_ids or set()):
+            t = camps.get(str(cid))
+            if not isinstance(t, dict):
+                continue
+            for k in ("msgs", "leads", "total", "impressions", "clicks"):
+                out[k] = int(out[k]) + int(t.get(k) or 0)
+            out["spend"] = float(out["spend"]) + float(t.get("spend") or 0.0)
+            for ak, av in (t.get("actions") or {}).items():
+                out["actions"][ak] = float(out["actions"].get(ak, 0.0)) + float(av or 0.0)
+        return out
+    if not entity_id:
+        return _empty_totals()
+    bucket = rollup.get("campaigns" if lvl == "campaign" else "adsets" if lvl == "adset" else "") or {}
+    t = bucket.get(str(entity_id))
+    return dict(t) if isinstance(t, dict) else _empty_totals()
+
+
+# ========= HOUR x DAY CUBE =========
+#
+# Fixed-width binary file per account, heatmap_snapshots/<aid>/cube.bin,
+# memory-mapped and read through memoryview.cast("f") (stdlib, no numpy):
+#
+#   header: magic "HMC1", int32 version, int32 days, int32 fields
+#   day slot (ordinal % days): int32 date ordinal + 24 x CUBE_FIELDS float32
+#
+# "state" is CUBE_STATES[status]; *_active sum only rows whose adset_status
+# is ACTIVE/UNKNOWN/empty (heatmaps with include_paused=false). Counts are
+# stored as float32 (exact below 2**24). save_day_snapshots() rewrites the
+# hour cells in place; a slot holding another date is refilled from day files.
+CUBE_FIELDS: List[str] = [
+    "state",
+    "rows",
+    "spend",
+    "msgs",
+    "leads",
+    "total",
+    "impressions",
+    "clicks",
+    "spend_active",
+    "msgs_active",
+    "leads_active",
+]
+CUBE_STATES: Dict[str, int] = {"": 0, "ready": 1, "ready_low_confidence": 2, "failed": 3}
+_CUBE_OTHER_STATE = 4
+
+_CUBE_MAGIC = b"HMC1"
+_CUBE_VERSION = 1
+_CUBE_HEADER = struct.Struct("<4siii")
+_CUBE_CELL = len(CUBE_FIELDS)
+_CUBE_DAY_BYTES = 4 + 24 * _CUBE_CELL * 4
+
+try:
+    CUBE_DAYS = max(7, int(os.getenv("HEATMAP_CUBE_DAYS", "400") or 400))
+except Exception:
+    CUBE_DAYS = 400
+
+_CUBES: Dict[str, Tuple[Any, mmap.mmap]] = {}
+_CUBES_GUARD = threading.Lock()
+
+
+def _cube_path(aid: str) -> str:
+    return os.path.join(_BASE_DIR, str(aid), "cube.bin")
+
+
+def _cube_map(aid: str) -> mmap.mmap:
+    """Opens (creating/resetting if the layout differs) the account cube."""
+    with _CUBES_GUARD:
+        ent = _CUBES.get(str(aid))
+        if ent is not None:
+            return ent[1]
+        path = _cube_path(aid)
+        size = _CUBE_HEADER.size + CUBE_DAYS * _CUBE_DAY_BYTES
+        header = _CUBE_HEADER.pack(_CUBE_MAGIC, _CUBE_VERSION, CUBE_DAYS, _CUBE_CELL)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path):
+            open(path, "ab").close()
+        # r+b, not a+b: in append mode writes go to the end regardless of seek().
+        f = open(path, "r+b")
+        try:
+            f.seek(0)
+            if f.read(_CUBE_HEADER.size) != header or os.fstat(f.fileno()).st_size != size:
+                f.truncate(0)
+                f.truncate(size)
+                f.seek(0)
+                f.write(header)
+                f.flush()
+            mm = mmap.mmap(f.fileno(), size)
+        except Exception:
+            f.close()
+            raise
+        _CUBES[str(aid)] = (f, mm)
+        return mm
+
+
+def close_cubes() -> None:
+    """Flushes and closes all open cube maps (shutdown, tests)."""
+    with _CUBES_GUARD:
+        for f, mm in _CUBES.values():
+            try:
+                mm.flush()
+                mm.close()
+            finally:
+                f.close()
+        _CUBES.clear()
+
+
+def _cube_offset(ordinal: int) -> int:
+    return _CUBE_HEADER.size + (int(ordinal) % CUBE_DAYS) * _CUBE_DAY_BYTES
+
+
+def _cube_cell(snap: Optional[Dict[str, Any]]) -> List[float]:
+    cell = [0.0] * _CUBE_CELL
+    if not snap:
+        return cell
+    st = str(snap.get("status") or "")
+    cell[0] = float(CUBE_STATES.get(st, _CUBE_OTHER_STATE))
+    try:
+        cell[1] = float(int(snap.get("rows_count") or 0))
+    except Exception:
+        pass
+    if st not in _READY_STATUSES:
+        return cell
+    t = _empty_totals()
+    active = _empty_totals()
+    for r in (snap.get("rows") or []):
+        if not isinstance(r, dict):
+            continue
+        _add_row_to_totals(t, r)
+        rs = str(r.get("adset_status") or "").upper()
+        if not rs or rs in {"ACTIVE", "UNKNOWN"}:
+            _add_row_to_totals(active, r)
+    for i, k in enumerate(("spend", "msgs", "leads", "total", "impressions", "clicks"), start=2):
+        cell[i] = float(t.get(k) or 0)
+    cell[8] = float(active.get("spend") or 0.0)
+    cell[9] = float(active.get("msgs") or 0)
+    cell[10] = float(active.get("leads") or 0)
+    return cell
+
+
+def _cube_write_day(mm: mmap.mmap, ordinal: int, snaps: Dict[int, Dict[str, Any]]) -> None:
+    off = _cube_offset(ordinal)
+    vals = array("f")
+    for h in range(24):
+        vals.extend(_cube_cell(snaps.get(h)))
+    # Cells first, ordinal last: the slot is claimed only once it is complete.
+    mm[off + 4:off + _CUBE_DAY_BYTES] = vals.tobytes()
+    mm[off:off + 4] = struct.pack("<i", int(ordinal))
+
+
+def _update_cube(aid: str, date_str: str, snaps: Dict[int, Dict[str, Any]], *, hours: List[int]) -> None:
+    ordinal = datetime.strptime(str(date_str), "%Y-%m-%d").toordinal()
+    with _day_lock(_cube_path(aid)):
+        mm = _cube_map(aid)
+        off = _cube_offset(ordinal)
+        if struct.unpack_from("<i", mm, off)[0] != ordinal:
+            _cube_write_day(mm, ordinal, snaps)
+        else:
+            for h in hours:
+                cell_off = off + 4 + int(h) * _CUBE_CELL * 4
+                mm[cell_off:cell_off + _CUBE_CELL * 4] = array("f", _cube_cell(snaps.get(int(h)))).tobytes()
+        mm.flush()
+
+
+def _invalidate_cube_day(aid: str, date_str: str) -> None:
+    """Resets the slot ordinal (0 never matches a date), forcing a refill."""
+    try:
+        ordinal = datetime.strptime(str(date_str), "%Y-%m-%d").toordinal()
+        with _day_lock(_cube_path(aid)):
+            mm = _cube_map(aid)
+            off = _cube_offset(ordinal)
+            if struct.unpack_from("<i", mm, off)[0] == ordinal:
+                mm[off:off + 4] = struct.pack("<i", 0)
+                mm.flush()
+    except Exception as e:
+        logging.getLogger(__name__).warning(
+            "heatmap_cube_invalidate_error aid=%s date=%s err=%s", str(aid), str(date_str), str(e)
+        )
+
+
+def cube_days(aid: str, *, dates: List[str]) -> Dict[str, List[List[float]]]:
+    """{date: 24 cells}, each cell a list in CUBE_FIELDS order.
+
+    Dates absent from the cube (older data, first use) are filled once from
+    the day files.
+    """
+    out: Dict[str, List[List[float]]] = {}
+    with _day_lock(_cube_path(aid)):
+        mm = _cube_map(aid)
+        filled = False
+        for d in dates or []:
+            ordinal = datetime.strptime(str(d), "%Y-%m-%d").toordinal()
+            off = _cube_offset(ordinal)
+            if struct.unpack_from("<i", mm, off)[0] != ordinal:
+                _cube_write_day(mm, ordinal, load_day_snapshots(aid, date_str=str(d)))
+                filled = True
+            flat = memoryview(mm)[off + 4:off + _CUBE_DAY_BYTES].cast("f").tolist()
+            out[str(d)] = [flat[h * _CUBE_CELL:(h + 1) * _CUBE_CELL] for h in range(24)]
+        if filled:
+            mm.flush()
+    return out
+
+
+def cube_field(name: str) -> int:
+    """Index of a metric in a cube cell."""
+    return CUBE_FIELDS.index(str(name))
+
+
+def list_snapshot_hours(aid: str, *, date_str: str) -> List[int]:
+    return sorted(load_manifest_day(aid, date_str=date_str).keys())
+
+
 def find_latest_ready_snapshots(
     aid: str,
     *,
@@ -92,17 +977,29 @@ def find_latest_ready_snapshots(
     now = now or datetime.now(ALMATY_TZ)
     cur = now.replace(minute=0, second=0, microsecond=0)
 
-    out: List[Dict[str, Any]] = []
     # Safety cap to avoid endless loops in case of timezone issues.
-    for _ in range(min(24 * 14, max_hours + 48)):
+    steps = min(24 * 14, max_hours + 48)
+    first_day = (cur - timedelta(hours=steps)).date()
+    dates: List[str] = []
+    d = cur.date()
+    while d >= first_day:
+        dates.append(d.strftime("%Y-%m-%d"))
+        d = d - timedelta(days=1)
+    manifest = load_manifest(aid, dates=dates)
+
+    out: List[Dict[str, Any]] = []
+    days: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for _ in range(steps):
         cur = cur - timedelta(hours=1)
         date_str = cur.strftime("%Y-%m-%d")
         hour = int(cur.strftime("%H"))
 
-        snap = load_snapshot(aid, date_str=date_str, hour=hour)
-        if not snap:
+        if not _is_ready((manifest.get(date_str) or {}).get(hour)):
             continue
-        if str(snap.get("status") or "") not in {"ready", "ready_low_confidence"}:
+        if date_str not in days:
+            days[date_str] = load_day_snapshots(aid, date_str=date_str)
+        snap = days[date_str].get(hour)
+        if not _is_ready(snap):
             continue
         out.append(snap)
         if len(out) >= max_hours:
@@ -128,8 +1025,9 @@ def sum_ready_spend_for_date(
         return None, "missing", "hours_empty"
 
     total = 0.0
+    day = load_manifest_day(aid, date_str=date_str)
     for h in hours:
-        snap = load_snapshot(aid, date_str=date_str, hour=int(h))
+        snap = day.get(int(h))
         if not snap:
             return None, "missing", "no_snapshot"
         st = str(snap.get("status") or "")
@@ -144,13 +1042,10 @@ def sum_ready_spend_for_date(
                 return None, "collecting", "rate_limit"
             return None, "collecting", "snapshot_collecting"
 
-        for r in (snap.get("rows") or []):
-            if not isinstance(r, dict):
-                continue
-            try:
-                total += float(r.get("spend") or 0.0)
-            except Exception:
-                continue
+        try:
+            total += float(snap.get("spend") or 0.0)
+        except Exception:
+            continue
 
     if float(total) <= 0.0:
         return float(total), "ready", "low_volume"
@@ -301,16 +1196,18 @@ def get_heatmap_dataset(
     collecting: List[int] = []
     failed: List[int] = []
 
+    day = load_manifest_day(aid, date_str=date_str)
+    ready_hours: List[int] = []
     for h in uniq_hours:
-        snap = load_snapshot(aid, date_str=date_str, hour=h)
+        snap = day.get(int(h))
         if not snap:
             missing.append(h)
             continue
         st = str(snap.get("status") or "")
         if st == "ready":
-            snapshots.append(snap)
+            ready_hours.append(h)
         elif st == "ready_low_confidence":
-            snapshots.append(snap)
+            ready_hours.append(h)
             low_confidence.append(h)
         elif st == "collecting":
             collecting.append(h)
@@ -324,7 +1221,7 @@ def get_heatmap_dataset(
         return None, "missing", "no_snapshot", meta
 
     if failed:
-        snap = load_snapshot(aid, date_str=date_str, hour=failed[0]) or {}
+        snap = day.get(int(failed[0])) or {}
         err = snap.get("error") or {}
         et = str((err or {}).get("type") or "snapshot_failed")
         meta["error"] = err if isinstance(err, dict) else {"type": et}
@@ -333,7 +1230,7 @@ def get_heatmap_dataset(
         return None, "failed", "rate_limit" if et == "rate_limit" else "snapshot_failed", meta
 
     if collecting:
-        snap = load_snapshot(aid, date_str=date_str, hour=collecting[0]) or {}
+        snap = day.get(int(collecting[0])) or {}
         attempts = int(snap.get("attempts") or 0)
         meta["attempts"] = attempts
         meta["deadline_at"] = str(snap.get("deadline_at") or "")
@@ -355,6 +1252,10 @@ def get_heatmap_dataset(
             return None, "collecting", "rate_limit", meta
         return None, "collecting", "snapshot_collecting", meta
 
+    # Rows are read only once every requested hour is known to be ready.
+    day_snaps = load_day_snapshots(aid, date_str=date_str)
+    snapshots = [day_snaps[h] for h in ready_hours if h in day_snaps]
+
     by_adset: Dict[str, Dict[str, Any]] = {}
     total_rows = 0
     spend_total = 0.0
@@ -368,28 +1269,7 @@ def get_heatmap_dataset(
             total_rows += 1
             spend = float(r.get("spend") or 0.0)
             spend_total += float(spend)
-            msgs = int(float(r.get("msgs") or 0) or 0)
-
-            leads = None
-            actions_map = r.get("actions")
-            if isinstance(actions_map, dict) and actions_map:
-                try:
-                    leads = int(count_leads_from_actions(actions_map, aid=str(aid), lead_action_type=None) or 0)
-                except Exception:
-                    leads = None
-            if leads is None:
-                try:
-                    leads = int(float(r.get("leads") or 0) or 0)
-                except Exception:
-                    leads = 0
-
-            total = None
-            try:
-                total = int(float(r.get("total") or 0) or 0)
-            except Exception:
-                total = None
-            if total is None or total <= 0:
-                total = int(msgs or 0) + int(leads or 0)
+            msgs, leads, total = row_derived_metrics(r)
 
             name = r.get("name")
             campaign_id = r.get("campaign_id")
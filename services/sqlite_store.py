@@ -0,0 +1,367 @@
+# services/sqlite_store.py
+
+"""
+Встроенное хранилище на SQLite (WAL) для JSON-"документов" бота:
+accounts.json, кэши отчётов, состояния алёртов/биллингов и т.п.
+
+Каждый документ (dict) хранится построчно: одна строка таблицы docs на
+ключ верхнего уровня. save_doc() пишет только изменившиеся строки,
+upsert_row()/delete_row() меняют одну строку без чтения всего документа.
+
+При первом обращении документ импортируется из старого JSON-файла.
+Этот же JSON-файл периодически перезаписывается экспортом (бэкап,
+не чаще STORAGE_JSON_EXPORT_INTERVAL_S).
+
+STORAGE_BACKEND=json возвращает старое поведение (полная перезапись файла).
+"""
+
+import atexit
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from fb_report.constants import DATA_DIR
+
+
+STORAGE_BACKEND = str(os.getenv("STORAGE_BACKEND", "sqlite") or "sqlite").strip().lower()
+STORAGE_DB_PATH = os.getenv("STORAGE_DB_PATH", os.path.join(DATA_DIR, "storage.sqlite3"))
+
+try:
+    _EXPORT_INTERVAL_S = float(os.getenv("STORAGE_JSON_EXPORT_INTERVAL_S", "900") or 900)
+except Exception:
+    _EXPORT_INTERVAL_S = 900.0
+
+_LOCAL = threading.local()
+_INIT_LOCK = threading.Lock()
+_IMPORTED: Dict[str, bool] = {}
+_LAST_EXPORT: Dict[str, float] = {}
+_DIRTY: Dict[str, str] = {}
+
+
+def backend_enabled() -> bool:
+    return STORAGE_BACKEND == "sqlite"
+
+
+# ========= JSON-ФАЙЛЫ (fallback / импорт / экспорт) =========
+
+def _read_json_file(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+        return obj if isinstance(obj, dict) else {}
+    except Exception:
+        return {}
+
+
+def _write_json_file(path: str, obj: Any) -> None:
+    tmp = f"{path}.tmp"
+    bak = f"{path}.bak"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        if os.path.exists(path):
+            shutil.copy2(path, bak)
+    except Exception:
+        pass
+    os.replace(tmp, path)
+
+
+# ========= SQLITE =========
+
+def _conn() -> sqlite3.Connection:
+    """Одно соединение на поток (sqlite3 не разделяет соединения между потоками)."""
+    con = getattr(_LOCAL, "con", None)
+    if con is not None:
+        return con
+    os.makedirs(os.path.dirname(STORAGE_DB_PATH) or ".", exist_ok=True)
+    con = sqlite3.connect(STORAGE_DB_PATH, timeout=30.0, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    with _INIT_LOCK:
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (doc, key))"
+        )
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS doc_meta ("
+            " doc TEXT PRIMARY KEY,"
+            " imported_at REAL NOT NULL)"
+        )
+    _LOCAL.con = con
+    return con
+
+
+def _dumps(v: Any) -> str:
+    return json.dumps(v, ensure_ascii=False, separators=(",", ":"))
+
+
+def _ensure_imported(doc: str, path: Optional[str]) -> None:
+    if _IMPORTED.get(doc):
+        return
+    con = _conn()
+    row = con.execute("SELECT 1 FROM doc_meta WHERE doc=?", (doc,)).fetchone()
+    if row is None:
+        legacy = _read_json_file(path) if path else {}
+        now = time.time()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            # Повторная проверка под write-lock: другой поток мог уже импортировать.
+            if con.execute("SELECT 1 FROM doc_meta WHERE doc=?", (doc,)).fetchone() is None:
+                con.executemany(
+                    "INSERT OR REPLACE INTO docs(doc, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                    [(doc, str(k), _dumps(v), now) for k, v in (legacy or {}).items()],
+                )
+                con.execute("INSERT INTO doc_meta(doc, imported_at) VALUES (?, ?)", (doc, now))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        try:
+            logging.getLogger(__name__).info(
+                "sqlite_store_import doc=%s rows=%s path=%s",
+                str(doc),
+                str(int(len(legacy or {}))),
+                str(path or ""),
+            )
+        except Exception:
+            pass
+    _IMPORTED[doc] = True
+
+
+def _maybe_export(doc: str, path: Optional[str]) -> None:
+    if not path:
+        return
+    _DIRTY[doc] = path
+    now = time.time()
+    if (now - float(_LAST_EXPORT.get(doc) or 0.0)) < float(_EXPORT_INTERVAL_S):
+        return
+    export_json(doc, path)
+
+
+def export_json(doc: str, path: str) -> None:
+    """Выгружает документ в JSON-файл (формат старого файла)."""
+    try:
+        _write_json_file(path, load_doc(doc, None))
+        _LAST_EXPORT[doc] = time.time()
+        _DIRTY.pop(doc, None)
+    except Exception as e:
+        logging.getLogger(__name__).warning("sqlite_store_export_error doc=%s err=%s", str(doc), str(e))
+
+
+def export_all(force: bool = False) -> int:
+    """Выгружает в JSON все документы с несохранёнными в файл изменениями."""
+    if not backend_enabled():
+        return 0
+    n = 0
+    for doc, path in list(_DIRTY.items()):
+        if force or (time.time() - float(_LAST_EXPORT.get(doc) or 0.0)) >= float(_EXPORT_INTERVAL_S):
+            export_json(doc, path)
+            n += 1
+    return n
+
+
+# ========= ПУБЛИЧНЫЙ API =========
+
+class TrackedDoc(dict):
+    """Документ из load_doc() + строки, из которых он прочитан (doc_base).
+
+    save_doc() такого объекта пишет только ключи, изменённые относительно
+    doc_base, поэтому параллельные read-modify-write разных ключей одного
+    документа (например, разных аккаунтов в accounts) не затирают друг друга.
+    Конфликт возможен только при изменении одного и того же ключа; если
+    независимые записи лежат внутри одного ключа (список правил, словарь
+    групп), read-modify-write нужно делать под doc_lock().
+    """
+
+    __slots__ = ("doc_base",)
+
+
+_DOC_LOCKS: Dict[str, threading.RLock] = {}
+_DOC_LOCKS_GUARD = threading.Lock()
+
+
+def doc_lock(doc: str) -> threading.RLock:
+    """Блокировка документа (в пределах процесса) для read-modify-write."""
+    with _DOC_LOCKS_GUARD:
+        lk = _DOC_LOCKS.get(str(doc))
+        if lk is None:
+            lk = threading.RLock()
+            _DOC_LOCKS[str(doc)] = lk
+        return lk
+
+
+def load_doc(doc: str, path: Optional[str]) -> Dict[str, Any]:
+    """Весь документ как dict (аналог json.load(path))."""
+    if not backend_enabled():
+        return _read_json_file(path) if path else {}
+    _ensure_imported(doc, path)
+    out = TrackedDoc()
+    base: Dict[str, str] = {}
+    for key, value in _conn().execute("SELECT key, value FROM docs WHERE doc=?", (doc,)):
+        try:
+            out[str(key)] = json.loads(value)
+        except Exception:
+            continue
+        base[str(key)] = str(value)
+    out.doc_base = base
+    return out
+
+
+def save_doc(doc: str, path: Optional[str], obj: Dict[str, Any]) -> List[str]:
+    """Сохраняет документ: пишутся только добавленные/изменённые/удалённые ключи.
+
+    Для TrackedDoc изменения считаются относительно прочитанной версии
+    (чужие изменения других ключей сохраняются), иначе — относительно БД.
+    Возвращает список изменившихся ключей верхнего уровня.
+    """
+    if not isinstance(obj, dict):
+        obj = {}
+    base: Optional[Dict[str, str]] = getattr(obj, "doc_base", None)
+    new_rows = {str(k): _dumps(v) for k, v in obj.items()}
+    if not backend_enabled():
+        old_file = _read_json_file(path) if path else {}
+        old_rows = {str(k): _dumps(v) for k, v in old_file.items()}
+        keys = [k for k, v in new_rows.items() if old_rows.get(k) != v]
+        keys.extend(k for k in old_rows.keys() if k not in new_rows)
+        if path:
+            _write_json_file(path, obj)
+        return keys
+    _ensure_imported(doc, path)
+    con = _conn()
+    now = time.time()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        old_rows = {
+            str(k): str(v)
+            for k, v in con.execute("SELECT key, value FROM docs WHERE doc=?", (doc,))
+        }
+        if base is None:
+            changed = [(doc, k, v, now) for k, v in new_rows.items() if old_rows.get(k) != v]
+            removed = [(doc, k) for k in old_rows.keys() if k not in new_rows]
+        else:
+            changed = [
+                (doc, k, v, now)
+                for k, v in new_rows.items()
+                if base.get(k) != v and old_rows.get(k) != v
+            ]
+            removed = [(doc, k) for k in base.keys() if k not in new_rows and k in old_rows]
+        if changed:
+            con.executemany(
+                "INSERT OR REPLACE INTO docs(doc, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                changed,
+            )
+        if removed:
+            con.executemany("DELETE FROM docs WHERE doc=? AND key=?", removed)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    if base is not None:
+        obj.doc_base = new_rows  # type: ignore[attr-defined]
+    if changed or removed:
+        _maybe_export(doc, path)
+    return [k for _d, k, _v, _t in changed] + [k for _d, k in removed]
+
+
+def doc_stamp(doc: str, path: Optional[str]) -> tuple:
+    """Дешёвый отпечаток версии документа для инвалидации in-memory кэшей.
+
+    sqlite: (число строк, max(updated_at)); json: (mtime_ns, size) файла.
+    """
+    if not backend_enabled():
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        return (int(st.st_mtime_ns), int(st.st_size)) if st is not None else (0, 0)
+    _ensure_imported(doc, path)
+    row = _conn().execute(
+        "SELECT COUNT(*), MAX(updated_at) FROM docs WHERE doc=?", (doc,)
+    ).fetchone()
+    return (int(row[0] or 0), float(row[1] or 0.0)) if row else (0, 0.0)
+
+
+def get_row(doc: str, path: Optional[str], key: str) -> Any:
+    """Одна запись документа (None, если нет)."""
+    if not backend_enabled():
+        return (_read_json_file(path) if path else {}).get(str(key))
+    _ensure_imported(doc, path)
+    row = _conn().execute("SELECT value FROM docs WHERE doc=? AND key=?", (doc, str(key))).fetchone()
+    if row is None:
+        return None
+    try:
+        return json.loads(row[0])
+    except Exception:
+        return None
+
+
+def upsert_row(doc: str, path: Optional[str], key: str, value: Any) -> None:
+    """Пишет одну запись документа без перезаписи остальных."""
+    if not backend_enabled():
+        d = _read_json_file(path) if path else {}
+        d[str(key)] = value
+        if path:
+            _write_json_file(path, d)
+        return
+    _ensure_imported(doc, path)
+    _conn().execute(
+        "INSERT OR REPLACE INTO docs(doc, key, value, updated_at) VALUES (?, ?, ?, ?)",
+        (doc, str(key), _dumps(value), time.time()),
+    )
+    _maybe_export(doc, path)
+
+
+def upsert_rows(doc: str, path: Optional[str], items: Dict[str, Any]) -> None:
+    """Пишет несколько записей документа одной транзакцией."""
+    if not items:
+        return
+    if not backend_enabled():
+        d = _read_json_file(path) if path else {}
+        for k, v in items.items():
+            d[str(k)] = v
+        if path:
+            _write_json_file(path, d)
+        return
+    _ensure_imported(doc, path)
+    con = _conn()
+    now = time.time()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.executemany(
+            "INSERT OR REPLACE INTO docs(doc, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            [(doc, str(k), _dumps(v), now) for k, v in items.items()],
+        )
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    _maybe_export(doc, path)
+
+
+def delete_row(doc: str, path: Optional[str], key: str) -> None:
+    if not backend_enabled():
+        d = _read_json_file(path) if path else {}
+        if str(key) in d:
+            d.pop(str(key), None)
+            if path:
+                _write_json_file(path, d)
+        return
+    _ensure_imported(doc, path)
+    _conn().execute("DELETE FROM docs WHERE doc=? AND key=?", (doc, str(key)))
+    _maybe_export(doc, path)
+
+
+# Несохранённые в JSON изменения выгружаются при остановке процесса.
+atexit.register(export_all, True)
@@ -14,6 +14,8 @@ from fb_report.constants import (
     REPORT_CACHE_TTL,
     ALMATY_TZ,
 )
+from services.data_generation import bump_generation, bump_generations
+from services.sqlite_store import get_row, load_doc, save_doc, upsert_row
 
 # В старой версии INSIGHTS_DIR задавался через config.
 # Здесь восстанавливаем тот же путь на основе DATA_DIR.
@@ -73,15 +75,14 @@ def load_hourly_stats() -> Dict[str, Any]:
     }
     """
     try:
-        with open(HOURLY_STATS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_doc("hourly_stats", HOURLY_STATS_FILE)
     except Exception:
         return {}
 
 
 def save_hourly_stats(stats: Dict[str, Any]) -> None:
-    """Сохраняет часовой кэш атомарно."""
-    _atomic_write_json(HOURLY_STATS_FILE, stats)
+    """Сохраняет часовой кэш (пишутся только изменённые аккаунты)."""
+    save_doc("hourly_stats", HOURLY_STATS_FILE, stats)
 
 
 # ========= ACCOUNTS.JSON И МЕТА =========
@@ -109,31 +110,29 @@ def ensure_accounts_file(repo_accounts_path: str | None = None) -> None:
 
 
 def load_accounts() -> Dict[str, Any]:
-    """Читает accounts.json, при ошибке возвращает пустой словарь."""
+    """Читает настройки аккаунтов (SQLite, импорт из accounts.json), при ошибке {}."""
     try:
-        with open(ACCOUNTS_JSON, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_doc("accounts", ACCOUNTS_JSON)
     except Exception:
         return {}
 
 
 def save_accounts(data: Dict[str, Any]) -> None:
-    """Сохраняет словарь в accounts.json атомарно."""
-    _atomic_write_json(ACCOUNTS_JSON, data)
+    """Сохраняет настройки аккаунтов (accounts.json остаётся периодическим экспортом)."""
+    bump_generations(save_doc("accounts", ACCOUNTS_JSON, data))
 
 
 def load_sync_meta() -> Dict[str, Any]:
     """Метаданные синка из BM (время последней синхронизации и т.п.)."""
     try:
-        with open(SYNC_META_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_doc("sync_meta", SYNC_META_FILE)
     except Exception:
         return {}
 
 
 def save_sync_meta(meta: Dict[str, Any]) -> None:
-    """Сохраняет sync_meta.json."""
-    _atomic_write_json(SYNC_META_FILE, meta)
+    """Сохраняет sync_meta."""
+    save_doc("sync_meta", SYNC_META_FILE, meta)
 
 
 def human_last_sync() -> str:
@@ -190,6 +189,7 @@ def save_local_insights(aid: str, data: Dict[str, Any]) -> None:
     """
     path = _insight_file(aid)
     tmp = f"{path}.tmp"
+    prev = load_local_insights(aid)
 
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
@@ -199,6 +199,9 @@ def save_local_insights(aid: str, data: Dict[str, Any]) -> None:
         os.fsync(f.fileno())
 
     os.replace(tmp, path)
+    # Новый период в кэше — заполнение, а не изменение входных данных отчётов.
+    if any(k in prev and prev.get(k) != v for k, v in (data or {}).items()):
+        bump_generation(aid)
 
 
 # ========= ТЕКСТОВЫЙ КЭШ ОТЧЁТОВ =========
@@ -230,15 +233,14 @@ def load_report_cache() -> Dict[str, Any]:
     }
     """
     try:
-        with open(REPORT_CACHE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_doc("report_cache", REPORT_CACHE_FILE)
     except Exception:
         return {}
 
 
 def save_report_cache(cache: Dict[str, Any]) -> None:
-    """Сохраняет report_cache.json атомарно."""
-    _atomic_write_json(REPORT_CACHE_FILE, cache)
+    """Сохраняет кэш отчётов (пишутся только изменённые аккаунты)."""
+    save_doc("report_cache", REPORT_CACHE_FILE, cache)
 
 
 def get_cached_report_entry(aid: str, key: str) -> Dict[str, Any] | None:
@@ -246,8 +248,8 @@ def get_cached_report_entry(aid: str, key: str) -> Dict[str, Any] | None:
     Возвращает entry из кэша по аккаунту и ключу периода,
     либо None, если нет записи.
     """
-    cache = load_report_cache()
-    return cache.get(aid, {}).get(key)
+    row = get_row("report_cache", REPORT_CACHE_FILE, aid) or {}
+    return row.get(key) if isinstance(row, dict) else None
 
 
 def set_cached_report_entry(aid: str, key: str, text: str) -> None:
@@ -255,10 +257,11 @@ def set_cached_report_entry(aid: str, key: str, text: str) -> None:
     Обновляет/создаёт запись в кэше отчётов и сохраняет её.
     """
     now_ts = datetime.now(ALMATY_TZ).timestamp()
-    cache = load_report_cache()
-    cache.setdefault(aid, {})
-    cache[aid][key] = {"text": text, "ts": now_ts}
-    save_report_cache(cache)
+    row = get_row("report_cache", REPORT_CACHE_FILE, aid)
+    if not isinstance(row, dict):
+        row = {}
+    row[key] = {"text": text, "ts": now_ts}
+    upsert_row("report_cache", REPORT_CACHE_FILE, aid, row)
 
 
 def is_cache_fresh(entry: Dict[str, Any] | None) -> bool:
@@ -0,0 +1,20 @@
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Модули читают окружение при импорте: токен бота обязателен, DATA_DIR — во
+# временный каталог, rate limiter не должен притормаживать тесты.
+os.environ.setdefault("TG_BOT_TOKEN", "123456:test-token")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="fb_report_tests_"))
+os.environ.setdefault("FB_RL_RATE_PER_S", "100000")
+os.environ.setdefault("FB_RL_BURST", "100000")
+os.environ.setdefault("FB_API_DEFAULT_DENY", "1")
+
+# Порядок импорта как у точки входа (fb_report.py): сначала приложение.
+import fb_report  # noqa: E402,F401
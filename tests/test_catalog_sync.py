@@ -0,0 +1,54 @@
+# tests/test_catalog_sync.py
+
+import time
+
+import services.facebook_api as fb
+
+
+def _seed(aid):
+    fb._cache_set(
+        f"adsets:{aid}",
+        [
+            {"id": "1", "name": "a", "campaign_id": "c1", "status": "ACTIVE", "effective_status": "ACTIVE"},
+            {"id": "2", "name": "b", "campaign_id": "c2", "status": "ACTIVE", "effective_status": "ACTIVE"},
+            {"id": "3", "name": "c", "campaign_id": "c2", "status": "ACTIVE", "effective_status": "ACTIVE"},
+        ],
+    )
+
+
+def test_delta_sync_picks_up_inherited_status():
+    aid = "act_catalog_inherited"
+    _seed(aid)
+    # Кампания c2 на паузе: updated_time адсетов 2 и 3 не менялся, в дельте
+    # только переименованный адсет 1; статусы приходят отдельным списком.
+    delta_rows = [{"id": "1", "name": "a2", "campaign_id": "c1", "status": "ACTIVE", "effective_status": "ACTIVE"}]
+    statuses = {"1": "ACTIVE", "2": "CAMPAIGN_PAUSED", "3": "ARCHIVED"}
+
+    out = fb._catalog_apply("adsets", aid, delta_rows, delta=True, started_at=time.time(), statuses=statuses)
+
+    by_id = {r["id"]: r for r in out}
+    assert by_id["1"]["name"] == "a2"
+    assert by_id["2"]["effective_status"] == "CAMPAIGN_PAUSED"
+    assert by_id["2"]["status"] == "ACTIVE"
+    assert "3" not in by_id
+
+
+def test_delta_sync_without_statuses_keeps_cached_rows():
+    aid = "act_catalog_no_status"
+    _seed(aid)
+    out = fb._catalog_apply("adsets", aid, [], delta=True, started_at=time.time(), statuses=None)
+    assert sorted(r["id"] for r in out) == ["1", "2", "3"]
+    assert all(r["effective_status"] == "ACTIVE" for r in out)
+
+
+def test_only_catalogs_are_persisted_to_l2():
+    from services.sqlite_store import get_row
+
+    aid = "act_cache_l2"
+    fb._cache_set(f"campaigns:{aid}", [{"id": "c1"}])
+    fb._cache_set(f"insights_bulk:{aid}:adset:today::", [{"spend": "1"}])
+
+    assert get_row(fb._CATALOG_DOC, None, f"campaigns:{aid}")["value"] == [{"id": "c1"}]
+    assert get_row(fb._CATALOG_DOC, None, f"insights_bulk:{aid}:adset:today::") is None
+    # L1 по-прежнему отдаёт оба значения.
+    assert fb._cache_get(f"insights_bulk:{aid}:adset:today::", ttl_s=60) == [{"spend": "1"}]
@@ -0,0 +1,67 @@
+# tests/test_concurrent_doc_saves.py
+
+"""
+Пересекающиеся read-modify-write разных групп/правил внутри одного
+ключа документа: оба изменения должны сохраниться.
+"""
+
+import threading
+import time
+
+import fb_report.client_groups as client_groups
+import fb_report.cpa_alerts as cpa_alerts
+
+
+def _slow(fn, delay=0.05):
+    # Задержка после чтения: без блокировки оба потока успевают прочитать
+    # старую версию до того, как первый сохранит свою.
+    def wrapper(*args, **kwargs):
+        res = fn(*args, **kwargs)
+        time.sleep(delay)
+        return res
+
+    return wrapper
+
+
+def _run_parallel(*fns):
+    start = threading.Barrier(len(fns))
+
+    def run(fn):
+        start.wait(timeout=10)
+        fn()
+
+    threads = [threading.Thread(target=run, args=(fn,)) for fn in fns]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_overlapping_group_saves_both_survive(monkeypatch):
+    monkeypatch.setattr(client_groups, "load_client_groups", _slow(client_groups.load_client_groups))
+
+    _run_parallel(
+        lambda: client_groups.set_group_account(chat_id="-1001", aid="act_1", enabled=True),
+        lambda: client_groups.set_group_account(chat_id="-1002", aid="act_2", enabled=True),
+        lambda: client_groups.set_group_account(chat_id="-1001", aid="act_3", enabled=True),
+    )
+
+    assert client_groups.enabled_accounts_for_group("-1001") == ["act_1", "act_3"]
+    assert client_groups.enabled_accounts_for_group("-1002") == ["act_2"]
+
+
+def test_overlapping_rule_saves_both_survive(monkeypatch):
+    monkeypatch.setattr(cpa_alerts, "load_cpa_alerts_state", _slow(cpa_alerts.load_cpa_alerts_state))
+    r1 = cpa_alerts.create_default_rule(name="r1")
+    r2 = cpa_alerts.create_default_rule(name="r2")
+    r2["id"] = r1["id"] + "_2"
+
+    _run_parallel(
+        lambda: cpa_alerts.upsert_rule(r1),
+        lambda: cpa_alerts.upsert_rule(r2),
+        lambda: cpa_alerts.set_global_enabled(False),
+    )
+
+    ids = {r["id"] for r in cpa_alerts.list_rules()}
+    assert {r1["id"], r2["id"]} <= ids
+    assert cpa_alerts.load_cpa_alerts_state()["enabled"] is False
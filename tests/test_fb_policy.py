@@ -0,0 +1,156 @@
+# tests/test_fb_policy.py
+
+"""
+Политика allow/deny FB API под параллельной нагрузкой: пересекающиеся
+scope'ы в потоках, asyncio-задачах (to_thread / run_fb_io / fb_call) и
+через submit_with_policy. deny одного воркера не блокирует разрешённый
+вызов другого, allow не вытекает за пределы своего scope.
+"""
+
+import asyncio
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from services.facebook_api import (
+    _fb_calls_allowed_here,
+    allow_fb_api_calls,
+    deny_fb_api_calls,
+    fb_call,
+    run_fb_io,
+    safe_api_call,
+    submit_with_policy,
+)
+
+WORKERS = 16
+ROUNDS = 25
+
+
+def _ok():
+    return "ok"
+
+
+def _call():
+    return safe_api_call(_ok, _caller="test_fb_policy")
+
+
+def test_default_policy_blocks_outside_scopes():
+    assert _fb_calls_allowed_here() is False
+    assert _call() is None
+    with allow_fb_api_calls(reason="test"):
+        assert _call() == "ok"
+    assert _call() is None
+
+
+def test_nested_scopes_restore_outer_policy():
+    with deny_fb_api_calls(reason="outer_deny"):
+        assert _call() is None
+        with allow_fb_api_calls(reason="inner_allow"):
+            assert _call() == "ok"
+        assert _call() is None
+    with allow_fb_api_calls(reason="outer_allow"):
+        with deny_fb_api_calls(reason="inner_deny"):
+            # allow сильнее deny (как и до contextvars).
+            assert _call() == "ok"
+        assert _call() == "ok"
+    assert _call() is None
+
+
+def test_overlapping_scopes_in_threads():
+    barrier = threading.Barrier(WORKERS)
+    errors = []
+
+    def worker(i: int) -> None:
+        rnd = random.Random(i)
+        try:
+            for _ in range(ROUNDS):
+                allow = rnd.random() < 0.5
+                scope = allow_fb_api_calls(reason=f"t{i}") if allow else deny_fb_api_calls(reason=f"t{i}")
+                with scope:
+                    barrier.wait(timeout=10)
+                    res = _call()
+                    if res != ("ok" if allow else None):
+                        errors.append((i, allow, res))
+                    barrier.wait(timeout=10)
+                if _call() is not None or _fb_calls_allowed_here():
+                    errors.append((i, "leak", allow))
+        except Exception as e:
+            errors.append((i, "exc", repr(e)))
+            barrier.abort()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(WORKERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert _fb_calls_allowed_here() is False
+
+
+def test_overlapping_scopes_in_asyncio_tasks():
+    async def worker(i: int, gate: asyncio.Event):
+        out = []
+        allow = i % 2 == 0
+        scope = allow_fb_api_calls(reason=f"a{i}") if allow else deny_fb_api_calls(reason=f"a{i}")
+        with scope:
+            await gate.wait()
+            for _ in range(3):
+                out.append(await asyncio.to_thread(_call))
+                out.append(await run_fb_io(_call))
+                out.append(await fb_call(_ok, _caller="test_fb_policy"))
+                await asyncio.sleep(0)
+        after = [
+            await asyncio.to_thread(_call),
+            await run_fb_io(_call),
+            await fb_call(_ok, _caller="test_fb_policy"),
+        ]
+        return allow, out, after
+
+    async def main():
+        gate = asyncio.Event()
+        tasks = [asyncio.create_task(worker(i, gate)) for i in range(WORKERS)]
+        await asyncio.sleep(0)
+        gate.set()
+        return await asyncio.gather(*tasks), _fb_calls_allowed_here()
+
+    results, allowed_in_main = asyncio.run(main())
+
+    assert allowed_in_main is False
+    for allow, out, after in results:
+        assert out == ["ok" if allow else None] * len(out)
+        assert after == [None, None, None]
+
+
+def test_submit_with_policy_carries_scope_but_not_beyond_it():
+    # Один поток в пуле: последующие задачи выполняются в том же потоке,
+    # где только что был allow-контекст.
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        with allow_fb_api_calls(reason="submit"):
+            with_policy = submit_with_policy(ex, _call).result(timeout=10)
+            plain = ex.submit(_call).result(timeout=10)
+        after = submit_with_policy(ex, _call).result(timeout=10)
+        with deny_fb_api_calls(reason="submit_deny"):
+            denied = submit_with_policy(ex, _call).result(timeout=10)
+
+    assert with_policy == "ok"
+    assert plain is None
+    assert after is None
+    assert denied is None
+
+
+def test_submit_with_policy_mixed_workers():
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        futures = []
+        for i in range(WORKERS * 4):
+            allow = i % 3 != 0
+            scope = allow_fb_api_calls(reason=f"s{i}") if allow else deny_fb_api_calls(reason=f"s{i}")
+            with scope:
+                futures.append((allow, submit_with_policy(ex, _call)))
+        leaked = [ex.submit(_call) for _ in range(WORKERS)]
+        results = [(allow, f.result(timeout=10)) for allow, f in futures]
+        leaked_results = [f.result(timeout=10) for f in leaked]
+
+    for allow, res in results:
+        assert res == ("ok" if allow else None)
+    assert leaked_results == [None] * len(leaked_results)
@@ -0,0 +1,37 @@
+# tests/test_fb_usage.py
+
+import json
+
+import services.facebook_api as fb
+
+
+def _headers(call_count=0, acc_pct=None):
+    h = {"x-app-usage": json.dumps({"call_count": call_count, "total_cputime": 0, "total_time": 0})}
+    if acc_pct is not None:
+        h["x-ad-account-usage"] = json.dumps({"acc_id_util_pct": acc_pct})
+    return h
+
+
+def test_low_reading_does_not_cancel_backoff(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(fb.time, "time", lambda: now[0])
+    monkeypatch.setattr(fb, "_USAGE_GLOBAL", (0.0, 0.0))
+    monkeypatch.setattr(fb, "_USAGE_BY_AID", {})
+
+    fb._update_usage_from_headers(_headers(90, acc_pct=80), "act_busy")
+    fb._update_usage_from_headers(_headers(5, acc_pct=1), "act_quiet")
+    fb._update_usage_from_headers(_headers(5, acc_pct=2), "act_busy")
+
+    usage = fb.get_fb_usage()
+    assert usage["global_pct"] == 90.0
+    assert usage["by_aid"]["act_busy"] == 80.0
+
+    # Через период полураспада высокое значение затухает вдвое.
+    now[0] += fb._RL_USAGE_HALF_LIFE_S
+    usage = fb.get_fb_usage()
+    assert abs(usage["global_pct"] - 45.0) < 1e-6
+    assert abs(usage["by_aid"]["act_busy"] - 40.0) < 1e-6
+
+    # Новое высокое значение снова поднимает уровень.
+    fb._update_usage_from_headers(_headers(70), "act_quiet")
+    assert fb.get_fb_usage()["global_pct"] == 70.0
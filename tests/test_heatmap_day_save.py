@@ -0,0 +1,128 @@
+# tests/test_heatmap_day_save.py
+
+import os
+
+import services.heatmap_store as hs
+from services.data_generation import get_generation
+from services.heatmap_store import cube_days, cube_field, load_day_snapshots, load_manifest_day, save_day_snapshots
+
+DATE = "2026-02-10"
+
+
+def _snap(aid, hour, spend):
+    rows = [{"adset_id": "1", "campaign_id": "c1", "name": "a", "spend": spend, "actions": {"link_click": 1}}]
+    return {
+        "account_id": aid,
+        "date": DATE,
+        "hour": hour,
+        "status": "ready",
+        "attempts": 1,
+        "rows": rows,
+        "rows_count": len(rows),
+    }
+
+
+def test_day_batch_is_written_once(monkeypatch):
+    aid = "act_day_batch"
+    writes = []
+    real_write = hs._atomic_write_json
+
+    def counting_write(path, obj, **kwargs):
+        writes.append(path)
+        return real_write(path, obj, **kwargs)
+
+    monkeypatch.setattr(hs, "_atomic_write_json", counting_write)
+
+    g0 = get_generation(aid)
+    save_day_snapshots(aid, DATE, {h: _snap(aid, h, float(h)) for h in (3, 4, 5)})
+
+    assert writes == [hs.snapshot_day_path(aid, date_str=DATE)]
+    assert get_generation(aid) == g0 + 1
+    assert sorted(load_day_snapshots(aid, date_str=DATE)) == [3, 4, 5]
+
+    manifest = load_manifest_day(aid, date_str=DATE)
+    assert sorted(manifest) == [3, 4, 5]
+    assert {int(e["gen"]) for e in manifest.values()} == {g0 + 1}
+
+    cells = cube_days(aid, dates=[DATE])[DATE]
+    spend = cube_field("spend")
+    assert [cells[h][spend] for h in (3, 4, 5)] == [3.0, 4.0, 5.0]
+
+    # Повтор тех же часов — без нового поколения.
+    save_day_snapshots(aid, DATE, {h: _snap(aid, h, float(h)) for h in (3, 4)})
+    assert get_generation(aid) == g0 + 1
+
+
+def test_failed_cube_update_invalidates_slot(monkeypatch):
+    aid = "act_cube_fail"
+    save_day_snapshots(aid, DATE, {7: _snap(aid, 7, 1.0)})
+    spend = cube_field("spend")
+    assert cube_days(aid, dates=[DATE])[DATE][7][spend] == 1.0
+
+    real_cell = hs._cube_cell
+    monkeypatch.setattr(hs, "_cube_cell", lambda _snap: (_ for _ in ()).throw(RuntimeError("boom")))
+    save_day_snapshots(aid, DATE, {7: _snap(aid, 7, 2.0), 8: _snap(aid, 8, 3.0)})
+    monkeypatch.setattr(hs, "_cube_cell", real_cell)
+
+    # Слот сброшен и перечитан из файла дня, а не отдаёт старые ячейки.
+    cells = cube_days(aid, dates=[DATE])[DATE]
+    assert cells[7][spend] == 2.0
+    assert cells[8][spend] == 3.0
+
+
+def test_cube_survives_reopen(monkeypatch):
+    aid = "act_cube_reopen"
+    save_day_snapshots(aid, DATE, {9: _snap(aid, 9, 4.5)})
+    spend = cube_field("spend")
+    assert cube_days(aid, dates=[DATE])[DATE][9][spend] == 4.5
+    hs.close_cubes()
+
+    path = hs._cube_path(aid)
+    with open(path, "rb") as f:
+        head = f.read(hs._CUBE_HEADER.size)
+    assert head[:4] == hs._CUBE_MAGIC
+    assert os.path.getsize(path) == hs._CUBE_HEADER.size + hs.CUBE_DAYS * hs._CUBE_DAY_BYTES
+
+    # Слот не перезаполняется из файлов дня: значение читается из cube.bin.
+    monkeypatch.setattr(hs, "load_day_snapshots", lambda *_a, **_k: (_ for _ in ()).throw(AssertionError("refilled")))
+    assert cube_days(aid, dates=[DATE])[DATE][9][spend] == 4.5
+
+
+def test_loaded_snapshot_does_not_alias_cache():
+    aid = "act_snap_alias"
+    snap = _snap(aid, 11, 1.0)
+    snap["meta"] = {"endpoint": "insights"}
+    snap["error"] = {"message": "x"}
+    save_day_snapshots(aid, DATE, {11: snap})
+    # Изменения исходного снапшота после записи не попадают в кэш.
+    snap["meta"]["endpoint"] = "changed"
+
+    a = hs.load_snapshot(aid, date_str=DATE, hour=11)
+    assert a["meta"] == {"endpoint": "insights"}
+    a["meta"]["endpoint"] = "mutated"
+    a["error"]["message"] = "mutated"
+    a["rows"][0]["actions"]["link_click"] = 99
+
+    b = hs.load_snapshot(aid, date_str=DATE, hour=11)
+    assert b["meta"] == {"endpoint": "insights"}
+    assert b["error"] == {"message": "x"}
+    assert b["rows"][0]["actions"] == {"link_click": 1}
+
+
+def test_day_without_ready_hours_is_rolled_up_once(monkeypatch):
+    aid = "act_rollup_empty"
+    empty_day = "2026-02-11"
+    save_day_snapshots(aid, empty_day, {5: dict(_snap(aid, 5, 0.0), date=empty_day, status="failed", rows=[])})
+
+    assert hs.load_day_rollups(aid, dates=[empty_day]) == {}
+    assert hs.load_day_rollup(aid, date_str=empty_day) is None
+
+    # Пустой rollup сохранён: файл дня больше не разбирается.
+    monkeypatch.setattr(hs, "load_day_snapshots", lambda *_a, **_k: (_ for _ in ()).throw(AssertionError("decoded")))
+    assert hs.load_day_rollups(aid, dates=[empty_day]) == {}
+    assert hs.load_day_rollup(aid, date_str=empty_day) is None
+    monkeypatch.undo()
+
+    # Первый готовый час пересобирает rollup.
+    save_day_snapshots(aid, empty_day, {6: dict(_snap(aid, 6, 2.0), date=empty_day)})
+    assert hs.load_day_rollup(aid, date_str=empty_day)["ready_hours"] == [6]
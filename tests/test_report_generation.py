@@ -0,0 +1,103 @@
+# tests/test_report_generation.py
+
+import time
+
+from fb_report.constants import REPORT_TODAY_CACHE_TTL
+from fb_report.reporting import _report_entry_valid
+from services.data_generation import get_generation
+from services.heatmap_store import save_snapshot
+from services.storage import save_local_insights
+
+
+def _snap(aid, hour, status, rows=None, attempts=1):
+    return {
+        "account_id": aid,
+        "date": "2026-01-05",
+        "hour": hour,
+        "status": status,
+        "attempts": attempts,
+        "rows": list(rows or []),
+        "rows_count": len(rows or []),
+    }
+
+
+ROWS = [{"adset_id": "1", "campaign_id": "c1", "name": "a", "spend": 1.5, "actions": {"link_click": 3}}]
+
+
+def test_snapshot_bookkeeping_does_not_bump_generation():
+    aid = "act_gen_bookkeeping"
+    g0 = get_generation(aid)
+    save_snapshot(_snap(aid, 10, "collecting", attempts=1))
+    save_snapshot(_snap(aid, 10, "collecting", attempts=2))
+    save_snapshot(_snap(aid, 10, "failed", attempts=3))
+    assert get_generation(aid) == g0
+
+    save_snapshot(_snap(aid, 10, "ready", ROWS))
+    g1 = get_generation(aid)
+    assert g1 == g0 + 1
+
+    # Тот же готовый час ещё раз (другие служебные поля) — без изменений.
+    save_snapshot(_snap(aid, 10, "ready", ROWS, attempts=5))
+    assert get_generation(aid) == g1
+
+    changed = [dict(ROWS[0], spend=2.0)]
+    save_snapshot(_snap(aid, 10, "ready", changed))
+    assert get_generation(aid) == g1 + 1
+
+
+def test_local_insights_fill_does_not_bump_generation():
+    aid = "act_gen_insights"
+    g0 = get_generation(aid)
+    save_local_insights(aid, {"preset:yesterday": {"spend": "1.00"}})
+    save_local_insights(aid, {"preset:yesterday": {"spend": "1.00"}, "preset:last_7d": {"spend": "9"}})
+    assert get_generation(aid) == g0
+    save_local_insights(aid, {"preset:yesterday": {"spend": "2.00"}, "preset:last_7d": {"spend": "9"}})
+    assert get_generation(aid) == g0 + 1
+
+
+def test_today_report_has_short_ttl():
+    now = time.time()
+    fresh = {"gen": 3, "ts": now - 1}
+    old = {"gen": 3, "ts": now - REPORT_TODAY_CACHE_TTL - 1}
+    assert _report_entry_valid(fresh, gen=3, period="today", now_ts=now)
+    assert not _report_entry_valid(old, gen=3, period="today", now_ts=now)
+    assert _report_entry_valid(old, gen=3, period="yesterday", now_ts=now)
+    assert not _report_entry_valid(fresh, gen=4, period="today", now_ts=now)
+
+
+def test_failed_report_is_not_cached(monkeypatch):
+    import fb_report.reporting as rep
+
+    aid = "act_report_error"
+    calls = []
+
+    def fetch(*_a, **_k):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("temporary FB error")
+        return "Acc", {"spend": "1.00", "impressions": "10"}
+
+    monkeypatch.setattr(rep, "fetch_insight", fetch)
+    monkeypatch.setattr(rep, "get_account_name", lambda _aid: "Acc")
+    period = {"since": "2026-01-01", "until": "2026-01-02"}
+
+    first = rep.get_cached_report(aid, period)
+    assert first.startswith("⚠ Ошибка")
+    second = rep.get_cached_report(aid, period)
+    assert not second.startswith("⚠ Ошибка")
+    assert len(calls) == 2
+
+    rep._REPORT_TEXT_MEMO.clear()
+    assert rep.get_cached_report(aid, period) == second
+    assert len(calls) == 2
+
+
+def test_generation_written_elsewhere_is_seen():
+    from services.data_generation import DATA_GENERATION_FILE
+    from services.sqlite_store import upsert_row
+
+    aid = "act_gen_external"
+    g0 = get_generation(aid)
+    # Как будто поколение увеличил другой процесс.
+    upsert_row("data_generation", DATA_GENERATION_FILE, aid, g0 + 5)
+    assert get_generation(aid) == g0 + 5
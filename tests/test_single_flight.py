@@ -0,0 +1,148 @@
+# tests/test_single_flight.py
+
+"""
+Single-flight FB-запросов: результат лидера раздаётся только вызывающим
+с той же политикой allow/deny и только если у лидера не было ошибок FB.
+"""
+
+import threading
+import time
+
+import services.facebook_api as fb
+from services.facebook_api import _single_flight, allow_fb_api_calls, deny_fb_api_calls, safe_api_call
+
+
+def _wait_joined(key, n=1, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if int((fb._SF_STATS.get(key) or {}).get("joined") or 0) >= n:
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def _boom():
+    raise RuntimeError("fb down")
+
+
+def test_failed_leader_result_is_not_shared():
+    key = "test_sf:failed_leader"
+    calls = []
+
+    def loader():
+        calls.append(threading.get_ident())
+        if len(calls) == 1:
+            # Лидер: дожидается второго вызывающего и получает ошибку FB.
+            assert _wait_joined(key)
+            return safe_api_call(_boom) or []
+        return ["fresh"]
+
+    results = {}
+
+    def run(name):
+        with allow_fb_api_calls(reason="test_sf"):
+            results[name] = _single_flight(key, loader)
+
+    leader = threading.Thread(target=run, args=("leader",))
+    leader.start()
+    while not fb._INFLIGHT:
+        time.sleep(0.001)
+    joiner = threading.Thread(target=run, args=("joiner",))
+    joiner.start()
+    leader.join()
+    joiner.join()
+
+    assert results == {"leader": [], "joiner": ["fresh"]}
+    assert len(calls) == 2
+    assert fb._SF_STATS[key]["unshared"] == 1
+
+
+def test_blocked_caller_does_not_share_with_allowed_caller():
+    key = "test_sf:policy"
+    release = threading.Event()
+    results = {}
+
+    def loader():
+        res = safe_api_call(lambda: ["live"])
+        release.wait(timeout=5)
+        return res or []
+
+    def run(name, scope):
+        with scope:
+            results[name] = _single_flight(key, loader)
+
+    denied = threading.Thread(target=run, args=("denied", deny_fb_api_calls(reason="test_sf")))
+    denied.start()
+    while not fb._INFLIGHT:
+        time.sleep(0.001)
+    allowed = threading.Thread(target=run, args=("allowed", allow_fb_api_calls(reason="test_sf")))
+    allowed.start()
+    time.sleep(0.05)
+    release.set()
+    denied.join()
+    allowed.join()
+
+    assert results == {"denied": [], "allowed": ["live"]}
+    assert int(fb._SF_STATS[key].get("joined") or 0) == 0
+
+
+def test_successful_leader_is_shared():
+    key = "test_sf:shared"
+    calls = []
+
+    def loader():
+        calls.append(1)
+        assert _wait_joined(key)
+        return safe_api_call(lambda: ["ok"]) or []
+
+    results = []
+
+    def run():
+        with allow_fb_api_calls(reason="test_sf"):
+            results.append(_single_flight(key, loader))
+
+    t1 = threading.Thread(target=run)
+    t1.start()
+    while not fb._INFLIGHT:
+        time.sleep(0.001)
+    t2 = threading.Thread(target=run)
+    t2.start()
+    t1.join()
+    t2.join()
+
+    assert results == [["ok"], ["ok"]]
+    assert len(calls) == 1
+
+
+def test_joiner_stops_waiting_for_stuck_leader(monkeypatch):
+    monkeypatch.setattr(fb, "_SF_WAIT_S", 0.1)
+    key = "test_sf:stuck_leader"
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(timeout=5)
+            return ["slow"]
+        return ["own"]
+
+    results = {}
+
+    def run(name):
+        with allow_fb_api_calls(reason="test_sf"):
+            results[name] = _single_flight(key, loader)
+
+    leader = threading.Thread(target=run, args=("leader",))
+    leader.start()
+    while not fb._INFLIGHT:
+        time.sleep(0.001)
+    joiner = threading.Thread(target=run, args=("joiner",))
+    joiner.start()
+    joiner.join(timeout=2)
+    assert not joiner.is_alive()
+    release.set()
+    leader.join()
+
+    assert results == {"leader": ["slow"], "joiner": ["own"]}
+    assert fb._SF_STATS[key]["timeouts"] == 1